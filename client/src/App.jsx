@@ -11,6 +11,12 @@ import { ColorModeContext, useMode } from "./theme";
 // Use environment variable for API base URL
 const API_BASE = import.meta.env.VITE_API_URL || 'https://queryous-3.onrender.com';
 
+// Signed-in users get their own server-side workspace
+const authHeaders = () => {
+  const token = localStorage.getItem('access_token');
+  return token ? { Authorization: `Bearer ${token}` } : {};
+};
+
 import Landing from "./pages/Landing.jsx";
 import Auth from "./pages/Auth.jsx";
 import Chat from "./pages/Chat.jsx";
@@ -242,7 +248,7 @@ const App = () => {
       // Send request to backend
       const response = await fetch(`${API_BASE}/ask`, {
         method: "POST",
-        headers: { "Content-Type": "application/json" },
+        headers: { "Content-Type": "application/json", ...authHeaders() },
         body: JSON.stringify({ query: inputValue }),
      });
       
@@ -308,6 +314,7 @@ const App = () => {
 
       const response = await fetch(`${API_BASE}/upload-csv`, {
         method: "POST",
+        headers: authHeaders(),
         body: formData,
       });
 
@@ -340,6 +347,7 @@ const App = () => {
     try {
       const response = await fetch(`${API_BASE}/clear-csv`, {
         method: "POST",
+        headers: authHeaders(),
       });
 
       if (response.ok) {
@@ -356,7 +364,7 @@ const App = () => {
     try {
       const response = await fetch(`${API_BASE}/export-csv`, {
         method: "POST",
-        headers: { "Content-Type": "application/json" },
+        headers: { "Content-Type": "application/json", ...authHeaders() },
         body: JSON.stringify({ sql_query: sqlQuery, filename }),
       });
 
@@ -387,7 +395,7 @@ const App = () => {
   useEffect(() => {
     const checkCsvStatus = async () => {
       try {
-        const response = await fetch(`${API_BASE}/csv-status`);
+        const response = await fetch(`${API_BASE}/csv-status`, { headers: authHeaders() });
         const data = await response.json();
         setCsvMode(data.is_csv_mode);
       } catch (error) {
@@ -404,7 +412,7 @@ const App = () => {
     try {
       const response = await fetch(`${API_BASE}/connect-db`, {
         method: "POST",
-        headers: { "Content-Type": "application/json" },
+        headers: { "Content-Type": "application/json", ...authHeaders() },
         body: JSON.stringify(dbCredentials),
       });
 
@@ -435,6 +443,7 @@ const App = () => {
     try {
       await fetch(`${API_BASE}/disconnect-db`, {
         method: "POST",
+        headers: authHeaders(),
       });
       console.log("Disconnected from DB.");
     } catch (error) {
@@ -479,6 +488,7 @@ const App = () => {
     try {
       await fetch(`${API_BASE}/clear-csv`, {
         method: "POST",
+        headers: authHeaders(),
       });
     } catch (error) {
       console.error("Failed to clear CSV data:", error);
@@ -537,6 +547,7 @@ const App = () => {
     try {
       await fetch(`${API_BASE}/clear-csv`, {
         method: "POST",
+        headers: authHeaders(),
       });
     } catch (error) {
       console.error("Failed to clear CSV data:", error);
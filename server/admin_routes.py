@@ -0,0 +1,60 @@
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from fastapi.responses import FileResponse
+from typing import Dict, Any
+
+from auth_routes import require_admin
+from query_stats import query_stats
+from request_profiler import PROFILE_ARTIFACTS, profile_store
+
+router = APIRouter(prefix="/admin", tags=["Admin"], dependencies=[Depends(require_admin)])
+
+@router.get("/query-stats")
+def get_query_stats(
+    sort: str = Query("total", description="total, p95, calls or max"),
+    limit: int = Query(20, ge=1, le=500)
+) -> Dict[str, Any]:
+    """List the SQL fingerprints costing the most time on this worker."""
+    try:
+        top = query_stats.top(sort, limit)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    return {**query_stats.stats(), "sort": sort, "queries": top}
+
+@router.get("/query-stats/{fingerprint}")
+def get_query_fingerprint(fingerprint: str) -> Dict[str, Any]:
+    """Get the statistics of one SQL fingerprint."""
+    stats = query_stats.get(fingerprint)
+    if stats is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Fingerprint not found")
+    return stats
+
+@router.delete("/query-stats")
+def reset_query_stats() -> Dict[str, Any]:
+    """Clear the statistics, e.g. after deploying a prompt change."""
+    query_stats.reset()
+    return {"message": "Query statistics reset"}
+
+@router.get("/profiles")
+def list_profiles() -> Dict[str, Any]:
+    """List saved request profiles, newest first."""
+    return {"profiles": profile_store.list()}
+
+@router.get("/profiles/{profile_id}")
+def get_profile(profile_id: str) -> Dict[str, Any]:
+    """Get a profile's metadata and the artifacts it has."""
+    profile = profile_store.get(profile_id)
+    if profile is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Profile not found")
+    return profile
+
+@router.get("/profiles/{profile_id}/{artifact}")
+def download_profile(profile_id: str, artifact: str):
+    """
+    Download a profile artifact: prof (pstats, for snakeviz or
+    python -m pstats), txt (top functions) or memory (top allocations).
+    """
+    path = profile_store.artifact_path(profile_id, artifact)
+    if path is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Profile artifact not found")
+    suffix, media_type = PROFILE_ARTIFACTS[artifact]
+    return FileResponse(path, media_type=media_type, filename=f"{profile_id}{suffix}")
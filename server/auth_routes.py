@@ -1,4 +1,4 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Request, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from typing import Optional, Dict, Any
 import os
@@ -6,6 +6,7 @@ from datetime import datetime, timedelta
 
 from auth_service import AuthService
 from auth_schemas import UserSignup, UserLogin, Token, UserProfile, DBCredentials
+from rate_limit import client_address, enforce, enforce_available, login_failure_limiter, login_ip_limiter
 
 router = APIRouter(prefix="/auth", tags=["Authentication"])
 security = HTTPBearer(auto_error=False)
@@ -13,6 +14,9 @@ security = HTTPBearer(auto_error=False)
 # Initialize auth service
 auth_service = AuthService()
 
+# Usernames allowed to use the /admin endpoints, comma-separated
+ADMIN_USERS = {name.strip() for name in os.getenv("ADMIN_USERS", "").split(",") if name.strip()}
+
 def get_current_user(
     credentials: HTTPAuthorizationCredentials = Depends(security)
 ) -> Dict[str, Any]:
@@ -35,11 +39,39 @@ def get_current_user(
     
     return user
 
+def get_optional_user(
+    credentials: HTTPAuthorizationCredentials = Depends(security)
+) -> Optional[Dict[str, Any]]:
+    """Get the authenticated user if a valid JWT token was sent, otherwise None."""
+    if not credentials:
+        return None
+    
+    return auth_service.get_user_by_token(credentials.credentials)
+
+def is_admin(user: Optional[Dict[str, Any]]) -> bool:
+    """Whether a user is listed in ADMIN_USERS."""
+    return user is not None and user["username"] in ADMIN_USERS
+
+def require_admin(
+    current_user: Dict[str, Any] = Depends(get_current_user)
+) -> Dict[str, Any]:
+    """Get the current user, who must be listed in ADMIN_USERS."""
+    if not is_admin(current_user):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Admin access required",
+        )
+    
+    return current_user
+
 @router.post("/signup", response_model=Token)
-async def signup(user_data: UserSignup):
+async def signup(user_data: UserSignup, request: Request):
     """Register a new user with username and password."""
+    # Signups hash a password too, so they share the per-address login limit
+    enforce(login_ip_limiter, client_address(request))
+    
     try:
-        user, token = auth_service.create_user(user_data)
+        user, token = await auth_service.create_user(user_data)
         
         return Token(
             access_token=token,
@@ -62,10 +94,14 @@ async def signup(user_data: UserSignup):
         )
 
 @router.post("/login", response_model=Token)
-async def login(credentials: UserLogin):
+async def login(credentials: UserLogin, request: Request):
     """Login with username and password."""
+    enforce(login_ip_limiter, client_address(request))
+    account = credentials.username.lower()
+    enforce_available(login_failure_limiter, account)
+    
     try:
-        user, token = auth_service.authenticate_user(credentials)
+        user, token = await auth_service.authenticate_user(credentials)
         
         return Token(
             access_token=token,
@@ -77,6 +113,7 @@ async def login(credentials: UserLogin):
             )
         )
     except ValueError as e:
+        login_failure_limiter.record(account)
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail=str(e)
@@ -6,9 +6,10 @@ class UserSignup(BaseModel):
     """Schema for user signup."""
     username: str
     password: str
+    email: Optional[str] = None
 
 class UserLogin(BaseModel):
-    """Schema for user login."""
+    """Schema for user login. The username may also be the account's email."""
     username: str
     password: str
 
@@ -1,36 +1,155 @@
 import os
+import hashlib
 import secrets
 from datetime import datetime, timedelta
-from typing import Optional, Dict, Any, Tuple
-from passlib.context import CryptContext
+from typing import Optional, Dict, Any, Tuple, Callable
 from jose import JWTError, jwt
+from sqlalchemy import bindparam, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
 
 from auth_schemas import UserSignup, UserLogin, DBCredentials
-
-# Password hashing
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+from cache import ExpiringLRUCache
+from init_db import SessionLocal
+from models import User, UserPreference
+from password_hashing import PasswordHasher, password_hasher
+from state_backend import StateBackend, state_backend, encrypt_secret, decrypt_secret
 
 # JWT settings
 JWT_SECRET = os.getenv("JWT_SECRET", "your-secret-key-change-in-production")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60
 
+# Decoded token cache settings
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "10000"))
+TOKEN_CACHE_TTL_SECONDS = int(os.getenv("TOKEN_CACHE_TTL_SECONDS", "60"))
+
+# User lookup cache settings
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "10000"))
+USER_CACHE_TTL_SECONDS = int(os.getenv("USER_CACHE_TTL_SECONDS", "300"))
+
+class TokenCache(ExpiringLRUCache):
+    """
+    LRU cache of verified token payloads keyed by the token's SHA-256.
+    
+    Entries live for at most ttl_seconds and never beyond the token's own exp.
+    """
+    
+    def __init__(self, max_size: int = TOKEN_CACHE_SIZE, ttl_seconds: int = TOKEN_CACHE_TTL_SECONDS):
+        super().__init__(max_size, ttl_seconds)
+    
+    @staticmethod
+    def _key(token: str) -> str:
+        return hashlib.sha256(token.encode()).hexdigest()
+    
+    def get(self, token: str) -> Optional[Dict[str, Any]]:
+        return super().get(self._key(token))
+    
+    def put(self, token: str, payload: Dict[str, Any]):
+        super().put(self._key(token), payload, payload.get("exp"))
+
+# Columns loaded for authentication, without hydrating ORM objects
+USER_COLUMNS = (
+    User.id, User.username, User.email, User.hashed_password,
+    User.is_active, User.created_at, User.preferences,
+)
+
+# Lookup statements built once, so each lookup only binds a value. The
+# export format preference comes along so exports don't need a query of
+# their own.
+USER_LOOKUPS = {
+    field: select(*USER_COLUMNS, UserPreference.export_format)
+    .outerjoin(UserPreference, UserPreference.user_id == User.id)
+    .where(getattr(User, field) == bindparam("value"))
+    for field in ("username", "email")
+}
+
+def user_to_dict(user) -> Dict[str, Any]:
+    """Plain dict of the user fields the API works with, from a User or a row of USER_COLUMNS."""
+    return {
+        "id": user.id,
+        "username": user.username,
+        "email": user.email,
+        "hashed_password": user.hashed_password,
+        "is_active": user.is_active,
+        "created_at": user.created_at.isoformat(),
+        "preferences": user.preferences or {},
+        "export_format": getattr(user, "export_format", None),
+    }
+
 class AuthService:
-    """Simple in-memory authentication service with JWT tokens."""
+    """
+    Authentication service with JWT tokens, storing users in the users table.
     
-    def __init__(self):
-        # In-memory user storage (replace with database in production)
-        self.users: Dict[str, Dict[str, Any]] = {}
-        # In-memory database credentials storage
-        self.db_credentials: Dict[str, DBCredentials] = {}
+    Database work runs in the threadpool on pooled sessions, and lookups by
+    username or email are served from a read-through cache.
+    """
     
-    def _hash_password(self, password: str) -> str:
-        """Hash a password using bcrypt."""
-        return pwd_context.hash(password)
+    def __init__(self, session_factory: Callable[[], Session] = SessionLocal,
+                 backend: StateBackend = state_backend, hasher: PasswordHasher = password_hasher,
+                 token_cache: Optional[TokenCache] = None, user_cache: Optional[ExpiringLRUCache] = None):
+        self.session_factory = session_factory
+        # Database credentials are kept in the shared state backend
+        self.backend = backend
+        # bcrypt runs in a process pool, off the event loop
+        self.hasher = hasher
+        self.token_cache = token_cache if token_cache is not None else TokenCache()
+        self.user_cache = user_cache if user_cache is not None else ExpiringLRUCache(USER_CACHE_SIZE, USER_CACHE_TTL_SECONDS)
     
-    def _verify_password(self, plain_password: str, hashed_password: str) -> bool:
-        """Verify a password against its hash."""
-        return pwd_context.verify(plain_password, hashed_password)
+    # User storage
+    
+    def _get_user(self, username: str) -> Optional[Dict[str, Any]]:
+        return self._cached_lookup("username", username)
+    
+    def _get_user_by_email(self, email: str) -> Optional[Dict[str, Any]]:
+        return self._cached_lookup("email", email.lower())
+    
+    def _get_user_by_login(self, login: str) -> Optional[Dict[str, Any]]:
+        """Look a user up by username, or by email if the login looks like one."""
+        if "@" in login:
+            return self._get_user_by_email(login)
+        return self._get_user(login)
+    
+    def _cached_lookup(self, field: str, value: str) -> Optional[Dict[str, Any]]:
+        cached = self.user_cache.get(f"{field}:{value}")
+        if cached is not None:
+            return cached
+        
+        with self.session_factory() as db:
+            row = db.execute(USER_LOOKUPS[field], {"value": value}).first()
+        if row is None:
+            return None
+        user = user_to_dict(row)
+        
+        self._cache_user(user)
+        return user
+    
+    def _cache_user(self, user: Dict[str, Any]):
+        self.user_cache.put(f"username:{user['username']}", user)
+        if user["email"]:
+            self.user_cache.put(f"email:{user['email']}", user)
+    
+    def _insert_user(self, username: str, email: Optional[str], hashed_password: str) -> Dict[str, Any]:
+        with self.session_factory() as db:
+            user = User(username=username, email=email, hashed_password=hashed_password)
+            db.add(user)
+            try:
+                db.commit()
+            except IntegrityError:
+                db.rollback()
+                raise ValueError("Username or email already exists")
+            user = user_to_dict(user)
+        
+        self._cache_user(user)
+        return user
+    
+    def _update_password(self, user: Dict[str, Any], hashed_password: str):
+        with self.session_factory() as db:
+            db.query(User).filter(User.id == user["id"]).update({"hashed_password": hashed_password})
+            db.commit()
+        
+        self._cache_user({**user, "hashed_password": hashed_password})
     
     def _create_access_token(self, data: dict) -> str:
         """Create a JWT access token."""
@@ -42,55 +161,62 @@ class AuthService:
     
     def _verify_token(self, token: str) -> Optional[Dict[str, Any]]:
         """Verify a JWT token and return the payload."""
+        payload = self.token_cache.get(token)
+        if payload is not None:
+            return payload
+        
         try:
             payload = jwt.decode(token, JWT_SECRET, algorithms=[ALGORITHM])
             username: str = payload.get("sub")
             if username is None:
                 return None
+            self.token_cache.put(token, payload)
             return payload
         except JWTError:
             return None
     
-    def create_user(self, user_data: UserSignup) -> Tuple[Dict[str, Any], str]:
+    async def create_user(self, user_data: UserSignup) -> Tuple[Dict[str, Any], str]:
         """Create a new user."""
+        email = user_data.email.lower() if user_data.email else None
+        
         # Check if user already exists
-        if user_data.username in self.users:
+        if await run_in_threadpool(self._get_user, user_data.username):
             raise ValueError("Username already exists")
+        if email and await run_in_threadpool(self._get_user_by_email, email):
+            raise ValueError("Email already registered")
         
         # Validate password length
         if len(user_data.password) < 8:
             raise ValueError("Password must be at least 8 characters long")
         
-        # Create user
-        hashed_password = self._hash_password(user_data.password)
-        user = {
-            "username": user_data.username,
-            "hashed_password": hashed_password,
-            "created_at": datetime.utcnow().isoformat()
-        }
-        
-        # Store user
-        self.users[user_data.username] = user
+        # Create user, unless another request created it first
+        hashed_password = await self.hasher.hash(user_data.password)
+        user = await run_in_threadpool(self._insert_user, user_data.username, email, hashed_password)
         
         # Create access token
-        token_data = {"sub": user_data.username}
+        token_data = {"sub": user["username"]}
         access_token = self._create_access_token(token_data)
         
         return user, access_token
     
-    def authenticate_user(self, credentials: UserLogin) -> Tuple[Dict[str, Any], str]:
-        """Authenticate a user and return user data and token."""
+    async def authenticate_user(self, credentials: UserLogin) -> Tuple[Dict[str, Any], str]:
+        """Authenticate a user by username or email and return user data and token."""
         # Check if user exists
-        user = self.users.get(credentials.username)
-        if not user:
+        user = await run_in_threadpool(self._get_user_by_login, credentials.username)
+        if not user or not user["hashed_password"] or not user["is_active"]:
             raise ValueError("Invalid username or password")
         
         # Verify password
-        if not self._verify_password(credentials.password, user["hashed_password"]):
+        verified, needs_rehash = await self.hasher.verify(credentials.password, user["hashed_password"])
+        if not verified:
             raise ValueError("Invalid username or password")
         
+        # Upgrade hashes made at an older BCRYPT_ROUNDS setting
+        if needs_rehash:
+            await run_in_threadpool(self._update_password, user, await self.hasher.hash(credentials.password))
+        
         # Create access token
-        token_data = {"sub": credentials.username}
+        token_data = {"sub": user["username"]}
         access_token = self._create_access_token(token_data)
         
         return user, access_token
@@ -105,12 +231,21 @@ class AuthService:
         if not username:
             return None
         
-        return self.users.get(username)
+        user = self._get_user(username)
+        if not user or not user["is_active"]:
+            return None
+        return user
     
     def store_db_credentials(self, username: str, credentials: DBCredentials) -> None:
-        """Store database credentials for a user."""
-        self.db_credentials[username] = credentials
+        """Store database credentials for a user, with the password encrypted."""
+        stored = credentials.model_dump()
+        stored["password"] = encrypt_secret(credentials.password)
+        self.backend.set(f"db-credentials:{username}", stored)
     
     def get_db_credentials(self, username: str) -> Optional[DBCredentials]:
         """Get stored database credentials for a user."""
-        return self.db_credentials.get(username)
+        stored = self.backend.get(f"db-credentials:{username}")
+        if not stored:
+            return None
+        stored["password"] = decrypt_secret(stored["password"])
+        return DBCredentials(**stored)
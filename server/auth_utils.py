@@ -5,10 +5,13 @@ from datetime import datetime, timedelta
 from typing import Optional, Dict, Any
 from passlib.context import CryptContext
 from jose import JWTError, jwt
-from twilio.rest import Client
 from fastapi import HTTPException, status
 import re
 
+from logger import get_logger
+
+log = get_logger("auth_utils")
+
 # Security configuration
 SECRET_KEY = os.getenv("SECRET_KEY", secrets.token_urlsafe(32))
 ALGORITHM = "HS256"
@@ -74,10 +77,12 @@ def generate_otp() -> str:
 def send_sms_otp(phone_number: str, otp_code: str, purpose: str = "verification") -> bool:
     """Send OTP via SMS using Twilio."""
     if not all([TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN, TWILIO_PHONE_NUMBER]):
-        print("Twilio credentials not configured")
+        log.warning("sms_not_configured")
         return False
     
     try:
+        # Imported here so the server starts without twilio when SMS is unused
+        from twilio.rest import Client
         client = Client(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN)
         
         message_body = f"Your Queryous {purpose} code is: {otp_code}. Valid for 10 minutes."
@@ -88,10 +93,10 @@ def send_sms_otp(phone_number: str, otp_code: str, purpose: str = "verification"
             to=phone_number
         )
         
-        print(f"SMS sent successfully. SID: {message.sid}")
+        log.info("sms_sent", sid=message.sid, purpose=purpose)
         return True
     except Exception as e:
-        print(f"Failed to send SMS: {str(e)}")
+        log.error("sms_failed", purpose=purpose, error=str(e))
         return False
 
 def validate_email(email: str) -> bool:
@@ -195,10 +200,12 @@ def extract_ip_address(request) -> str:
     return request.client.host if request.client else "unknown"
 
 def is_rate_limited(email: str, max_attempts: int = 5, time_window: int = 300) -> bool:
-    """Check if user has exceeded login attempts (simple in-memory rate limiting)."""
-    # In production, this should use Redis or database
-    # For now, this is a placeholder that always returns False
-    return False
+    """Check if an account has exceeded its failed login attempts in the sliding window."""
+    from rate_limit import SlidingWindowLimiter
+    
+    # Shares counters with the failed logins recorded by the login route
+    limiter = SlidingWindowLimiter("login", max_attempts, time_window)
+    return limiter.check(email.lower()) > 0
 
 # Default user preferences
 DEFAULT_USER_PREFERENCES = {
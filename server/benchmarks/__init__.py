@@ -0,0 +1,5 @@
+"""
+Benchmarks for the Data Analytics Chatbot API Server
+
+Run from the server directory, e.g. `python -m benchmarks.bench_export`.
+"""
@@ -0,0 +1,109 @@
+"""
+Authentication benchmark
+
+Measures the two costs authentication adds to the server:
+- Login throughput and event-loop stalls during a burst of logins, with
+  bcrypt inline on the loop (the old behaviour) vs in the process pool
+- Per-request token verification, with and without the decoded token cache
+
+Usage:
+    python -m benchmarks.bench_auth --logins 32 --rounds 12
+"""
+
+import argparse
+import asyncio
+import os
+import time
+from typing import Dict, List
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark login throughput and token verification")
+    parser.add_argument("--logins", type=int, default=32, help="concurrent logins per burst")
+    parser.add_argument("--rounds", type=int, default=12, help="bcrypt cost (BCRYPT_ROUNDS)")
+    parser.add_argument("--requests", type=int, default=20000, help="token verifications to time")
+    return parser.parse_args()
+
+async def measure_loop_lag(stop: asyncio.Event, interval: float = 0.005) -> List[float]:
+    """
+    Record how late a periodic timer fires, as a stand-in for the latency
+    every other request on the loop would see.
+
+    """
+    lags = []
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        lags.append(time.perf_counter() - start - interval)
+    return lags
+
+async def login_burst(label: str, login, count: int) -> Dict[str, float]:
+    stop = asyncio.Event()
+    lag_task = asyncio.create_task(measure_loop_lag(stop))
+    await asyncio.sleep(0)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(login() for _ in range(count)))
+    elapsed = time.perf_counter() - start
+
+    stop.set()
+    lags = await lag_task
+    result = {
+        "path": label,
+        "logins_per_s": count / elapsed,
+        "max_loop_lag_ms": max(lags, default=0.0) * 1000,
+    }
+    print(f"{label:<24} {result['logins_per_s']:>8.1f} logins/s   max loop stall {result['max_loop_lag_ms']:>8.1f} ms")
+    return result
+
+def time_verifications(label: str, service, token: str, count: int) -> Dict[str, float]:
+    start = time.perf_counter()
+    for _ in range(count):
+        service.get_user_by_token(token)
+    per_request = (time.perf_counter() - start) / count
+    print(f"{label:<24} {per_request * 1e6:>8.1f} us per authenticated request")
+    return {"path": label, "us_per_request": per_request * 1e6}
+
+async def run(args) -> List[Dict[str, float]]:
+    from auth_schemas import UserLogin, UserSignup
+    from auth_service import AuthService, TokenCache
+    from password_hashing import PasswordHasher, pwd_context
+    from state_backend import InProcessStateBackend
+
+    hasher = PasswordHasher()
+    hasher.start()
+    service = AuthService(backend=InProcessStateBackend(), hasher=hasher)
+    await service.create_user(UserSignup(username="bench", password="bench-password"))
+    credentials = UserLogin(username="bench", password="bench-password")
+    stored_hash = service._get_user("bench")["hashed_password"]
+
+    async def inline_login():
+        # What authenticate_user used to do: bcrypt on the event loop
+        pwd_context.verify(credentials.password, stored_hash)
+
+    async def pooled_login():
+        await service.authenticate_user(credentials)
+
+    print(f"bcrypt rounds {args.rounds}, {hasher.workers} hashing worker(s), {args.logins} concurrent logins")
+    results = [
+        await login_burst("login inline", inline_login, args.logins),
+        await login_burst("login process pool", pooled_login, args.logins),
+    ]
+
+    _, token = await service.authenticate_user(credentials)
+    uncached = AuthService(backend=service.backend, hasher=hasher, token_cache=TokenCache(max_size=0))
+    results += [
+        time_verifications("token decode", uncached, token, args.requests),
+        time_verifications("token cache", service, token, args.requests),
+    ]
+
+    hasher.shutdown()
+    return results
+
+def main():
+    args = parse_args()
+    # The cost is read when password_hashing is imported, here and in the pool workers
+    os.environ["BCRYPT_ROUNDS"] = str(args.rounds)
+    return asyncio.run(run(args))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,276 @@
+"""
+End-to-end request benchmark
+
+Drives the API in-process through FastAPI's TestClient, with the LLM
+replaced by benchmarks.llm_stub, so a change can be measured from
+request to response:
+- /upload-csv of a generated CSV
+- /ask and /get-more-data against the uploaded data (DuckDB) and against
+  the same rows in a SQLite database
+- /export-csv of the whole table
+
+Each scenario reports throughput and p50/p95/p99 latency per fixture
+size. With --save-baseline the results are written to a JSON file; later
+runs compare against it and exit non-zero when a scenario's p95 or
+throughput regresses by more than --tolerance. Baselines depend on the
+machine, so none is committed: a run without one exits with status 2
+rather than passing unchecked.
+
+Usage:
+    python -m benchmarks.bench_e2e --sizes 10k,1m --llm-latency 0.2
+    python -m benchmarks.bench_e2e --sizes 10k --save-baseline
+"""
+
+import argparse
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+from sqlalchemy import create_engine
+
+from benchmarks.llm_stub import LLMStub
+
+BENCH_TABLE = "bench_sales"
+BENCH_USER = "bench"
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), "baseline_e2e.json")
+SIZES = {"10k": 10_000, "100k": 100_000, "1m": 1_000_000, "10m": 10_000_000}
+
+# Questions the LLM stub answers, portable between DuckDB and SQLite
+QUESTIONS = {
+    "Total amount by region": f"SELECT region, SUM(amount) AS total_amount FROM {BENCH_TABLE} GROUP BY region ORDER BY region",
+    "Average quantity per region": f"SELECT region, AVG(quantity) AS avg_quantity, COUNT(*) AS orders FROM {BENCH_TABLE} GROUP BY region",
+    "Largest orders": f"SELECT * FROM {BENCH_TABLE} ORDER BY amount DESC LIMIT 100",
+    "Big orders in the North": f"SELECT * FROM {BENCH_TABLE} WHERE region = 'North' AND quantity > 50",
+}
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark the API end to end with a stubbed LLM")
+    parser.add_argument("--sizes", default="10k", help=f"comma-separated fixture sizes: {', '.join(SIZES)}")
+    parser.add_argument("--requests", type=int, default=40, help="requests per /ask and /get-more-data scenario")
+    parser.add_argument("--heavy-requests", type=int, default=3, help="requests per upload and export scenario")
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="seconds the LLM stub waits per call")
+    parser.add_argument("--llm-jitter", type=float, default=0.0, help="uniform +/- jitter on the stub latency")
+    parser.add_argument("--skip-sqlite", action="store_true", help="only run the DuckDB (uploaded CSV) scenarios")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="baseline JSON to compare against")
+    parser.add_argument("--save-baseline", action="store_true", help="write this run's results as the baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed relative regression before failing")
+    return parser.parse_args()
+
+# MEASUREMENT
+
+def run_scenario(name: str, count: int, call: Callable[[int], int]) -> Dict[str, float]:
+    """
+    Time count calls of call(i), which sends one request and returns the
+    bytes or rows it moved.
+
+    """
+    latencies = []
+    moved = 0
+    started = time.perf_counter()
+    for i in range(count):
+        request_started = time.perf_counter()
+        moved += call(i)
+        latencies.append(time.perf_counter() - request_started)
+    elapsed = time.perf_counter() - started
+
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) * 1000
+    result = {
+        "requests": count,
+        "seconds": round(elapsed, 3),
+        "rps": round(count / elapsed, 2),
+        "p50_ms": round(float(p50), 2),
+        "p95_ms": round(float(p95), 2),
+        "p99_ms": round(float(p99), 2),
+        "moved_per_s": round(moved / elapsed, 1),
+    }
+    print(f"{name:<28} {result['rps']:>8.1f} req/s   p50 {result['p50_ms']:>9.1f} ms   "
+          f"p95 {result['p95_ms']:>9.1f} ms   p99 {result['p99_ms']:>9.1f} ms")
+    return result
+
+def check(response, expected: int = 200):
+    if response.status_code != expected:
+        raise RuntimeError(f"{response.request.method} {response.request.url.path} returned "
+                           f"{response.status_code}: {response.text[:300]}")
+    return response
+
+def sign_in(client, username: str) -> Dict[str, str]:
+    """
+    Authorization header for a benchmark user, signing it up on first use.
+    Only signed-in users can pick a workspace with X-Workspace-Id.
+
+    """
+    body = {"username": username, "password": "bench-password"}
+    response = client.post("/auth/signup", json=body)
+    if response.status_code != 200:
+        response = check(client.post("/auth/login", json=body))
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+# SCENARIOS
+
+def bench_size(client, label: str, rows: int, args, sqlite_dir: str) -> Dict[str, Dict[str, float]]:
+    from benchmarks.bench_export import make_fixture
+    from db import get_database_schema, format_schema_for_prompt
+    from utils import workspaces, workspace_key, workspace_owner
+
+    print(f"\nBuilding fixture with {rows:,} rows...")
+    df = make_fixture(rows)
+    buffer = io.BytesIO()
+    df.to_csv(buffer, index=False)
+    csv_bytes = buffer.getvalue()
+    print(f"CSV fixture is {len(csv_bytes) / 1e6:.1f} MB")
+
+    questions = list(QUESTIONS)
+    page_limit = 1000
+    pages = max(rows // page_limit, 1)
+    results = {}
+
+    def ask(headers):
+        def call(i: int) -> int:
+            response = check(client.post("/ask", json={"query": questions[i % len(questions)], "limit": page_limit}, headers=headers))
+            return response.json()["returned_rows"]
+        return call
+
+    def more_data(headers):
+        def call(i: int) -> int:
+            body = {"sql_query": f"SELECT * FROM {BENCH_TABLE}", "page": i % pages + 1, "limit": page_limit}
+            return len(check(client.post("/get-more-data", json=body, headers=headers)).json()["data"])
+        return call
+
+    def export(headers):
+        def call(i: int) -> int:
+            body = {"sql_query": f"SELECT * FROM {BENCH_TABLE}", "filename": "bench.csv"}
+            return len(check(client.post("/export-csv", json=body, headers=headers)).content)
+        return call
+
+    # DuckDB: the uploaded CSV
+    auth_headers = sign_in(client, BENCH_USER)
+    duckdb_headers = {**auth_headers, "X-Workspace-Id": f"bench-duckdb-{label}"}
+
+    def upload(i: int) -> int:
+        files = {"file": (f"{BENCH_TABLE}.csv", csv_bytes, "text/csv")}
+        check(client.post("/upload-csv", files=files, headers=duckdb_headers))
+        return len(csv_bytes)
+
+    results[f"upload_csv@{label}"] = run_scenario(f"upload-csv {label}", args.heavy_requests, upload)
+    results[f"ask_duckdb@{label}"] = run_scenario(f"ask duckdb {label}", args.requests, ask(duckdb_headers))
+    results[f"get_more_data_duckdb@{label}"] = run_scenario(f"get-more-data duckdb {label}", args.requests, more_data(duckdb_headers))
+    results[f"export_csv_duckdb@{label}"] = run_scenario(f"export-csv duckdb {label}", args.heavy_requests, export(duckdb_headers))
+
+    if not args.skip_sqlite:
+        # SQLite: the same rows in a database, connected directly since
+        # /connect-db only accepts MySQL and PostgreSQL credentials
+        sqlite_path = os.path.join(sqlite_dir, f"bench_{label}.sqlite")
+        engine = create_engine(f"sqlite:///{sqlite_path}")
+        df.to_sql(BENCH_TABLE, engine, if_exists="replace", index=False, chunksize=50000)
+
+        workspace_id = f"bench-sqlite-{label}"
+        user = {"username": BENCH_USER}
+        workspace = workspaces.get(workspace_key(user, workspace_id), workspace_owner(user))
+        workspace.set_database_engine(engine)
+        workspace.schema_prompt = format_schema_for_prompt(get_database_schema(engine))
+        sqlite_headers = {**auth_headers, "X-Workspace-Id": workspace_id}
+
+        results[f"ask_sqlite@{label}"] = run_scenario(f"ask sqlite {label}", args.requests, ask(sqlite_headers))
+        results[f"get_more_data_sqlite@{label}"] = run_scenario(f"get-more-data sqlite {label}", args.requests, more_data(sqlite_headers))
+        results[f"export_csv_sqlite@{label}"] = run_scenario(f"export-csv sqlite {label}", args.heavy_requests, export(sqlite_headers))
+        workspace.close_database()
+
+    return results
+
+# BASELINE
+
+def compare(results: Dict[str, Dict[str, float]], baseline: Dict[str, Dict[str, float]], tolerance: float) -> List[str]:
+    """
+    Scenarios whose p95 rose, or whose throughput fell, by more than the
+    tolerance relative to the baseline.
+
+    """
+    regressions = []
+    print(f"\n{'scenario':<32} {'p95 ms':>20} {'req/s':>20}")
+    for key, result in results.items():
+        base = baseline.get(key)
+        if base is None:
+            print(f"{key:<32} {'(no baseline)':>20}")
+            continue
+        p95_change = result["p95_ms"] / base["p95_ms"] - 1 if base["p95_ms"] else 0.0
+        rps_change = result["rps"] / base["rps"] - 1 if base["rps"] else 0.0
+        print(f"{key:<32} {base['p95_ms']:>8.1f} -> {result['p95_ms']:>8.1f} {base['rps']:>8.1f} -> {result['rps']:>8.1f}"
+              f"   ({p95_change:+.0%} p95, {rps_change:+.0%} req/s)")
+        if p95_change > tolerance:
+            regressions.append(f"{key}: p95 {base['p95_ms']:.1f} ms -> {result['p95_ms']:.1f} ms ({p95_change:+.0%})")
+        if rps_change < -tolerance:
+            regressions.append(f"{key}: throughput {base['rps']:.1f} -> {result['rps']:.1f} req/s ({rps_change:+.0%})")
+    return regressions
+
+def load_baseline(path: str) -> Optional[Dict[str, Dict[str, float]]]:
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)["scenarios"]
+
+def save_baseline(path: str, results: Dict[str, Dict[str, float]], args):
+    merged = load_baseline(path) or {}
+    merged.update(results)
+    with open(path, "w") as f:
+        json.dump({
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "llm_latency": args.llm_latency,
+            "scenarios": merged,
+        }, f, indent=2, sort_keys=True)
+    print(f"\nBaseline written to {path}")
+
+# MAIN
+
+def run(args) -> Dict[str, Dict[str, float]]:
+    labels = [label.strip().lower() for label in args.sizes.split(",") if label.strip()]
+    unknown = [label for label in labels if label not in SIZES]
+    if unknown:
+        raise SystemExit(f"Unknown sizes: {', '.join(unknown)}. Use: {', '.join(SIZES)}")
+
+    with tempfile.TemporaryDirectory(prefix="bench_e2e_") as workdir, \
+            LLMStub(QUESTIONS, BENCH_TABLE, args.llm_latency, args.llm_jitter) as stub:
+        # Read when the server modules are first imported, below and in bench_size
+        os.environ["LLM_API_URL"] = stub.url
+        os.environ["LLM_API_KEY"] = "bench"
+        os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(workdir, 'auth.db')}"
+        os.environ["RATE_LIMIT_ENABLED"] = "false"
+        os.environ.setdefault("LOG_LEVEL", "WARNING")
+        os.environ.setdefault("WORKSPACE_MAX_MB", "65536")
+        os.environ.setdefault("WORKSPACE_MEMORY_LIMIT_MB", "65536")
+
+        from fastapi.testclient import TestClient
+        import main as server
+
+        results = {}
+        with TestClient(server.app) as client:
+            for label in labels:
+                results.update(bench_size(client, label, SIZES[label], args, workdir))
+        print(f"\nLLM stub calls: {stub.calls}")
+    return results
+
+def main():
+    args = parse_args()
+    results = run(args)
+
+    baseline = load_baseline(args.baseline)
+    regressions = compare(results, baseline, args.tolerance) if baseline else []
+    if args.save_baseline:
+        save_baseline(args.baseline, results, args)
+    elif baseline is None:
+        print(f"\nNo baseline at {args.baseline}; run with --save-baseline to create one")
+        sys.exit(2)
+
+    if regressions and not args.save_baseline:
+        print(f"\nREGRESSIONS beyond {args.tolerance:.0%}:")
+        for line in regressions:
+            print(f"  {line}")
+        sys.exit(1)
+    return results
+
+if __name__ == "__main__":
+    main()
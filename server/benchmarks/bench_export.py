@@ -0,0 +1,125 @@
+"""
+Export throughput benchmark
+
+Measures MB/s of every CSV export path per backend:
+- DuckDB: native COPY TO vs chunked encoding (always runs)
+- SQLite: chunked encoding, standing in for the MySQL fallback (always runs)
+- PostgreSQL: COPY TO STDOUT vs chunked encoding (set BENCH_POSTGRES_URL)
+- MySQL: chunked encoding (set BENCH_MYSQL_URL)
+
+Usage:
+    python -m benchmarks.bench_export --rows 1000000
+"""
+
+import argparse
+import os
+import time
+from typing import Callable, Dict, Iterator, List
+
+import duckdb
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine
+
+from exports import (
+    stream_chunked_csv_export,
+    stream_duckdb_copy_export,
+    stream_postgres_copy_export,
+)
+
+BENCH_TABLE = "bench_export"
+
+def make_fixture(rows: int) -> pd.DataFrame:
+    """
+    Build a deterministic mixed-type table to export.
+
+    """
+    rng = np.random.default_rng(42)
+    return pd.DataFrame({
+        "id": np.arange(rows, dtype=np.int64),
+        "region": rng.choice(["North", "South", "East", "West"], rows),
+        "amount": rng.normal(500, 150, rows).round(2),
+        "quantity": rng.integers(1, 100, rows),
+        "order_date": pd.Timestamp("2024-01-01") + pd.to_timedelta(rng.integers(0, 365, rows), unit="D"),
+    })
+
+def measure(label: str, open_stream: Callable[[], Iterator[bytes]]) -> Dict[str, float]:
+    """
+    Drain an export stream and report its throughput.
+
+    """
+    start = time.perf_counter()
+    first_byte = None
+    total_bytes = 0
+    for block in open_stream():
+        if first_byte is None:
+            first_byte = time.perf_counter() - start
+        total_bytes += len(block)
+    elapsed = time.perf_counter() - start
+
+    result = {
+        "path": label,
+        "mb": total_bytes / 1e6,
+        "seconds": elapsed,
+        "mb_per_s": total_bytes / 1e6 / elapsed if elapsed else 0.0,
+        "first_byte_ms": (first_byte or 0.0) * 1000,
+    }
+    print(f"{label:<28} {result['mb']:>9.1f} MB {elapsed:>8.2f} s "
+          f"{result['mb_per_s']:>9.1f} MB/s  first byte {result['first_byte_ms']:.0f} ms")
+    return result
+
+def bench_duckdb(df: pd.DataFrame) -> List[Dict[str, float]]:
+    conn = duckdb.connect(':memory:')
+    conn.register(BENCH_TABLE, df)
+    sql = f'SELECT * FROM "{BENCH_TABLE}"'
+
+    def cursor():
+        cur = conn.cursor()
+        cur.register(BENCH_TABLE, df)
+        return cur
+
+    return [
+        measure("duckdb copy", lambda: stream_duckdb_copy_export(sql, cursor())),
+        measure("duckdb chunked", lambda: stream_chunked_csv_export(sql, cursor(), is_csv=True)),
+    ]
+
+def bench_sqlalchemy(name: str, url: str, df: pd.DataFrame) -> List[Dict[str, float]]:
+    engine = create_engine(url)
+    df.to_sql(BENCH_TABLE, engine, if_exists="replace", index=False, chunksize=50000)
+    sql = f"SELECT * FROM {BENCH_TABLE}"
+
+    results = []
+    if engine.dialect.name == "postgresql":
+        results.append(measure(f"{name} copy", lambda: stream_postgres_copy_export(sql, engine)))
+    results.append(measure(f"{name} chunked", lambda: stream_chunked_csv_export(sql, engine)))
+    engine.dispose()
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark CSV export throughput per backend")
+    parser.add_argument("--rows", type=int, default=1_000_000, help="rows in the exported table")
+    args = parser.parse_args()
+
+    print(f"Building fixture with {args.rows:,} rows...")
+    df = make_fixture(args.rows)
+
+    results = bench_duckdb(df)
+
+    sqlite_path = os.path.abspath("bench_export.sqlite")
+    try:
+        results += bench_sqlalchemy("sqlite", f"sqlite:///{sqlite_path}", df)
+    finally:
+        if os.path.exists(sqlite_path):
+            os.remove(sqlite_path)
+
+    for name in ("postgres", "mysql"):
+        url = os.getenv(f"BENCH_{name.upper()}_URL")
+        if url:
+            results += bench_sqlalchemy(name, url, df)
+        else:
+            print(f"{name:<28} skipped (set BENCH_{name.upper()}_URL)")
+
+    return results
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,228 @@
+"""
+Startup-time benchmark
+
+Tracks how long a fresh server process takes before it can serve, since
+autoscaled containers pay it on every cold start:
+- Import time of main, from `python -X importtime`, with the packages
+  that account for it
+- Time from launching uvicorn until /health answers
+- Latency of the first /upload-csv, which loads pandas and DuckDB on
+  demand (warm-up disabled, so this is the worst case)
+
+Fails when a dependency meant to load lazily (pandas, numpy, DuckDB,
+pyarrow, httpx, twilio) is imported with main, when import time
+exceeds --budget-ms, or when any timing regresses past --tolerance
+against the baseline saved with --save-baseline.
+
+Usage:
+    python -m benchmarks.bench_startup --runs 5
+    python -m benchmarks.bench_startup --budget-ms 1500 --save-baseline
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+
+from benchmarks.loadgen import SERVER_DIR, free_port
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), "baseline_startup.json")
+# Loaded on first use or by the warm-up, never by importing main
+LAZY_MODULES = ("pandas", "numpy", "duckdb", "pyarrow", "httpx", "twilio")
+TIMINGS = ("import_ms", "ready_ms", "first_upload_ms")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Measure server import time and time to first request")
+    parser.add_argument("--runs", type=int, default=5, help="fresh processes per measurement; medians are reported")
+    parser.add_argument("--top", type=int, default=15, help="packages listed in the import report")
+    parser.add_argument("--skip-serve", action="store_true", help="only measure import time")
+    parser.add_argument("--budget-ms", type=float, help="fail when the median import time of main exceeds this")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="baseline JSON to compare against")
+    parser.add_argument("--save-baseline", action="store_true", help="write this run's results as the baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed relative regression before failing")
+    parser.add_argument("--output", help="write the report as JSON to this file")
+    return parser.parse_args()
+
+def server_env(workdir: str) -> Dict[str, str]:
+    return {
+        **os.environ,
+        "DATABASE_URL": f"sqlite:///{os.path.join(workdir, 'auth.db')}",
+        "RATE_LIMIT_ENABLED": "false",
+        "LOG_LEVEL": os.getenv("LOG_LEVEL", "WARNING"),
+        "WARMUP_IMPORTS": "false",
+    }
+
+def median(values: List[float]) -> float:
+    ordered = sorted(values)
+    middle = len(ordered) // 2
+    return ordered[middle] if len(ordered) % 2 else (ordered[middle - 1] + ordered[middle]) / 2
+
+# IMPORT TIME
+
+def parse_importtime(stderr: str) -> Tuple[float, Dict[str, float]]:
+    """
+    The cumulative microseconds of main and the self time of every
+    top-level package imported along with it.
+
+    """
+    total = 0.0
+    packages: Dict[str, float] = defaultdict(float)
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        name = name.strip()
+        packages[name.split(".")[0]] += float(self_us)
+        if name == "main":
+            total = float(cumulative_us)
+    return total, packages
+
+def measure_import(env: Dict[str, str]) -> Tuple[float, Dict[str, float], List[str]]:
+    """Import main in a fresh interpreter: milliseconds, package breakdown and eager lazy modules"""
+    probe = f"import json, sys, main; print(json.dumps([m for m in {LAZY_MODULES!r} if m in sys.modules]))"
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", probe],
+                            cwd=SERVER_DIR, env=env, capture_output=True, text=True, timeout=120)
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing main failed:\n{result.stderr[-2000:]}")
+    total_us, packages = parse_importtime(result.stderr)
+    eager = json.loads(result.stdout.strip().splitlines()[-1])
+    return total_us / 1000, {name: us / 1000 for name, us in packages.items()}, eager
+
+# SERVING
+
+def measure_serve(env: Dict[str, str]) -> Tuple[float, float]:
+    """Launch uvicorn: milliseconds until /health answers, and of the first CSV upload"""
+    port = free_port()
+    started = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--workers", "1", "--log-level", "warning"],
+        cwd=SERVER_DIR, env=env,
+    )
+    try:
+        with httpx.Client(base_url=f"http://127.0.0.1:{port}", timeout=60.0) as client:
+            deadline = started + 60.0
+            while True:
+                try:
+                    if client.get("/health").status_code == 200:
+                        break
+                except httpx.HTTPError:
+                    pass
+                if time.perf_counter() > deadline or server.poll() is not None:
+                    raise RuntimeError("Server did not become ready")
+                time.sleep(0.01)
+            ready = time.perf_counter() - started
+
+            fixture = b"region,amount\n" + b"".join(b"North,%d\n" % i for i in range(100))
+            upload_started = time.perf_counter()
+            response = client.post("/upload-csv", files={"file": ("startup.csv", fixture, "text/csv")})
+            if response.status_code != 200:
+                raise RuntimeError(f"/upload-csv returned {response.status_code}: {response.text[:300]}")
+            first_upload = time.perf_counter() - upload_started
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+    return ready * 1000, first_upload * 1000
+
+# MAIN
+
+def run(args) -> Dict[str, object]:
+    imports: List[float] = []
+    packages: Dict[str, List[float]] = defaultdict(list)
+    eager: List[str] = []
+    ready: List[float] = []
+    first_upload: List[float] = []
+
+    with tempfile.TemporaryDirectory(prefix="bench_startup_") as workdir:
+        env = server_env(workdir)
+        # One untimed import so every timed run reads warm bytecode caches
+        measure_import(env)
+        for _ in range(args.runs):
+            import_ms, breakdown, eager_modules = measure_import(env)
+            imports.append(import_ms)
+            for name, ms in breakdown.items():
+                packages[name].append(ms)
+            eager = sorted(set(eager) | set(eager_modules))
+        if not args.skip_serve:
+            for _ in range(args.runs):
+                ready_ms, upload_ms = measure_serve(env)
+                ready.append(ready_ms)
+                first_upload.append(upload_ms)
+
+    top = sorted(((name, median(values + [0.0] * (args.runs - len(values)))) for name, values in packages.items()),
+                 key=lambda item: item[1], reverse=True)[:args.top]
+    timings = {"import_ms": round(median(imports), 1)}
+    if ready:
+        timings["ready_ms"] = round(median(ready), 1)
+        timings["first_upload_ms"] = round(median(first_upload), 1)
+
+    print(f"\nimport main          {timings['import_ms']:>9.1f} ms   (median of {args.runs})")
+    if ready:
+        print(f"launch to /health    {timings['ready_ms']:>9.1f} ms")
+        print(f"first /upload-csv    {timings['first_upload_ms']:>9.1f} ms")
+    print(f"\n{'package':<28} {'self ms':>9}")
+    for name, ms in top:
+        print(f"{name:<28} {ms:>9.1f}")
+    if eager:
+        print(f"\nImported eagerly by main: {', '.join(eager)}")
+    return {"timings": timings, "packages": [{"package": name, "self_ms": round(ms, 1)} for name, ms in top],
+            "eager_imports": eager}
+
+def compare(timings: Dict[str, float], baseline: Dict[str, float], tolerance: float) -> List[str]:
+    regressions = []
+    print(f"\n{'timing':<20} {'baseline':>10} {'now':>10}")
+    for key in TIMINGS:
+        if key not in timings or not baseline.get(key):
+            continue
+        change = timings[key] / baseline[key] - 1
+        print(f"{key:<20} {baseline[key]:>10.1f} {timings[key]:>10.1f}   ({change:+.0%})")
+        if change > tolerance:
+            regressions.append(f"{key}: {baseline[key]:.1f} ms -> {timings[key]:.1f} ms ({change:+.0%})")
+    return regressions
+
+def load_baseline(path: str) -> Optional[Dict[str, float]]:
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)["timings"]
+
+def main():
+    args = parse_args()
+    report = run(args)
+    timings = report["timings"]
+
+    failures = [f"{module} is imported by main but should load lazily" for module in report["eager_imports"]]
+    if args.budget_ms is not None and timings["import_ms"] > args.budget_ms:
+        failures.append(f"import_ms: {timings['import_ms']:.1f} ms exceeds the budget of {args.budget_ms:.0f} ms")
+
+    baseline = load_baseline(args.baseline)
+    if baseline and not args.save_baseline:
+        failures.extend(compare(timings, baseline, args.tolerance))
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump({"created_at": time.strftime("%Y-%m-%dT%H:%M:%S"), "timings": timings}, f, indent=2, sort_keys=True)
+        print(f"\nBaseline written to {args.baseline}")
+    elif baseline is None:
+        print(f"\nNo baseline at {args.baseline}; run with --save-baseline to create one")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Report written to {args.output}")
+
+    if failures:
+        print("\nFAILED:")
+        for line in failures:
+            print(f"  {line}")
+        sys.exit(1)
+    return report
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+"""
+User lookup benchmark
+
+Compares how long finding a user takes at a realistic account count:
+- The old in-memory store (a dict in the state backend)
+- The users table with the lookup cache disabled (every lookup queries)
+- The users table through the read-through cache
+- End-to-end login through AuthService, bcrypt included
+
+Runs against a temporary SQLite file, or against BENCH_AUTH_DATABASE_URL
+(e.g. a PostgreSQL URL) when set.
+
+Usage:
+    python -m benchmarks.bench_users --users 100000
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import tempfile
+import time
+import uuid
+from datetime import datetime
+from typing import Callable, Dict, List
+
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import sessionmaker
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark user lookups and logins")
+    parser.add_argument("--users", type=int, default=100_000, help="accounts in the table")
+    parser.add_argument("--lookups", type=int, default=20_000, help="lookups timed per path")
+    parser.add_argument("--logins", type=int, default=50, help="logins timed per path")
+    parser.add_argument("--rounds", type=int, default=4, help="bcrypt cost for the login comparison")
+    return parser.parse_args()
+
+def percentiles(label: str, samples: List[float], unit: str = "us") -> Dict[str, float]:
+    scale = 1e6 if unit == "us" else 1e3
+    ordered = sorted(samples)
+    result = {
+        "path": label,
+        "p50": statistics.median(ordered) * scale,
+        "p99": ordered[int(len(ordered) * 0.99) - 1] * scale,
+    }
+    print(f"{label:<28} p50 {result['p50']:>9.1f} {unit}   p99 {result['p99']:>9.1f} {unit}")
+    return result
+
+def time_calls(func: Callable[[str], object], names: List[str]) -> List[float]:
+    samples = []
+    for name in names:
+        start = time.perf_counter()
+        func(name)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+def populate(database_url: str, count: int, hashed_password: str):
+    """
+    Fill the users table with count accounts sharing one password hash.
+
+    """
+    from models import Base, User
+
+    engine = create_engine(database_url)
+    Base.metadata.drop_all(engine, tables=[User.__table__])
+    Base.metadata.create_all(engine, tables=[User.__table__])
+    now = datetime.utcnow()
+    batch = 10_000
+    with engine.begin() as conn:
+        for offset in range(0, count, batch):
+            conn.execute(insert(User), [
+                {
+                    "id": str(uuid.uuid4()),
+                    "username": f"user{i}",
+                    "email": f"user{i}@example.com",
+                    "hashed_password": hashed_password,
+                    "is_active": True,
+                    "created_at": now,
+                    "updated_at": now,
+                    "preferences": {},
+                }
+                for i in range(offset, min(offset + batch, count))
+            ])
+    return engine
+
+async def run(args) -> List[Dict[str, float]]:
+    from auth_schemas import UserLogin
+    from auth_service import AuthService
+    from cache import ExpiringLRUCache
+    from password_hashing import PasswordHasher, pwd_context
+    from state_backend import InProcessStateBackend
+
+    hashed_password = pwd_context.hash("bench-password")
+    database_url = os.getenv("BENCH_AUTH_DATABASE_URL")
+    sqlite_path = None
+    if not database_url:
+        sqlite_path = os.path.join(tempfile.mkdtemp(), "bench_users.db")
+        database_url = f"sqlite:///{sqlite_path}"
+
+    print(f"Populating {args.users:,} users...")
+    engine = populate(database_url, args.users, hashed_password)
+    sessions = sessionmaker(bind=engine)
+
+    memory = InProcessStateBackend()
+    for i in range(args.users):
+        memory.set(f"user:user{i}", {"username": f"user{i}", "hashed_password": hashed_password})
+
+    rng = random.Random(42)
+    names = [f"user{rng.randrange(args.users)}" for _ in range(args.lookups)]
+    hot_names = names[: max(args.lookups // 10, 1)] * 10
+
+    hasher = PasswordHasher(workers=1)
+    uncached = AuthService(session_factory=sessions, hasher=hasher, user_cache=ExpiringLRUCache(0, 0))
+    cached = AuthService(session_factory=sessions, hasher=hasher)
+
+    results = [
+        percentiles("lookup in-memory dict", time_calls(lambda name: memory.get(f"user:{name}"), names)),
+        percentiles("lookup users table", time_calls(uncached._get_user, names)),
+        percentiles("lookup cached (90% hits)", time_calls(cached._get_user, hot_names)),
+    ]
+
+    # Whole logins, with bcrypt at a low cost so lookups are not drowned out
+    hasher.start()
+    login_names = names[: args.logins]
+
+    async def time_logins(service: AuthService) -> List[float]:
+        samples = []
+        for name in login_names:
+            start = time.perf_counter()
+            await service.authenticate_user(UserLogin(username=name, password="bench-password"))
+            samples.append(time.perf_counter() - start)
+        return samples
+
+    results.append(percentiles("login users table (cold)", await time_logins(uncached), unit="ms"))
+    results.append(percentiles("login users table (cached)", await time_logins(cached), unit="ms"))
+
+    hasher.shutdown()
+    engine.dispose()
+    if sqlite_path:
+        os.remove(sqlite_path)
+    return results
+
+def main():
+    args = parse_args()
+    # Read when password_hashing is imported, here and in the pool worker
+    os.environ["BCRYPT_ROUNDS"] = str(args.rounds)
+    return asyncio.run(run(args))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""
+Local stand-in for the Groq/OpenAI-compatible chat completions endpoint
+
+Answers the server's LLM calls deterministically so benchmarks measure
+the server rather than the network or the model:
+- SQL requests are answered from a question -> SQL mapping, falling back
+  to selecting the first rows of a default table
+- Summary and title requests get fixed text
+- Latency is injectable, with optional seeded jitter, to model a real
+  provider's response time, and can be set per question for SQL requests
+
+Runs in-process as a background HTTP server, or standalone for servers
+started separately:
+    python -m benchmarks.llm_stub --port 8089 --latency 0.4 --table sales
+"""
+
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional, Tuple
+
+QUESTION_PATTERN = re.compile(r"User question:\s*(.*)\s*$", re.DOTALL)
+
+class LLMStub:
+    """
+    A chat completions server on 127.0.0.1. Use as a context manager, or
+    call start() and stop().
+
+    """
+
+    def __init__(self, sql: Optional[Dict[str, str]] = None, default_table: str = "data",
+                 latency: float = 0.0, jitter: float = 0.0, port: int = 0, seed: int = 42,
+                 sql_latency: Optional[Dict[str, float]] = None):
+        self.sql = sql or {}
+        self.sql_latency = sql_latency or {}
+        self.default_table = default_table
+        self.latency = latency
+        self.jitter = jitter
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.calls: Dict[str, int] = {}
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), self._handler())
+        self.server.daemon_threads = True
+        self.thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/openai/v1/chat/completions"
+
+    def start(self) -> "LLMStub":
+        self.thread = threading.Thread(target=self.server.serve_forever, name="llm-stub", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self) -> "LLMStub":
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def answer(self, messages: list) -> Tuple[str, str, Optional[str]]:
+        """The task a request is for, the stub's reply to it and the question asked"""
+        system = next((m["content"] for m in messages if m.get("role") == "system"), "")
+        prompt = next((m["content"] for m in reversed(messages) if m.get("role") == "user"), "")
+
+        if "summaries" in system:
+            if "short title" in prompt:
+                return "title", "Benchmark Result Overview", None
+            return "summary", "The results show the expected distribution across the benchmark data.", None
+
+        match = QUESTION_PATTERN.search(prompt)
+        question = match.group(1).strip() if match else prompt.strip()
+        return "sql", self.sql.get(question, f"SELECT * FROM {self.default_table} LIMIT 100"), question
+
+    def delay(self, question: Optional[str] = None) -> float:
+        if question in self.sql_latency:
+            return self.sql_latency[question]
+        with self.lock:
+            jitter = self.random.uniform(-self.jitter, self.jitter) if self.jitter else 0.0
+        return max(self.latency + jitter, 0.0)
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                task, content, question = stub.answer(body.get("messages", []))
+                with stub.lock:
+                    stub.calls[task] = stub.calls.get(task, 0) + 1
+                time.sleep(stub.delay(question))
+
+                prompt_tokens = sum(len(m.get("content", "")) for m in body.get("messages", [])) // 4
+                reply = json.dumps({
+                    "id": f"stub-{task}",
+                    "object": "chat.completion",
+                    "model": body.get("model", "stub"),
+                    "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+                    "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": len(content) // 4},
+                }).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(reply)))
+                self.end_headers()
+                self.wfile.write(reply)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a local stand-in for the LLM chat completions API")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every response")
+    parser.add_argument("--jitter", type=float, default=0.0, help="uniform +/- seconds around the latency")
+    parser.add_argument("--table", default="data", help="table queried by unknown questions")
+    parser.add_argument("--sql", help="JSON file mapping questions to SQL")
+    args = parser.parse_args()
+
+    sql = None
+    if args.sql:
+        with open(args.sql) as f:
+            sql = json.load(f)
+
+    stub = LLMStub(sql, args.table, args.latency, args.jitter, args.port)
+    print(f"LLM stub listening at {stub.url} (set LLM_API_URL to this)")
+    try:
+        stub.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
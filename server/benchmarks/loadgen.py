@@ -0,0 +1,352 @@
+"""
+Concurrent load generator and capacity report
+
+Finds how many concurrent analysts one worker sustains:
+- Starts the server (uvicorn, one worker) and the LLM stub as separate
+  processes, or targets a running server with --url
+- Signs each virtual analyst in as its own user, so each gets its own
+  workspace, uploads a fixture to it, then has them loop over a weighted
+  mix of questions, result pages, exports and re-uploads
+- Steps through the concurrency levels, reporting throughput, latency
+  percentiles and errors at each, and the event-loop lag the server
+  measured meanwhile (read from /metrics)
+- Marks the saturation point: the first level where throughput stops
+  growing by --min-gain or p95 exceeds --p95-slo
+
+Event-loop lag is the number to watch for blocking calls in async
+handlers: it should stay near zero as concurrency rises.
+
+Usage:
+    python -m benchmarks.loadgen --levels 1,2,4,8,16 --duration 20 --llm-latency 0.4
+    python -m benchmarks.loadgen --url http://localhost:8001 --metrics-token ...
+"""
+
+import argparse
+import asyncio
+import io
+import json
+import os
+import random
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+import numpy as np
+
+from benchmarks.bench_e2e import BENCH_TABLE, QUESTIONS
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LAG_METRIC = "queryous_event_loop_lag_seconds"
+STALL_METRIC = "queryous_event_loop_stalls_total"
+PAGE_LIMIT = 1000
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Measure latency against concurrency for one worker")
+    parser.add_argument("--url", help="target a running server instead of starting one")
+    parser.add_argument("--metrics-token", help="bearer token for /metrics, if the server requires one")
+    parser.add_argument("--levels", default="1,2,4,8,16,32", help="comma-separated concurrency levels")
+    parser.add_argument("--duration", type=float, default=15.0, help="seconds measured per level")
+    parser.add_argument("--warmup", type=float, default=2.0, help="seconds run before measuring each level")
+    parser.add_argument("--mix", default="ask=50,page=30,export=15,upload=5", help="weighted request mix")
+    parser.add_argument("--think", type=float, default=0.0, help="mean seconds an analyst waits between requests")
+    parser.add_argument("--rows", type=int, default=10_000, help="rows in each analyst's fixture")
+    parser.add_argument("--llm-latency", type=float, default=0.3, help="seconds the LLM stub waits per call")
+    parser.add_argument("--llm-jitter", type=float, default=0.1, help="uniform +/- jitter on the stub latency")
+    parser.add_argument("--min-gain", type=float, default=0.1, help="throughput growth below which a level is saturated")
+    parser.add_argument("--p95-slo", type=float, default=10.0, help="p95 seconds above which a level is saturated")
+    parser.add_argument("--output", help="write the report as JSON to this path")
+    parser.add_argument("--seed", type=int, default=42)
+    return parser.parse_args()
+
+def parse_mix(value: str) -> Dict[str, float]:
+    mix = {}
+    for part in value.split(","):
+        name, _, weight = part.partition("=")
+        if name.strip() not in ACTIONS:
+            raise SystemExit(f"Unknown action '{name}'. Use: {', '.join(ACTIONS)}")
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+# PROCESSES
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def start_processes(args, workdir: str, max_level: int) -> Tuple[str, List[subprocess.Popen]]:
+    """
+    Start the LLM stub and a single uvicorn worker, returning the server
+    URL and the processes to stop.
+
+    """
+    sql_path = os.path.join(workdir, "questions.json")
+    with open(sql_path, "w") as f:
+        json.dump(QUESTIONS, f)
+
+    stub_port, server_port = free_port(), free_port()
+    stub = subprocess.Popen(
+        [sys.executable, "-m", "benchmarks.llm_stub", "--port", str(stub_port), "--table", BENCH_TABLE,
+         "--sql", sql_path, "--latency", str(args.llm_latency), "--jitter", str(args.llm_jitter)],
+        cwd=SERVER_DIR, stdout=subprocess.DEVNULL,
+    )
+
+    env = {
+        **os.environ,
+        "LLM_API_URL": f"http://127.0.0.1:{stub_port}/openai/v1/chat/completions",
+        "LLM_API_KEY": "loadgen",
+        "DATABASE_URL": f"sqlite:///{os.path.join(workdir, 'auth.db')}",
+        "RATE_LIMIT_ENABLED": "false",
+        "LOG_LEVEL": os.getenv("LOG_LEVEL", "WARNING"),
+        "WORKSPACE_MAX_LIVE": str(max_level + 10),
+        "METRICS_TOKEN": "",
+    }
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(server_port),
+         "--workers", "1", "--log-level", "warning"],
+        cwd=SERVER_DIR, env=env,
+    )
+    return f"http://127.0.0.1:{server_port}", [server, stub]
+
+async def wait_ready(client: httpx.AsyncClient, timeout: float = 60.0):
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        try:
+            if (await client.get("/health")).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        await asyncio.sleep(0.25)
+    raise RuntimeError("Server did not become ready")
+
+# ACTIONS
+
+async def ask(client: httpx.AsyncClient, headers: Dict[str, str], rng: random.Random, fixture: bytes) -> int:
+    body = {"query": rng.choice(list(QUESTIONS)), "limit": PAGE_LIMIT}
+    return (await client.post("/ask", json=body, headers=headers)).status_code
+
+async def page(client: httpx.AsyncClient, headers: Dict[str, str], rng: random.Random, fixture: bytes) -> int:
+    pages = max(fixture.count(b"\n") // PAGE_LIMIT, 1)
+    body = {"sql_query": f"SELECT * FROM {BENCH_TABLE}", "page": rng.randint(1, pages), "limit": PAGE_LIMIT}
+    return (await client.post("/get-more-data", json=body, headers=headers)).status_code
+
+async def export(client: httpx.AsyncClient, headers: Dict[str, str], rng: random.Random, fixture: bytes) -> int:
+    body = {"sql_query": f"SELECT * FROM {BENCH_TABLE}", "filename": "load.csv"}
+    async with client.stream("POST", "/export-csv", json=body, headers=headers) as response:
+        async for _ in response.aiter_raw():
+            pass
+    return response.status_code
+
+async def upload(client: httpx.AsyncClient, headers: Dict[str, str], rng: random.Random, fixture: bytes) -> int:
+    files = {"file": (f"{BENCH_TABLE}.csv", fixture, "text/csv")}
+    return (await client.post("/upload-csv", files=files, headers=headers)).status_code
+
+ACTIONS = {"ask": ask, "page": page, "export": export, "upload": upload}
+
+# LOAD
+
+# Bearer tokens of the signed-in analysts, by index
+analyst_tokens: Dict[int, str] = {}
+
+async def sign_in_analysts(client: httpx.AsyncClient, count: int):
+    """Sign up (or log in) one user per analyst; only signed-in users get a workspace of their own"""
+    async def sign_in(index: int):
+        body = {"username": f"loadgen-{index}", "password": "loadgen-password"}
+        response = await client.post("/auth/signup", json=body)
+        if response.status_code != 200:
+            response = await client.post("/auth/login", json=body)
+            response.raise_for_status()
+        analyst_tokens[index] = response.json()["access_token"]
+    await asyncio.gather(*(sign_in(index) for index in range(count)))
+
+def analyst_headers(index: int) -> Dict[str, str]:
+    return {"Authorization": f"Bearer {analyst_tokens[index]}"}
+
+async def analyst(client: httpx.AsyncClient, index: int, mix: Dict[str, float], fixture: bytes,
+                  measure_from: float, stop_at: float, think: float, seed: int,
+                  samples: List[Tuple[str, float, bool]]):
+    """One virtual analyst sending requests back to back until stop_at"""
+    rng = random.Random(seed)
+    names, weights = list(mix), list(mix.values())
+    headers = analyst_headers(index)
+    while time.perf_counter() < stop_at:
+        action = rng.choices(names, weights)[0]
+        started = time.perf_counter()
+        try:
+            ok = await ACTIONS[action](client, headers, rng, fixture) < 400
+        except httpx.HTTPError:
+            ok = False
+        finished = time.perf_counter()
+        if started >= measure_from and finished <= stop_at:
+            samples.append((action, finished - started, ok))
+        if think:
+            await asyncio.sleep(rng.expovariate(1 / think))
+
+async def scrape_loop_lag(client: httpx.AsyncClient, headers: Dict[str, str]) -> Optional[Dict[str, object]]:
+    """The server's event-loop lag histogram and stall count, if /metrics is readable"""
+    try:
+        response = await client.get("/metrics", headers=headers)
+    except httpx.HTTPError:
+        return None
+    if response.status_code != 200:
+        return None
+    buckets, total, count, stalls = {}, 0.0, 0, 0.0
+    for line in response.text.splitlines():
+        if line.startswith(f"{LAG_METRIC}_bucket"):
+            bound = re.search(r'le="([^"]+)"', line).group(1)
+            buckets[float(bound)] = float(line.rsplit(" ", 1)[1])
+        elif line.startswith(f"{LAG_METRIC}_sum"):
+            total = float(line.rsplit(" ", 1)[1])
+        elif line.startswith(f"{LAG_METRIC}_count"):
+            count = float(line.rsplit(" ", 1)[1])
+        elif line.startswith(STALL_METRIC):
+            stalls = float(line.rsplit(" ", 1)[1])
+    return {"buckets": buckets, "sum": total, "count": count, "stalls": stalls}
+
+def lag_between(before: Optional[Dict], after: Optional[Dict]) -> Optional[Dict[str, float]]:
+    """Mean, p50 and p99 loop lag (bucket upper bounds) and stalls between two scrapes"""
+    if not before or not after or after["count"] <= before["count"]:
+        return None
+    count = after["count"] - before["count"]
+
+    def quantile(q: float) -> float:
+        for bound in sorted(after["buckets"]):
+            if after["buckets"][bound] - before["buckets"].get(bound, 0) >= q * count:
+                return bound
+        return float("inf")
+
+    return {
+        "mean_ms": round((after["sum"] - before["sum"]) / count * 1000, 2),
+        "p50_ms": quantile(0.5) * 1000,
+        "p99_ms": quantile(0.99) * 1000,
+        "stalls": int(after["stalls"] - before["stalls"]),
+    }
+
+async def run_level(client: httpx.AsyncClient, level: int, args, mix: Dict[str, float], fixture: bytes,
+                    metrics_headers: Dict[str, str]) -> Dict[str, object]:
+    samples: List[Tuple[str, float, bool]] = []
+    now = time.perf_counter()
+    measure_from = now + args.warmup
+    stop_at = measure_from + args.duration
+
+    tasks = [
+        asyncio.create_task(analyst(client, index, mix, fixture, measure_from, stop_at,
+                                    args.think, args.seed * 1000 + index, samples))
+        for index in range(level)
+    ]
+    await asyncio.sleep(args.warmup)
+    lag_before = await scrape_loop_lag(client, metrics_headers)
+    await asyncio.gather(*tasks)
+    lag_after = await scrape_loop_lag(client, metrics_headers)
+
+    latencies = [seconds for _, seconds, ok in samples if ok]
+    result: Dict[str, object] = {
+        "concurrency": level,
+        "requests": len(samples),
+        "errors": sum(1 for _, _, ok in samples if not ok),
+        "rps": round(len(latencies) / args.duration, 2),
+        "loop_lag": lag_between(lag_before, lag_after),
+        "actions": {},
+    }
+    if latencies:
+        p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+        result.update(p50_s=round(float(p50), 3), p95_s=round(float(p95), 3), p99_s=round(float(p99), 3))
+    for action in mix:
+        action_latencies = [seconds for name, seconds, ok in samples if name == action and ok]
+        if action_latencies:
+            result["actions"][action] = {
+                "requests": len(action_latencies),
+                "p50_s": round(float(np.percentile(action_latencies, 50)), 3),
+                "p95_s": round(float(np.percentile(action_latencies, 95)), 3),
+            }
+    return result
+
+def print_level(result: Dict[str, object]):
+    lag = result["loop_lag"]
+    lag_text = f"lag p50 {lag['p50_ms']:>6.1f} p99 {lag['p99_ms']:>7.1f} ms stalls {lag['stalls']:>3}" if lag else "lag n/a"
+    print(f"c={result['concurrency']:<4} {result['rps']:>7.1f} req/s   "
+          f"p50 {result.get('p50_s', 0):>6.2f} s  p95 {result.get('p95_s', 0):>6.2f} s  p99 {result.get('p99_s', 0):>6.2f} s   "
+          f"errors {result['errors']:>4}   {lag_text}")
+
+def find_saturation(levels: List[Dict[str, object]], min_gain: float, p95_slo: float) -> Optional[int]:
+    """The first concurrency level that adds too little throughput or breaks the p95 SLO"""
+    best = 0.0
+    for result in levels:
+        if result.get("p95_s", float("inf")) > p95_slo or (best and result["rps"] < best * (1 + min_gain)):
+            return result["concurrency"]
+        best = max(best, result["rps"])
+    return None
+
+# MAIN
+
+async def run(args) -> Dict[str, object]:
+    from benchmarks.bench_export import make_fixture
+
+    levels = sorted({int(level) for level in args.levels.split(",")})
+    mix = parse_mix(args.mix)
+    buffer = io.BytesIO()
+    make_fixture(args.rows).to_csv(buffer, index=False)
+    fixture = buffer.getvalue()
+    metrics_headers = {"Authorization": f"Bearer {args.metrics_token}"} if args.metrics_token else {}
+
+    with tempfile.TemporaryDirectory(prefix="loadgen_") as workdir:
+        processes = []
+        url = args.url
+        if not url:
+            url, processes = start_processes(args, workdir, max(levels))
+        try:
+            limits = httpx.Limits(max_connections=max(levels) + 4, max_keepalive_connections=max(levels) + 4)
+            async with httpx.AsyncClient(base_url=url, timeout=300.0, limits=limits) as client:
+                await wait_ready(client)
+                await sign_in_analysts(client, max(levels))
+                print(f"Uploading a {args.rows:,}-row fixture for {max(levels)} analysts...")
+                await asyncio.gather(*(
+                    upload(client, analyst_headers(index), random.Random(), fixture)
+                    for index in range(max(levels))
+                ))
+
+                print(f"Mix {mix}, {args.duration:.0f} s per level, LLM latency {args.llm_latency} s\n")
+                results = []
+                for level in levels:
+                    result = await run_level(client, level, args, mix, fixture, metrics_headers)
+                    print_level(result)
+                    results.append(result)
+        finally:
+            for process in processes:
+                process.terminate()
+                process.wait(timeout=30)
+
+    saturation = find_saturation(results, args.min_gain, args.p95_slo)
+    sustained = max((r["concurrency"] for r in results if saturation is None or r["concurrency"] < saturation), default=None)
+    if saturation is None:
+        print(f"\nNo saturation up to concurrency {levels[-1]}")
+    else:
+        print(f"\nSaturated at concurrency {saturation}; sustains {sustained} concurrent analysts")
+
+    return {
+        "url": args.url or "local",
+        "mix": mix,
+        "duration": args.duration,
+        "llm_latency": args.llm_latency,
+        "rows": args.rows,
+        "levels": results,
+        "saturation": saturation,
+        "sustained_concurrency": sustained,
+    }
+
+def main():
+    args = parse_args()
+    report = asyncio.run(run(args))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Report written to {args.output}")
+    return report
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,218 @@
+"""
+Local stand-in for a Redis server
+
+Speaks enough of the Redis protocol (RESP) for the state backend, so
+multi-worker runs and tests don't need a real Redis:
+- AUTH, SELECT, PING, GET, SET (with NX and EX), DEL, INCRBY, EXPIRE and
+  SCAN with MATCH and COUNT
+- Keys expire lazily, when they are next read
+- Every database number shares one keyspace
+
+Runs in-process as a background TCP server, or standalone for servers
+started separately:
+    python -m benchmarks.redis_stub --port 6390
+"""
+
+import argparse
+import fnmatch
+import socketserver
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+class RedisStub:
+    """
+    A Redis-protocol server on 127.0.0.1. Use as a context manager, or
+    call start() and stop().
+
+    """
+
+    def __init__(self, port: int = 0, password: Optional[str] = None):
+        self.password = password
+        self.values: Dict[str, bytes] = {}
+        self.expiry: Dict[str, float] = {}
+        self.lock = threading.Lock()
+        self.commands: Dict[str, int] = {}
+        self.server = socketserver.ThreadingTCPServer(("127.0.0.1", port), self._handler())
+        self.server.daemon_threads = True
+        self.thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        auth = f":{self.password}@" if self.password else ""
+        return f"redis://{auth}{host}:{port}/0"
+
+    def start(self) -> "RedisStub":
+        self.thread = threading.Thread(target=self.server.serve_forever, name="redis-stub", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self) -> "RedisStub":
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    # COMMANDS
+
+    def _live(self, key: str) -> bool:
+        expires_at = self.expiry.get(key)
+        if expires_at is not None and expires_at <= time.time():
+            self.values.pop(key, None)
+            self.expiry.pop(key, None)
+        return key in self.values
+
+    def execute(self, args: List[bytes], authenticated: bool) -> Tuple[bytes, bool]:
+        """The encoded reply to one command, and whether the connection is now authenticated"""
+        name = args[0].decode().upper()
+        with self.lock:
+            self.commands[name] = self.commands.get(name, 0) + 1
+        if name == "AUTH":
+            if args[1].decode() != self.password:
+                return error("WRONGPASS invalid password"), False
+            return simple("OK"), True
+        if self.password and not authenticated:
+            return error("NOAUTH Authentication required."), False
+        if name in ("PING", "SELECT"):
+            return simple("PONG" if name == "PING" else "OK"), authenticated
+
+        handler = getattr(self, f"_{name.lower()}", None)
+        if handler is None:
+            return error(f"ERR unknown command '{name}'"), authenticated
+        with self.lock:
+            try:
+                return handler(*[arg.decode() for arg in args[1:]]), authenticated
+            except (ValueError, TypeError):
+                return error("ERR syntax error"), authenticated
+
+    def _get(self, key: str) -> bytes:
+        return bulk(self.values[key] if self._live(key) else None)
+
+    def _set(self, key: str, value: str, *options: str) -> bytes:
+        options = [option.upper() for option in options]
+        if "NX" in options and self._live(key):
+            return bulk(None)
+        self.values[key] = value.encode()
+        if "EX" in options:
+            self.expiry[key] = time.time() + int(options[options.index("EX") + 1])
+        else:
+            self.expiry.pop(key, None)
+        return simple("OK")
+
+    def _del(self, *keys: str) -> bytes:
+        deleted = 0
+        for key in keys:
+            if self._live(key):
+                deleted += 1
+            self.values.pop(key, None)
+            self.expiry.pop(key, None)
+        return integer(deleted)
+
+    def _incrby(self, key: str, amount: str) -> bytes:
+        try:
+            value = int(self.values[key]) if self._live(key) else 0
+        except ValueError:
+            return error("ERR value is not an integer or out of range")
+        value += int(amount)
+        self.values[key] = str(value).encode()
+        return integer(value)
+
+    def _expire(self, key: str, seconds: str) -> bytes:
+        if not self._live(key):
+            return integer(0)
+        self.expiry[key] = time.time() + int(seconds)
+        return integer(1)
+
+    def _scan(self, cursor: str, *options: str) -> bytes:
+        options = list(options)
+        pattern = options[options.index("MATCH") + 1] if "MATCH" in options else "*"
+        count = int(options[options.index("COUNT") + 1]) if "COUNT" in options else 10
+        keys = sorted(key for key in list(self.values) if self._live(key) and _glob_match(key, pattern))
+        start = int(cursor)
+        batch = keys[start:start + count]
+        next_cursor = start + count if start + count < len(keys) else 0
+        return array([bulk(str(next_cursor).encode()), array([bulk(key.encode()) for key in batch])])
+
+    def _handler(self):
+        stub = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                authenticated = False
+                while True:
+                    try:
+                        args = read_command(self.rfile)
+                    except (ConnectionError, ValueError):
+                        return
+                    if args is None:
+                        return
+                    reply, authenticated = stub.execute(args, authenticated)
+                    self.wfile.write(reply)
+
+        return Handler
+
+# PROTOCOL
+
+def read_command(reader) -> Optional[List[bytes]]:
+    """One command sent as an array of bulk strings, or None at end of stream"""
+    line = reader.readline()
+    if not line:
+        return None
+    if line[:1] != b"*":
+        raise ValueError(f"Expected an array, got {line!r}")
+    args = []
+    for _ in range(int(line[1:-2])):
+        header = reader.readline()
+        if header[:1] != b"$":
+            raise ValueError(f"Expected a bulk string, got {header!r}")
+        args.append(reader.read(int(header[1:-2]) + 2)[:-2])
+    return args
+
+def simple(value: str) -> bytes:
+    return b"+%s\r\n" % value.encode()
+
+def error(message: str) -> bytes:
+    return b"-%s\r\n" % message.encode()
+
+def integer(value: int) -> bytes:
+    return b":%d\r\n" % value
+
+def bulk(value: Optional[bytes]) -> bytes:
+    return b"$-1\r\n" if value is None else b"$%d\r\n%s\r\n" % (len(value), value)
+
+def array(items: List[bytes]) -> bytes:
+    return b"*%d\r\n" % len(items) + b"".join(items)
+
+def _glob_match(key: str, pattern: str) -> bool:
+    """Redis glob matching, where a backslash escapes the next character"""
+    translated, escaped = "", False
+    for char in pattern:
+        if escaped:
+            translated += f"[{char}]" if char in "*?[" else char
+            escaped = False
+        elif char == "\\":
+            escaped = True
+        else:
+            translated += char
+    return fnmatch.fnmatchcase(key, translated)
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a local stand-in for a Redis server")
+    parser.add_argument("--port", type=int, default=6390)
+    parser.add_argument("--password", help="password required with AUTH")
+    args = parser.parse_args()
+
+    stub = RedisStub(args.port, args.password)
+    print(f"Redis stub listening at {stub.url} (set STATE_BACKEND_URL to this)")
+    try:
+        stub.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,321 @@
+"""
+Workload replay
+
+Re-runs a workload recorded by workload_capture (CAPTURE_ENABLED=true)
+against a chosen backend, so performance changes are tested against
+real traffic:
+- --target sql runs each request's database work directly, the same
+  count, page and export calls the server makes, without HTTP or the LLM
+- --target api drives the whole app in-process, with the LLM stub
+  answering every captured question with its captured SQL (cached LLM
+  responses), after either a fixed delay or the captured SQL generation
+  time (--llm-latency original)
+- Requests are dispatched open-loop at their captured pacing,
+  accelerated by --speed (0 sends them as fast as --concurrency allows)
+
+The backend is a database URL, or a directory of CSV or Parquet files
+loaded into DuckDB as the server does for uploads (tables are named
+after the files). Redacted string and number literals in the SQL stay executable
+but match nothing, so filtered queries return fewer rows than they did.
+
+The report compares replayed latency with the captured latency per
+request kind, and lists the SQL fingerprints that cost the most.
+
+Usage:
+    python -m benchmarks.replay workload_capture.jsonl --csv-dir ./data --speed 10
+    python -m benchmarks.replay workload_capture.jsonl --database-url postgresql://... --target sql
+    python -m benchmarks.replay workload_capture.jsonl --csv-dir ./data --target api --llm-latency original
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+
+from benchmarks.llm_stub import LLMStub
+
+REPLAY_KINDS = ("ask", "page", "export")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Replay a captured workload against a backend")
+    parser.add_argument("captures", nargs="+", help="capture JSON lines files, oldest first")
+    parser.add_argument("--database-url", help="SQLAlchemy URL of the database to replay against")
+    parser.add_argument("--csv-dir", help="directory of CSV or Parquet files to load into DuckDB")
+    parser.add_argument("--target", choices=("sql", "api"), default="sql", help="replay database work only, or whole requests")
+    parser.add_argument("--speed", type=float, default=1.0, help="pacing multiplier; 0 replays as fast as possible")
+    parser.add_argument("--concurrency", type=int, default=16, help="requests in flight at most")
+    parser.add_argument("--kinds", default=",".join(REPLAY_KINDS), help="request kinds to replay")
+    parser.add_argument("--limit", type=int, help="replay only the first N requests")
+    parser.add_argument("--llm-latency", default="0", help="seconds per LLM call in api mode, or 'original'")
+    parser.add_argument("--output", help="write the report as JSON to this path")
+    args = parser.parse_args()
+    if bool(args.database_url) == bool(args.csv_dir):
+        parser.error("give exactly one of --database-url or --csv-dir")
+    return args
+
+def load_workload(paths: List[str], kinds: List[str], limit: Optional[int]) -> List[Dict[str, Any]]:
+    records = []
+    for path in paths:
+        with open(path) as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                record = json.loads(line)
+                if record.get("kind") in kinds and record.get("sql") and record.get("status") == "ok":
+                    records.append(record)
+    records.sort(key=lambda record: record["ts"])
+    return records[:limit] if limit else records
+
+def load_csv_dir(directory: str):
+    """The files in a directory as DataFrames keyed by table name"""
+    import pandas as pd
+    from utils import sanitize_table_name
+
+    tables = {}
+    for name in sorted(os.listdir(directory)):
+        path = os.path.join(directory, name)
+        if name.endswith(".csv"):
+            tables[sanitize_table_name(name)] = pd.read_csv(path)
+        elif name.endswith(".parquet"):
+            tables[sanitize_table_name(name)] = pd.read_parquet(path)
+    if not tables:
+        raise SystemExit(f"No .csv or .parquet files in {directory}")
+    return tables
+
+# TARGETS
+
+def sql_target(args) -> Callable[[Dict[str, Any]], None]:
+    """Run each record's database work directly, as the server would"""
+    from exports import stream_export
+    from utils import execute_paginated_query, get_total_row_count, setup_csv_engine
+
+    if args.csv_dir:
+        tables = load_csv_dir(args.csv_dir)
+        engine = setup_csv_engine(tables)
+        is_csv = True
+    else:
+        from sqlalchemy import create_engine
+        engine = create_engine(args.database_url, pool_size=args.concurrency)
+        is_csv = False
+
+    local = threading.local()
+
+    def open_cursor():
+        # Tables registered on a connection are not visible to its cursors
+        cursor = engine.cursor()
+        for table_name, df in tables.items():
+            cursor.register(table_name, df)
+        return cursor
+
+    def query_engine():
+        # DuckDB connections are not shared between threads; each gets a cursor
+        if not is_csv:
+            return engine
+        if not hasattr(local, "cursor"):
+            local.cursor = open_cursor()
+        return local.cursor
+
+    def run(record: Dict[str, Any]):
+        sql_query = record["sql"]
+        if record["kind"] == "export":
+            # Exports close the DuckDB cursor they read from, as in the server
+            source = open_cursor() if is_csv else engine
+            for _ in stream_export(sql_query, source, is_csv=is_csv, export_format=record.get("format", "csv")):
+                pass
+            return
+        limit = record.get("limit") or 1000
+        offset = ((record.get("page") or 1) - 1) * limit
+        get_total_row_count(sql_query, query_engine(), is_csv)
+        execute_paginated_query(sql_query, limit, offset, query_engine(), is_csv)
+
+    return run
+
+def api_target(args) -> Callable[[Dict[str, Any]], None]:
+    """Send each record as a request to the app in-process"""
+    from fastapi.testclient import TestClient
+    import main as server
+    from db import format_schema_for_prompt, get_database_schema
+    from utils import workspace_key, workspaces
+
+    client = TestClient(server.app)
+    client.__enter__()
+    # Replays run in the anonymous workspace, the only one open to requests without a user
+    headers: Dict[str, str] = {}
+
+    if args.csv_dir:
+        import io
+        for table_name, df in load_csv_dir(args.csv_dir).items():
+            buffer = io.BytesIO()
+            df.to_csv(buffer, index=False)
+            response = client.post("/upload-csv", files={"file": (f"{table_name}.csv", buffer.getvalue(), "text/csv")}, headers=headers)
+            response.raise_for_status()
+    else:
+        from sqlalchemy import create_engine
+        engine = create_engine(args.database_url)
+        workspace = workspaces.get(workspace_key(None))
+        workspace.set_database_engine(engine)
+        workspace.schema_prompt = format_schema_for_prompt(get_database_schema(engine))
+
+    def run(record: Dict[str, Any]):
+        if record["kind"] == "ask":
+            body = {"query": record["question"] or "", "page": record.get("page") or 1, "limit": record.get("limit") or 1000}
+            response = client.post("/ask", json=body, headers=headers)
+        elif record["kind"] == "page":
+            body = {"sql_query": record["sql"], "page": record.get("page") or 1, "limit": record.get("limit") or 1000}
+            response = client.post("/get-more-data", json=body, headers=headers)
+        else:
+            response = client.post("/export-csv", json={"sql_query": record["sql"]}, headers=headers)
+        if response.status_code >= 400:
+            raise RuntimeError(f"{response.status_code}: {response.text[:200]}")
+
+    return run
+
+def captured_seconds(record: Dict[str, Any], target: str) -> Optional[float]:
+    """The captured latency comparable to what the target replays"""
+    if target == "api" or record["kind"] == "export":
+        return record.get("seconds")
+    stages = record.get("stages") or {}
+    if "count" in stages or "page" in stages:
+        return stages.get("count", 0.0) + stages.get("page", 0.0)
+    return None
+
+# REPLAY
+
+def replay(records: List[Dict[str, Any]], run: Callable[[Dict[str, Any]], None], args) -> List[Dict[str, Any]]:
+    """
+    Dispatch records at their captured offsets divided by speed, and
+    return one result per record.
+
+    """
+    results: List[Dict[str, Any]] = []
+    lock = threading.Lock()
+    first_ts = records[0]["ts"]
+    started = time.perf_counter()
+
+    def execute(record: Dict[str, Any], scheduled: float):
+        request_started = time.perf_counter()
+        error = None
+        try:
+            run(record)
+        except Exception as e:
+            error = str(e)
+        finished = time.perf_counter()
+        with lock:
+            results.append({
+                "kind": record["kind"],
+                "fingerprint": record.get("fingerprint"),
+                "seconds": finished - request_started,
+                "late": max(request_started - scheduled, 0.0),
+                "captured": captured_seconds(record, args.target),
+                "error": error,
+            })
+
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        for record in records:
+            scheduled = started + ((record["ts"] - first_ts) / args.speed if args.speed else 0.0)
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            pool.submit(execute, record, scheduled)
+    return results
+
+def summarize(results: List[Dict[str, Any]], elapsed: float) -> Dict[str, Any]:
+    def percentiles(values: List[float]) -> Dict[str, float]:
+        if not values:
+            return {}
+        p50, p95, p99 = np.percentile(values, [50, 95, 99]) * 1000
+        return {"p50_ms": round(float(p50), 1), "p95_ms": round(float(p95), 1), "p99_ms": round(float(p99), 1)}
+
+    report: Dict[str, Any] = {"requests": len(results), "seconds": round(elapsed, 2), "kinds": {}, "fingerprints": []}
+    print(f"\n{'kind':<8} {'requests':>8} {'errors':>7}   {'replay p50/p95 ms':>20}   {'captured p50/p95 ms':>20}   {'late p95 ms':>11}")
+    for kind in REPLAY_KINDS:
+        rows = [result for result in results if result["kind"] == kind]
+        if not rows:
+            continue
+        ok = [result for result in rows if result["error"] is None]
+        replayed = percentiles([result["seconds"] for result in ok])
+        captured = percentiles([result["captured"] for result in ok if result["captured"] is not None])
+        late = percentiles([result["late"] for result in rows])
+        report["kinds"][kind] = {"requests": len(rows), "errors": len(rows) - len(ok),
+                                 "replay": replayed, "captured": captured, "late": late}
+        print(f"{kind:<8} {len(rows):>8} {len(rows) - len(ok):>7}   "
+              f"{replayed.get('p50_ms', 0):>9.1f} /{replayed.get('p95_ms', 0):>9.1f}   "
+              f"{captured.get('p50_ms', 0):>9.1f} /{captured.get('p95_ms', 0):>9.1f}   {late.get('p95_ms', 0):>11.1f}")
+
+    by_fingerprint: Dict[str, Dict[str, Any]] = {}
+    for result in results:
+        entry = by_fingerprint.setdefault(result["fingerprint"], {"fingerprint": result["fingerprint"], "kind": result["kind"],
+                                                                  "calls": 0, "seconds": 0.0, "captured": 0.0})
+        entry["calls"] += 1
+        entry["seconds"] += result["seconds"]
+        entry["captured"] += result["captured"] or 0.0
+    top = sorted(by_fingerprint.values(), key=lambda entry: entry["seconds"], reverse=True)[:10]
+    print(f"\n{'fingerprint':<18} {'kind':<7} {'calls':>6} {'replay s':>9} {'captured s':>11}")
+    for entry in top:
+        print(f"{entry['fingerprint']:<18} {entry['kind']:<7} {entry['calls']:>6} {entry['seconds']:>9.2f} {entry['captured']:>11.2f}")
+        report["fingerprints"].append({key: round(value, 4) if isinstance(value, float) else value for key, value in entry.items()})
+
+    errors = [result["error"] for result in results if result["error"]]
+    if errors:
+        print(f"\n{len(errors)} requests failed, e.g. {errors[0]}")
+    return report
+
+def main():
+    args = parse_args()
+    kinds = [kind.strip() for kind in args.kinds.split(",") if kind.strip()]
+    records = load_workload(args.captures, kinds, args.limit)
+    if not records:
+        raise SystemExit("No successful requests with SQL in the capture")
+    span = records[-1]["ts"] - records[0]["ts"]
+    print(f"Replaying {len(records)} requests captured over {span:.0f} s "
+          f"({'as fast as possible' if not args.speed else f'{args.speed:g}x'}, target {args.target})")
+
+    stub = None
+    if args.target == "api":
+        sql = {record["question"]: record["sql"] for record in records if record["kind"] == "ask" and record.get("question")}
+        sql_latency = None
+        latency = 0.0
+        if args.llm_latency == "original":
+            sql_latency = {record["question"]: record["stages"].get("llm_sql", 0.0)
+                           for record in records if record["kind"] == "ask" and record.get("question")}
+            summaries = [record["stages"].get("llm_summary", 0.0) for record in records if record["kind"] == "ask"]
+            latency = float(np.mean(summaries)) if summaries else 0.0
+        else:
+            latency = float(args.llm_latency)
+        stub = LLMStub(sql, latency=latency, sql_latency=sql_latency).start()
+        # Read when the server modules are imported by api_target
+        os.environ["LLM_API_URL"] = stub.url
+        os.environ["LLM_API_KEY"] = "replay"
+        os.environ["RATE_LIMIT_ENABLED"] = "false"
+        os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='replay_'), 'auth.db')}")
+        os.environ.setdefault("LOG_LEVEL", "WARNING")
+        run = api_target(args)
+    else:
+        run = sql_target(args)
+
+    started = time.perf_counter()
+    try:
+        results = replay(records, run, args)
+    finally:
+        if stub is not None:
+            stub.stop()
+    report = summarize(results, time.perf_counter() - started)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nReport written to {args.output}")
+    if report["kinds"] and all(kind["errors"] == kind["requests"] for kind in report["kinds"].values()):
+        sys.exit(1)
+    return report
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+"""
+In-process caches for the Data Analytics Chatbot API Server
+
+- ExpiringLRUCache: a thread-safe LRU cache whose entries expire after a
+  TTL, used for verified tokens and user lookups, generated SQL, cost
+  estimates and rendered shared dashboards
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Optional, Tuple
+
+class ExpiringLRUCache:
+    """Thread-safe LRU cache whose entries expire after a TTL."""
+    
+    def __init__(self, max_size: int, ttl_seconds: int):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.entries: "OrderedDict[str, Tuple[Any, float]]" = OrderedDict()
+        self.lock = threading.Lock()
+    
+    def get(self, key: str) -> Optional[Any]:
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at <= time.time():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+    
+    def put(self, key: str, value: Any, expires_at: Optional[float] = None):
+        if self.max_size <= 0:
+            return
+        expires_at = min(time.time() + self.ttl_seconds, expires_at or float("inf"))
+        with self.lock:
+            self.entries[key] = (value, expires_at)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+    
+    def invalidate(self, *keys: str):
+        with self.lock:
+            for key in keys:
+                self.entries.pop(key, None)
@@ -0,0 +1,333 @@
+"""
+Chart data preparation for the Data Analytics Chatbot API Server
+
+This module decides what an automatic chart should show and computes its
+data over the full query result by pushing aggregation down to the engine:
+- Chart planning from the column profile of a result sample
+- GROUP BY aggregation for bar charts
+- Time bucketing plus LTTB downsampling for line charts
+- 2D binning for scatter plots
+"""
+
+from __future__ import annotations
+
+import math
+import os
+from typing import Any, Dict, Optional, Tuple
+
+from deadlines import RequestCancelledError, database_connection, interruptible
+from lazy_imports import lazy_module
+from profiling import columns_of_kind, is_identifier, profile_columns
+from utils import clean_sql_query, log_error
+
+duckdb = lazy_module("duckdb")
+np = lazy_module("numpy")
+pd = lazy_module("pandas")
+
+# Payload bounds for chart data, independent of the result size
+CHART_MAX_CATEGORIES = int(os.getenv("CHART_MAX_CATEGORIES", "50"))
+CHART_MAX_TIME_BUCKETS = int(os.getenv("CHART_MAX_TIME_BUCKETS", "2000"))
+CHART_MAX_LINE_POINTS = int(os.getenv("CHART_MAX_LINE_POINTS", "500"))
+CHART_MAX_SCATTER_POINTS = int(os.getenv("CHART_MAX_SCATTER_POINTS", "1000"))
+CHART_SCATTER_BINS = int(os.getenv("CHART_SCATTER_BINS", "40"))
+
+# Time bucket units from finest to coarsest with their approximate length in seconds
+TIME_UNITS = [
+    ("second", 1),
+    ("minute", 60),
+    ("hour", 3600),
+    ("day", 86400),
+    ("week", 7 * 86400),
+    ("month", 30 * 86400),
+    ("quarter", 91 * 86400),
+    ("year", 365 * 86400),
+]
+
+# strftime-style truncation for engines without date_trunc
+MYSQL_TIME_FORMATS = {
+    "second": "%Y-%m-%d %H:%i:%s",
+    "minute": "%Y-%m-%d %H:%i:00",
+    "hour": "%Y-%m-%d %H:00:00",
+    "day": "%Y-%m-%d",
+    "month": "%Y-%m-01",
+    "year": "%Y-01-01",
+}
+SQLITE_TIME_FORMATS = {
+    "second": "%Y-%m-%d %H:%M:%S",
+    "minute": "%Y-%m-%d %H:%M:00",
+    "hour": "%Y-%m-%d %H:00:00",
+    "day": "%Y-%m-%d",
+    "month": "%Y-%m-01",
+    "year": "%Y-01-01",
+}
+
+# CHART PLANNING
+
+def plan_chart(df: pd.DataFrame, profile: Optional[Dict[str, Dict[str, Any]]] = None) -> Optional[Dict[str, Any]]:
+    """
+    Choose the chart type and encoding for a result from a sample of its rows.
+
+    The choice is made from the column profile, which is computed here if
+    the caller doesn't already have one. The plan records which fields go
+    on each axis and how the full result has to be aggregated to draw it.
+
+    """
+    if df.shape[1] == 0:
+        return None
+
+    if df.shape[1] == 1:
+        return {"mark": "bar", "x": df.columns[0], "x_type": "nominal",
+                "y": "count", "y_type": "quantitative", "aggregate": "count"}
+
+    if profile is None:
+        profile = profile_columns(df)
+
+    # Identifier-like columns (unique, increasing integers) make poor measures
+    numeric_cols = columns_of_kind(profile, "numeric")
+    measure_cols = [col for col in numeric_cols if not is_identifier(profile[col], len(df))] or numeric_cols
+    categorical_cols = columns_of_kind(profile, "categorical") + columns_of_kind(profile, "boolean")
+    time_cols = columns_of_kind(profile, "temporal")
+
+    if time_cols:
+        # Prefer a time column the result is already ordered by
+        time_col = next((col for col in time_cols if profile[col]["monotonic"]), time_cols[0])
+        value_cols = [col for col in measure_cols if col != time_col]
+        if value_cols:
+            return {"mark": "line", "x": time_col, "x_type": "temporal",
+                    "y": value_cols[0], "y_type": "quantitative", "aggregate": "time"}
+
+    if categorical_cols and measure_cols:
+        return {"mark": "bar", "x": categorical_cols[0], "x_type": "nominal",
+                "y": measure_cols[0], "y_type": "quantitative", "aggregate": "sum"}
+
+    scatter_cols = measure_cols if len(measure_cols) >= 2 else numeric_cols
+    if len(scatter_cols) >= 2:
+        return {"mark": "point", "x": scatter_cols[0], "x_type": "quantitative",
+                "y": scatter_cols[1], "y_type": "quantitative", "aggregate": "bin"}
+
+    if categorical_cols:
+        return {"mark": "bar", "x": categorical_cols[0], "x_type": "nominal",
+                "y": "count", "y_type": "quantitative", "aggregate": "count"}
+
+    return None
+
+# CHART DATA
+
+def prepare_visualization_data(sql_query: str, engine, is_csv: bool, sample: pd.DataFrame,
+                               total_rows: Optional[int] = None,
+                               profile: Optional[Dict[str, Dict[str, Any]]] = None) -> Tuple[pd.DataFrame, Optional[Dict[str, Any]]]:
+    """
+    Compute size-bounded chart data over the full result of a query.
+
+    The chart is planned from the sample (usually the current page) and the
+    aggregation runs on the engine against the whole query. When the sample
+    already holds every row, it is aggregated locally with DuckDB instead.
+    If aggregation fails, the sample is returned unaggregated.
+
+    """
+    plan = plan_chart(sample, profile)
+    if plan is None or plan["aggregate"] is None:
+        return sample.head(CHART_MAX_SCATTER_POINTS), plan
+
+    local = None
+    if total_rows is not None and total_rows <= len(sample):
+        local = duckdb.connect(':memory:')
+        local.register('chart_sample', sample)
+        source_sql, engine, dialect, is_csv = 'SELECT * FROM chart_sample', local, 'duckdb', True
+    else:
+        source_sql = clean_sql_query(sql_query)
+        dialect = 'duckdb' if is_csv else engine.dialect.name
+
+    try:
+        query = ChartQuery(source_sql, engine, is_csv, dialect)
+        aggregators = {
+            "count": _aggregate_counts,
+            "sum": _aggregate_sums,
+            "time": _aggregate_time_series,
+            "bin": _aggregate_scatter,
+        }
+        data = aggregators[plan["aggregate"]](query, plan)
+        return data, {**plan, "aggregated": True, "size": "count" if "count" in data.columns and plan["aggregate"] == "bin" else None}
+    except RequestCancelledError:
+        raise
+    except Exception as e:
+        log_error(e, "Chart aggregation", include_traceback=False)
+        return sample.head(CHART_MAX_SCATTER_POINTS), plan
+    finally:
+        if local is not None:
+            local.close()
+
+class ChartQuery:
+    """Runs aggregation SQL around a source query on one engine"""
+
+    def __init__(self, source_sql: str, engine, is_csv: bool, dialect: str):
+        self.source_sql = source_sql
+        self.engine = engine
+        self.is_csv = is_csv
+        self.dialect = dialect
+
+    def quote(self, name: str) -> str:
+        if self.dialect == 'mysql':
+            return "`" + str(name).replace("`", "``") + "`"
+        return '"' + str(name).replace('"', '""') + '"'
+
+    def run(self, select_sql: str) -> pd.DataFrame:
+        """Run SELECT ... FROM (source) AS chart_source"""
+        sql = select_sql.format(source=f"({self.source_sql}) AS chart_source")
+        if self.is_csv:
+            with interruptible(self.engine):
+                return self.engine.execute(sql).fetchdf()
+        with database_connection(self.engine) as conn:
+            return pd.read_sql_query(sql, conn)
+
+def _aggregate_counts(query: ChartQuery, plan: Dict[str, Any]) -> pd.DataFrame:
+    """
+    Count rows per value of a single column (top categories only).
+
+    """
+    x = query.quote(plan["x"])
+    return query.run(
+        f"SELECT {x}, COUNT(*) AS {query.quote('count')} FROM {{source}} "
+        f"GROUP BY {x} ORDER BY 2 DESC LIMIT {CHART_MAX_CATEGORIES}"
+    )
+
+def _aggregate_sums(query: ChartQuery, plan: Dict[str, Any]) -> pd.DataFrame:
+    """
+    Sum a numeric column per category (top categories only).
+
+    """
+    x, y = query.quote(plan["x"]), query.quote(plan["y"])
+    return query.run(
+        f"SELECT {x}, SUM({y}) AS {y} FROM {{source}} "
+        f"GROUP BY {x} ORDER BY 2 DESC LIMIT {CHART_MAX_CATEGORIES}"
+    )
+
+def _aggregate_time_series(query: ChartQuery, plan: Dict[str, Any]) -> pd.DataFrame:
+    """
+    Average the value per time bucket, with the bucket width chosen from the
+    time range, then downsample the buckets with LTTB.
+
+    """
+    x, y = query.quote(plan["x"]), query.quote(plan["y"])
+    time_expr = _time_cast(query.dialect, x)
+
+    bounds = query.run(f"SELECT MIN({time_expr}) AS lo, MAX({time_expr}) AS hi FROM {{source}}")
+    lo, hi = pd.to_datetime(bounds.iloc[0]['lo']), pd.to_datetime(bounds.iloc[0]['hi'])
+    if pd.isna(lo) or pd.isna(hi):
+        raise ValueError("Time column has no values")
+
+    unit = _choose_time_unit(query.dialect, (hi - lo).total_seconds())
+    bucket = _time_bucket(query.dialect, unit, time_expr)
+    data = query.run(
+        f"SELECT {bucket} AS {x}, AVG({y}) AS {y} FROM {{source}} "
+        f"WHERE {x} IS NOT NULL GROUP BY 1 ORDER BY 1"
+    )
+    data[plan["x"]] = pd.to_datetime(data[plan["x"]])
+    data = data.dropna()
+
+    if len(data) > CHART_MAX_LINE_POINTS:
+        x_values = data[plan["x"]].to_numpy(dtype='datetime64[ns]').astype(np.int64).astype(float)
+        y_values = data[plan["y"]].to_numpy(dtype=float)
+        data = data.iloc[lttb_indices(x_values, y_values, CHART_MAX_LINE_POINTS)]
+    return data.reset_index(drop=True)
+
+def _aggregate_scatter(query: ChartQuery, plan: Dict[str, Any]) -> pd.DataFrame:
+    """
+    Return raw points for small results, otherwise counts per cell of a
+    fixed grid positioned at the cell centres.
+
+    """
+    x, y = query.quote(plan["x"]), query.quote(plan["y"])
+    stats = query.run(
+        f"SELECT COUNT(*) AS n, MIN({x}) AS x_lo, MAX({x}) AS x_hi, MIN({y}) AS y_lo, MAX({y}) AS y_hi "
+        f"FROM {{source}} WHERE {x} IS NOT NULL AND {y} IS NOT NULL"
+    ).iloc[0]
+
+    if int(stats['n']) <= CHART_MAX_SCATTER_POINTS:
+        return query.run(f"SELECT {x}, {y} FROM {{source}} WHERE {x} IS NOT NULL AND {y} IS NOT NULL")
+
+    x_lo, y_lo = float(stats['x_lo']), float(stats['y_lo'])
+    x_width = (float(stats['x_hi']) - x_lo) / CHART_SCATTER_BINS or 1.0
+    y_width = (float(stats['y_hi']) - y_lo) / CHART_SCATTER_BINS or 1.0
+    x_bin = f"FLOOR(({x} - {x_lo!r}) / {x_width!r})"
+    y_bin = f"FLOOR(({y} - {y_lo!r}) / {y_width!r})"
+
+    data = query.run(
+        f"SELECT {x_bin} AS x_bin, {y_bin} AS y_bin, COUNT(*) AS {query.quote('count')} "
+        f"FROM {{source}} WHERE {x} IS NOT NULL AND {y} IS NOT NULL GROUP BY 1, 2"
+    )
+    return pd.DataFrame({
+        plan["x"]: x_lo + (np.minimum(data['x_bin'], CHART_SCATTER_BINS - 1) + 0.5) * x_width,
+        plan["y"]: y_lo + (np.minimum(data['y_bin'], CHART_SCATTER_BINS - 1) + 0.5) * y_width,
+        "count": data['count'],
+    })
+
+# SQL DIALECT HELPERS
+
+def _time_cast(dialect: str, column: str) -> str:
+    if dialect == 'mysql':
+        return f"CAST({column} AS DATETIME)"
+    if dialect == 'sqlite':
+        return f"datetime({column})"
+    return f"CAST({column} AS TIMESTAMP)"
+
+def _choose_time_unit(dialect: str, span_seconds: float) -> str:
+    """Finest unit that keeps the number of buckets under the limit"""
+    formats = _time_formats(dialect)
+    for unit, seconds in TIME_UNITS:
+        if formats is not None and unit not in formats:
+            continue
+        if span_seconds / seconds <= CHART_MAX_TIME_BUCKETS:
+            return unit
+    return "year"
+
+def _time_formats(dialect: str) -> Optional[Dict[str, str]]:
+    if dialect == 'mysql':
+        return MYSQL_TIME_FORMATS
+    if dialect == 'sqlite':
+        return SQLITE_TIME_FORMATS
+    return None
+
+def _time_bucket(dialect: str, unit: str, time_expr: str) -> str:
+    if dialect == 'mysql':
+        return f"DATE_FORMAT({time_expr}, '{MYSQL_TIME_FORMATS[unit]}')"
+    if dialect == 'sqlite':
+        return f"strftime('{SQLITE_TIME_FORMATS[unit]}', {time_expr})"
+    return f"date_trunc('{unit}', {time_expr})"
+
+# DOWNSAMPLING
+
+def lttb_indices(x: np.ndarray, y: np.ndarray, threshold: int) -> np.ndarray:
+    """
+    Largest-Triangle-Three-Buckets downsampling.
+
+    Returns the indices of at most `threshold` points that preserve the
+    visual shape of the series; the first and last points are always kept.
+
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    bucket_size = (n - 2) / (threshold - 2)
+    indices = np.empty(threshold, dtype=np.int64)
+    indices[0], indices[-1] = 0, n - 1
+
+    selected = 0
+    for i in range(threshold - 2):
+        start = int(math.floor(i * bucket_size)) + 1
+        end = int(math.floor((i + 1) * bucket_size)) + 1
+        next_end = min(int(math.floor((i + 2) * bucket_size)) + 1, n)
+
+        # Average of the next bucket is the third vertex of the triangle
+        avg_x = x[end:next_end].mean()
+        avg_y = y[end:next_end].mean()
+
+        areas = np.abs(
+            (x[selected] - avg_x) * (y[start:end] - y[selected])
+            - (x[selected] - x[start:end]) * (avg_y - y[selected])
+        )
+        selected = start + int(np.argmax(areas))
+        indices[i + 1] = selected
+
+    return indices
@@ -0,0 +1,110 @@
+"""
+Chart rendering for the Data Analytics Chatbot API Server
+
+This module turns chart data and a chart plan (see chart_data.plan_chart)
+into a Vega-Lite specification without Altair:
+- Spec templates cached per chart type and encoding
+- Inline data values serialized straight from the DataFrame
+- No filesystem I/O and no schema validation on the request path
+"""
+
+from __future__ import annotations
+
+import json
+from functools import lru_cache
+from typing import Any, Dict, Optional
+
+from chart_data import plan_chart
+from lazy_imports import lazy_module
+from logger import get_logger
+
+pd = lazy_module("pandas")
+
+log = get_logger("charts")
+
+VEGA_LITE_SCHEMA = "https://vega.github.io/schema/vega-lite/v6.json"
+
+# Placeholders substituted into cached templates
+_X_FIELD = "__queryous_x_field__"
+_Y_FIELD = "__queryous_y_field__"
+_SIZE_FIELD = "__queryous_size_field__"
+
+# SPEC TEMPLATES
+
+@lru_cache(maxsize=64)
+def _spec_template(mark: str, x_type: str, y_type: str, sized: bool) -> str:
+    """
+    Serialized spec for one chart type without its data, with placeholders
+    for the field names.
+
+    """
+    encoding = {
+        "x": {"field": _X_FIELD, "type": x_type},
+        "y": {"field": _Y_FIELD, "type": y_type},
+    }
+    if x_type == "nominal":
+        encoding["x"]["sort"] = None
+    if sized:
+        encoding["size"] = {"field": _SIZE_FIELD, "type": "quantitative"}
+
+    spec = {
+        "$schema": VEGA_LITE_SCHEMA,
+        "mark": {"type": mark, "tooltip": True},
+        "encoding": encoding,
+    }
+    # Leave the closing brace off so the data can be appended
+    return json.dumps(spec)[:-1]
+
+def _field_name(name: Any) -> str:
+    """
+    Escape characters Vega-Lite treats as nested field access.
+
+    """
+    escaped = str(name).replace("\\", "\\\\").replace(".", "\\.").replace("[", "\\[").replace("]", "\\]")
+    return json.dumps(escaped)
+
+# CHART GENERATION
+
+def build_chart_spec(df: pd.DataFrame, plan: Dict[str, Any]) -> str:
+    """
+    Build a Vega-Lite spec as a JSON string with the data inlined.
+
+    """
+    if plan["aggregate"] == "count" and not plan.get("aggregated"):
+        counts = df[plan["x"]].value_counts().reset_index()
+        counts.columns = [plan["x"], 'count']
+        df = counts
+
+    size_field = plan.get("size")
+    columns = [plan["x"], plan["y"]] + ([size_field] if size_field else [])
+    values = df[columns].to_json(orient='records', date_format='iso')
+
+    template = _spec_template(plan["mark"], plan["x_type"], plan["y_type"], bool(size_field))
+    spec = template.replace(json.dumps(_X_FIELD), _field_name(plan["x"]))
+    spec = spec.replace(json.dumps(_Y_FIELD), _field_name(plan["y"]))
+    if size_field:
+        spec = spec.replace(json.dumps(_SIZE_FIELD), _field_name(size_field))
+
+    return f'{spec}, "data": {{"values": {values}}}}}'
+
+def generate_auto_chart(df: pd.DataFrame, plan: Optional[Dict[str, Any]] = None) -> Optional[str]:
+    """
+    Generate a Vega-Lite chart for a result, or None if it can't be charted.
+
+    """
+    try:
+        if df.empty:
+            return None
+
+        # Plan from the data itself when no server-side aggregation was done
+        if plan is None:
+            plan = plan_chart(df)
+        if plan is None:
+            return None
+
+        return build_chart_spec(df, plan)
+
+    except Exception as e:
+        # The answer is still useful without a chart
+        log.warning("chart_generation_failed", error=str(e))
+        return None
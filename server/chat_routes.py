@@ -0,0 +1,111 @@
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Response, status
+from typing import Optional, Dict, Any
+import gzip
+
+from auth_routes import get_current_user
+from chat_schemas import (
+    ChatSessionCreate, ChatSessionUpdate, ChatSessionSummary,
+    ChatMessageCreate, ChatMessageOut, ChatMessagePage
+)
+from chat_service import ChatService, PayloadTooLargeError
+
+router = APIRouter(prefix="/chats", tags=["Chat History"])
+
+# Initialize chat service
+chat_service = ChatService()
+
+# The handlers below are plain functions so FastAPI runs their database
+# work in the threadpool rather than on the event loop.
+
+def session_not_found() -> HTTPException:
+    return HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Chat session not found")
+
+@router.get("")
+def list_chat_sessions(
+    page: int = Query(1, ge=1),
+    limit: int = Query(50, ge=1, le=200),
+    current_user: Dict[str, Any] = Depends(get_current_user)
+):
+    """List the user's chat sessions for the sidebar, without their messages."""
+    sessions, has_more = chat_service.list_sessions(current_user["id"], limit, (page - 1) * limit)
+    return {"sessions": sessions, "page": page, "has_more": has_more}
+
+@router.post("", response_model=ChatSessionSummary, status_code=status.HTTP_201_CREATED)
+def create_chat_session(
+    data: ChatSessionCreate,
+    current_user: Dict[str, Any] = Depends(get_current_user)
+):
+    """Start a new chat session."""
+    return chat_service.create_session(current_user["id"], data)
+
+@router.patch("/{session_id}", response_model=ChatSessionSummary)
+def update_chat_session(
+    session_id: str,
+    data: ChatSessionUpdate,
+    current_user: Dict[str, Any] = Depends(get_current_user)
+):
+    """Rename, star or tag a chat session."""
+    chat = chat_service.update_session(current_user["id"], session_id, data)
+    if chat is None:
+        raise session_not_found()
+    return chat
+
+@router.delete("/{session_id}")
+def delete_chat_session(
+    session_id: str,
+    current_user: Dict[str, Any] = Depends(get_current_user)
+):
+    """Delete a chat session with all of its messages."""
+    if not chat_service.delete_session(current_user["id"], session_id):
+        raise session_not_found()
+    return {"message": "Chat session deleted", "session_id": session_id}
+
+@router.get("/{session_id}/messages", response_model=ChatMessagePage)
+def get_chat_messages(
+    session_id: str,
+    before_seq: Optional[int] = Query(None, ge=1),
+    limit: int = Query(50, ge=1, le=200),
+    current_user: Dict[str, Any] = Depends(get_current_user)
+):
+    """
+    Get a page of messages, the newest ones by default. Result payloads are
+    not included; messages with one have has_payload set.
+    """
+    messages = chat_service.get_messages(current_user["id"], session_id, before_seq, limit)
+    if messages is None:
+        raise session_not_found()
+    return messages
+
+@router.post("/{session_id}/messages", response_model=ChatMessageOut, status_code=status.HTTP_201_CREATED)
+def append_chat_message(
+    session_id: str,
+    data: ChatMessageCreate,
+    current_user: Dict[str, Any] = Depends(get_current_user)
+):
+    """Append a message, storing any result payload out of row."""
+    try:
+        message = chat_service.append_message(current_user["id"], session_id, data)
+    except PayloadTooLargeError as e:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=str(e))
+    if message is None:
+        raise session_not_found()
+    return message
+
+@router.get("/{session_id}/messages/{seq}/payload")
+def get_chat_message_payload(
+    session_id: str,
+    seq: int,
+    accept_encoding: Optional[str] = Header(None, alias="Accept-Encoding"),
+    current_user: Dict[str, Any] = Depends(get_current_user)
+):
+    """
+    Get the result rows and chart stored with a message. Payloads are kept
+    gzip-compressed and sent as they are to clients that accept gzip.
+    """
+    body = chat_service.get_payload(current_user["id"], session_id, seq)
+    if body is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Message payload not found")
+    
+    if accept_encoding and "gzip" in accept_encoding:
+        return Response(body, media_type="application/json", headers={"Content-Encoding": "gzip", "Vary": "Accept-Encoding"})
+    return Response(gzip.decompress(body), media_type="application/json", headers={"Vary": "Accept-Encoding"})
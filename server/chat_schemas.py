@@ -0,0 +1,48 @@
+from pydantic import BaseModel
+from typing import Optional, List, Dict, Any
+
+class ChatSessionCreate(BaseModel):
+    """Schema for starting a chat session."""
+    title: str = "New Chat"
+    tags: List[str] = []
+
+class ChatSessionUpdate(BaseModel):
+    """Schema for renaming, starring or tagging a chat session."""
+    title: Optional[str] = None
+    is_favorite: Optional[bool] = None
+    tags: Optional[List[str]] = None
+
+class ChatSessionSummary(BaseModel):
+    """Schema for a chat session in listings, without its messages."""
+    id: str
+    title: str
+    is_favorite: bool
+    tags: List[str]
+    message_count: int
+    created_at: str
+    updated_at: str
+
+class ChatMessageCreate(BaseModel):
+    """Schema for appending a message. The payload holds result rows and charts."""
+    role: str
+    content: str = ""
+    sql_query: Optional[str] = None
+    details: Dict[str, Any] = {}
+    payload: Optional[Dict[str, Any]] = None
+
+class ChatMessageOut(BaseModel):
+    """Schema for a stored message. Its payload is fetched separately."""
+    seq: int
+    role: str
+    content: str
+    sql_query: Optional[str] = None
+    details: Dict[str, Any]
+    has_payload: bool
+    payload_size: Optional[int] = None
+    created_at: str
+
+class ChatMessagePage(BaseModel):
+    """Schema for one page of a session's messages, oldest first."""
+    messages: List[ChatMessageOut]
+    has_more: bool
+    next_before_seq: Optional[int] = None
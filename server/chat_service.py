@@ -0,0 +1,277 @@
+import gzip
+import json
+import os
+from datetime import datetime
+from typing import Optional, Dict, Any, List, Tuple, Callable
+from sqlalchemy import delete, func, null, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from chat_schemas import ChatSessionCreate, ChatSessionUpdate, ChatMessageCreate
+from init_db import SessionLocal
+from models import ChatSession, ChatMessage, ChatMessagePayload
+
+# Largest result payload stored with a message, uncompressed
+CHAT_PAYLOAD_MAX_MB = int(os.getenv("CHAT_PAYLOAD_MAX_MB", "20"))
+
+# Attempts at claiming the next sequence number when appends race
+APPEND_RETRIES = 5
+
+# Fields of legacy blob messages that move to the out-of-row payload
+LEGACY_PAYLOAD_FIELDS = ("data", "visualization")
+
+class PayloadTooLargeError(ValueError):
+    """Raised when a message payload exceeds CHAT_PAYLOAD_MAX_MB"""
+
+# Session listing columns: no message bodies, and a count from the (session_id, seq) index
+MESSAGE_COUNT = (
+    select(func.count(ChatMessage.id))
+    .where(ChatMessage.session_id == ChatSession.id)
+    .correlate(ChatSession)
+    .scalar_subquery()
+)
+SESSION_COLUMNS = (
+    ChatSession.id, ChatSession.title, ChatSession.is_favorite, ChatSession.tags,
+    ChatSession.created_at, ChatSession.updated_at, MESSAGE_COUNT.label("message_count"),
+)
+
+def session_to_dict(row) -> Dict[str, Any]:
+    """Summary dict of a chat session from a row of SESSION_COLUMNS."""
+    return {
+        "id": row.id,
+        "title": row.title,
+        "is_favorite": bool(row.is_favorite),
+        "tags": row.tags or [],
+        "message_count": row.message_count,
+        "created_at": row.created_at.isoformat(),
+        "updated_at": row.updated_at.isoformat(),
+    }
+
+def message_to_dict(message: ChatMessage) -> Dict[str, Any]:
+    """Dict of a stored message, without its payload."""
+    return {
+        "seq": message.seq,
+        "role": message.role,
+        "content": message.content,
+        "sql_query": message.sql_query,
+        "details": message.details or {},
+        "has_payload": message.payload_size is not None,
+        "payload_size": message.payload_size,
+        "created_at": message.created_at.isoformat(),
+    }
+
+def encode_payload(payload: Dict[str, Any]) -> Tuple[bytes, int]:
+    """Compress a payload for storage, returning the body and its uncompressed size."""
+    encoded = json.dumps(payload, separators=(",", ":"), default=str).encode()
+    if len(encoded) > CHAT_PAYLOAD_MAX_MB * 1024 * 1024:
+        raise PayloadTooLargeError(f"Message payload exceeds {CHAT_PAYLOAD_MAX_MB} MB")
+    return gzip.compress(encoded, compresslevel=6), len(encoded)
+
+class ChatService:
+    """
+    Chat history stored as an append-only messages table.
+    
+    Each message is one row numbered by seq within its session, so appends
+    never rewrite earlier messages and pages are read straight off the
+    (session_id, seq) index. Result rows and charts are kept out of row in
+    chat_message_payloads and only loaded on request.
+    """
+    
+    def __init__(self, session_factory: Callable[[], Session] = SessionLocal):
+        self.session_factory = session_factory
+    
+    def _owned_session(self, db: Session, user_id: str, session_id: str) -> Optional[ChatSession]:
+        chat = db.execute(
+            select(ChatSession).where(ChatSession.id == session_id, ChatSession.user_id == user_id)
+        ).scalar_one_or_none()
+        if chat is not None and chat.messages is not None:
+            self._migrate_legacy_messages(db, chat)
+        return chat
+    
+    def _summary(self, db: Session, session_id: str) -> Dict[str, Any]:
+        row = db.execute(select(*SESSION_COLUMNS).where(ChatSession.id == session_id)).one()
+        return session_to_dict(row)
+    
+    def _migrate_legacy_messages(self, db: Session, chat: ChatSession):
+        """
+        Move a session's legacy JSON blob of messages into chat_messages.
+        
+        The session keeps its updated_at, so migrating doesn't reorder the
+        listing.
+        """
+        try:
+            for seq, legacy in enumerate(chat.messages, start=1):
+                payload = {field: legacy[field] for field in LEGACY_PAYLOAD_FIELDS if legacy.get(field) is not None}
+                message = ChatMessage(
+                    session_id=chat.id,
+                    seq=seq,
+                    role=legacy.get("role") or legacy.get("type") or "user",
+                    content=legacy.get("content") or legacy.get("text") or "",
+                    sql_query=legacy.get("sql_query"),
+                    details={
+                        key: value for key, value in legacy.items()
+                        if key not in LEGACY_PAYLOAD_FIELDS + ("role", "type", "content", "text", "sql_query")
+                    },
+                )
+                self._add_message(db, message, payload or None)
+            # Setting updated_at to itself keeps its onupdate from firing
+            db.execute(
+                update(ChatSession)
+                .where(ChatSession.id == chat.id)
+                .values(messages=null(), updated_at=ChatSession.updated_at)
+            )
+            db.commit()
+        except IntegrityError:
+            # Another worker migrated it first
+            db.rollback()
+        db.refresh(chat)
+    
+    def migrate_legacy_sessions(self, batch_size: int = 100) -> int:
+        """
+        Move every remaining legacy message blob into chat_messages, so
+        session listings count their messages. Returns sessions migrated.
+        """
+        migrated = 0
+        # Sessions whose messages conflict with rows already in chat_messages
+        # are left as they are rather than retried forever
+        skipped: List[str] = []
+        while True:
+            with self.session_factory() as db:
+                chats = db.execute(
+                    select(ChatSession)
+                    .where(ChatSession.messages.isnot(None), ChatSession.id.notin_(skipped))
+                    .limit(batch_size)
+                ).scalars().all()
+                if not chats:
+                    return migrated
+                for chat in chats:
+                    self._migrate_legacy_messages(db, chat)
+                    if chat.messages is None:
+                        migrated += 1
+                    else:
+                        skipped.append(chat.id)
+    
+    def _add_message(self, db: Session, message: ChatMessage, payload: Optional[Dict[str, Any]]):
+        body = None
+        if payload is not None:
+            body, message.payload_size = encode_payload(payload)
+        db.add(message)
+        db.flush()
+        if body is not None:
+            db.add(ChatMessagePayload(message_id=message.id, body=body))
+    
+    # Sessions
+    
+    def list_sessions(self, user_id: str, limit: int, offset: int) -> Tuple[List[Dict[str, Any]], bool]:
+        """List a user's sessions, most recently active first, without any messages."""
+        with self.session_factory() as db:
+            rows = db.execute(
+                select(*SESSION_COLUMNS)
+                .where(ChatSession.user_id == user_id)
+                .order_by(ChatSession.updated_at.desc())
+                .limit(limit + 1)
+                .offset(offset)
+            ).all()
+        return [session_to_dict(row) for row in rows[:limit]], len(rows) > limit
+    
+    def create_session(self, user_id: str, data: ChatSessionCreate) -> Dict[str, Any]:
+        with self.session_factory() as db:
+            chat = ChatSession(user_id=user_id, title=data.title, tags=data.tags, messages=null())
+            db.add(chat)
+            db.commit()
+            return self._summary(db, chat.id)
+    
+    def update_session(self, user_id: str, session_id: str, data: ChatSessionUpdate) -> Optional[Dict[str, Any]]:
+        with self.session_factory() as db:
+            chat = self._owned_session(db, user_id, session_id)
+            if chat is None:
+                return None
+            for field, value in data.model_dump(exclude_none=True).items():
+                setattr(chat, field, value)
+            db.commit()
+            return self._summary(db, session_id)
+    
+    def delete_session(self, user_id: str, session_id: str) -> bool:
+        with self.session_factory() as db:
+            owned = db.execute(
+                select(ChatSession.id).where(ChatSession.id == session_id, ChatSession.user_id == user_id)
+            ).first()
+            if owned is None:
+                return False
+            message_ids = select(ChatMessage.id).where(ChatMessage.session_id == session_id)
+            db.execute(delete(ChatMessagePayload).where(ChatMessagePayload.message_id.in_(message_ids)))
+            db.execute(delete(ChatMessage).where(ChatMessage.session_id == session_id))
+            db.execute(delete(ChatSession).where(ChatSession.id == session_id))
+            db.commit()
+            return True
+    
+    # Messages
+    
+    def append_message(self, user_id: str, session_id: str, data: ChatMessageCreate) -> Optional[Dict[str, Any]]:
+        """
+        Append a message at the end of a session.
+        
+        The next seq is claimed optimistically; if a concurrent append took
+        it, the unique (session_id, seq) constraint rejects the insert and
+        the append is retried.
+        """
+        for _ in range(APPEND_RETRIES):
+            with self.session_factory() as db:
+                if self._owned_session(db, user_id, session_id) is None:
+                    return None
+                last_seq = db.execute(
+                    select(func.max(ChatMessage.seq)).where(ChatMessage.session_id == session_id)
+                ).scalar()
+                message = ChatMessage(
+                    session_id=session_id,
+                    seq=(last_seq or 0) + 1,
+                    role=data.role,
+                    content=data.content,
+                    sql_query=data.sql_query,
+                    details=data.details,
+                )
+                try:
+                    self._add_message(db, message, data.payload)
+                    db.execute(
+                        update(ChatSession).where(ChatSession.id == session_id).values(updated_at=datetime.utcnow())
+                    )
+                    db.commit()
+                except IntegrityError:
+                    db.rollback()
+                    continue
+                return message_to_dict(message)
+        raise RuntimeError("Could not append message, too many concurrent writers")
+    
+    def get_messages(self, user_id: str, session_id: str, before_seq: Optional[int],
+                     limit: int) -> Optional[Dict[str, Any]]:
+        """
+        One page of messages, oldest first, ending just before before_seq
+        (or at the newest message). Pass next_before_seq back to page
+        further into the past.
+        """
+        with self.session_factory() as db:
+            if self._owned_session(db, user_id, session_id) is None:
+                return None
+            query = select(ChatMessage).where(ChatMessage.session_id == session_id)
+            if before_seq is not None:
+                query = query.where(ChatMessage.seq < before_seq)
+            rows = db.execute(query.order_by(ChatMessage.seq.desc()).limit(limit + 1)).scalars().all()
+        
+        page = list(reversed(rows[:limit]))
+        has_more = len(rows) > limit
+        return {
+            "messages": [message_to_dict(message) for message in page],
+            "has_more": has_more,
+            "next_before_seq": page[0].seq if has_more else None,
+        }
+    
+    def get_payload(self, user_id: str, session_id: str, seq: int) -> Optional[bytes]:
+        """The gzip-compressed JSON payload of a message, or None if it has none."""
+        with self.session_factory() as db:
+            if self._owned_session(db, user_id, session_id) is None:
+                return None
+            return db.execute(
+                select(ChatMessagePayload.body)
+                .join(ChatMessage, ChatMessage.id == ChatMessagePayload.message_id)
+                .where(ChatMessage.session_id == session_id, ChatMessage.seq == seq)
+            ).scalar()
@@ -0,0 +1,304 @@
+"""
+Query cost guard for the Data Analytics Chatbot API Server
+
+Estimates what a query will cost before it runs, from the backend's own
+planner, so a generated cartesian join cannot tie up a pool for an hour:
+- PostgreSQL: EXPLAIN (FORMAT JSON) total cost and row estimates
+- MySQL: EXPLAIN FORMAT=JSON query cost and rows per join
+- DuckDB: EXPLAIN (FORMAT JSON) cardinality estimates, with cross
+  products sized as the product of their inputs
+- The largest row estimate anywhere in the plan, and the cost, are
+  compared with COST_GUARD_MAX_ROWS and COST_GUARD_MAX_COST
+- Estimates are cached per schema and SQL fingerprint
+
+Queries over a threshold are handled by COST_GUARD_ACTION:
+- limit       run with the result capped at COST_GUARD_LIMIT_ROWS (default);
+              refused instead when the expensive step sits under an
+              aggregate, sort or hash build, which a cap cannot cut short
+- background  /ask answers with a background export job instead
+- reject      refuse the query
+- allow       only log it
+Queries over COST_GUARD_REJECT_FACTOR times a threshold are always refused.
+Backends without a usable EXPLAIN, such as SQLite, are not guarded.
+"""
+
+import json
+import os
+import re
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+from cache import ExpiringLRUCache
+from deadlines import RequestCancelledError, database_connection, interruptible
+from logger import get_logger
+from metrics import cost_guard_decisions, stage
+from query_stats import fingerprint, schema_fingerprint
+from utils import clean_sql_query
+
+log = get_logger("cost_guard")
+
+# CONFIGURATION
+
+COST_GUARD_ENABLED = os.getenv("COST_GUARD_ENABLED", "true").lower() == "true"
+# Largest row estimate of any step in the plan (scan, join, aggregate)
+COST_GUARD_MAX_ROWS = float(os.getenv("COST_GUARD_MAX_ROWS", "50000000"))
+# Planner cost in the backend's own units (PostgreSQL and MySQL)
+COST_GUARD_MAX_COST = float(os.getenv("COST_GUARD_MAX_COST", "10000000"))
+COST_GUARD_REJECT_FACTOR = float(os.getenv("COST_GUARD_REJECT_FACTOR", "100"))
+COST_GUARD_ACTION = os.getenv("COST_GUARD_ACTION", "limit").lower()
+COST_GUARD_LIMIT_ROWS = int(os.getenv("COST_GUARD_LIMIT_ROWS", "100000"))
+COST_GUARD_CACHE_SIZE = int(os.getenv("COST_GUARD_CACHE_SIZE", "2000"))
+COST_GUARD_CACHE_TTL_SECONDS = int(os.getenv("COST_GUARD_CACHE_TTL_SECONDS", "600"))
+
+COST_GUARD_ACTIONS = ("limit", "background", "reject", "allow")
+
+# Plan steps that consume their whole input before producing a row
+DUCKDB_BLOCKING = {"HASH_GROUP_BY", "PERFECT_HASH_GROUP_BY", "UNGROUPED_AGGREGATE", "ORDER_BY", "TOP_N", "WINDOW"}
+POSTGRES_BLOCKING = {"Sort", "Incremental Sort", "Hash", "Materialize", "SetOp", "WindowAgg"}
+MYSQL_BLOCKING = ("grouping_operation", "ordering_operation", "duplicates_removal", "windowing")
+
+# A query already capped by the guard
+_LIMITED = re.compile(r"^SELECT \* FROM \((?P<inner>.*) LIMIT (?P<rows>\d+)\) AS limited_query$", re.DOTALL)
+
+class QueryTooExpensiveError(ValueError):
+    """Raised when the planner's estimate for a query is over the guard's limits"""
+
+class CostEstimate:
+    """The planner's estimate for one query"""
+
+    def __init__(self, rows: float, cost: Optional[float], backend: str,
+                 blocked_rows: float = 0.0, blocked_cost: Optional[float] = None):
+        self.rows = rows
+        self.cost = cost
+        self.backend = backend
+        # The largest estimates among steps under a blocking operator,
+        # which run in full however few rows are fetched
+        self.blocked_rows = blocked_rows
+        self.blocked_cost = blocked_cost
+
+    def level(self, max_rows: float = COST_GUARD_MAX_ROWS, max_cost: float = COST_GUARD_MAX_COST,
+              reject_factor: float = COST_GUARD_REJECT_FACTOR) -> str:
+        """ok, expensive or prohibitive"""
+        ratio = self.rows / max_rows if max_rows > 0 else 0.0
+        if self.cost is not None and max_cost > 0:
+            ratio = max(ratio, self.cost / max_cost)
+        if ratio >= reject_factor:
+            return "prohibitive"
+        if ratio >= 1:
+            return "expensive"
+        return "ok"
+
+    def limitable(self, max_rows: float = COST_GUARD_MAX_ROWS, max_cost: float = COST_GUARD_MAX_COST) -> bool:
+        """Whether capping the result makes the query cheap: its expensive steps stream"""
+        if max_rows > 0 and self.blocked_rows >= max_rows:
+            return False
+        return self.blocked_cost is None or max_cost <= 0 or self.blocked_cost < max_cost
+
+    def describe(self) -> str:
+        text = f"about {self.rows:,.0f} rows"
+        if self.cost is not None:
+            text += f" at a planner cost of {self.cost:,.0f}"
+        return text
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"rows": self.rows, "cost": self.cost, "backend": self.backend,
+                "blocked_rows": self.blocked_rows, "blocked_cost": self.blocked_cost}
+
+# PLAN PARSING
+
+def _walk(node: Any) -> Iterator[Dict[str, Any]]:
+    if isinstance(node, dict):
+        yield node
+        for value in node.values():
+            yield from _walk(value)
+    elif isinstance(node, list):
+        for value in node:
+            yield from _walk(value)
+
+def _number(value: Any) -> Optional[float]:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+def duckdb_rows(node: Dict[str, Any], blocked: bool = False) -> Tuple[float, float, float]:
+    """
+    Estimated output rows of a DuckDB plan node, the largest estimate at or
+    below it, and the largest at or below it under a blocking operator.
+    blocked says whether an ancestor is one.
+
+    """
+    name = node.get("name", "").strip()
+    blocked = blocked or name in DUCKDB_BLOCKING
+    # Joins stream their first input and materialize the others
+    is_join = "JOIN" in name or "CROSS_PRODUCT" in name
+    children = [duckdb_rows(child, blocked or (is_join and i > 0)) for i, child in enumerate(node.get("children", []))]
+    largest = max((child[1] for child in children), default=0.0)
+    largest_blocked = max((child[2] for child in children), default=0.0)
+    rows = _number(node.get("extra_info", {}).get("Estimated Cardinality"))
+    if rows is None:
+        child_rows = [child[0] for child in children]
+        if "CROSS_PRODUCT" in name or "NESTED_LOOP" in name:
+            # No estimate is printed for these; assume every pair survives
+            rows = 1.0
+            for value in child_rows:
+                rows *= max(value, 1.0)
+        else:
+            rows = max(child_rows, default=0.0)
+    if blocked:
+        largest_blocked = max(largest_blocked, rows)
+    return rows, max(largest, rows), largest_blocked
+
+def _postgres_nodes(node: Dict[str, Any], blocked: bool = False) -> Iterator[Tuple[Dict[str, Any], bool]]:
+    """Every plan node with whether it or an ancestor consumes its whole input"""
+    node_type = node.get("Node Type")
+    # A sorted group aggregate streams over sorted input; plain and hashed ones don't
+    blocked = blocked or node_type in POSTGRES_BLOCKING or (node_type == "Aggregate" and node.get("Strategy") != "Sorted")
+    yield node, blocked
+    for child in node.get("Plans", []):
+        yield from _postgres_nodes(child, blocked)
+
+def postgres_estimate(plan: Any) -> CostEstimate:
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    root = plan[0]["Plan"]
+    nodes = list(_postgres_nodes(root))
+    rows = max(_number(node.get("Plan Rows")) or 0.0 for node, _ in nodes)
+    blocked = [node for node, is_blocked in nodes if is_blocked]
+    blocked_rows = max((_number(node.get("Plan Rows")) or 0.0 for node in blocked), default=0.0)
+    blocked_cost = max((_number(node.get("Total Cost")) or 0.0 for node in blocked), default=0.0)
+    return CostEstimate(rows, _number(root.get("Total Cost")), "postgresql", blocked_rows, blocked_cost)
+
+def mysql_estimate(plan: Any) -> CostEstimate:
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    rows = 0.0
+    for node in _walk(plan):
+        for key in ("rows_examined_per_scan", "rows_produced_per_join"):
+            value = _number(node.get(key))
+            if value is not None:
+                rows = max(rows, value)
+    cost = _number(plan.get("query_block", {}).get("cost_info", {}).get("query_cost"))
+    # MySQL shows grouping, ordering and DISTINCT as wrappers around the
+    # whole join, so when present every step is under one
+    if any(key in node for node in _walk(plan) for key in MYSQL_BLOCKING):
+        return CostEstimate(rows, cost, "mysql", rows, cost)
+    return CostEstimate(rows, cost, "mysql")
+
+def explain(sql_query: str, engine, is_csv: bool) -> Optional[CostEstimate]:
+    """Ask the backend's planner about a query. None if the backend can't say."""
+    if is_csv:
+        with interruptible(engine):
+            result = engine.execute(f"EXPLAIN (FORMAT JSON) {sql_query}").fetchall()
+        plan = json.loads(result[0][1])
+        rows, largest, largest_blocked = duckdb_rows(plan[0]) if plan else (0.0, 0.0, 0.0)
+        return CostEstimate(largest, None, "duckdb", largest_blocked)
+
+    dialect = engine.dialect.name
+    if dialect == "postgresql":
+        statement = f"EXPLAIN (FORMAT JSON) {sql_query}"
+    elif dialect in ("mysql", "mariadb"):
+        statement = f"EXPLAIN FORMAT=JSON {sql_query}"
+    else:
+        return None
+    with database_connection(engine) as conn:
+        plan = conn.exec_driver_sql(statement).fetchone()[0]
+    return postgres_estimate(plan) if dialect == "postgresql" else mysql_estimate(plan)
+
+# GUARD
+
+def limit_query(sql_query: str, rows: int) -> str:
+    """Cap a query's result; the cap survives the LIMIT stripping done for counts and paging"""
+    return f"SELECT * FROM ({clean_sql_query(sql_query)} LIMIT {rows}) AS limited_query"
+
+class CostGuard:
+    """Classifies queries by their estimated cost and decides how to run them"""
+
+    def __init__(self, enabled: bool = COST_GUARD_ENABLED, action: str = COST_GUARD_ACTION,
+                 limit_rows: int = COST_GUARD_LIMIT_ROWS):
+        if action not in COST_GUARD_ACTIONS:
+            raise ValueError(f"COST_GUARD_ACTION must be one of {', '.join(COST_GUARD_ACTIONS)}")
+        self.enabled = enabled
+        self.action = action
+        self.limit_rows = limit_rows
+        self.estimates = ExpiringLRUCache(COST_GUARD_CACHE_SIZE, COST_GUARD_CACHE_TTL_SECONDS)
+
+    def estimate(self, sql_query: str, engine, is_csv: bool, schema_prompt: str) -> Optional[CostEstimate]:
+        """The planner's estimate, cached per schema and SQL fingerprint"""
+        mode = "csv" if is_csv else "database"
+        key = f"{mode}:{schema_fingerprint(schema_prompt)}:{fingerprint(sql_query)}"
+        cached = self.estimates.get(key)
+        if cached is not None:
+            return cached or None
+        try:
+            with stage("explain"):
+                estimate = explain(clean_sql_query(sql_query), engine, is_csv)
+        except RequestCancelledError:
+            raise
+        except Exception as e:
+            # Let the query itself report errors such as a syntax error
+            log.warning("explain_failed", error=str(e))
+            return None
+        # False caches "no estimate" for backends without EXPLAIN
+        self.estimates.put(key, estimate or False)
+        return estimate
+
+    def check(self, sql_query: str, engine, is_csv: bool, schema_prompt: str,
+              background: bool = False) -> Tuple[str, str, Optional[CostEstimate]]:
+        """
+        Decide how to run a query: returns the action taken ("ok", "allow",
+        "limit" or "background"), the SQL to run and the estimate.
+        Raises QueryTooExpensiveError when the query is refused.
+        background says whether the caller can hand the query to a job.
+
+        """
+        if not self.enabled or engine is None:
+            return "ok", sql_query, None
+
+        limited = _LIMITED.match(sql_query.strip())
+        estimate = self.estimate(limited.group("inner") if limited else sql_query, engine, is_csv, schema_prompt)
+        level = estimate.level() if estimate is not None else "ok"
+
+        if level == "ok":
+            action = "ok"
+        elif level == "prohibitive":
+            action = "reject"
+        elif not estimate.limitable() and (limited or self.action == "limit"):
+            # A cap would only trim the output of work that runs in full
+            action = "reject"
+        elif limited and int(limited.group("rows")) <= self.limit_rows:
+            # Already capped on an earlier request, e.g. a later page
+            action = "limit"
+        elif self.action == "background" and not background:
+            action = "reject"
+        else:
+            action = self.action
+
+        if action != "ok":
+            cost_guard_decisions.inc(action=action)
+            log.warning("query_cost_guarded", action=action, level=level, fingerprint=fingerprint(sql_query),
+                        rows=estimate.rows, cost=estimate.cost, blocked_rows=estimate.blocked_rows,
+                        backend=estimate.backend)
+
+        if action == "reject":
+            hint = ""
+            if level == "expensive" and not estimate.limitable():
+                hint = (" It aggregates or sorts the expensive part, so capping the result would not help."
+                        " Try a narrower question, or export it with /export-jobs.")
+            elif level == "expensive":
+                hint = " Try a narrower question, or export it with /export-jobs."
+            raise QueryTooExpensiveError(f"This query is too expensive to run: the planner expects {estimate.describe()}.{hint}")
+        if action == "limit" and not limited:
+            return action, limit_query(sql_query, self.limit_rows), estimate
+        return action, sql_query, estimate
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "action": self.action,
+            "max_rows": COST_GUARD_MAX_ROWS,
+            "max_cost": COST_GUARD_MAX_COST,
+            "cached_estimates": len(self.estimates.entries),
+        }
+
+# Global cost guard
+cost_guard = CostGuard()
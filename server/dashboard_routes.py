@@ -0,0 +1,147 @@
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Response, status
+from typing import Optional, Dict, Any, List
+
+from auth_routes import get_current_user
+from dashboard_schemas import DashboardCreate, DashboardUpdate
+from dashboard_service import DashboardService
+
+router = APIRouter(prefix="/dashboards", tags=["Dashboards"])
+
+# Initialize dashboard service
+dashboard_service = DashboardService()
+
+# The handlers below are plain functions so FastAPI runs their database
+# work in the threadpool rather than on the event loop.
+
+def dashboard_not_found() -> HTTPException:
+    return HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Dashboard not found")
+
+def parse_columns(columns: Optional[str]) -> Optional[List[str]]:
+    """Comma-separated column names, or None for every column."""
+    if not columns:
+        return None
+    return [name.strip() for name in columns.split(",") if name.strip()]
+
+def cached_response(result, if_none_match: Optional[str]) -> Response:
+    """
+    Answer a shared view with its cached JSON, or 304 if the client
+    already holds the same ETag.
+    """
+    if result is None:
+        raise dashboard_not_found()
+    body, etag = result
+    headers = {"ETag": etag, "Cache-Control": "public, no-cache"}
+    if if_none_match and etag in [tag.strip() for tag in if_none_match.split(",")]:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(body, media_type="application/json", headers=headers)
+
+# Shared views, registered first so /shared/... is not taken for a dashboard id
+
+@router.get("/shared/{share_token}")
+def get_shared_dashboard(
+    share_token: str,
+    if_none_match: Optional[str] = Header(None, alias="If-None-Match")
+):
+    """Get a public dashboard's title, config and columns by its share token."""
+    return cached_response(dashboard_service.shared_view(share_token), if_none_match)
+
+@router.get("/shared/{share_token}/data")
+def get_shared_dashboard_data(
+    share_token: str,
+    columns: Optional[str] = None,
+    offset: int = Query(0, ge=0),
+    limit: int = Query(1000, ge=1, le=5000),
+    if_none_match: Optional[str] = Header(None, alias="If-None-Match")
+):
+    """Get a page of a public dashboard's rows, limited to the columns a widget needs."""
+    try:
+        result = dashboard_service.shared_data(share_token, parse_columns(columns), offset, limit)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    return cached_response(result, if_none_match)
+
+# Owner views
+
+@router.get("")
+def list_dashboards(current_user: Dict[str, Any] = Depends(get_current_user)):
+    """List the user's dashboards, without their table data."""
+    return {"dashboards": dashboard_service.list_dashboards(current_user["id"])}
+
+@router.post("", status_code=status.HTTP_201_CREATED)
+def create_dashboard(
+    data: DashboardCreate,
+    current_user: Dict[str, Any] = Depends(get_current_user)
+):
+    """Save a dashboard, storing its table data as a compressed snapshot."""
+    return dashboard_service.create_dashboard(current_user["id"], data)
+
+@router.get("/{dashboard_id}")
+def get_dashboard(
+    dashboard_id: str,
+    current_user: Dict[str, Any] = Depends(get_current_user)
+):
+    """Get a dashboard's title, config and columns. Rows come from /data."""
+    dashboard = dashboard_service.get_dashboard(current_user["id"], dashboard_id)
+    if dashboard is None:
+        raise dashboard_not_found()
+    return dashboard
+
+@router.get("/{dashboard_id}/data")
+def get_dashboard_data(
+    dashboard_id: str,
+    columns: Optional[str] = None,
+    offset: int = Query(0, ge=0),
+    limit: int = Query(1000, ge=1, le=5000),
+    current_user: Dict[str, Any] = Depends(get_current_user)
+):
+    """Get a page of a dashboard's rows, limited to the columns a widget needs."""
+    try:
+        data = dashboard_service.read_data(current_user["id"], dashboard_id, parse_columns(columns), offset, limit)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    if data is None:
+        raise dashboard_not_found()
+    return data
+
+@router.patch("/{dashboard_id}")
+def update_dashboard(
+    dashboard_id: str,
+    data: DashboardUpdate,
+    current_user: Dict[str, Any] = Depends(get_current_user)
+):
+    """Edit a dashboard. Sending data replaces its table snapshot."""
+    dashboard = dashboard_service.update_dashboard(current_user["id"], dashboard_id, data)
+    if dashboard is None:
+        raise dashboard_not_found()
+    return dashboard
+
+@router.delete("/{dashboard_id}")
+def delete_dashboard(
+    dashboard_id: str,
+    current_user: Dict[str, Any] = Depends(get_current_user)
+):
+    if not dashboard_service.delete_dashboard(current_user["id"], dashboard_id):
+        raise dashboard_not_found()
+    return {"message": "Dashboard deleted", "dashboard_id": dashboard_id}
+
+@router.post("/{dashboard_id}/share")
+def share_dashboard(
+    dashboard_id: str,
+    current_user: Dict[str, Any] = Depends(get_current_user)
+):
+    """Make a dashboard public under a new share token."""
+    dashboard = dashboard_service.set_sharing(current_user["id"], dashboard_id, True)
+    if dashboard is None:
+        raise dashboard_not_found()
+    return dashboard
+
+@router.delete("/{dashboard_id}/share")
+def unshare_dashboard(
+    dashboard_id: str,
+    current_user: Dict[str, Any] = Depends(get_current_user)
+):
+    """Make a dashboard private again, revoking its share token."""
+    dashboard = dashboard_service.set_sharing(current_user["id"], dashboard_id, False)
+    if dashboard is None:
+        raise dashboard_not_found()
+    return dashboard
@@ -0,0 +1,21 @@
+from pydantic import BaseModel
+from typing import Optional, List, Dict, Any
+
+class DashboardCreate(BaseModel):
+    """Schema for saving a dashboard. data holds the table rows it is built from."""
+    title: str
+    description: Optional[str] = None
+    config: Dict[str, Any] = {}
+    data: List[Dict[str, Any]] = []
+    tags: List[str] = []
+    is_public: bool = False
+
+class DashboardUpdate(BaseModel):
+    """Schema for editing a dashboard. Sending data replaces its table snapshot."""
+    title: Optional[str] = None
+    description: Optional[str] = None
+    config: Optional[Dict[str, Any]] = None
+    data: Optional[List[Dict[str, Any]]] = None
+    tags: Optional[List[str]] = None
+    is_public: Optional[bool] = None
+    is_favorite: Optional[bool] = None
@@ -0,0 +1,422 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import numbers
+import os
+import secrets
+import threading
+from typing import Optional, Dict, Any, List, Tuple, Callable
+
+from sqlalchemy import bindparam, delete, func, select, update
+from sqlalchemy.orm import Session
+
+from cache import ExpiringLRUCache
+from dashboard_schemas import DashboardCreate, DashboardUpdate
+from init_db import SessionLocal
+from lazy_imports import lazy_module
+from models import Dashboard, DashboardSnapshot
+from state_backend import StateBackend, state_backend
+from utils import log_error
+
+pa = lazy_module("pyarrow")
+pq = lazy_module("pyarrow.parquet")
+
+# Rows per Parquet row group; a page of rows only decodes the groups it overlaps
+DASHBOARD_ROW_GROUP_SIZE = int(os.getenv("DASHBOARD_ROW_GROUP_SIZE", "10000"))
+
+# Rendered shared views and data pages kept per worker
+SHARE_CACHE_SIZE = int(os.getenv("SHARE_CACHE_SIZE", "512"))
+SHARE_CACHE_TTL_SECONDS = int(os.getenv("SHARE_CACHE_TTL_SECONDS", "300"))
+
+# How often batched view counts are written to the dashboards table
+VIEW_COUNT_FLUSH_SECONDS = int(os.getenv("VIEW_COUNT_FLUSH_SECONDS", "30"))
+
+# Dashboard columns without the legacy data blob
+DASHBOARD_COLUMNS = (
+    Dashboard.id, Dashboard.user_id, Dashboard.title, Dashboard.description, Dashboard.config,
+    Dashboard.is_public, Dashboard.share_token, Dashboard.is_favorite, Dashboard.tags,
+    Dashboard.view_count, Dashboard.created_at, Dashboard.updated_at,
+    DashboardSnapshot.row_count, DashboardSnapshot.columns,
+)
+
+# SNAPSHOT ENCODING
+
+def _cell_text(value: Any) -> str:
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, separators=(",", ":"), default=str)
+    return str(value)
+
+def _column_array(values: List[Any]) -> pa.Array:
+    """
+    Arrow array for one column. Mixed types fall back to floats when every
+    value is a number, otherwise to strings with dicts and lists as JSON.
+    """
+    try:
+        return pa.array(values)
+    except (pa.ArrowInvalid, pa.ArrowTypeError, OverflowError):
+        pass
+    present = [value for value in values if value is not None]
+    if all(isinstance(value, numbers.Number) and not isinstance(value, (bool, complex)) for value in present):
+        try:
+            return pa.array([None if value is None else float(value) for value in values], type=pa.float64())
+        except (ValueError, OverflowError):
+            pass
+    return pa.array([None if value is None else _cell_text(value) for value in values], type=pa.string())
+
+def encode_snapshot(rows: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Encode table rows as a zstd-compressed Parquet file.
+    
+    Returns the DashboardSnapshot fields: body, row_count, columns and etag.
+    """
+    names = list(dict.fromkeys(name for row in rows for name in row))
+    table = pa.table({name: _column_array([row.get(name) for row in rows]) for name in names})
+    sink = pa.BufferOutputStream()
+    pq.write_table(table, sink, compression="zstd", row_group_size=DASHBOARD_ROW_GROUP_SIZE)
+    body = sink.getvalue().to_pybytes()
+    return {
+        "body": body,
+        "row_count": table.num_rows,
+        "columns": [{"name": field.name, "type": str(field.type)} for field in table.schema],
+        "etag": hashlib.sha256(body).hexdigest(),
+    }
+
+def read_snapshot(body: bytes, columns: Optional[List[str]], offset: int, limit: int) -> Dict[str, Any]:
+    """
+    Decode a page of rows from a snapshot, reading only the requested
+    columns and the row groups the page overlaps.
+    """
+    parquet = pq.ParquetFile(pa.BufferReader(body))
+    total_rows = parquet.metadata.num_rows
+    if columns:
+        unknown = set(columns) - set(parquet.schema_arrow.names)
+        if unknown:
+            raise ValueError(f"Unknown dashboard columns: {', '.join(sorted(unknown))}")
+    
+    groups, first_row, start = [], None, 0
+    for index in range(parquet.num_row_groups):
+        end = start + parquet.metadata.row_group(index).num_rows
+        if end > offset and start < offset + limit:
+            groups.append(index)
+            first_row = start if first_row is None else first_row
+        start = end
+    
+    if groups:
+        table = parquet.read_row_groups(groups, columns=columns).slice(offset - first_row, limit)
+        rows = table.to_pylist()
+    else:
+        rows = []
+    return {
+        "data": rows,
+        "total_rows": total_rows,
+        "returned_rows": len(rows),
+        "offset": offset,
+        "has_more": offset + len(rows) < total_rows,
+    }
+
+def legacy_rows(data: Any) -> List[Dict[str, Any]]:
+    """Table rows from a legacy Dashboard.data value."""
+    if isinstance(data, dict):
+        data = data.get("rows") or data.get("data") or []
+    return [row for row in data or [] if isinstance(row, dict)]
+
+def dashboard_to_dict(row, pending_views: int = 0) -> Dict[str, Any]:
+    """Dict of a dashboard from a row of DASHBOARD_COLUMNS, without table data."""
+    return {
+        "id": row.id,
+        "title": row.title,
+        "description": row.description,
+        "config": row.config or {},
+        "is_public": bool(row.is_public),
+        "share_token": row.share_token,
+        "is_favorite": bool(row.is_favorite),
+        "tags": row.tags or [],
+        "view_count": (row.view_count or 0) + pending_views,
+        "row_count": row.row_count or 0,
+        "columns": row.columns or [],
+        "created_at": row.created_at.isoformat(),
+        "updated_at": row.updated_at.isoformat(),
+    }
+
+def encode_json(content: Any) -> Tuple[bytes, str]:
+    """Serialize a response body once, with an ETag derived from it."""
+    body = json.dumps(content, separators=(",", ":"), default=str).encode()
+    return body, f'"{hashlib.sha256(body).hexdigest()[:32]}"'
+
+# VIEW COUNTS
+
+class ViewCounter:
+    """
+    Counts dashboard views in memory and adds them to view_count in one
+    batched UPDATE per flush, instead of a row write per view.
+    """
+    
+    def __init__(self, session_factory: Callable[[], Session] = SessionLocal):
+        self.session_factory = session_factory
+        self.counts: Dict[str, int] = {}
+        self.lock = threading.Lock()
+    
+    def add(self, dashboard_id: str):
+        with self.lock:
+            self.counts[dashboard_id] = self.counts.get(dashboard_id, 0) + 1
+    
+    def pending(self, dashboard_id: str) -> int:
+        with self.lock:
+            return self.counts.get(dashboard_id, 0)
+    
+    def flush(self) -> int:
+        """Write the pending counts, returning how many views were written."""
+        with self.lock:
+            counts, self.counts = self.counts, {}
+        if not counts:
+            return 0
+        
+        table = Dashboard.__table__
+        statement = (
+            table.update()
+            .where(table.c.id == bindparam("dashboard_id"))
+            .values(view_count=func.coalesce(table.c.view_count, 0) + bindparam("views"))
+        )
+        try:
+            with self.session_factory() as db:
+                db.connection().execute(statement, [
+                    {"dashboard_id": dashboard_id, "views": views} for dashboard_id, views in counts.items()
+                ])
+                db.commit()
+        except Exception:
+            # Keep the views for the next flush
+            with self.lock:
+                for dashboard_id, views in counts.items():
+                    self.counts[dashboard_id] = self.counts.get(dashboard_id, 0) + views
+            raise
+        return sum(counts.values())
+
+# Global view counter instance
+view_counter = ViewCounter()
+
+async def run_view_count_flush_loop(interval_seconds: int = VIEW_COUNT_FLUSH_SECONDS):
+    """
+    Periodically write batched dashboard view counts.
+    
+    """
+    while True:
+        await asyncio.sleep(interval_seconds)
+        try:
+            await asyncio.to_thread(view_counter.flush)
+        except Exception as e:
+            log_error(e, "Dashboard view count flush")
+
+# DASHBOARD SERVICE
+
+class DashboardService:
+    """
+    Dashboards with their table data stored as compressed Parquet snapshots.
+    
+    Widgets fetch only the columns and rows they show. Shared views are
+    rendered once and cached per worker; each cached entry remembers the
+    dashboard's version in the state backend, which every change bumps, so
+    a cached view is served only while it is current on all workers.
+    """
+    
+    def __init__(self, session_factory: Callable[[], Session] = SessionLocal,
+                 backend: StateBackend = state_backend, counter: ViewCounter = view_counter,
+                 share_cache: Optional[ExpiringLRUCache] = None):
+        self.session_factory = session_factory
+        self.backend = backend
+        self.counter = counter
+        self.share_cache = share_cache if share_cache is not None else ExpiringLRUCache(SHARE_CACHE_SIZE, SHARE_CACHE_TTL_SECONDS)
+    
+    def _version(self, dashboard_id: str) -> int:
+        return self.backend.get(f"dashboard-version:{dashboard_id}") or 0
+    
+    def _bump_version(self, dashboard_id: str):
+        self.backend.incr(f"dashboard-version:{dashboard_id}")
+    
+    def _row(self, db: Session, *conditions):
+        return db.execute(
+            select(*DASHBOARD_COLUMNS)
+            .outerjoin(DashboardSnapshot, DashboardSnapshot.dashboard_id == Dashboard.id)
+            .where(*conditions)
+        ).first()
+    
+    def _owned(self, db: Session, user_id: str, dashboard_id: str) -> Optional[Dashboard]:
+        dashboard = db.execute(
+            select(Dashboard).where(Dashboard.id == dashboard_id, Dashboard.user_id == user_id)
+        ).scalar_one_or_none()
+        if dashboard is not None:
+            self._migrate_legacy_data(db, dashboard)
+        return dashboard
+    
+    def _save_snapshot(self, db: Session, dashboard_id: str, rows: List[Dict[str, Any]]):
+        snapshot = db.get(DashboardSnapshot, dashboard_id)
+        fields = encode_snapshot(rows)
+        if snapshot is None:
+            db.add(DashboardSnapshot(dashboard_id=dashboard_id, **fields))
+        else:
+            for field, value in fields.items():
+                setattr(snapshot, field, value)
+    
+    def _migrate_legacy_data(self, db: Session, dashboard: Dashboard):
+        """Move table rows still held in Dashboard.data into a snapshot."""
+        rows = legacy_rows(dashboard.data)
+        if not rows:
+            return
+        if db.get(DashboardSnapshot, dashboard.id) is None:
+            self._save_snapshot(db, dashboard.id, rows)
+        # Setting updated_at to itself keeps its onupdate from firing
+        db.execute(
+            update(Dashboard)
+            .where(Dashboard.id == dashboard.id)
+            .values(data=[], updated_at=Dashboard.updated_at)
+        )
+        db.commit()
+    
+    def _body(self, db: Session, dashboard_id: str) -> Optional[bytes]:
+        return db.execute(
+            select(DashboardSnapshot.body).where(DashboardSnapshot.dashboard_id == dashboard_id)
+        ).scalar()
+    
+    # Owner views
+    
+    def list_dashboards(self, user_id: str) -> List[Dict[str, Any]]:
+        with self.session_factory() as db:
+            rows = db.execute(
+                select(*DASHBOARD_COLUMNS)
+                .outerjoin(DashboardSnapshot, DashboardSnapshot.dashboard_id == Dashboard.id)
+                .where(Dashboard.user_id == user_id)
+                .order_by(Dashboard.updated_at.desc())
+            ).all()
+        return [dashboard_to_dict(row, self.counter.pending(row.id)) for row in rows]
+    
+    def create_dashboard(self, user_id: str, data: DashboardCreate) -> Dict[str, Any]:
+        with self.session_factory() as db:
+            dashboard = Dashboard(
+                user_id=user_id,
+                title=data.title,
+                description=data.description,
+                config=data.config,
+                data=[],
+                tags=data.tags,
+                is_public=data.is_public,
+                share_token=secrets.token_urlsafe(24) if data.is_public else None,
+            )
+            db.add(dashboard)
+            db.flush()
+            self._save_snapshot(db, dashboard.id, data.data)
+            db.commit()
+            return dashboard_to_dict(self._row(db, Dashboard.id == dashboard.id))
+    
+    def get_dashboard(self, user_id: str, dashboard_id: str) -> Optional[Dict[str, Any]]:
+        with self.session_factory() as db:
+            if self._owned(db, user_id, dashboard_id) is None:
+                return None
+            row = self._row(db, Dashboard.id == dashboard_id)
+        return dashboard_to_dict(row, self.counter.pending(dashboard_id))
+    
+    def update_dashboard(self, user_id: str, dashboard_id: str, data: DashboardUpdate) -> Optional[Dict[str, Any]]:
+        with self.session_factory() as db:
+            dashboard = self._owned(db, user_id, dashboard_id)
+            if dashboard is None:
+                return None
+            changes = data.model_dump(exclude_none=True)
+            rows = changes.pop("data", None)
+            for field, value in changes.items():
+                setattr(dashboard, field, value)
+            if data.is_public and not dashboard.share_token:
+                dashboard.share_token = secrets.token_urlsafe(24)
+            if rows is not None:
+                self._save_snapshot(db, dashboard_id, rows)
+            db.commit()
+            self._bump_version(dashboard_id)
+            row = self._row(db, Dashboard.id == dashboard_id)
+        return dashboard_to_dict(row, self.counter.pending(dashboard_id))
+    
+    def delete_dashboard(self, user_id: str, dashboard_id: str) -> bool:
+        with self.session_factory() as db:
+            owned = db.execute(
+                select(Dashboard.id).where(Dashboard.id == dashboard_id, Dashboard.user_id == user_id)
+            ).first()
+            if owned is None:
+                return False
+            db.execute(delete(DashboardSnapshot).where(DashboardSnapshot.dashboard_id == dashboard_id))
+            db.execute(delete(Dashboard).where(Dashboard.id == dashboard_id))
+            db.commit()
+        self._bump_version(dashboard_id)
+        return True
+    
+    def set_sharing(self, user_id: str, dashboard_id: str, shared: bool) -> Optional[Dict[str, Any]]:
+        """Share a dashboard under a new token, or revoke its token."""
+        with self.session_factory() as db:
+            dashboard = self._owned(db, user_id, dashboard_id)
+            if dashboard is None:
+                return None
+            dashboard.is_public = shared
+            dashboard.share_token = secrets.token_urlsafe(24) if shared else None
+            db.commit()
+            self._bump_version(dashboard_id)
+            row = self._row(db, Dashboard.id == dashboard_id)
+        return dashboard_to_dict(row, self.counter.pending(dashboard_id))
+    
+    def read_data(self, user_id: str, dashboard_id: str, columns: Optional[List[str]],
+                  offset: int, limit: int) -> Optional[Dict[str, Any]]:
+        with self.session_factory() as db:
+            if self._owned(db, user_id, dashboard_id) is None:
+                return None
+            body = self._body(db, dashboard_id)
+        if body is None:
+            return {"data": [], "total_rows": 0, "returned_rows": 0, "offset": offset, "has_more": False}
+        return read_snapshot(body, columns, offset, limit)
+    
+    # Shared views
+    
+    def _shared(self, cache_key: str, token: str, render) -> Optional[Tuple[bytes, str]]:
+        """
+        Serve a shared view from the cache while its dashboard version is
+        unchanged, otherwise render it again. Each call counts a view.
+        """
+        cached = self.share_cache.get(cache_key)
+        if cached is not None:
+            dashboard_id, version, body, etag = cached
+            if self._version(dashboard_id) == version:
+                self.counter.add(dashboard_id)
+                return body, etag
+        
+        with self.session_factory() as db:
+            dashboard_id = db.execute(
+                select(Dashboard.id).where(Dashboard.share_token == token, Dashboard.is_public.is_(True))
+            ).scalar()
+            if dashboard_id is None:
+                return None
+            version = self._version(dashboard_id)
+            dashboard = db.get(Dashboard, dashboard_id)
+            self._migrate_legacy_data(db, dashboard)
+            body, etag = encode_json(render(db, dashboard_id))
+        
+        self.share_cache.put(cache_key, (dashboard_id, version, body, etag))
+        self.counter.add(dashboard_id)
+        return body, etag
+    
+    def shared_view(self, token: str) -> Optional[Tuple[bytes, str]]:
+        """A shared dashboard's title, config and columns, as JSON bytes and an ETag."""
+        def render(db: Session, dashboard_id: str) -> Dict[str, Any]:
+            view = dashboard_to_dict(self._row(db, Dashboard.id == dashboard_id))
+            # The view count changes constantly and would defeat caching
+            for private in ("view_count", "share_token", "is_favorite"):
+                view.pop(private)
+            return view
+        
+        return self._shared(f"view:{token}", token, render)
+    
+    def shared_data(self, token: str, columns: Optional[List[str]], offset: int,
+                    limit: int) -> Optional[Tuple[bytes, str]]:
+        """A page of a shared dashboard's rows, as JSON bytes and an ETag."""
+        def render(db: Session, dashboard_id: str) -> Dict[str, Any]:
+            body = self._body(db, dashboard_id)
+            if body is None:
+                return {"data": [], "total_rows": 0, "returned_rows": 0, "offset": offset, "has_more": False}
+            return read_snapshot(body, columns, offset, limit)
+        
+        key = f"data:{token}:{','.join(columns or [])}:{offset}:{limit}"
+        return self._shared(key, token, render)
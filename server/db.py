@@ -4,6 +4,10 @@ from sqlalchemy import create_engine, inspect
 from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy import text  # make sure text is imported
 
+from logger import get_logger
+
+log = get_logger("db")
+
 
 def configure_db(db_type: str, host: str, user: str, password: str, database: str):
     """
@@ -24,7 +28,7 @@ def configure_db(db_type: str, host: str, user: str, password: str, database: st
     """
 
     try:
-        print(f"Attempting to connect to {host}...")
+        log.info("database_connecting", db_type=db_type, host=host)
         
         # Connection parameters including timeouts
         connect_args = {
@@ -44,7 +48,7 @@ def configure_db(db_type: str, host: str, user: str, password: str, database: st
         # Test connection with a simple query
         with engine.connect() as conn:
             conn.execute(text("SELECT 1"))
-            print(f"Successfully connected to {db_type} database at {host}")
+            log.info("database_connected", db_type=db_type, host=host)
         
         return engine
 
@@ -61,7 +65,7 @@ def configure_db(db_type: str, host: str, user: str, password: str, database: st
         else:
             detail = f"Database connection error: {error_msg}"
         
-        print(f"❌ Connection failed: {detail}")
+        log.error("database_connection_failed", db_type=db_type, host=host, error=error_msg)
         raise HTTPException(status_code=500, detail=detail)
 
 
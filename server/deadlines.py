@@ -0,0 +1,236 @@
+"""
+Request deadlines for the Data Analytics Chatbot API Server
+
+Bounds how long one request may keep the database and the LLM busy, and
+stops its work when nobody is waiting for the answer any more:
+- Each /ask and /get-more-data runs under a Deadline of
+  REQUEST_TIMEOUT_SECONDS, carried in a context variable so it reaches
+  the worker threads queries run in
+- Database queries get the time left as a server-side timeout:
+  statement_timeout on PostgreSQL, MAX_EXECUTION_TIME on MySQL
+  (max_statement_time on MariaDB)
+- While a query runs, the deadline holds how to cancel it: the driver's
+  cancel() on PostgreSQL, KILL QUERY on MySQL and interrupt() on DuckDB
+- A watcher polls for the client disconnecting every
+  DISCONNECT_POLL_SECONDS; on a disconnect or when the deadline passes it
+  cancels the queries in flight and the request's task, which aborts a
+  pending LLM call
+
+Cancelled requests, queries and LLM calls are counted in
+queryous_cancelled_work_total. REQUEST_TIMEOUT_SECONDS=0 disables the
+deadline but keeps cancellation on disconnect.
+"""
+
+import asyncio
+import contextvars
+import itertools
+import math
+import os
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from typing import Callable, Dict, Iterator, Optional, Tuple
+
+from fastapi import Request
+
+from logger import get_logger
+from metrics import cancelled_work
+
+log = get_logger("deadlines")
+
+# CONFIGURATION
+
+REQUEST_TIMEOUT_SECONDS = float(os.getenv("REQUEST_TIMEOUT_SECONDS", "120"))
+DISCONNECT_POLL_SECONDS = float(os.getenv("DISCONNECT_POLL_SECONDS", "0.5"))
+
+class RequestCancelledError(Exception):
+    """Raised in work whose request was cancelled; reason is "disconnect" or "deadline" """
+
+    def __init__(self, reason: str, message: str):
+        super().__init__(message)
+        self.reason = reason
+
+class Deadline:
+    """The time limit of one request, and the work in flight to stop when it is cancelled"""
+
+    def __init__(self, timeout_seconds: float = REQUEST_TIMEOUT_SECONDS):
+        self.timeout_seconds = timeout_seconds
+        self.expires_at = time.monotonic() + timeout_seconds if timeout_seconds > 0 else math.inf
+        self.reason: Optional[str] = None
+        self.cancels_in_flight: Dict[int, Tuple[str, Callable[[], None]]] = {}
+        self.ids = itertools.count()
+        self.lock = threading.Lock()
+
+    def remaining(self) -> float:
+        return max(self.expires_at - time.monotonic(), 0.0)
+
+    @property
+    def expired(self) -> bool:
+        return self.reason is not None or self.remaining() <= 0
+
+    def error(self) -> RequestCancelledError:
+        if self.reason == "disconnect":
+            return RequestCancelledError("disconnect", "The client disconnected before the request completed")
+        return RequestCancelledError("deadline", f"The request did not complete within {self.timeout_seconds:g} seconds")
+
+    def check(self):
+        """Raise RequestCancelledError if the request was cancelled or is out of time"""
+        if self.reason is None and self.remaining() <= 0:
+            self.reason = "deadline"
+        if self.reason is not None:
+            raise self.error()
+
+    def cancel(self, reason: str) -> int:
+        """Stop the work in flight. Returns how many cancels were sent."""
+        with self.lock:
+            if self.reason is None:
+                self.reason = reason
+            in_flight = list(self.cancels_in_flight.values())
+            self.cancels_in_flight.clear()
+        for kind, cancel in in_flight:
+            try:
+                cancel()
+                cancelled_work.inc(reason=self.reason, kind=kind)
+            except Exception as e:
+                log.warning("cancel_failed", kind=kind, error=str(e))
+        return len(in_flight)
+
+    @contextmanager
+    def cancels(self, kind: str, cancel: Callable[[], None]) -> Iterator[None]:
+        """Register how to stop the work running in the block"""
+        with self.lock:
+            self.check()
+            key = next(self.ids)
+            self.cancels_in_flight[key] = (kind, cancel)
+        try:
+            yield
+        except Exception:
+            # The backend's own error for a cancelled or timed out query
+            if self.expired:
+                self.check()
+            raise
+        finally:
+            with self.lock:
+                self.cancels_in_flight.pop(key, None)
+
+# The deadline of the request being handled
+current_deadline: contextvars.ContextVar[Optional[Deadline]] = contextvars.ContextVar("current_deadline", default=None)
+
+def check_deadline():
+    deadline = current_deadline.get()
+    if deadline is not None:
+        deadline.check()
+
+# DATABASE QUERIES
+
+def _kill_query(engine, connection_id: int):
+    with engine.connect() as conn:
+        conn.exec_driver_sql(f"KILL QUERY {int(connection_id)}")
+
+@contextmanager
+def database_connection(engine) -> Iterator:
+    """
+    A connection from a SQLAlchemy engine for running queries under the
+    current deadline: the backend times them out itself, and a cancel
+    stops them mid-flight. Dialects without either just get a connection.
+
+    """
+    deadline = current_deadline.get()
+    with engine.connect() as conn:
+        if deadline is None:
+            yield conn
+            return
+        deadline.check()
+        remaining = deadline.remaining()
+        timeout_ms = max(int(remaining * 1000), 1) if math.isfinite(remaining) else None
+        dialect = engine.dialect
+        reset = None
+        cancel = None
+
+        if dialect.name == "postgresql":
+            if timeout_ms:
+                # Reset when the connection goes back to the pool and rolls back
+                conn.exec_driver_sql(f"SET LOCAL statement_timeout = {timeout_ms}")
+            dbapi_connection = conn.connection.dbapi_connection
+            cancel = dbapi_connection.cancel
+        elif dialect.name == "mysql":
+            if timeout_ms and getattr(dialect, "is_mariadb", False):
+                conn.exec_driver_sql(f"SET SESSION max_statement_time = {timeout_ms / 1000:.3f}")
+                reset = "SET SESSION max_statement_time = DEFAULT"
+            elif timeout_ms:
+                conn.exec_driver_sql(f"SET SESSION MAX_EXECUTION_TIME = {timeout_ms}")
+                reset = "SET SESSION MAX_EXECUTION_TIME = DEFAULT"
+            connection_id = conn.exec_driver_sql("SELECT CONNECTION_ID()").scalar()
+            cancel = lambda: _kill_query(engine, connection_id)
+
+        try:
+            if cancel is None:
+                yield conn
+            else:
+                with deadline.cancels("query", cancel):
+                    yield conn
+        finally:
+            if reset and not conn.closed:
+                try:
+                    conn.exec_driver_sql(reset)
+                except Exception as e:
+                    # A killed query can leave the connection unusable
+                    conn.invalidate()
+                    log.warning("deadline_reset_failed", error=str(e))
+
+@contextmanager
+def interruptible(cursor) -> Iterator:
+    """
+    Run DuckDB queries on a cursor under the current deadline. The cursor
+    must be the request's own: interrupt() stops whatever it is running.
+
+    """
+    deadline = current_deadline.get()
+    if deadline is None:
+        yield cursor
+        return
+    with deadline.cancels("query", cursor.interrupt):
+        yield cursor
+
+# REQUESTS
+
+async def _watch(request: Request, deadline: Deadline, task: asyncio.Task):
+    while True:
+        await asyncio.sleep(min(DISCONNECT_POLL_SECONDS, deadline.remaining()))
+        if deadline.remaining() <= 0:
+            reason = "deadline"
+        elif await request.is_disconnected():
+            reason = "disconnect"
+        else:
+            continue
+        # Cancels reach the database over the network, so keep them off the loop
+        await asyncio.to_thread(deadline.cancel, reason)
+        task.cancel()
+        return
+
+@asynccontextmanager
+async def request_deadline(request: Request, timeout_seconds: float = REQUEST_TIMEOUT_SECONDS):
+    """
+    Run the block under a new deadline, watching for the client going
+    away. Raises RequestCancelledError when either cancels it.
+
+    """
+    deadline = Deadline(timeout_seconds)
+    token = current_deadline.set(deadline)
+    task = asyncio.current_task()
+    watcher = asyncio.create_task(_watch(request, deadline, task))
+    try:
+        try:
+            yield deadline
+        except asyncio.CancelledError:
+            if deadline.reason is None:
+                raise
+            task.uncancel()
+            raise deadline.error() from None
+    except RequestCancelledError as e:
+        cancelled_work.inc(reason=e.reason, kind="request")
+        log.info("request_cancelled", reason=e.reason)
+        raise
+    finally:
+        watcher.cancel()
+        current_deadline.reset(token)
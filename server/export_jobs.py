@@ -0,0 +1,368 @@
+"""
+Background export jobs for the Data Analytics Chatbot API Server
+
+This module runs large exports outside the HTTP request:
+- A bounded worker pool that writes export streams to artifact files
+- Progress tracking (rows and bytes written) for polling clients
+- A disk quota across all artifacts and TTL-based cleanup
+- HTTP Range parsing so finished artifacts can be downloaded resumably
+
+With a shared state backend, job records are published there and
+artifacts are written to the shared data directory, so any worker can
+report on, cancel or serve a job that another worker ran.
+"""
+
+import asyncio
+import os
+import re
+import shutil
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from exports import ExportProgress
+from logger import get_logger
+from state_backend import SHARED_DATA_DIR, state_backend
+from utils import log_error
+
+log = get_logger("export_jobs")
+
+# CONFIGURATION
+
+EXPORT_JOB_DIR = os.getenv("EXPORT_JOB_DIR", os.path.join(SHARED_DATA_DIR, "export_jobs"))
+EXPORT_JOB_WORKERS = int(os.getenv("EXPORT_JOB_WORKERS", "2"))
+EXPORT_JOB_MAX_PENDING = int(os.getenv("EXPORT_JOB_MAX_PENDING", "20"))
+EXPORT_JOB_QUOTA_BYTES = int(os.getenv("EXPORT_JOB_QUOTA_MB", "2048")) * 1024 * 1024
+EXPORT_JOB_TTL_SECONDS = int(os.getenv("EXPORT_JOB_TTL_SECONDS", "3600"))
+
+# How often a running job publishes its progress and checks for remote cancellation
+EXPORT_JOB_PUBLISH_INTERVAL = 1.0
+
+class ExportQueueFullError(Exception):
+    """Raised when too many export jobs are already queued or running"""
+
+# JOB STATE
+
+class ExportJob:
+    """
+    State of a single background export. owner is the key of the workspace
+    it was started from, so anonymous clients only see their own jobs.
+    """
+
+    def __init__(self, export_format: str, filename: str, owner: str):
+        self.id = uuid.uuid4().hex
+        self.export_format = export_format
+        self.filename = filename
+        self.owner = owner
+        self.status = "queued"
+        self.error: Optional[str] = None
+        self.progress = ExportProgress()
+        self.bytes_written = 0
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.cancel_requested = threading.Event()
+
+    @property
+    def path(self) -> str:
+        return os.path.join(EXPORT_JOB_DIR, self.id)
+
+    @property
+    def expires_at(self) -> Optional[float]:
+        return self.finished_at + EXPORT_JOB_TTL_SECONDS if self.finished_at else None
+
+    @property
+    def is_finished(self) -> bool:
+        return self.status in ("completed", "failed", "cancelled")
+
+    @classmethod
+    def from_record(cls, record: Dict[str, Any]) -> "ExportJob":
+        """Rebuild a job published by another worker"""
+        job = cls(record["format"], record["filename"], record["owner"])
+        job.id = record["job_id"]
+        job.status = record["status"]
+        job.error = record["error"]
+        job.progress.rows_written = record["rows_written"]
+        job.bytes_written = record["bytes_written"]
+        job.created_at = record["created_at"]
+        job.started_at = record["started_at"]
+        job.finished_at = record["finished_at"]
+        return job
+    
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "format": self.export_format,
+            "filename": self.filename,
+            "rows_written": self.progress.rows_written,
+            "bytes_written": self.bytes_written,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "expires_at": self.expires_at,
+            "error": self.error,
+        }
+
+class ExportJobManager:
+    """Runs export jobs in a bounded thread pool and manages their artifacts"""
+
+    def __init__(self, workers: int = EXPORT_JOB_WORKERS, max_pending: int = EXPORT_JOB_MAX_PENDING,
+                 quota_bytes: int = EXPORT_JOB_QUOTA_BYTES):
+        self.max_pending = max_pending
+        self.quota_bytes = quota_bytes
+        self.jobs: Dict[str, ExportJob] = {}
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="export-job")
+
+    def submit(self, open_stream: Callable[[ExportProgress], Iterator[bytes]], export_format: str,
+               filename: str, owner: str) -> ExportJob:
+        """
+        Queue an export. open_stream is called on a worker thread with the
+        job's progress object and must return the encoded byte stream.
+
+        """
+        self.cleanup_expired()
+
+        with self.lock:
+            pending = sum(1 for job in self.jobs.values() if not job.is_finished)
+            if pending >= self.max_pending:
+                raise ExportQueueFullError("Too many export jobs are queued, try again later")
+            if self._disk_usage() >= self.quota_bytes:
+                raise ExportQueueFullError("Export storage quota exceeded, try again later")
+
+            job = ExportJob(export_format, filename, owner)
+            self.jobs[job.id] = job
+
+        self._publish(job)
+        self.executor.submit(self._run, job, open_stream)
+        return job
+
+    def get(self, job_id: str, owner: str) -> Optional[ExportJob]:
+        """
+        Look up a job, hiding jobs that belong to another workspace.
+
+        """
+        job = self.jobs.get(job_id) or self._shared_job(job_id)
+        if job is None or job.owner != owner:
+            return None
+        return job
+
+    def list_jobs(self, owner: str) -> List[ExportJob]:
+        jobs = {job.id: job for job in self.jobs.values() if job.owner == owner}
+        if state_backend.shared:
+            for key in state_backend.keys("export-job:"):
+                job_id = key.split(":", 1)[1]
+                if job_id not in jobs:
+                    job = self._shared_job(job_id)
+                    if job is not None and job.owner == owner:
+                        jobs[job_id] = job
+        return sorted(jobs.values(), key=lambda job: job.created_at)
+
+    def cancel(self, job_id: str, owner: str) -> bool:
+        """
+        Cancel a running job or delete a finished one together with its artifact.
+
+        """
+        job = self.get(job_id, owner)
+        if job is None:
+            return False
+
+        job.cancel_requested.set()
+        if job.id not in self.jobs and not job.is_finished:
+            # Running on another worker, which picks up the flag as it writes
+            state_backend.set(f"export-job-cancel:{job.id}", True, EXPORT_JOB_TTL_SECONDS)
+        elif job.is_finished:
+            with self.lock:
+                self.jobs.pop(job.id, None)
+            self._unpublish(job)
+            self._remove_artifact(job)
+        return True
+
+    def cleanup_expired(self) -> int:
+        """
+        Delete finished jobs whose artifacts have outlived the TTL.
+
+        """
+        now = time.time()
+        with self.lock:
+            expired = [job for job in self.jobs.values() if job.expires_at and job.expires_at <= now]
+            for job in expired:
+                self.jobs.pop(job.id, None)
+
+        for job in expired:
+            self._unpublish(job)
+            self._remove_artifact(job)
+        if state_backend.shared:
+            return len(expired) + self._remove_stale_artifacts(now)
+        return len(expired)
+
+    def _run(self, job: ExportJob, open_stream: Callable[[ExportProgress], Iterator[bytes]]):
+        """
+        Write the export stream to a partial file and publish it when complete.
+
+        """
+        if job.cancel_requested.is_set():
+            self._finish(job, "cancelled")
+            return
+
+        job.status = "running"
+        job.started_at = time.time()
+        self._publish(job)
+        partial_path = f"{job.path}.part"
+        published_at = job.started_at
+
+        try:
+            os.makedirs(EXPORT_JOB_DIR, exist_ok=True)
+            stream = open_stream(job.progress)
+            try:
+                with open(partial_path, 'wb') as f:
+                    for block in stream:
+                        if job.cancel_requested.is_set():
+                            break
+                        f.write(block)
+                        job.bytes_written += len(block)
+                        if self._disk_usage() > self.quota_bytes:
+                            raise ExportQueueFullError("Export storage quota exceeded")
+                        if state_backend.shared and time.time() - published_at >= EXPORT_JOB_PUBLISH_INTERVAL:
+                            published_at = time.time()
+                            self._publish(job)
+                            if state_backend.get(f"export-job-cancel:{job.id}"):
+                                job.cancel_requested.set()
+            finally:
+                stream.close()
+
+            if job.cancel_requested.is_set():
+                os.remove(partial_path)
+                self._finish(job, "cancelled")
+                return
+
+            os.replace(partial_path, job.path)
+            self._finish(job, "completed")
+            log.info("export_job_completed", job_id=job.id, rows=job.progress.rows_written, bytes=job.bytes_written)
+
+        except Exception as e:
+            log_error(e, f"Export job {job.id}")
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
+            job.error = str(e)
+            self._finish(job, "failed")
+
+    def _finish(self, job: ExportJob, status: str):
+        job.status = status
+        job.finished_at = time.time()
+        if status == "cancelled":
+            with self.lock:
+                self.jobs.pop(job.id, None)
+            self._unpublish(job)
+        else:
+            self._publish(job)
+
+    def _publish(self, job: ExportJob):
+        if state_backend.shared:
+            state_backend.set(f"export-job:{job.id}", {**job.to_dict(), "owner": job.owner}, EXPORT_JOB_TTL_SECONDS)
+
+    def _unpublish(self, job: ExportJob):
+        if state_backend.shared:
+            state_backend.delete(f"export-job:{job.id}")
+            state_backend.delete(f"export-job-cancel:{job.id}")
+
+    def _shared_job(self, job_id: str) -> Optional[ExportJob]:
+        if not state_backend.shared:
+            return None
+        record = state_backend.get(f"export-job:{job_id}")
+        return ExportJob.from_record(record) if record else None
+
+    def _disk_usage(self) -> int:
+        """Bytes held by finished artifacts plus jobs still being written"""
+        if state_backend.shared:
+            # Other workers write to the same directory
+            return sum(entry.stat().st_size for entry in os.scandir(EXPORT_JOB_DIR) if entry.is_file())
+        return sum(job.bytes_written for job in self.jobs.values() if job.status in ("running", "completed"))
+
+    def _remove_stale_artifacts(self, now: float) -> int:
+        """Remove shared artifacts untouched for longer than the TTL, e.g. from a stopped worker"""
+        removed = 0
+        for entry in os.scandir(EXPORT_JOB_DIR):
+            if entry.is_file() and entry.stat().st_mtime + EXPORT_JOB_TTL_SECONDS <= now:
+                try:
+                    os.remove(entry.path)
+                    removed += 1
+                except FileNotFoundError:
+                    pass
+        return removed
+
+    def _remove_artifact(self, job: ExportJob):
+        for path in (job.path, f"{job.path}.part"):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def reset_storage(self):
+        """Remove artifacts left behind by a previous process"""
+        if not state_backend.shared:
+            # Shared artifacts may belong to other workers and expire by TTL instead
+            shutil.rmtree(EXPORT_JOB_DIR, ignore_errors=True)
+        os.makedirs(EXPORT_JOB_DIR, exist_ok=True)
+
+# Global export job manager instance
+export_job_manager = ExportJobManager()
+
+async def run_cleanup_loop(interval_seconds: int = 300):
+    """
+    Periodically delete expired export artifacts.
+
+    """
+    while True:
+        await asyncio.sleep(interval_seconds)
+        removed = export_job_manager.cleanup_expired()
+        if removed:
+            log.info("export_jobs_expired", removed=removed)
+
+# RANGE REQUEST UTILITIES
+
+def parse_range_header(range_header: Optional[str], file_size: int) -> Optional[Tuple[int, int]]:
+    """
+    Parse a single-range "bytes=start-end" header into inclusive offsets.
+
+    Returns None when no range was requested and raises ValueError when the
+    range cannot be satisfied.
+
+    """
+    if not range_header:
+        return None
+
+    match = re.fullmatch(r'\s*bytes=(\d*)-(\d*)\s*', range_header)
+    if not match or (not match.group(1) and not match.group(2)):
+        raise ValueError(f"Invalid Range header: {range_header}")
+
+    start_text, end_text = match.groups()
+    if not start_text:
+        # Suffix range: the last N bytes
+        length = int(end_text)
+        if length == 0:
+            raise ValueError("Requested range is empty")
+        start, end = max(file_size - length, 0), file_size - 1
+    else:
+        start = int(start_text)
+        end = min(int(end_text), file_size - 1) if end_text else file_size - 1
+
+    if start >= file_size or start > end:
+        raise ValueError(f"Requested range not satisfiable for {file_size} bytes")
+    return start, end
+
+def iter_file_range(path: str, start: int, end: int, block_size: int = 1024 * 1024) -> Iterator[bytes]:
+    """
+    Read the inclusive byte range [start, end] of a file in blocks.
+
+    """
+    remaining = end - start + 1
+    with open(path, 'rb') as f:
+        f.seek(start)
+        while remaining > 0:
+            block = f.read(min(block_size, remaining))
+            if not block:
+                break
+            remaining -= len(block)
+            yield block
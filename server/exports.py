@@ -0,0 +1,555 @@
+"""
+Export utilities for the Data Analytics Chatbot API Server
+
+This module turns query results into downloadable files without building
+the whole file in memory:
+- Native bulk export paths (Postgres COPY TO STDOUT, DuckDB COPY TO)
+- Chunked query execution via utils.iter_query_chunks as a portable fallback
+- Incremental encoding of each chunk as CSV, gzip-CSV, JSONL, Parquet or Arrow IPC
+- Export format resolution and response headers for file downloads
+"""
+
+from __future__ import annotations
+
+import os
+import queue
+import tempfile
+import threading
+import zlib
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple
+
+from lazy_imports import lazy_module
+from utils import iter_query_chunks, log_error
+
+pd = lazy_module("pandas")
+
+# Number of rows pulled from the database and encoded per chunk
+EXPORT_CHUNK_SIZE = int(os.getenv("EXPORT_CHUNK_SIZE", "50000"))
+
+# Size of the byte blocks sent to the client by the native export paths
+EXPORT_BLOCK_SIZE = int(os.getenv("EXPORT_BLOCK_SIZE", str(1024 * 1024)))
+
+# Compression level for gzip-CSV exports encoded in Python
+EXPORT_GZIP_LEVEL = int(os.getenv("EXPORT_GZIP_LEVEL", "6"))
+
+# Supported export formats: media type and file extension
+EXPORT_FORMATS: Dict[str, Tuple[str, str]] = {
+    "csv": ("text/csv", "csv"),
+    "csv.gz": ("application/gzip", "csv.gz"),
+    "jsonl": ("application/x-ndjson", "jsonl"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+    "arrow": ("application/vnd.apache.arrow.stream", "arrows"),
+}
+
+EXPORT_FORMAT_ALIASES = {
+    "gzip": "csv.gz",
+    "csv_gz": "csv.gz",
+    "json": "jsonl",
+    "ndjson": "jsonl",
+    "ipc": "arrow",
+}
+
+# DuckDB COPY options for the formats it can write natively
+DUCKDB_COPY_OPTIONS = {
+    "csv": "FORMAT CSV, HEADER",
+    "csv.gz": "FORMAT CSV, HEADER, COMPRESSION GZIP",
+    "jsonl": "FORMAT JSON",
+    "parquet": "FORMAT PARQUET, COMPRESSION ZSTD",
+}
+
+class ExportProgress:
+    """Running row count of an export, updated as the stream is produced"""
+    
+    def __init__(self):
+        self.rows_written = 0
+
+# EXPORT FORMATS
+
+def resolve_export_format(requested: Optional[str], user: Optional[Dict[str, Any]] = None) -> str:
+    """
+    Pick the export format from the request, falling back to the export
+    format in the user's preferences and then to CSV.
+
+    """
+    export_format = requested
+    if not export_format and user:
+        export_format = user.get("export_format")
+
+    export_format = (export_format or "csv").strip().lower()
+    export_format = EXPORT_FORMAT_ALIASES.get(export_format, export_format)
+
+    if export_format not in EXPORT_FORMATS:
+        supported = ", ".join(EXPORT_FORMATS)
+        raise ValueError(f"Unsupported export format '{export_format}'. Choose one of: {supported}")
+    return export_format
+
+# EXPORT STREAMS
+
+def stream_export(sql_query: str, engine, is_csv: bool = False, export_format: str = "csv",
+                  chunk_size: int = EXPORT_CHUNK_SIZE, progress: Optional[ExportProgress] = None) -> Iterator[bytes]:
+    """
+    Start an export in any supported format.
+
+    DuckDB writes CSV, gzip-CSV, JSONL and Parquet natively; everything else
+    is encoded chunk by chunk so memory stays bounded by the chunk size.
+    When a progress object is given its row count is kept up to date.
+
+    """
+    if export_format == "csv":
+        return stream_csv_export(sql_query, engine, is_csv, chunk_size, progress)
+    if is_csv and export_format in DUCKDB_COPY_OPTIONS:
+        return stream_duckdb_copy_export(sql_query, engine, export_format=export_format, progress=progress)
+    if export_format == "csv.gz":
+        return _gzip_blocks(stream_csv_export(sql_query, engine, is_csv, chunk_size, progress))
+    if export_format == "arrow" and is_csv:
+        return stream_duckdb_arrow_export(sql_query, engine, chunk_size, progress)
+
+    encoders = {
+        "jsonl": _encode_jsonl_chunks,
+        "parquet": _encode_parquet_chunks,
+        "arrow": _encode_arrow_chunks,
+    }
+    return _start_chunked_export(sql_query, engine, is_csv, chunk_size, encoders[export_format], progress)
+
+def stream_csv_export(sql_query: str, engine, is_csv: bool = False, chunk_size: int = EXPORT_CHUNK_SIZE,
+                      progress: Optional[ExportProgress] = None) -> Iterator[bytes]:
+    """
+    Start a CSV export using the fastest path available for the engine.
+
+    DuckDB uses COPY TO a temporary file and PostgreSQL uses COPY TO STDOUT;
+    every other database falls back to chunked encoding in Python.
+
+    """
+    if is_csv:
+        return stream_duckdb_copy_export(sql_query, engine, progress=progress)
+    if engine.dialect.name == "postgresql":
+        return stream_postgres_copy_export(sql_query, engine, progress=progress)
+    return stream_chunked_csv_export(sql_query, engine, is_csv, chunk_size, progress)
+
+def stream_chunked_csv_export(sql_query: str, engine, is_csv: bool = False, chunk_size: int = EXPORT_CHUNK_SIZE,
+                              progress: Optional[ExportProgress] = None) -> Iterator[bytes]:
+    """
+    Start a CSV export and return an iterator of encoded CSV chunks.
+
+    """
+    return _start_chunked_export(sql_query, engine, is_csv, chunk_size, _encode_csv_chunks, progress)
+
+def _start_chunked_export(sql_query: str, engine, is_csv: bool, chunk_size: int,
+                          encoder: Callable[[pd.DataFrame, Iterator[pd.DataFrame]], Iterator[bytes]],
+                          progress: Optional[ExportProgress] = None) -> Iterator[bytes]:
+    """
+    Run a query in chunks and feed them to an encoder.
+
+    The first chunk is fetched before returning so that invalid SQL or an
+    empty result is reported as a normal error instead of a truncated
+    download. DuckDB cursors passed in are closed once the stream finishes.
+
+    """
+    chunks = iter_query_chunks(sql_query, engine, is_csv, chunk_size)
+    if progress is not None:
+        chunks = _count_rows(chunks, progress)
+    try:
+        first_chunk = next(chunks, None)
+        if first_chunk is None or first_chunk.empty:
+            raise ValueError("Query returned no results to export")
+    except Exception:
+        chunks.close()
+        if is_csv:
+            engine.close()
+        raise
+
+    return _run_encoder(encoder(first_chunk, chunks), chunks, engine if is_csv else None)
+
+def _count_rows(chunks: Iterator[pd.DataFrame], progress: ExportProgress) -> Iterator[pd.DataFrame]:
+    """
+    Pass chunks through while adding their row counts to the progress.
+
+    """
+    try:
+        for chunk in chunks:
+            progress.rows_written += len(chunk)
+            yield chunk
+    finally:
+        chunks.close()
+
+def _run_encoder(encoded: Iterator[bytes], chunks: Iterator[pd.DataFrame], cursor=None) -> Iterator[bytes]:
+    """
+    Yield encoded output and release the query resources when done.
+
+    """
+    try:
+        for block in encoded:
+            if block:
+                yield block
+    except Exception as e:
+        log_error(e, "Streaming export")
+        raise
+    finally:
+        encoded.close()
+        chunks.close()
+        if cursor is not None:
+            cursor.close()
+
+# CHUNK ENCODERS
+
+def _encode_csv_chunks(first_chunk: pd.DataFrame, chunks: Iterator[pd.DataFrame]) -> Iterator[bytes]:
+    """
+    Encode DataFrame chunks as CSV, writing the header only once.
+
+    """
+    yield first_chunk.to_csv(index=False).encode('utf-8')
+    del first_chunk
+    for chunk in chunks:
+        yield chunk.to_csv(index=False, header=False).encode('utf-8')
+
+def _encode_jsonl_chunks(first_chunk: pd.DataFrame, chunks: Iterator[pd.DataFrame]) -> Iterator[bytes]:
+    """
+    Encode DataFrame chunks as newline-delimited JSON records.
+
+    """
+    def encode(chunk: pd.DataFrame) -> bytes:
+        lines = chunk.to_json(orient='records', lines=True, date_format='iso')
+        return (lines if lines.endswith('\n') else lines + '\n').encode('utf-8')
+
+    yield encode(first_chunk)
+    del first_chunk
+    for chunk in chunks:
+        yield encode(chunk)
+
+def _encode_parquet_chunks(first_chunk: pd.DataFrame, chunks: Iterator[pd.DataFrame]) -> Iterator[bytes]:
+    """
+    Encode DataFrame chunks as a zstd-compressed Parquet file, one row
+    group per chunk.
+
+    """
+    pa = _require_pyarrow("Parquet")
+    import pyarrow.parquet as pq
+
+    table = pa.Table.from_pandas(first_chunk, preserve_index=False)
+    del first_chunk
+    schema = _stream_schema(pa, table.schema)
+    table = table.cast(schema)
+    sink = _ByteSink()
+    writer = pq.ParquetWriter(sink, schema, compression='zstd')
+    try:
+        writer.write_table(table)
+        yield sink.drain()
+        for chunk in chunks:
+            writer.write_table(pa.Table.from_pandas(chunk, preserve_index=False).cast(schema))
+            yield sink.drain()
+    finally:
+        writer.close()
+    yield sink.drain()
+
+def _encode_arrow_chunks(first_chunk: pd.DataFrame, chunks: Iterator[pd.DataFrame]) -> Iterator[bytes]:
+    """
+    Encode DataFrame chunks as an Arrow IPC stream, one record batch per chunk.
+
+    """
+    pa = _require_pyarrow("Arrow")
+
+    batch = pa.RecordBatch.from_pandas(first_chunk, preserve_index=False)
+    del first_chunk
+    schema = _stream_schema(pa, batch.schema)
+    batches = (pa.RecordBatch.from_pandas(chunk, preserve_index=False).cast(schema) for chunk in chunks)
+    yield from _write_arrow_stream(pa, batch.cast(schema), batches)
+
+def _stream_schema(pa, schema):
+    """
+    The schema a chunked export is written with, taken from its first
+    chunk. Columns that chunk only held NULLs in have no type yet, so they
+    are written as strings and later chunks' values are cast to text.
+
+    """
+    return pa.schema(
+        [field.with_type(pa.string()) if pa.types.is_null(field.type) else field for field in schema],
+        metadata=schema.metadata
+    )
+
+def _write_arrow_stream(pa, first_batch, batches) -> Iterator[bytes]:
+    """
+    Write record batches to an Arrow IPC stream and yield the bytes as they are produced.
+
+    """
+    sink = _ByteSink()
+    writer = pa.ipc.new_stream(sink, first_batch.schema)
+    try:
+        writer.write_batch(first_batch)
+        yield sink.drain()
+        for batch in batches:
+            writer.write_batch(batch)
+            yield sink.drain()
+    finally:
+        writer.close()
+    yield sink.drain()
+
+def _gzip_blocks(blocks: Iterator[bytes]) -> Iterator[bytes]:
+    """
+    Compress a byte stream into a single gzip member as it is produced.
+
+    """
+    compressor = zlib.compressobj(EXPORT_GZIP_LEVEL, zlib.DEFLATED, 31)
+    try:
+        for block in blocks:
+            compressed = compressor.compress(block)
+            if compressed:
+                yield compressed
+        yield compressor.flush()
+    finally:
+        blocks.close()
+
+def _require_pyarrow(format_name: str):
+    """
+    Import pyarrow, which is only needed for columnar export formats.
+
+    """
+    try:
+        import pyarrow
+    except ImportError:
+        raise ValueError(f"{format_name} export requires the pyarrow package")
+    return pyarrow
+
+class _ByteSink:
+    """Minimal writable file object that lets encoders hand off their output"""
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.position = 0
+        self.closed = False
+
+    def write(self, data) -> int:
+        self.buffer += data
+        self.position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self) -> bytes:
+        """Return everything written since the last drain"""
+        data = bytes(self.buffer)
+        self.buffer.clear()
+        return data
+
+# NATIVE EXPORT PATHS
+
+def stream_duckdb_copy_export(sql_query: str, cursor, block_size: int = EXPORT_BLOCK_SIZE, export_format: str = "csv",
+                              progress: Optional[ExportProgress] = None) -> Iterator[bytes]:
+    """
+    Export a DuckDB query with its native writer and stream the file.
+
+    DuckDB writes the result to a temporary file in parallel, which is then
+    sent in blocks and removed. The cursor is closed once the COPY finishes.
+
+    """
+    clean_query = sql_query.strip().rstrip(';')
+    extension = EXPORT_FORMATS[export_format][1]
+    fd, path = tempfile.mkstemp(prefix="queryous_export_", suffix=f".{extension}")
+    os.close(fd)
+
+    try:
+        escaped_path = path.replace("'", "''")
+        copy_options = DUCKDB_COPY_OPTIONS[export_format]
+        copy_result = cursor.execute(f"COPY ({clean_query}) TO '{escaped_path}' ({copy_options})").fetchone()
+        if copy_result and copy_result[0] == 0:
+            raise ValueError("Query returned no results to export")
+        if copy_result and progress is not None:
+            progress.rows_written = copy_result[0]
+    except Exception:
+        os.remove(path)
+        raise
+    finally:
+        cursor.close()
+
+    return _stream_file(path, block_size)
+
+def stream_duckdb_arrow_export(sql_query: str, cursor, chunk_size: int = EXPORT_CHUNK_SIZE,
+                               progress: Optional[ExportProgress] = None) -> Iterator[bytes]:
+    """
+    Export a DuckDB query as an Arrow IPC stream straight from its record
+    batches, without a pandas round trip. The cursor is closed afterwards.
+
+    """
+    try:
+        pa = _require_pyarrow("Arrow")
+        reader = cursor.execute(sql_query.strip().rstrip(';')).fetch_record_batch(chunk_size)
+        first_batch = next(iter(reader), None)
+        if first_batch is None or first_batch.num_rows == 0:
+            raise ValueError("Query returned no results to export")
+    except Exception:
+        cursor.close()
+        raise
+
+    def counted(batches):
+        for batch in batches:
+            if progress is not None:
+                progress.rows_written += batch.num_rows
+            yield batch
+
+    def stream():
+        try:
+            yield from _write_arrow_stream(pa, first_batch, counted(reader))
+        finally:
+            cursor.close()
+
+    if progress is not None:
+        progress.rows_written = first_batch.num_rows
+    return stream()
+
+def _stream_file(path: str, block_size: int) -> Iterator[bytes]:
+    """
+    Stream a file in blocks and delete it afterwards.
+
+    """
+    try:
+        with open(path, 'rb') as f:
+            while True:
+                block = f.read(block_size)
+                if not block:
+                    break
+                yield block
+    finally:
+        os.remove(path)
+
+def stream_postgres_copy_export(sql_query: str, engine, block_size: int = EXPORT_BLOCK_SIZE,
+                                progress: Optional[ExportProgress] = None) -> Iterator[bytes]:
+    """
+    Export a PostgreSQL query with COPY ... TO STDOUT WITH CSV HEADER.
+
+    psycopg2's copy_expert runs in a background thread and writes into a
+    bounded queue, so the server does the CSV encoding and the client
+    receives blocks as soon as they are produced. Output is buffered until
+    at least one data row has arrived so empty results raise an error.
+    The row count is only known, and reported to progress, once COPY ends.
+
+    """
+    clean_query = sql_query.strip().rstrip(';')
+    copy_sql = f"COPY ({clean_query}) TO STDOUT WITH CSV HEADER"
+
+    writer = _QueueWriter(block_size)
+    raw_connection = engine.raw_connection()
+
+    def run_copy():
+        try:
+            cursor = raw_connection.cursor()
+            try:
+                cursor.copy_expert(copy_sql, writer)
+                if progress is not None and cursor.rowcount >= 0:
+                    progress.rows_written = cursor.rowcount
+            finally:
+                cursor.close()
+            writer.finish()
+        except Exception as e:
+            writer.finish(e)
+
+    thread = threading.Thread(target=run_copy, name="postgres-copy-export", daemon=True)
+    thread.start()
+
+    blocks = writer.blocks()
+    try:
+        # Hold back output until the header and one data row are available
+        prefix = b""
+        for block in blocks:
+            prefix += block
+            if prefix.count(b"\n") >= 2:
+                break
+        if prefix.count(b"\n") < 2:
+            raise ValueError("Query returned no results to export")
+    except Exception:
+        writer.abort()
+        thread.join()
+        raw_connection.close()
+        raise
+
+    return _stream_copy_blocks(prefix, blocks, writer, thread, raw_connection)
+
+def _stream_copy_blocks(prefix: bytes, blocks: Iterator[bytes], writer, thread, raw_connection) -> Iterator[bytes]:
+    """
+    Yield the COPY output and release the connection when done.
+
+    """
+    try:
+        yield prefix
+        for block in blocks:
+            yield block
+    except Exception as e:
+        log_error(e, "Streaming PostgreSQL COPY export")
+        raise
+    finally:
+        writer.abort()
+        thread.join()
+        raw_connection.close()
+
+class _QueueWriter:
+    """File-like sink that hands COPY output to a consumer in fixed-size blocks"""
+
+    _DONE = object()
+
+    def __init__(self, block_size: int, max_blocks: int = 8):
+        self.block_size = block_size
+        self.buffer = bytearray()
+        self.queue: queue.Queue = queue.Queue(maxsize=max_blocks)
+        self.aborted = threading.Event()
+        self.error: Optional[Exception] = None
+
+    def write(self, data) -> int:
+        if self.aborted.is_set():
+            raise IOError("Export stream was closed by the client")
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        self.buffer += data
+        if len(self.buffer) >= self.block_size:
+            self._put(bytes(self.buffer))
+            self.buffer.clear()
+        return len(data)
+
+    def finish(self, error: Optional[Exception] = None):
+        """Flush remaining output and signal the end of the stream"""
+        self.error = error
+        if error is None and self.buffer:
+            self._put(bytes(self.buffer))
+            self.buffer.clear()
+        self._put(self._DONE)
+
+    def abort(self):
+        """Stop the producer; pending writes fail and the queue is drained"""
+        self.aborted.set()
+        while True:
+            try:
+                self.queue.get_nowait()
+            except queue.Empty:
+                break
+
+    def blocks(self) -> Iterator[bytes]:
+        while True:
+            item = self.queue.get()
+            if item is self._DONE:
+                if self.error is not None:
+                    raise self.error
+                return
+            yield item
+
+    def _put(self, item):
+        while not self.aborted.is_set():
+            try:
+                self.queue.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+
+# RESPONSE HELPERS
+
+def export_headers(filename: str) -> Dict[str, str]:
+    """
+    Build download headers for an exported file.
+
+    """
+    return {
+        'Content-Disposition': f'attachment; filename="{filename}"',
+    }
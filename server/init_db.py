@@ -3,27 +3,50 @@ Database initialization and configuration for authentication.
 """
 
 import os
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, inspect, text, MetaData
 from sqlalchemy.orm import sessionmaker, Session
-from models import Base
+from sqlalchemy.schema import CreateTable
+from models import Base, User
 from dotenv import load_dotenv
 
+from logger import get_logger
+
 # Load environment variables
 load_dotenv()
 
+log = get_logger("init_db")
+
 # Database configuration
 DATABASE_URL = os.getenv(
     "DATABASE_URL", 
     "sqlite:///./queryous_auth.db"  # Default to SQLite for development
 )
 
+# Connection pool size per worker process (ignored for SQLite)
+DATABASE_POOL_SIZE = int(os.getenv("DATABASE_POOL_SIZE", "10"))
+DATABASE_MAX_OVERFLOW = int(os.getenv("DATABASE_MAX_OVERFLOW", "20"))
+
+engine_options = {}
+if not DATABASE_URL.startswith("sqlite"):
+    engine_options = {"pool_size": DATABASE_POOL_SIZE, "max_overflow": DATABASE_MAX_OVERFLOW}
+
 # Create database engine
 engine = create_engine(
     DATABASE_URL,
     echo=False,  # Set to True for SQL query logging
-    pool_pre_ping=True  # Verify connections before use
+    pool_pre_ping=True,  # Verify connections before use
+    **engine_options
 )
 
+if engine.dialect.name == "sqlite":
+    @event.listens_for(engine, "connect")
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        # Let readers run while another worker writes, and wait on locks instead of failing
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA busy_timeout=5000")
+        cursor.close()
+
 # Create session factory
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
@@ -44,10 +67,12 @@ def init_database():
     try:
         # Create all tables
         Base.metadata.create_all(bind=engine)
-        print("✅ Database tables created successfully!")
+        log.info("database_tables_created")
+        
+        # create_all leaves existing tables alone
+        migrate_schema()
         
         # Create indexes for performance
-        from sqlalchemy import text
         with engine.connect() as conn:
             # Index for user lookups
             try:
@@ -58,6 +83,7 @@ def init_database():
                 # Index for chat sessions
                 conn.execute(text("CREATE INDEX IF NOT EXISTS idx_chat_sessions_user_id ON chat_sessions(user_id)"))
                 conn.execute(text("CREATE INDEX IF NOT EXISTS idx_chat_sessions_created_at ON chat_sessions(created_at)"))
+                conn.execute(text("CREATE INDEX IF NOT EXISTS idx_chat_sessions_user_updated ON chat_sessions(user_id, updated_at)"))
                 
                 # Index for dashboards
                 conn.execute(text("CREATE INDEX IF NOT EXISTS idx_dashboards_user_id ON dashboards(user_id)"))
@@ -73,15 +99,48 @@ def init_database():
                 conn.execute(text("CREATE INDEX IF NOT EXISTS idx_login_attempts_created_at ON login_attempts(created_at)"))
                 
                 conn.commit()
-                print("✅ Database indexes created successfully!")
+                log.info("database_indexes_created")
                 
             except Exception as e:
-                print(f"⚠️  Warning: Could not create some indexes: {e}")
+                log.warning("database_indexes_failed", error=str(e))
         
     except Exception as e:
-        print(f"❌ Error creating database tables: {e}")
+        log.error("database_tables_failed", error=str(e))
         raise
 
+def migrate_schema():
+    """
+    Apply model changes that create_all does not make to tables created
+    by earlier versions.
+    """
+    with engine.begin() as conn:
+        email = next(column for column in inspect(conn).get_columns("users") if column["name"] == "email")
+        if not email["nullable"]:
+            # Username-only signups have no email
+            if engine.dialect.name == "postgresql":
+                conn.execute(text("ALTER TABLE users ALTER COLUMN email DROP NOT NULL"))
+            elif engine.dialect.name == "mysql":
+                conn.execute(text("ALTER TABLE users MODIFY email VARCHAR(255) NULL"))
+            elif engine.dialect.name == "sqlite":
+                _rebuild_sqlite_table(conn, User.__table__)
+            log.info("database_migrated", change="users.email nullable")
+
+def _rebuild_sqlite_table(conn, table):
+    """
+    SQLite cannot change a column's constraints, so copy the rows into a
+    table created from the model and swap it in. Foreign keys from other
+    tables refer to the table by name and keep working.
+    """
+    existing = {column["name"] for column in inspect(conn).get_columns(table.name)}
+    columns = ", ".join(column.name for column in table.columns if column.name in existing)
+    staging = table.to_metadata(MetaData(), name=f"{table.name}_migrating")
+    conn.execute(CreateTable(staging))
+    conn.execute(text(f"INSERT INTO {staging.name} ({columns}) SELECT {columns} FROM {table.name}"))
+    conn.execute(text(f"DROP TABLE {table.name}"))
+    conn.execute(text(f"ALTER TABLE {staging.name} RENAME TO {table.name}"))
+    for index in table.indexes:
+        index.create(conn)
+
 def reset_database():
     """
     Reset database by dropping and recreating all tables.
@@ -0,0 +1,105 @@
+"""
+Lazy imports for the Data Analytics Chatbot API Server
+
+Keeps heavy dependencies off the cold-start path:
+- lazy_module() stands in for a module (pandas, numpy, duckdb, httpx)
+  and imports it on first attribute access, so `pd = lazy_module("pandas")`
+  reads like the usual import
+- After the import the module's namespace is copied onto the stand-in,
+  so later attribute lookups cost the same as on the module itself
+- An optional warm-up imports them in a background thread shortly after
+  the server starts accepting connections, so the first request does not
+  pay for them either
+
+Modules that use a lazy module in annotations need
+`from __future__ import annotations` so defining them does not trigger it.
+"""
+
+import asyncio
+import importlib
+import os
+import threading
+import time
+from typing import Dict, List
+
+from logger import get_logger
+
+log = get_logger("lazy_imports")
+
+# CONFIGURATION
+
+# Import the heavy modules in the background once the server is up
+WARMUP_IMPORTS = os.getenv("WARMUP_IMPORTS", "true").lower() == "true"
+# Seconds after startup before warming up, letting uvicorn bind its socket first
+WARMUP_DELAY_SECONDS = float(os.getenv("WARMUP_DELAY_SECONDS", "1.0"))
+
+# LAZY MODULES
+
+# Seconds each lazy module took to import, by module name
+import_seconds: Dict[str, float] = {}
+_modules: Dict[str, "LazyModule"] = {}
+_lock = threading.Lock()
+
+class LazyModule:
+    """A module that is imported the first time one of its attributes is read"""
+
+    def __init__(self, name: str):
+        self._lazy_name = name
+
+    def __getattr__(self, attr: str):
+        # Only reached until the module is loaded; afterwards its namespace
+        # is on the instance and attributes resolve directly
+        if attr.startswith("__") and attr.endswith("__"):
+            raise AttributeError(attr)
+        return getattr(self._lazy_load(), attr)
+
+    def _lazy_load(self):
+        name = self.__dict__["_lazy_name"]
+        started = time.perf_counter()
+        module = importlib.import_module(name)
+        with _lock:
+            if name not in import_seconds:
+                import_seconds[name] = round(time.perf_counter() - started, 4)
+                log.info("lazy_import", module=name, seconds=import_seconds[name],
+                         thread=threading.current_thread().name)
+        self.__dict__.update(module.__dict__)
+        return module
+
+    def __repr__(self) -> str:
+        loaded = "loaded" if "__name__" in self.__dict__ else "not loaded"
+        return f"<lazy module {self.__dict__['_lazy_name']!r} ({loaded})>"
+
+def lazy_module(name: str) -> LazyModule:
+    """The shared stand-in for a module, created on first use"""
+    with _lock:
+        if name not in _modules:
+            _modules[name] = LazyModule(name)
+        return _modules[name]
+
+def loaded_modules() -> List[str]:
+    return sorted(name for name, module in _modules.items() if "__name__" in module.__dict__)
+
+# WARM-UP
+
+def warm_up_imports() -> float:
+    """Import every lazy module now. Returns the seconds it took."""
+    started = time.perf_counter()
+    for name in list(_modules):
+        try:
+            _modules[name]._lazy_load()
+        except Exception as e:
+            log.warning("lazy_import_failed", module=name, error=str(e))
+    return time.perf_counter() - started
+
+async def run_import_warmup(delay_seconds: float = WARMUP_DELAY_SECONDS):
+    """
+    Warm up the lazy modules in a worker thread after a short delay.
+    Started from the startup event, which runs before uvicorn accepts
+    connections, so the delay keeps the imports off the readiness path.
+
+    """
+    if not WARMUP_IMPORTS:
+        return
+    await asyncio.sleep(delay_seconds)
+    seconds = await asyncio.to_thread(warm_up_imports)
+    log.info("imports_warmed", seconds=round(seconds, 3), modules=loaded_modules())
@@ -0,0 +1,113 @@
+"""
+Structured logging for the Data Analytics Chatbot API Server
+
+Replaces ad-hoc printing with one event per line:
+- Events are a short name plus key=value fields, e.g.
+  log.info("query_completed", rows=120, seconds=0.84)
+- Fields are only formatted when the level is enabled, so debug logging
+  costs a level check when switched off
+- LOG_FORMAT=json writes one JSON object per line for log shippers,
+  LOG_FORMAT=text a compact human-readable line
+- Every line carries the id of the request it was logged under
+"""
+
+import contextvars
+import json
+import logging
+import os
+import sys
+import time
+from typing import Any, Optional
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# CONFIGURATION
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text").lower()
+
+# Id of the request being handled, set by the metrics middleware
+request_id: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("request_id", default=None)
+
+# FORMATTERS
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "event": record.getMessage(),
+        }
+        rid = getattr(record, "request_id", None)
+        if rid:
+            entry["request_id"] = rid
+        entry.update(getattr(record, "fields", {}))
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+class TextFormatter(logging.Formatter):
+    """time level logger event key=value ..."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        parts = [
+            time.strftime("%H:%M:%S", time.localtime(record.created)),
+            record.levelname.ljust(7),
+            record.name,
+            record.getMessage(),
+        ]
+        rid = getattr(record, "request_id", None)
+        if rid:
+            parts.append(f"request_id={rid}")
+        parts.extend(f"{key}={value!r}" if isinstance(value, str) and " " in value else f"{key}={value}"
+                     for key, value in getattr(record, "fields", {}).items())
+        line = " ".join(parts)
+        if record.exc_info:
+            line += "\n" + self.formatException(record.exc_info)
+        return line
+
+def _configure() -> logging.Logger:
+    root = logging.getLogger("queryous")
+    if not root.handlers:
+        handler = logging.StreamHandler(sys.stdout)
+        handler.setFormatter(JsonFormatter() if LOG_FORMAT == "json" else TextFormatter())
+        root.addHandler(handler)
+        root.setLevel(LOG_LEVEL)
+        # Uvicorn configures the root logger; keep our lines out of its handlers
+        root.propagate = False
+    return root
+
+_root = _configure()
+
+# LOGGER
+
+class StructuredLogger:
+    """Thin wrapper over a logging.Logger that takes fields as keyword arguments"""
+
+    def __init__(self, name: str):
+        self.logger = _root.getChild(name)
+
+    def _log(self, level: int, event: str, exc_info: Any, fields: dict):
+        if self.logger.isEnabledFor(level):
+            self.logger.log(level, event, exc_info=exc_info,
+                            extra={"fields": fields, "request_id": request_id.get()})
+
+    def debug(self, event: str, **fields):
+        self._log(logging.DEBUG, event, None, fields)
+
+    def info(self, event: str, **fields):
+        self._log(logging.INFO, event, None, fields)
+
+    def warning(self, event: str, **fields):
+        self._log(logging.WARNING, event, None, fields)
+
+    def error(self, event: str, exc_info: Any = None, **fields):
+        self._log(logging.ERROR, event, exc_info, fields)
+
+def get_logger(name: str) -> StructuredLogger:
+    return StructuredLogger(name)
@@ -6,16 +6,18 @@ Business logic and utilities are imported from separate modules.
 """
 
 # Standard library imports
+import asyncio
 import traceback
 import os
-from typing import Optional
+import time
+from typing import Optional, Dict, Any
 
-from fastapi import FastAPI, HTTPException, UploadFile, File
+import anyio
+from fastapi import FastAPI, HTTPException, UploadFile, File, Depends, Header, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from pydantic import BaseModel
-import altair as alt
-import io
 
 # Local imports
 from db import (
@@ -28,15 +30,38 @@ from db import (
 from services import (
     query_llm, 
     summarize_results, 
-    execute_query, 
-    generate_auto_chart
+    close_llm_client
+)
+from chart_data import prepare_visualization_data
+from charts import generate_auto_chart
+from cost_guard import cost_guard, QueryTooExpensiveError
+from deadlines import RequestCancelledError, request_deadline
+from profiling import profile_columns, describe_profile
+from exports import (
+    EXPORT_FORMATS,
+    ExportProgress,
+    resolve_export_format,
+    stream_export,
+    export_headers
+)
+from export_jobs import (
+    ExportQueueFullError,
+    export_job_manager,
+    run_cleanup_loop,
+    parse_range_header,
+    iter_file_range
 )
 from utils import (
     LLM_API_URL,
     LLM_API_KEY,
     MYSQL_SYSTEM_PROMPT,
     CSV_SYSTEM_PROMPT,
-    app_state,
+    ApplicationState,
+    WorkspaceLimitError,
+    WorkspaceMemoryError,
+    workspaces,
+    workspace_key,
+    workspace_owner,
     clean_sql_query,
     sanitize_table_name,
     generate_csv_schema,
@@ -45,10 +70,8 @@ from utils import (
     calculate_pagination,
     get_total_row_count,
     execute_paginated_query,
-    prepare_visualization_data,
     prepare_summary_data,
     create_response_message,
-    export_to_csv,
     Timer,
     validate_file_upload,
     validate_query_input,
@@ -56,13 +79,52 @@ from utils import (
     log_error
 )
 
+from rate_limit import (
+    ask_limiter,
+    export_limiter,
+    upload_limiter,
+    llm_call_budget,
+    db_time_budget,
+    rate_limited,
+    client_key,
+    charge_db_time,
+    enforce,
+    enforce_available
+)
+
 # Authentication imports
-from auth_routes import router as auth_router
+from auth_routes import router as auth_router, get_optional_user
+from admin_routes import router as admin_router
+from chat_routes import router as chat_router, chat_service
+from dashboard_routes import router as dashboard_router
+from dashboard_service import view_counter, run_view_count_flush_loop
+from password_hashing import password_hasher
+from maintenance import maintenance, run_maintenance_loop
+from init_db import init_database, engine as auth_engine
+from lazy_imports import run_import_warmup
+from query_stats import query_stats, query_mode
+from request_profiler import RequestProfile, profiled, profiled_call
+from sql_cache import sql_cache
+from warm_start import warm_start
+from workload_capture import workload_capture
+from logger import get_logger
+from metrics import (
+    METRICS_TOKEN,
+    MetricsMiddleware,
+    Gauge,
+    stage,
+    run_loop_lag_monitor,
+    render_metrics,
+    export_rows,
+    export_bytes,
+    export_seconds,
+    csv_upload_bytes,
+    csv_upload_rows
+)
 
-# FASTAPI APPLICATION SETUP
+log = get_logger("main")
 
-# Enable json data transformer for Altair (instead of vegafusion to avoid dependency issues)
-alt.data_transformers.enable("json")
+# FASTAPI APPLICATION SETUP
 
 # Initialize FastAPI application with metadata
 app = FastAPI(
@@ -84,8 +146,48 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Count requests and add Server-Timing and X-Request-Id headers
+app.add_middleware(MetricsMiddleware)
+
 # Include authentication routes
 app.include_router(auth_router)
+app.include_router(chat_router)
+app.include_router(dashboard_router)
+app.include_router(admin_router)
+
+@app.exception_handler(RequestCancelledError)
+async def request_cancelled_handler(request: Request, exc: RequestCancelledError):
+    """
+    Answer a request stopped by its deadline with 504. One whose client
+    disconnected gets 499, as nginx logs it, though nobody reads it.
+    
+    """
+    status_code = 504 if exc.reason == "deadline" else 499
+    return JSONResponse(status_code=status_code, content={"detail": str(exc)})
+
+def get_workspace(
+    current_user: Optional[Dict[str, Any]] = Depends(get_optional_user),
+    workspace_id: Optional[str] = Header(None, alias="X-Workspace-Id")
+) -> ApplicationState:
+    """
+    Resolve the workspace holding the caller's data source.
+    
+    Signed-in users get their own workspace (or one per X-Workspace-Id, up
+    to WORKSPACE_MAX_PER_USER); unauthenticated requests share the
+    anonymous workspace.
+    
+    """
+    try:
+        workspace = workspaces.get(workspace_key(current_user, workspace_id), workspace_owner(current_user))
+    except WorkspaceLimitError as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "5"})
+    
+    # Pick up changes made through other workers
+    version = workspace.version
+    workspace.sync()
+    if workspace.version != version:
+        workspaces.enforce_limits(keep=workspace.key)
+    return workspace
 
 class QueryRequest(BaseModel):
     """
@@ -112,6 +214,7 @@ class QueryResponse(BaseModel):
     returned_rows: Optional[int] = None
     page: Optional[int] = None
     has_more: Optional[bool] = None
+    job_id: Optional[str] = None
 
 class DBCredentials(BaseModel):
     """
@@ -133,28 +236,29 @@ class DBCredentials(BaseModel):
 # DATABASE CONNECTION ENDPOINTS
 
 @app.post("/connect-db")
-async def connect_database(credentials: DBCredentials):
+async def connect_database(credentials: DBCredentials, workspace: ApplicationState = Depends(get_workspace)):
     """
     Establish connection to the database and load schema information.
     
     """
     try:
-        print(f"Attempting to connect to {credentials.type} database at {credentials.url}")
         
         # Configure and establish database connection
-        app_state.db_engine = configure_db(
-            db_type=credentials.type, 
-            host=credentials.url,
-            user=credentials.username,
-            password=credentials.password,
-            database=credentials.name
-        )
+        database_params = {
+            "db_type": credentials.type,
+            "host": credentials.url,
+            "user": credentials.username,
+            "password": credentials.password,
+            "database": credentials.name
+        }
+        workspace.set_database_engine(configure_db(**database_params), database_params)
         
         # Extract database schema and format for LLM context
-        schema = get_database_schema(app_state.db_engine)
-        app_state.schema_prompt = format_schema_for_prompt(schema)
+        schema = get_database_schema(workspace.db_engine)
+        workspace.schema_prompt = format_schema_for_prompt(schema)
+        workspace.publish()
 
-        print("Connected to database and schema loaded successfully.")
+        log.info("schema_loaded", workspace=workspace.key, db_type=credentials.type)
         return {"message": "Connected to database and schema loaded successfully."}
         
     except Exception as e:
@@ -164,14 +268,15 @@ async def connect_database(credentials: DBCredentials):
 
 
 @app.post("/disconnect-db")
-async def disconnect_database():
+async def disconnect_database(workspace: ApplicationState = Depends(get_workspace)):
     """
     Disconnect from the current database and clear schema information.
     
     """
-    app_state.reset_database_connection()
+    workspace.reset_database_connection()
+    workspace.publish()
     
-    print("Disconnected from database.")
+    log.info("database_disconnected", workspace=workspace.key)
     return {"message": "Disconnected from database successfully."}
 
 # APPLICATION LIFECYCLE EVENTS
@@ -184,247 +289,607 @@ async def startup_event():
     This function is called when the FastAPI application starts.
     It initializes the server and logs the startup status.
     """
-    print("Data Analytics Chatbot API Server started successfully!")
-    print("Server is ready to accept database connections...")
-    print("API documentation available at: /docs")
+    # Create the users table and other application tables if missing
+    init_database()
+    
+    # Export job artifacts from a previous process can no longer be tracked
+    export_job_manager.reset_storage()
+    asyncio.create_task(run_cleanup_loop())
+    asyncio.create_task(evict_idle_workspaces())
+    asyncio.create_task(run_maintenance_loop())
+    asyncio.create_task(migrate_chat_history())
+    asyncio.create_task(run_view_count_flush_loop())
+    asyncio.create_task(run_loop_lag_monitor())
+    # pandas, DuckDB and the other heavy modules load in the background once serving
+    asyncio.create_task(run_import_warmup())
+    # Reconnect and reload the workspaces that were live before the restart
+    asyncio.create_task(warm_start.run())
+    
+    # Spawn the bcrypt workers before the first login arrives
+    password_hasher.start()
+    
+    log.info("server_started", docs="/docs", metrics="/metrics")
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """
+    Application shutdown event handler.
+    
+    """
+    password_hasher.shutdown()
+    
+    # Write dashboard views counted since the last flush
+    try:
+        view_counter.flush()
+    except Exception as e:
+        log_error(e, "Dashboard view count flush")
+    
+    # Write captured requests still queued
+    workload_capture.flush()
+    
+    await close_llm_client()
+    
+    # Record the live workspaces for the next start
+    try:
+        warm_start.save()
+    except Exception as e:
+        log_error(e, "Warm start manifest save")
+
+async def migrate_chat_history():
+    """
+    Move chat sessions still stored as one JSON blob into the messages table.
+    
+    """
+    try:
+        migrated = await asyncio.to_thread(chat_service.migrate_legacy_sessions)
+    except Exception as e:
+        log_error(e, "Chat history migration")
+        return
+    if migrated:
+        log.info("chat_history_migrated", sessions=migrated)
+
+async def evict_idle_workspaces(interval_seconds: int = 60):
+    """
+    Periodically close workspaces nobody has used within the idle timeout.
+    
+    """
+    while True:
+        await asyncio.sleep(interval_seconds)
+        evicted = workspaces.evict_idle()
+        if evicted:
+            log.info("idle_workspaces_evicted", count=evicted)
 
 # MAIN QUERY PROCESSING ENDPOINT
 
+# LLM calls made by each /ask: the SQL, the summary and the title. The SQL
+# call is only made, and charged, when the question isn't in the SQL cache
+LLM_CALLS_PER_QUERY = 3
+
 @app.post("/ask", response_model=QueryResponse)
-async def process_natural_language_query(request: QueryRequest):
+async def process_natural_language_query(
+    request: QueryRequest,
+    http_request: Request,
+    current_user: Optional[Dict[str, Any]] = Depends(get_optional_user),
+    workspace: ApplicationState = Depends(get_workspace),
+    client: str = Depends(rate_limited(ask_limiter)),
+    profile: Optional[RequestProfile] = Depends(profiled())
+):
     """
     Process a natural language query and return structured results.
     
     This endpoint handles both database and CSV queries based on current mode.
+    Queries the planner expects to be too expensive are capped, refused or
+    handed to a background export job, depending on COST_GUARD_ACTION.
+    Queries and LLM calls run under a deadline and are cancelled when the
+    client disconnects.
     
     """
-    with Timer() as timer:
-        try:
-            # Extract and validate the user query
-            user_query = validate_query_input(request.query)
+    enforce(llm_call_budget, client, LLM_CALLS_PER_QUERY - 1)
+    enforce_available(db_time_budget, client)
+    
+    # Held so eviction and syncs leave the engines alone while queries run
+    async with request_deadline(http_request):
+        with workspace.hold(), Timer() as timer:
+            original_sql = None
+            cursor = None
+            try:
+                # Extract and validate the user query
+                user_query = validate_query_input(request.query)
                 
-            # Extract pagination parameters
-            limit, offset = calculate_pagination(request.page, request.limit)
-            page = request.page
+                # Extract pagination parameters
+                limit, offset = calculate_pagination(request.page, request.limit)
+                page = request.page
                 
-            print(f"1. Received query: {user_query} (limit: {limit}, page: {page})")
-            print(f"   Mode: {'CSV' if app_state.is_csv_mode else 'Database'}")
+                log.info("query_received", query=user_query, limit=limit, page=page,
+                         mode="csv" if workspace.is_csv_mode else "database")
 
-            # Check if we have a data source
-            if app_state.is_csv_mode and not app_state.csv_engine:
-                raise ValueError("No CSV data uploaded")
-            elif not app_state.is_csv_mode and not app_state.db_engine:
-                raise ValueError("No database connection established")
+                # Check if we have a data source
+                if workspace.is_csv_mode and not workspace.csv_engine:
+                    raise ValueError("No CSV data uploaded")
+                elif not workspace.is_csv_mode and not workspace.db_engine:
+                    raise ValueError("No database connection established")
+                
+                # A DuckDB cursor of its own, so a cancel interrupts only this request
+                if workspace.is_csv_mode:
+                    cursor = workspace.csv_cursor()
+                engine = cursor if cursor is not None else workspace.db_engine
 
-            # Step 1: Generate SQL query using LLM
-            print("2. Generating SQL query using LLM...")
-            
-            # Use appropriate system prompt based on mode
-            current_system_prompt = CSV_SYSTEM_PROMPT if app_state.is_csv_mode else MYSQL_SYSTEM_PROMPT
-            
-            llm_response = query_llm(
-                user_prompt=user_query, 
-                system_prompt=current_system_prompt, 
-                schema_prompt=app_state.schema_prompt, 
-                llm_api_url=LLM_API_URL, 
-                llm_api_key=LLM_API_KEY
-            )
-            
-            # Clean the SQL query
-            original_sql = extract_sql_query(llm_response)
-            print(f"3. Generated SQL: {original_sql}")
-
-            # Step 2: Validate SQL query syntax and safety
-            if not is_valid_sql(original_sql):
-                raise ValueError("Generated SQL query is invalid or unsafe")
-
-            # Step 3: Get total count and execute paginated query
-            total_rows = get_total_row_count(
-                original_sql, 
-                app_state.csv_engine if app_state.is_csv_mode else app_state.db_engine,
-                app_state.is_csv_mode
-            )
+                # Step 1: Generate SQL query using LLM, unless this question was
+                # already answered for the same schema
+                original_sql = sql_cache.lookup(workspace.schema_prompt, workspace.is_csv_mode, user_query)
+                sql_cached = original_sql is not None
+                if not sql_cached:
+                    llm_call_budget.record(client)
+                    
+                    # Use appropriate system prompt based on mode
+                    current_system_prompt = CSV_SYSTEM_PROMPT if workspace.is_csv_mode else MYSQL_SYSTEM_PROMPT
+                
+                    llm_response = await query_llm(
+                        user_prompt=user_query, 
+                        system_prompt=current_system_prompt, 
+                        schema_prompt=workspace.schema_prompt, 
+                        llm_api_url=LLM_API_URL, 
+                        llm_api_key=LLM_API_KEY
+                    )
+                
+                    # Clean the SQL query
+                    original_sql = extract_sql_query(llm_response)
+                log.debug("sql_generated", sql=original_sql, cached=sql_cached)
+
+                # Step 2: Validate SQL query syntax and safety
+                if not is_valid_sql(original_sql):
+                    raise ValueError("Generated SQL query is invalid or unsafe")
+
+                # Step 3: Check the planner's estimate before running anything
+                guard_action, sql_query, cost_estimate = await asyncio.to_thread(
+                    profiled_call(profile, cost_guard.check),
+                    original_sql,
+                    engine,
+                    workspace.is_csv_mode,
+                    workspace.schema_prompt,
+                    background=True
+                )
+                if guard_action == "background":
+                    export_format = resolve_export_format(None, current_user)
+                    job = export_job_manager.submit(
+                        lambda progress: open_export_stream(workspace, original_sql, export_format, client, progress),
+                        export_format,
+                        f"query_results.{EXPORT_FORMATS[export_format][1]}",
+                        owner=workspace.key
+                    )
+                    log.info("query_sent_to_background", job_id=job.id, estimated_rows=cost_estimate.rows)
+                    return QueryResponse(
+                        response=(f"This query is expected to return {cost_estimate.describe()}, so it is running "
+                                  f"as a background export. Poll /export-jobs/{job.id} for progress."),
+                        sql_query=original_sql,
+                        execution_time=timer.elapsed_time,
+                        job_id=job.id
+                    )
+
+                # Step 4: Get total count and execute paginated query
+                db_started = time.perf_counter()
+                with stage("count"):
+                    total_rows = await asyncio.to_thread(
+                        profiled_call(profile, get_total_row_count),
+                        sql_query, 
+                        engine,
+                        workspace.is_csv_mode
+                    )
             
-            result_dataframe = execute_paginated_query(
-                original_sql,
-                limit,
-                offset,
-                app_state.csv_engine if app_state.is_csv_mode else app_state.db_engine,
-                app_state.is_csv_mode
-            )
+                with stage("page"):
+                    result_dataframe = await asyncio.to_thread(
+                        profiled_call(profile, execute_paginated_query),
+                        sql_query,
+                        limit,
+                        offset,
+                        engine,
+                        workspace.is_csv_mode
+                    )
+                if not sql_cached:
+                    # The generated SQL, so a later guard decision can differ
+                    sql_cache.store(workspace.schema_prompt, workspace.is_csv_mode, user_query, original_sql)
             
-            # Convert dataframe to JSON-serializable format
-            query_results = result_dataframe.to_dict(orient='records')
-            returned_rows = len(query_results)
-            has_more = offset + returned_rows < total_rows
+                # Convert dataframe to JSON-serializable format
+                with stage("serialize"):
+                    query_results = result_dataframe.to_dict(orient='records')
+                returned_rows = len(query_results)
+                has_more = offset + returned_rows < total_rows
             
-            print(f"4. Query returned {returned_rows} rows (page {page} of {total_rows} total)")
+                # Profile the columns once for both charting and the summary
+                with stage("profile"):
+                    column_profile = profile_columns(result_dataframe)
 
-            # Step 4: Generate automatic visualization using sample data for large datasets
-            visualization_json = None
-            if not result_dataframe.empty:
-                print("5. Generating automatic visualization...")
-                viz_data = prepare_visualization_data(result_dataframe)
-                visualization_json = generate_auto_chart(viz_data)
+                # Step 5: Generate automatic visualization aggregated over the full result
+                visualization_json = None
+                if not result_dataframe.empty:
+                    with stage("chart"):
+                        viz_data, chart_plan = await asyncio.to_thread(
+                            profiled_call(profile, prepare_visualization_data),
+                            sql_query,
+                            engine,
+                            workspace.is_csv_mode,
+                            result_dataframe,
+                            total_rows,
+                            column_profile
+                        )
+                        visualization_json = generate_auto_chart(viz_data, chart_plan)
+                charge_db_time(client, db_started)
 
-            # Step 5: Generate AI-powered summary and title using sample data
-            print("6. Generating AI summary and title...")
+                # Step 6: Generate AI-powered summary and title using sample data
+                summary_data = prepare_summary_data(query_results)
             
-            summary_data = prepare_summary_data(query_results)
+                # Include pagination info in the summary context
+                summary_context = f"Showing {returned_rows} rows (page {page}) out of {total_rows} total rows."
+                if guard_action == "limit":
+                    summary_context += f" The result was capped at {cost_guard.limit_rows} rows because the full query is too expensive."
+                data_source = "CSV data" if workspace.is_csv_mode else "database"
+                enhanced_query = f"{user_query}\n\nContext: {summary_context} from {data_source}."
+                if column_profile:
+                    enhanced_query += f"\nColumns on this page:\n{describe_profile(column_profile)}"
             
-            # Include pagination info in the summary context
-            summary_context = f"Showing {returned_rows} rows (page {page}) out of {total_rows} total rows."
-            data_source = "CSV data" if app_state.is_csv_mode else "database"
-            enhanced_query = f"{user_query}\n\nContext: {summary_context} from {data_source}."
+                result_summary = await summarize_results(
+                    query=enhanced_query, 
+                    sql_query=original_sql, 
+                    result_data=summary_data, 
+                    llm_api_url=LLM_API_URL, 
+                    llm_api_key=LLM_API_KEY, 
+                    task="summary"
+                )
             
-            result_summary = summarize_results(
-                query=enhanced_query, 
-                sql_query=original_sql, 
-                result_data=summary_data, 
-                llm_api_url=LLM_API_URL, 
-                llm_api_key=LLM_API_KEY, 
-                task="summary"
-            )
-            
-            result_title = summarize_results(
-                query=user_query, 
-                sql_query=original_sql, 
-                result_data=summary_data, 
-                llm_api_url=LLM_API_URL, 
-                llm_api_key=LLM_API_KEY, 
-                task="title"
-            )
-
-            print(f"Query processed successfully in {timer.elapsed_time}s")
-            print(f"Summary: {result_summary}")
-            print(f"Title: {result_title}")
-
-            # Create response message
-            response_msg = create_response_message(
-                total_rows, returned_rows, page, limit, app_state.is_csv_mode
-            )
-
-            # Return comprehensive response
-            return QueryResponse(
-                response=response_msg,
-                sql_query=original_sql,
-                execution_time=timer.elapsed_time,
-                visualization=visualization_json,
-                data=query_results,
-                summary=result_summary,
-                title=result_title,
-                total_rows=total_rows,
-                returned_rows=returned_rows,
-                page=page,
-                has_more=has_more
-            )
+                result_title = await summarize_results(
+                    query=user_query, 
+                    sql_query=original_sql, 
+                    result_data=summary_data, 
+                    llm_api_url=LLM_API_URL, 
+                    llm_api_key=LLM_API_KEY, 
+                    task="title"
+                )
+
+                log.info("query_completed", seconds=timer.elapsed_time, rows=returned_rows, total_rows=total_rows)
+                if workload_capture.sampled():
+                    workload_capture.record("ask", workspace, sql_query, user_query, page=page, limit=limit,
+                                            total_rows=total_rows, returned_rows=returned_rows,
+                                            columns=len(result_dataframe.columns))
+
+                # Create response message
+                response_msg = create_response_message(
+                    total_rows, returned_rows, page, limit, workspace.is_csv_mode
+                )
+                if guard_action == "limit":
+                    response_msg += (f" Results are capped at {cost_guard.limit_rows} rows: the full query "
+                                     f"is expected to return {cost_estimate.describe()}; use /export-jobs for all of it.")
+
+                # Return comprehensive response
+                return QueryResponse(
+                    response=response_msg,
+                    sql_query=sql_query,
+                    execution_time=timer.elapsed_time,
+                    visualization=visualization_json,
+                    data=query_results,
+                    summary=result_summary,
+                    title=result_title,
+                    total_rows=total_rows,
+                    returned_rows=returned_rows,
+                    page=page,
+                    has_more=has_more
+                )
             
-        except Exception as e:
-            # Log detailed error information for debugging
-            log_error(e, f"Query processing after {timer.elapsed_time}s")
+            except QueryTooExpensiveError as e:
+                if workload_capture.sampled():
+                    workload_capture.record("ask", workspace, original_sql, request.query, error=e,
+                                            page=request.page, limit=request.limit)
+                raise HTTPException(status_code=422, detail=str(e))
+            except ExportQueueFullError as e:
+                raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "30"})
+            except RequestCancelledError:
+                raise
+            except Exception as e:
+                # Log detailed error information for debugging
+                log_error(e, f"Query processing after {timer.elapsed_time}s")
+                if workload_capture.sampled():
+                    workload_capture.record("ask", workspace, original_sql, request.query, error=e,
+                                            page=request.page, limit=request.limit)
             
-            # Return user-friendly error response
-            raise HTTPException(
-                status_code=500, 
-                detail=format_error_message(e, "Failed to process query")
-            )
+                # Return user-friendly error response
+                raise HTTPException(
+                    status_code=500, 
+                    detail=format_error_message(e, "Failed to process query")
+                )
+            finally:
+                if cursor is not None:
+                    cursor.close()
 
 # ADDITIONAL DATA RETRIEVAL ENDPOINT
 
 @app.post("/get-more-data")
-async def get_more_data(request: dict):
+async def get_more_data(
+    request: dict,
+    http_request: Request,
+    workspace: ApplicationState = Depends(get_workspace),
+    client: str = Depends(client_key())
+):
     """
     Retrieve additional pages of data for a previously executed query.
     
     This endpoint allows fetching more data from large result sets without
-    re-executing the entire query processing pipeline.
+    re-executing the entire query processing pipeline. Runs under the
+    same deadline and disconnect cancellation as /ask.
 
     """
-    try:
-        sql_query = request.get("sql_query")
-        page = max(request.get("page", 1), 1)
-        limit = min(request.get("limit", 1000), 5000)
-        offset = (page - 1) * limit
+    enforce_available(db_time_budget, client)
+    
+    async with request_deadline(http_request):
+        with workspace.hold():
+            sql_query = request.get("sql_query")
+            cursor = None
+            try:
+                page = max(request.get("page", 1), 1)
+                limit = min(request.get("limit", 1000), 5000)
+                offset = (page - 1) * limit
         
-        if not sql_query:
-            raise ValueError("SQL query is required")
+                if not sql_query:
+                    raise ValueError("SQL query is required")
             
-        # Validate SQL query
-        if not is_valid_sql(sql_query):
-            raise ValueError("Invalid SQL query")
-        
-        # Get total count and execute query
-        total_rows = get_total_row_count(
-            sql_query, 
-            app_state.csv_engine if app_state.is_csv_mode else app_state.db_engine,
-            app_state.is_csv_mode
-        )
+                # Validate SQL query
+                if not is_valid_sql(sql_query):
+                    raise ValueError("Invalid SQL query")
+            
+                if workspace.is_csv_mode and workspace.csv_engine:
+                    cursor = workspace.csv_cursor()
+                engine = cursor if cursor is not None else workspace.db_engine
         
-        result_dataframe = execute_paginated_query(
-            sql_query,
-            limit,
-            offset,
-            app_state.csv_engine if app_state.is_csv_mode else app_state.db_engine,
-            app_state.is_csv_mode
-        )
+                # Pages of a query /ask capped keep the cap; there is no background
+                # job to hand an expensive query to here
+                _, sql_query, _ = await asyncio.to_thread(
+                    cost_guard.check,
+                    sql_query,
+                    engine,
+                    workspace.is_csv_mode,
+                    workspace.schema_prompt
+                )
         
-        query_results = result_dataframe.to_dict(orient='records')
-        returned_rows = len(query_results)
-        has_more = offset + returned_rows < total_rows
+                # Get total count and execute query
+                db_started = time.perf_counter()
+                with stage("count"):
+                    total_rows = await asyncio.to_thread(
+                        get_total_row_count,
+                        sql_query, 
+                        engine,
+                        workspace.is_csv_mode
+                    )
         
-        return {
-            "data": query_results,
-            "total_rows": total_rows,
-            "returned_rows": returned_rows,
-            "page": page,
-            "has_more": has_more,
-            "message": f"Retrieved {returned_rows} rows from page {page}"
-        }
+                with stage("page"):
+                    result_dataframe = await asyncio.to_thread(
+                        execute_paginated_query,
+                        sql_query,
+                        limit,
+                        offset,
+                        engine,
+                        workspace.is_csv_mode
+                    )
         
-    except Exception as e:
-        log_error(e, "Additional data retrieval")
-        raise HTTPException(status_code=500, detail=format_error_message(e, "Failed to retrieve data"))
+                charge_db_time(client, db_started)
+        
+                with stage("serialize"):
+                    query_results = result_dataframe.to_dict(orient='records')
+                returned_rows = len(query_results)
+                has_more = offset + returned_rows < total_rows
+        
+                if workload_capture.sampled():
+                    workload_capture.record("page", workspace, sql_query, page=page, limit=limit,
+                                            total_rows=total_rows, returned_rows=returned_rows,
+                                            columns=len(result_dataframe.columns))
+        
+                return {
+                    "data": query_results,
+                    "total_rows": total_rows,
+                    "returned_rows": returned_rows,
+                    "page": page,
+                    "has_more": has_more,
+                    "message": f"Retrieved {returned_rows} rows from page {page}"
+                }
+        
+            except QueryTooExpensiveError as e:
+                raise HTTPException(status_code=422, detail=str(e))
+            except RequestCancelledError:
+                raise
+            except Exception as e:
+                log_error(e, "Additional data retrieval")
+                if workload_capture.sampled():
+                    workload_capture.record("page", workspace, sql_query, error=e,
+                                            page=request.get("page"), limit=request.get("limit"))
+                raise HTTPException(status_code=500, detail=format_error_message(e, "Failed to retrieve data"))
+            finally:
+                if cursor is not None:
+                    cursor.close()
 
 # CSV UPLOAD AND EXPORT ENDPOINTS
 
 @app.post("/upload-csv")
-async def upload_csv_file(file: UploadFile = File(...)):
+async def upload_csv_file(
+    file: UploadFile = File(...),
+    workspace: ApplicationState = Depends(get_workspace),
+    client: str = Depends(rate_limited(upload_limiter)),
+    profile: Optional[RequestProfile] = Depends(profiled())
+):
     try:
         # Validate file type
         if not validate_file_upload(file.filename, "csv"):
             raise ValueError("Only CSV files are supported")
         
-        print(f"Uploading CSV file: {file.filename}")
-        
         # Read and process CSV content
-        content = await file.read()
-        table_name, csv_data, metadata = process_csv_upload(content, file.filename)
+        with stage("csv_read"):
+            content = await file.read()
+        with stage("csv_parse"):
+            table_name, csv_data, metadata = process_csv_upload(content, file.filename)
         
-        # Store the DataFrame
-        app_state.uploaded_csvs[table_name] = csv_data
+        # Store the DataFrame, counting it against the workspace memory limits
+        with stage("csv_store"):
+            workspace.add_csv_table(table_name, csv_data)
+            workspaces.enforce_limits(keep=workspace.key)
         
         # Setup CSV engine
-        app_state.csv_engine = setup_csv_engine(app_state.uploaded_csvs)
+        with stage("csv_engine"):
+            workspace.close_csv_engine()
+            workspace.csv_engine = setup_csv_engine(workspace.uploaded_csvs)
         
         # Generate schema and set CSV mode
-        schema_prompt = generate_csv_schema(app_state.uploaded_csvs)
-        app_state.set_csv_mode(app_state.uploaded_csvs, schema_prompt)
+        with stage("csv_schema"):
+            schema_prompt = generate_csv_schema(workspace.uploaded_csvs)
+            workspace.set_csv_mode(workspace.uploaded_csvs, schema_prompt)
+            workspace.publish()
         
-        print(f"Generated schema prompt:\n{schema_prompt}")
-        print(f"Successfully uploaded CSV: {file.filename} as table '{table_name}'")
-        print(f"Table has {len(csv_data)} rows and {len(csv_data.columns)} columns")
+        csv_upload_bytes.inc(len(content))
+        csv_upload_rows.inc(len(csv_data))
+        log.info("csv_uploaded", filename=file.filename, table=table_name,
+                 rows=len(csv_data), columns=len(csv_data.columns), bytes=len(content))
+        log.debug("csv_schema", schema=schema_prompt)
         
         return {
             "message": f"CSV file uploaded successfully as table '{table_name}'",
             **metadata
         }
         
+    except WorkspaceMemoryError as e:
+        raise HTTPException(status_code=413, detail=str(e))
     except Exception as e:
         log_error(e, "CSV upload")
         raise HTTPException(status_code=500, detail=format_error_message(e, "Failed to upload CSV"))
 
+def get_export_source(workspace: ApplicationState):
+    """
+    Pick the engine exports read from in the workspace's current mode.
+    
+    """
+    if workspace.is_csv_mode and workspace.csv_engine:
+        # A dedicated DuckDB cursor so other queries can run meanwhile
+        return workspace.csv_cursor(), True
+    
+    # The database is read through a server-side cursor
+    if not workspace.db_engine:
+        raise ValueError("No database connection available")
+    return workspace.db_engine, False
+
+def open_export_stream(workspace: ApplicationState, sql_query: str, export_format: str, client: str, progress=None):
+    """
+    Start streaming the results of a query in the given export format.
+    Blocking: DuckDB COPY runs to completion before this returns, so call
+    it from a worker thread.
+    
+    The workspace is held from before the export starts until the stream
+    is closed, so it is not evicted while its engine is still being read.
+    
+    """
+    held = HeldExportStream(workspace, sql_query, export_format, client, progress or ExportProgress())
+    try:
+        engine, is_csv = get_export_source(workspace)
+        held.open(stream_export(sql_query, engine, is_csv=is_csv, export_format=export_format,
+                                progress=held.progress), is_csv)
+    except BaseException:
+        held.close()
+        raise
+    return held
+
+class HeldExportStream:
+    """
+    An export stream holding its workspace until close(), which also
+    charges the time spent to the client's database time budget and
+    records the export's statistics. close() is safe to call more than
+    once, and releases everything even if the stream was never read.
+    """
+    
+    def __init__(self, workspace: ApplicationState, sql_query: str, export_format: str, client: str,
+                 progress: ExportProgress):
+        self.workspace = workspace
+        self.sql_query = sql_query
+        self.export_format = export_format
+        self.client = client
+        self.progress = progress
+        self.stream = None
+        self.is_csv = False
+        self.bytes_written = 0
+        self.error: Optional[BaseException] = None
+        # Taken before the stream opens, as DuckDB COPY runs eagerly
+        self.started = time.perf_counter()
+        self.held = workspace.hold()
+        self.held.__enter__()
+        self.closed = False
+    
+    def open(self, stream, is_csv: bool):
+        self.stream = stream
+        self.is_csv = is_csv
+    
+    def __iter__(self):
+        return self
+    
+    def __next__(self) -> bytes:
+        try:
+            chunk = next(self.stream)
+        except StopIteration:
+            self.close()
+            raise
+        except Exception as e:
+            self.error = e
+            self.close()
+            raise
+        self.bytes_written += len(chunk)
+        return chunk
+    
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            if self.stream is not None:
+                self.stream.close()
+        finally:
+            self.held.__exit__(None, None, None)
+            if self.stream is not None:
+                self._record()
+    
+    def _record(self):
+        charge_db_time(self.client, self.started)
+        elapsed = time.perf_counter() - self.started
+        rows = self.progress.rows_written
+        query_stats.record(self.sql_query, elapsed, rows, query_mode(self.is_csv),
+                           f"export_{self.export_format}", error=self.error)
+        if workload_capture.sampled():
+            workload_capture.record("export", self.workspace, self.sql_query, error=self.error,
+                                    format=self.export_format, seconds=round(elapsed, 4),
+                                    returned_rows=rows, bytes=self.bytes_written)
+        export_seconds.observe(elapsed, format=self.export_format)
+        export_rows.inc(rows, format=self.export_format)
+        export_bytes.inc(self.bytes_written, format=self.export_format)
+
+class ExportResponse(StreamingResponse):
+    """
+    Streams a held export, closing it however the response ends: after
+    the last chunk, when the client disconnects, or if the body is never
+    sent at all. A BackgroundTask is not enough, as Starlette skips it
+    when the client disconnects.
+    """
+    
+    def __init__(self, export: HeldExportStream, profile: Optional[RequestProfile] = None, **kwargs):
+        # The stream is pulled from the threadpool after the endpoint returns
+        super().__init__(profile.wrap_stream(export) if profile is not None else export, **kwargs)
+        self.export = export
+    
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            with anyio.CancelScope(shield=True):
+                await run_in_threadpool(self.export.close)
+
 @app.post("/export-csv")
-async def export_query_results(request: dict):
+async def export_query_results(
+    request: dict,
+    workspace: ApplicationState = Depends(get_workspace),
+    client: str = Depends(rate_limited(export_limiter)),
+    profile: Optional[RequestProfile] = Depends(profiled())
+):
+    enforce_available(db_time_budget, client)
+    
     try:
         sql_query = request.get("sql_query", "")
         filename = request.get("filename", "query_results.csv")
@@ -432,54 +897,207 @@ async def export_query_results(request: dict):
         if not sql_query:
             raise ValueError("No SQL query provided for export")
         
-        print(f"Exporting query results to CSV: {filename}")
-        
-        # Execute query based on current mode
-        if app_state.is_csv_mode and app_state.csv_engine:
-            # Query CSV data using DuckDB
-            result_df = app_state.csv_engine.execute(sql_query).fetchdf()
-        else:
-            # Query database
-            if not app_state.db_engine:
-                raise ValueError("No database connection available")
-            result_df = execute_query(sql_query, app_state.db_engine)
+        log.info("export_started", format="csv", filename=filename)
         
-        # Export to CSV
-        csv_content, headers = export_to_csv(result_df, filename)
+        # Opening the stream can run the whole DuckDB COPY, so keep it off the loop
+        export = await asyncio.to_thread(profiled_call(profile, open_export_stream), workspace, sql_query, "csv", client)
         
-        print(f"Successfully exported {len(result_df)} rows to CSV")
-        
-        return StreamingResponse(
-            io.StringIO(csv_content), 
+        return ExportResponse(
+            export,
+            profile,
             media_type="text/csv",
-            headers=headers
+            headers=export_headers(filename)
         )
         
     except Exception as e:
         log_error(e, "CSV export")
         raise HTTPException(status_code=500, detail=format_error_message(e, "Failed to export CSV"))
 
+@app.post("/export")
+async def export_query_results_as(
+    request: dict,
+    current_user: Optional[Dict[str, Any]] = Depends(get_optional_user),
+    workspace: ApplicationState = Depends(get_workspace),
+    client: str = Depends(rate_limited(export_limiter)),
+    profile: Optional[RequestProfile] = Depends(profiled())
+):
+    """
+    Export query results as CSV, gzip-CSV, JSONL, Parquet or Arrow IPC.
+    
+    The format comes from the request's "format" field, then the user's
+    export_format preference, and defaults to CSV.
+    
+    """
+    enforce_available(db_time_budget, client)
+    
+    try:
+        sql_query = request.get("sql_query", "")
+        
+        if not sql_query:
+            raise ValueError("No SQL query provided for export")
+        
+        export_format = resolve_export_format(request.get("format"), current_user)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=format_error_message(e, "Failed to export results"))
+    
+    try:
+        media_type, extension = EXPORT_FORMATS[export_format]
+        filename = request.get("filename") or f"query_results.{extension}"
+        
+        log.info("export_started", format=export_format, filename=filename)
+        
+        export = await asyncio.to_thread(
+            profiled_call(profile, open_export_stream), workspace, sql_query, export_format, client
+        )
+        return ExportResponse(
+            export,
+            profile,
+            media_type=media_type,
+            headers=export_headers(filename)
+        )
+        
+    except Exception as e:
+        log_error(e, f"{export_format} export")
+        raise HTTPException(status_code=500, detail=format_error_message(e, "Failed to export results"))
+
+# BACKGROUND EXPORT JOB ENDPOINTS
+
+@app.post("/export-jobs", status_code=202)
+async def submit_export_job(
+    request: dict,
+    current_user: Optional[Dict[str, Any]] = Depends(get_optional_user),
+    workspace: ApplicationState = Depends(get_workspace),
+    client: str = Depends(rate_limited(export_limiter))
+):
+    """
+    Start a background export and return its job id.
+    
+    Takes the same body as /export. Poll /export-jobs/{job_id} for progress
+    and fetch the file from /export-jobs/{job_id}/download once completed.
+    
+    """
+    enforce_available(db_time_budget, client)
+    
+    try:
+        sql_query = request.get("sql_query", "")
+        
+        if not sql_query:
+            raise ValueError("No SQL query provided for export")
+        
+        export_format = resolve_export_format(request.get("format"), current_user)
+        filename = request.get("filename") or f"query_results.{EXPORT_FORMATS[export_format][1]}"
+        if workspace.query_engine is None:
+            raise ValueError("No data source available to export from")
+        
+        job = export_job_manager.submit(
+            lambda progress: open_export_stream(workspace, sql_query, export_format, client, progress),
+            export_format,
+            filename,
+            owner=workspace.key
+        )
+        
+        log.info("export_job_queued", job_id=job.id, format=export_format, filename=filename)
+        return job.to_dict()
+        
+    except ExportQueueFullError as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "30"})
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=format_error_message(e, "Failed to start export"))
+
+def export_job_owner(
+    current_user: Optional[Dict[str, Any]] = Depends(get_optional_user),
+    workspace_id: Optional[str] = Header(None, alias="X-Workspace-Id")
+) -> str:
+    """
+    Jobs belong to the workspace that started them, keyed without loading
+    the workspace itself.
+    
+    """
+    return workspace_key(current_user, workspace_id)
+
+@app.get("/export-jobs")
+async def list_export_jobs(owner: str = Depends(export_job_owner)):
+    return {"jobs": [job.to_dict() for job in export_job_manager.list_jobs(owner)]}
+
+@app.get("/export-jobs/{job_id}")
+async def get_export_job(job_id: str, owner: str = Depends(export_job_owner)):
+    job = export_job_manager.get(job_id, owner)
+    if not job:
+        raise HTTPException(status_code=404, detail="Export job not found")
+    return job.to_dict()
+
+@app.delete("/export-jobs/{job_id}")
+async def cancel_export_job(job_id: str, owner: str = Depends(export_job_owner)):
+    if not export_job_manager.cancel(job_id, owner):
+        raise HTTPException(status_code=404, detail="Export job not found")
+    return {"message": "Export job cancelled", "job_id": job_id}
+
+@app.get("/export-jobs/{job_id}/download")
+async def download_export_job(
+    job_id: str,
+    range_header: Optional[str] = Header(None, alias="Range"),
+    owner: str = Depends(export_job_owner)
+):
+    """
+    Download a finished export. Supports single byte ranges so interrupted
+    downloads can be resumed.
+    
+    """
+    job = export_job_manager.get(job_id, owner)
+    if not job:
+        raise HTTPException(status_code=404, detail="Export job not found")
+    if job.status != "completed":
+        raise HTTPException(status_code=409, detail=f"Export job is {job.status}")
+    
+    try:
+        file_size = os.path.getsize(job.path)
+    except FileNotFoundError:
+        # Cleaned up by another worker after the job record was read
+        raise HTTPException(status_code=410, detail="Export job has expired")
+    try:
+        byte_range = parse_range_header(range_header, file_size)
+    except ValueError as e:
+        raise HTTPException(status_code=416, detail=str(e), headers={"Content-Range": f"bytes */{file_size}"})
+    
+    headers = {**export_headers(job.filename), "Accept-Ranges": "bytes"}
+    if byte_range:
+        start, end = byte_range
+        status_code = 206
+        headers["Content-Range"] = f"bytes {start}-{end}/{file_size}"
+    else:
+        start, end = 0, file_size - 1
+        status_code = 200
+    headers["Content-Length"] = str(end - start + 1)
+    
+    return StreamingResponse(
+        iter_file_range(job.path, start, end),
+        status_code=status_code,
+        media_type=EXPORT_FORMATS[job.export_format][0],
+        headers=headers
+    )
+
 @app.get("/csv-status")
-async def get_csv_status():
+async def get_csv_status(workspace: ApplicationState = Depends(get_workspace)):
     return {
-        "is_csv_mode": app_state.is_csv_mode,
-        "tables_count": len(app_state.uploaded_csvs),
-        "schema_prompt": app_state.schema_prompt,
+        "is_csv_mode": workspace.is_csv_mode,
+        "tables_count": len(workspace.uploaded_csvs),
+        "schema_prompt": workspace.schema_prompt,
         "tables": [
             {
                 "name": name,
                 "rows": len(df),
                 "columns": list(df.columns)
             }
-            for name, df in app_state.uploaded_csvs.items()
-        ] if app_state.uploaded_csvs else []
+            for name, df in workspace.uploaded_csvs.items()
+        ] if workspace.uploaded_csvs else []
     }
 
 @app.post("/clear-csv")
-async def clear_csv_data():
-    app_state.reset_csv_state()
+async def clear_csv_data(workspace: ApplicationState = Depends(get_workspace)):
+    workspace.reset_csv_state()
+    workspace.publish(removed_tables=True)
     
-    print("Cleared all CSV data - back to database mode")
+    log.info("csv_cleared", workspace=workspace.key)
     
     return {
         "message": "CSV data cleared successfully",
@@ -499,17 +1117,51 @@ async def root():
     }
 
 @app.get("/health")
-async def health_check():
-    import time
+async def health_check(workspace: ApplicationState = Depends(get_workspace)):
     return {
         "status": "healthy",
         "timestamp": time.time(),
-        "database_connected": app_state.db_engine is not None,
-        "schema_loaded": bool(app_state.schema_prompt),
-        "csv_mode": app_state.is_csv_mode,
+        "database_connected": workspace.db_engine is not None,
+        "schema_loaded": bool(workspace.schema_prompt),
+        "csv_mode": workspace.is_csv_mode,
+        "workspace": workspace.stats(),
+        "workspaces": workspaces.stats(),
+        "maintenance": maintenance.stats(),
+        "workload_capture": workload_capture.stats(),
+        "warm_start": warm_start.stats(),
+        "cost_guard": cost_guard.stats(),
         "version": "1.3.0"
     }
 
+# METRICS
+
+def pool_connections() -> Dict[tuple, float]:
+    """Checked-out connections of the auth pool and the workspace pools"""
+    in_use = {("auth",): auth_engine.pool.checkedout() if hasattr(auth_engine.pool, "checkedout") else 0}
+    workspace_in_use = 0
+    for workspace in list(workspaces.workspaces.values()):
+        pool = getattr(workspace.db_engine, "pool", None)
+        if pool is not None and hasattr(pool, "checkedout"):
+            workspace_in_use += pool.checkedout()
+    in_use[("workspace",)] = workspace_in_use
+    return in_use
+
+Gauge("queryous_db_connections_in_use", "Database connections checked out of the pools", ("pool",),
+      collect=pool_connections)
+Gauge("queryous_workspaces_live", "Workspaces held in memory",
+      collect=lambda: {(): workspaces.stats()["live_workspaces"]})
+Gauge("queryous_workspace_memory_bytes", "Memory held by uploaded CSV data",
+      collect=lambda: {(): workspaces.stats()["memory_bytes"]})
+Gauge("queryous_export_jobs_active", "Export jobs queued or running",
+      collect=lambda: {(): sum(1 for job in list(export_job_manager.jobs.values()) if not job.is_finished)})
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics(authorization: Optional[str] = Header(None)):
+    """Prometheus metrics for this worker process"""
+    if METRICS_TOKEN and authorization != f"Bearer {METRICS_TOKEN}":
+        raise HTTPException(status_code=401, detail="Invalid metrics token")
+    return Response(render_metrics(), media_type="text/plain; version=0.0.4")
+
 # APPLICATION ENTRY POINT
 
 if __name__ == "__main__":
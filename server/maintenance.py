@@ -0,0 +1,216 @@
+"""
+Database maintenance for the Data Analytics Chatbot API Server
+
+login_attempts and otp_verifications only ever grow, so a background task
+keeps them in check:
+- Expired OTPs and login attempts past their retention are deleted in
+  bounded batches, each in its own short transaction
+- Before rows are deleted they are rolled up into daily totals in
+  auth_event_counts
+- VACUUM/ANALYZE (or the dialect's equivalent) runs after large purges
+- Rows purged per run are reported through stats()
+"""
+
+import asyncio
+import os
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Any, Dict
+
+from sqlalchemy import delete, select, text, update
+
+from init_db import SessionLocal, engine
+from logger import get_logger
+from metrics import maintenance_rows_purged
+from models import AuthEventCount, LoginAttempt, OTPVerification
+from state_backend import state_backend
+from utils import log_error
+
+# CONFIGURATION
+
+MAINTENANCE_INTERVAL_SECONDS = int(os.getenv("MAINTENANCE_INTERVAL_SECONDS", "3600"))
+LOGIN_ATTEMPT_RETENTION_DAYS = int(os.getenv("LOGIN_ATTEMPT_RETENTION_DAYS", "90"))
+# OTPs are kept this long after they expire
+OTP_RETENTION_HOURS = int(os.getenv("OTP_RETENTION_HOURS", "24"))
+MAINTENANCE_BATCH_SIZE = int(os.getenv("MAINTENANCE_BATCH_SIZE", "1000"))
+# Pause between batches so other writers are not starved of locks
+MAINTENANCE_BATCH_PAUSE_SECONDS = float(os.getenv("MAINTENANCE_BATCH_PAUSE_SECONDS", "0.05"))
+# VACUUM rewrites the table (the whole file on SQLite), so only after large purges
+MAINTENANCE_VACUUM_MIN_ROWS = int(os.getenv("MAINTENANCE_VACUUM_MIN_ROWS", "10000"))
+
+PURGED_TABLES = ("login_attempts", "otp_verifications")
+
+log = get_logger("maintenance")
+
+# MAINTENANCE TASK
+
+class MaintenanceTask:
+    """
+    Purges and compacts the authentication audit tables.
+
+    Only one worker runs each pass: the pass is leased through the state
+    backend, which workers share when running several.
+    """
+
+    def __init__(self, session_factory=SessionLocal, db_engine=engine, backend=state_backend,
+                 batch_size: int = MAINTENANCE_BATCH_SIZE):
+        self.session_factory = session_factory
+        self.engine = db_engine
+        self.backend = backend
+        self.batch_size = batch_size
+        self.runs = 0
+        self.last_run = None
+        self.last_duration = None
+        self.last_purged = {table: 0 for table in PURGED_TABLES}
+        self.total_purged = {table: 0 for table in PURGED_TABLES}
+
+    def _add_counts(self, db, counts: Counter):
+        """Add to the daily totals, creating rows for new days"""
+        for (day, event, kind, outcome), count in counts.items():
+            matches = (
+                AuthEventCount.day == day,
+                AuthEventCount.event == event,
+                AuthEventCount.kind == kind,
+                AuthEventCount.outcome == outcome,
+            )
+            result = db.execute(
+                update(AuthEventCount).where(*matches).values(count=AuthEventCount.count + count)
+            )
+            if result.rowcount == 0:
+                db.add(AuthEventCount(day=day, event=event, kind=kind, outcome=outcome, count=count))
+
+    def _purge_batch(self, model, condition, order_column, rollup) -> int:
+        """
+        Roll up and delete one batch of rows, returning how many went.
+
+        If another process deleted some of the rows first, the batch is
+        abandoned so nothing is counted twice.
+
+        """
+        with self.session_factory() as db:
+            rows = db.execute(
+                select(model).where(condition).order_by(order_column).limit(self.batch_size)
+            ).scalars().all()
+            if not rows:
+                return 0
+
+            ids = [row.id for row in rows]
+            deleted = db.execute(delete(model).where(model.id.in_(ids))).rowcount
+            if deleted != len(ids):
+                db.rollback()
+                return 0
+
+            self._add_counts(db, Counter(rollup(row) for row in rows))
+            db.commit()
+            return deleted
+
+    def _purge(self, model, condition, order_column, rollup) -> int:
+        purged = 0
+        while True:
+            batch = self._purge_batch(model, condition, order_column, rollup)
+            purged += batch
+            if batch < self.batch_size:
+                return purged
+            time.sleep(MAINTENANCE_BATCH_PAUSE_SECONDS)
+
+    def purge_login_attempts(self, now: datetime) -> int:
+        cutoff = now - timedelta(days=LOGIN_ATTEMPT_RETENTION_DAYS)
+        return self._purge(
+            LoginAttempt,
+            LoginAttempt.created_at < cutoff,
+            LoginAttempt.created_at,
+            lambda row: (row.created_at.date(), "login", row.method, "success" if row.success else "failure")
+        )
+
+    def purge_otps(self, now: datetime) -> int:
+        cutoff = now - timedelta(hours=OTP_RETENTION_HOURS)
+        return self._purge(
+            OTPVerification,
+            OTPVerification.expires_at < cutoff,
+            OTPVerification.expires_at,
+            lambda row: ((row.created_at or row.expires_at).date(), "otp", row.purpose,
+                         "used" if row.is_used else "unused")
+        )
+
+    def compact(self, purged: Dict[str, int]):
+        """
+        Refresh planner statistics for tables that lost rows, and reclaim
+        space after large purges.
+
+        """
+        dialect = self.engine.dialect.name
+        tables = [table for table, count in purged.items() if count]
+        if not tables:
+            return
+        vacuum = sum(purged.values()) >= MAINTENANCE_VACUUM_MIN_ROWS
+
+        statements = []
+        if dialect == "sqlite":
+            statements = [f"ANALYZE {table}" for table in tables]
+            if vacuum:
+                statements.append("VACUUM")
+        elif dialect == "postgresql":
+            statements = [f"VACUUM (ANALYZE) {table}" if vacuum else f"ANALYZE {table}" for table in tables]
+        elif dialect in ("mysql", "mariadb"):
+            statements = [f"{'OPTIMIZE' if vacuum else 'ANALYZE'} TABLE {table}" for table in tables]
+
+        # VACUUM cannot run inside a transaction
+        with self.engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            for statement in statements:
+                conn.execute(text(statement))
+
+    def run_once(self) -> Dict[str, int]:
+        """
+        Run one maintenance pass if no other worker holds the lease.
+
+        Returns rows purged per table, or an empty dict when skipped.
+
+        """
+        if not self.backend.add("maintenance-lease", os.getpid(), ttl_seconds=MAINTENANCE_INTERVAL_SECONDS):
+            return {}
+
+        started = time.time()
+        now = datetime.utcnow()
+        purged = {
+            "login_attempts": self.purge_login_attempts(now),
+            "otp_verifications": self.purge_otps(now),
+        }
+        self.compact(purged)
+
+        self.runs += 1
+        self.last_run = started
+        self.last_duration = round(time.time() - started, 2)
+        self.last_purged = purged
+        for table, count in purged.items():
+            self.total_purged[table] += count
+        return purged
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "runs": self.runs,
+            "last_run": self.last_run,
+            "last_duration_seconds": self.last_duration,
+            "last_purged": self.last_purged,
+            "total_purged": self.total_purged,
+        }
+
+# Global maintenance task instance
+maintenance = MaintenanceTask()
+
+async def run_maintenance_loop(interval_seconds: int = MAINTENANCE_INTERVAL_SECONDS):
+    """
+    Periodically purge the authentication audit tables.
+
+    """
+    while True:
+        await asyncio.sleep(interval_seconds)
+        try:
+            purged = await asyncio.to_thread(maintenance.run_once)
+        except Exception as e:
+            log_error(e, "Database maintenance")
+            continue
+        for table, count in purged.items():
+            maintenance_rows_purged.inc(count, table=table)
+        if any(purged.values()):
+            log.info("maintenance_completed", seconds=maintenance.last_duration, **purged)
@@ -0,0 +1,302 @@
+"""
+Metrics for the Data Analytics Chatbot API Server
+
+Latency and throughput instrumentation without external dependencies:
+- Counters, gauges and histograms rendered in the Prometheus text format
+  for /metrics
+- stage() times one step of a request (LLM call, count, page fetch,
+  chart, ...) into a per-stage histogram and into the request's
+  Server-Timing header
+- An ASGI middleware that counts requests per route and status, and
+  attaches Server-Timing and a request id to every response
+- An event-loop lag monitor, so blocking calls in async handlers show up
+  as lag and as stall warnings naming the requests in flight
+
+Metrics are kept per worker process; with several workers, scrape each
+one or run a single worker per container.
+"""
+
+import asyncio
+import bisect
+import contextvars
+import itertools
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from logger import get_logger, request_id
+
+log = get_logger("metrics")
+
+# CONFIGURATION
+
+# Bearer token required to read /metrics, if set
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+
+# Latency buckets in seconds, from fast DuckDB queries to slow LLM calls
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# How often the event loop is checked for lag, and the lag logged as a stall
+LOOP_LAG_INTERVAL_SECONDS = float(os.getenv("LOOP_LAG_INTERVAL_SECONDS", "0.1"))
+LOOP_LAG_WARN_SECONDS = float(os.getenv("LOOP_LAG_WARN_SECONDS", "0.25"))
+LOOP_LAG_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+# METRIC TYPES
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+class Metric:
+    """Base for metrics holding one value per combination of label values"""
+
+    kind = "untyped"
+
+    def __init__(self, name: str, description: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self.lock = threading.Lock()
+        registry.append(self)
+
+    def _key(self, labels: Dict[str, Any]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labels)
+
+    def samples(self) -> Iterator[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, description: str, labels: Tuple[str, ...] = ()):
+        super().__init__(name, description, labels)
+        self.values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self) -> Iterator[str]:
+        with self.lock:
+            values = list(self.values.items())
+        for key, value in values:
+            yield f"{self.name}{_format_labels(self.labels, key)} {value}"
+
+class Gauge(Metric):
+    """
+    A gauge that is either set directly or read from a callback at scrape
+    time. The callback returns {label values: value}.
+    """
+
+    kind = "gauge"
+
+    def __init__(self, name: str, description: str, labels: Tuple[str, ...] = (),
+                 collect: Optional[Callable[[], Dict[Tuple[str, ...], float]]] = None):
+        super().__init__(name, description, labels)
+        self.values: Dict[Tuple[str, ...], float] = {}
+        self.collect = collect
+
+    def set(self, value: float, **labels):
+        with self.lock:
+            self.values[self._key(labels)] = value
+
+    def samples(self) -> Iterator[str]:
+        if self.collect is not None:
+            values = list(self.collect().items())
+        else:
+            with self.lock:
+                values = list(self.values.items())
+        for key, value in values:
+            yield f"{self.name}{_format_labels(self.labels, key)} {value}"
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, description: str, labels: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        super().__init__(name, description, labels)
+        self.buckets = buckets
+        # Per label values: count in each bucket (the last is +Inf), and the sum
+        self.values: Dict[Tuple[str, ...], Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            entry = self.values.get(key)
+            if entry is None:
+                entry = self.values[key] = ([0] * (len(self.buckets) + 1), [0.0])
+            entry[0][index] += 1
+            entry[1][0] += value
+
+    def samples(self) -> Iterator[str]:
+        with self.lock:
+            values = [(key, list(counts), total[0]) for key, (counts, total) in self.values.items()]
+        bounds = [str(bound) for bound in self.buckets] + ["+Inf"]
+        for key, counts, total in values:
+            for bound, cumulative in zip(bounds, itertools.accumulate(counts)):
+                le = f'le="{bound}"'
+                yield f"{self.name}_bucket{_format_labels(self.labels, key, le)} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(self.labels, key)} {total}"
+            yield f"{self.name}_count{_format_labels(self.labels, key)} {sum(counts)}"
+
+registry: List[Metric] = []
+
+def render_metrics() -> str:
+    """All registered metrics in the Prometheus text exposition format"""
+    return "\n".join(metric.render() for metric in registry) + "\n"
+
+# APPLICATION METRICS
+
+http_requests = Counter("queryous_http_requests_total", "HTTP requests by route and status", ("method", "route", "status"))
+http_request_seconds = Histogram("queryous_http_request_duration_seconds", "Time to response headers", ("method", "route"))
+stage_seconds = Histogram("queryous_stage_duration_seconds", "Time spent in each request stage", ("stage",))
+
+llm_requests = Counter("queryous_llm_requests_total", "LLM API calls by task and outcome", ("task", "outcome"))
+llm_tokens = Counter("queryous_llm_tokens_total", "LLM tokens reported by the API", ("task", "kind"))
+sql_cache_lookups = Counter("queryous_sql_cache_lookups_total", "Generated SQL cache lookups by outcome", ("outcome",))
+cost_guard_decisions = Counter("queryous_cost_guard_decisions_total", "Queries over a cost threshold by action taken", ("action",))
+cancelled_work = Counter("queryous_cancelled_work_total", "Requests, queries and LLM calls stopped by a disconnect or deadline", ("reason", "kind"))
+
+export_rows = Counter("queryous_export_rows_total", "Rows streamed by exports", ("format",))
+export_bytes = Counter("queryous_export_bytes_total", "Bytes streamed by exports", ("format",))
+export_seconds = Histogram("queryous_export_duration_seconds", "Duration of export streams", ("format",))
+
+csv_upload_bytes = Counter("queryous_csv_upload_bytes_total", "Bytes of uploaded CSV files")
+csv_upload_rows = Counter("queryous_csv_upload_rows_total", "Rows ingested from uploaded CSV files")
+
+rate_limited_requests = Counter("queryous_rate_limited_requests_total", "Requests rejected with 429", ("limiter",))
+maintenance_rows_purged = Counter("queryous_maintenance_rows_purged_total", "Rows purged by database maintenance", ("table",))
+
+loop_lag_seconds = Histogram("queryous_event_loop_lag_seconds", "How late the event loop woke a periodic timer",
+                             buckets=LOOP_LAG_BUCKETS)
+loop_stalls = Counter("queryous_event_loop_stalls_total", "Event loop lags of at least LOOP_LAG_WARN_SECONDS")
+
+# REQUEST STAGE TIMING
+
+class RequestTimings:
+    """Stages timed while handling one request, for its Server-Timing header"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages: List[Tuple[str, float]] = []
+
+    def header(self) -> str:
+        entries = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in self.stages]
+        entries.append(f"total;dur={(time.perf_counter() - self.started) * 1000:.1f}")
+        return ", ".join(entries)
+
+current_timings: contextvars.ContextVar[Optional[RequestTimings]] = contextvars.ContextVar("current_timings", default=None)
+
+def record_stage(name: str, seconds: float):
+    stage_seconds.observe(seconds, stage=name)
+    timings = current_timings.get()
+    if timings is not None:
+        timings.stages.append((name, seconds))
+
+@contextmanager
+def stage(name: str):
+    """
+    Time a block as one stage of the current request. Works from the
+    threadpool too, since FastAPI copies the context into worker threads.
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(name, time.perf_counter() - started)
+
+def record_llm_usage(task: str, usage: Optional[Dict[str, Any]]):
+    """Count the tokens an OpenAI-compatible response reports under usage"""
+    if not usage:
+        return
+    for kind in ("prompt_tokens", "completion_tokens"):
+        if usage.get(kind):
+            llm_tokens.inc(usage[kind], task=task, kind=kind.replace("_tokens", ""))
+
+# MIDDLEWARE
+
+_request_ids = itertools.count(1)
+
+# Requests being handled by this worker: request id -> "METHOD /path", and
+# the last few to finish with their finish time, so a stall can be blamed
+# on a request that blocked the loop and completed before the monitor woke
+in_flight: Dict[str, str] = {}
+recently_finished: "deque[Tuple[float, str]]" = deque(maxlen=64)
+
+class MetricsMiddleware:
+    """
+    ASGI middleware counting requests and adding Server-Timing and
+    X-Request-Id headers. Written against raw ASGI rather than as an
+    HTTP middleware so streamed responses pass straight through.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.prefix = f"{os.getpid():x}"
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timings = RequestTimings()
+        rid = f"{self.prefix}-{next(_request_ids):x}"
+        timings_token = current_timings.set(timings)
+        request_token = request_id.set(rid)
+        in_flight[rid] = f"{scope['method']} {scope['path']}"
+        status = 500
+
+        async def send_with_headers(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", timings.header().encode()))
+                headers.append((b"x-request-id", rid.encode()))
+                message = {**message, "headers": headers}
+                route = getattr(scope.get("route"), "path", "unmatched")
+                http_request_seconds.observe(time.perf_counter() - timings.started, method=scope["method"], route=route)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_headers)
+        finally:
+            route = getattr(scope.get("route"), "path", "unmatched")
+            http_requests.inc(method=scope["method"], route=route, status=status)
+            recently_finished.append((time.perf_counter(), in_flight.pop(rid, "")))
+            current_timings.reset(timings_token)
+            request_id.reset(request_token)
+
+# EVENT LOOP LAG
+
+async def run_loop_lag_monitor(interval: float = LOOP_LAG_INTERVAL_SECONDS):
+    """
+    Measure how late the event loop wakes a timer. Any lag is time the
+    loop spent running something that did not yield, which every other
+    request on this worker had to wait out.
+    """
+    while True:
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        lag = max(time.perf_counter() - started - interval, 0.0)
+        loop_lag_seconds.observe(lag)
+        if lag >= LOOP_LAG_WARN_SECONDS:
+            loop_stalls.inc()
+            requests = set(in_flight.values())
+            requests.update(label for finished, label in list(recently_finished) if finished >= started)
+            log.warning("event_loop_stalled", seconds=round(lag, 3), requests=sorted(requests))
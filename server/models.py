@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, Boolean, Text, JSON, ForeignKey
+from sqlalchemy import Column, Integer, String, Date, DateTime, Boolean, Text, JSON, LargeBinary, ForeignKey, UniqueConstraint
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 from datetime import datetime
@@ -10,7 +10,7 @@ class User(Base):
     __tablename__ = "users"
     
     id = Column(String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
-    email = Column(String(255), unique=True, index=True, nullable=False)
+    email = Column(String(255), unique=True, index=True, nullable=True)  # Username-only signups have none
     username = Column(String(100), unique=True, index=True, nullable=True)
     full_name = Column(String(255), nullable=True)
     phone_number = Column(String(20), nullable=True)
@@ -50,7 +50,7 @@ class ChatSession(Base):
     title = Column(String(255), nullable=False, default="New Chat")
     
     # Session data
-    messages = Column(JSON, default=list)  # Store chat messages
+    messages = Column(JSON, default=list)  # Legacy message blob, moved to chat_messages on first access
     database_connection = Column(JSON, nullable=True)  # Store DB connection details
     
     # Metadata
@@ -64,6 +64,32 @@ class ChatSession(Base):
     # Relationships
     user = relationship("User", back_populates="chat_sessions")
 
+class ChatMessage(Base):
+    __tablename__ = "chat_messages"
+    __table_args__ = (UniqueConstraint("session_id", "seq", name="uq_chat_messages_session_seq"),)
+    
+    # Append-only: one row per message, numbered within its session
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    session_id = Column(String(36), ForeignKey("chat_sessions.id", ondelete="CASCADE"), nullable=False)
+    seq = Column(Integer, nullable=False)
+    role = Column(String(20), nullable=False)  # user, assistant
+    content = Column(Text, nullable=False, default="")
+    
+    # Small query details kept in-row; result rows and charts go to chat_message_payloads
+    sql_query = Column(Text, nullable=True)
+    details = Column(JSON, default=dict)  # Title, summary, row counts, etc.
+    payload_size = Column(Integer, nullable=True)  # Uncompressed bytes, None without a payload
+    
+    # Timestamps
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class ChatMessagePayload(Base):
+    __tablename__ = "chat_message_payloads"
+    
+    # Large result payloads, stored out of row and loaded only when asked for
+    message_id = Column(Integer, ForeignKey("chat_messages.id", ondelete="CASCADE"), primary_key=True)
+    body = Column(LargeBinary, nullable=False)  # gzip-compressed JSON
+
 class Dashboard(Base):
     __tablename__ = "dashboards"
     
@@ -73,7 +99,7 @@ class Dashboard(Base):
     description = Column(Text, nullable=True)
     
     # Dashboard data
-    data = Column(JSON, nullable=False)  # Raw table data
+    data = Column(JSON, nullable=False)  # Legacy raw table data, moved to dashboard_snapshots on first access
     config = Column(JSON, default=dict)  # Dashboard configuration
     
     # Sharing and access
@@ -92,6 +118,19 @@ class Dashboard(Base):
     # Relationships
     user = relationship("User", back_populates="dashboards")
 
+class DashboardSnapshot(Base):
+    __tablename__ = "dashboard_snapshots"
+    
+    # A dashboard's table data as one zstd-compressed Parquet file
+    dashboard_id = Column(String(36), ForeignKey("dashboards.id", ondelete="CASCADE"), primary_key=True)
+    body = Column(LargeBinary, nullable=False)
+    row_count = Column(Integer, nullable=False, default=0)
+    columns = Column(JSON, default=list)  # [{"name": ..., "type": ...}]
+    etag = Column(String(64), nullable=False)  # SHA-256 of the body
+    
+    # Timestamps
+    created_at = Column(DateTime, default=datetime.utcnow)
+
 class UserPreference(Base):
     __tablename__ = "user_preferences"
     
@@ -158,3 +197,15 @@ class LoginAttempt(Base):
     
     # Timestamps
     created_at = Column(DateTime, default=datetime.utcnow)
+
+class AuthEventCount(Base):
+    __tablename__ = "auth_event_counts"
+    __table_args__ = (UniqueConstraint("day", "event", "kind", "outcome", name="uq_auth_event_counts"),)
+    
+    # Daily totals kept for login attempts and OTPs after their rows are purged
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    day = Column(Date, nullable=False)
+    event = Column(String(20), nullable=False)  # login, otp
+    kind = Column(String(50), nullable=False)  # Login method or OTP purpose
+    outcome = Column(String(20), nullable=False)  # success, failure, used, unused
+    count = Column(Integer, nullable=False, default=0)
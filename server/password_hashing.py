@@ -0,0 +1,83 @@
+"""
+Password hashing for the Data Analytics Chatbot API Server
+
+bcrypt is deliberately slow (about 250 ms at the default cost), so this
+module keeps it off the event loop:
+- Hashing and verification run in a bounded process pool
+- The bcrypt cost is configurable with BCRYPT_ROUNDS
+- Hashes made at another cost still verify, and are reported as needing
+  a rehash
+"""
+
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional, Tuple
+
+from passlib.context import CryptContext
+
+# CONFIGURATION
+
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(min(os.cpu_count() or 1, 4))))
+
+# Password hashing
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
+
+# WORKER FUNCTIONS
+# These run in the pool's processes and must stay importable at module level.
+
+def hash_password(password: str) -> str:
+    return pwd_context.hash(password)
+
+def verify_password(plain_password: str, hashed_password: str) -> Tuple[bool, bool]:
+    """
+    Verify a password, also reporting whether its hash should be upgraded
+    to the current cost.
+
+    """
+    verified = pwd_context.verify(plain_password, hashed_password)
+    return verified, verified and pwd_context.needs_update(hashed_password)
+
+# PROCESS POOL
+
+class PasswordHasher:
+    """Runs bcrypt in a process pool so event loops are never blocked by it"""
+
+    def __init__(self, workers: int = PASSWORD_HASH_WORKERS):
+        self.workers = workers
+        self.executor: Optional[ProcessPoolExecutor] = None
+
+    def start(self):
+        """
+        Start the pool. Spawned rather than forked, as the server process
+        already runs threads.
+
+        """
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+            # Start the workers now rather than on the first login
+            for _ in range(self.workers):
+                self.executor.submit(hash_password, "")
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+    async def _run(self, func, *args):
+        self.start()
+        return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+
+    async def hash(self, password: str) -> str:
+        return await self._run(hash_password, password)
+
+    async def verify(self, plain_password: str, hashed_password: str) -> Tuple[bool, bool]:
+        return await self._run(verify_password, plain_password, hashed_password)
+
+# Global password hasher instance
+password_hasher = PasswordHasher()
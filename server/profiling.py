@@ -0,0 +1,158 @@
+"""
+Column profiling for the Data Analytics Chatbot API Server
+
+This module profiles a query result once so that chart planning and the
+AI summary can share the same facts about its columns:
+- Dtype and semantic kind (numeric, temporal, categorical, boolean)
+- Cardinality, null counts and monotonicity
+- Whether text columns hold parseable dates
+- Numeric and temporal ranges
+
+Every statistic is computed with vectorized pandas operations.
+"""
+
+from __future__ import annotations
+
+from typing import Any, Dict, List, Optional
+
+from lazy_imports import lazy_module
+
+pd = lazy_module("pandas")
+ptypes = lazy_module("pandas.api.types")
+
+# Rows inspected when deciding whether a text column holds dates
+DATETIME_SAMPLE_SIZE = 200
+
+# Share of sampled values that must parse for a text column to count as temporal
+DATETIME_PARSE_RATIO = 0.9
+
+# Column names treated as temporal even without a datetime dtype
+TIME_COLUMN_NAMES = ('date', 'time')
+
+# Loose shape of a date at the start of a string: 2024-01-31, 31/01/2024, 2024.01.31 ...
+DATE_PATTERN = r'^\s*\d{1,4}[-/.]\d{1,2}[-/.]\d{1,4}'
+
+# PROFILING
+
+def profile_columns(df: pd.DataFrame) -> Dict[str, Dict[str, Any]]:
+    """
+    Profile every column of a result.
+
+    Returns a dict keyed by column name, preserving column order.
+
+    """
+    if df.empty and df.shape[1] == 0:
+        return {}
+
+    null_counts = df.isna().sum()
+    try:
+        cardinality = df.nunique(dropna=True)
+    except TypeError:
+        # Unhashable values such as JSON arrays are compared by their text
+        cardinality = df.astype(str).nunique(dropna=True)
+    numeric = df.select_dtypes(include=['number'], exclude=['bool'])
+
+    profile: Dict[str, Dict[str, Any]] = {}
+    for col in df.columns:
+        series = df[col]
+        column = {
+            "dtype": str(series.dtype),
+            "kind": "other",
+            "cardinality": int(cardinality[col]),
+            "nulls": int(null_counts[col]),
+            "monotonic": _monotonic(series),
+            "datetime_parsable": False,
+            "min": None,
+            "max": None,
+        }
+
+        if ptypes.is_bool_dtype(series):
+            column["kind"] = "boolean"
+        elif col in numeric.columns:
+            column["kind"] = "numeric"
+            column["min"], column["max"] = _scalar(series.min()), _scalar(series.max())
+        elif ptypes.is_datetime64_any_dtype(series):
+            column["kind"] = "temporal"
+            column["datetime_parsable"] = True
+            column["min"], column["max"] = _scalar(series.min()), _scalar(series.max())
+        elif ptypes.is_object_dtype(series) or ptypes.is_string_dtype(series) or isinstance(series.dtype, pd.CategoricalDtype):
+            parsed = _parse_datetimes(series)
+            if parsed is not None:
+                column["kind"] = "temporal"
+                column["datetime_parsable"] = True
+                column["min"], column["max"] = _scalar(parsed.min()), _scalar(parsed.max())
+            else:
+                column["kind"] = "categorical"
+
+        if column["kind"] != "temporal" and str(col).lower() in TIME_COLUMN_NAMES:
+            column["kind"] = "temporal"
+
+        profile[col] = column
+
+    return profile
+
+def _monotonic(series: pd.Series) -> Optional[str]:
+    try:
+        if series.is_monotonic_increasing:
+            return "increasing"
+        if series.is_monotonic_decreasing:
+            return "decreasing"
+    except TypeError:
+        pass
+    return None
+
+def _parse_datetimes(series: pd.Series) -> Optional[pd.Series]:
+    """
+    Parse a text column as dates if a sample of it looks like dates.
+
+    """
+    sample = series.dropna().astype(str).head(DATETIME_SAMPLE_SIZE)
+    if sample.empty:
+        return None
+    if sample.str.match(DATE_PATTERN).mean() < DATETIME_PARSE_RATIO:
+        return None
+
+    if pd.to_datetime(sample, errors='coerce', format='mixed').notna().mean() < DATETIME_PARSE_RATIO:
+        return None
+    return pd.to_datetime(series, errors='coerce', format='mixed')
+
+def _scalar(value: Any) -> Any:
+    if pd.isna(value):
+        return None
+    if isinstance(value, pd.Timestamp):
+        return value.isoformat()
+    return value.item() if hasattr(value, 'item') else value
+
+# PROFILE QUERIES
+
+def columns_of_kind(profile: Dict[str, Dict[str, Any]], kind: str) -> List[str]:
+    return [col for col, column in profile.items() if column["kind"] == kind]
+
+def is_identifier(column: Dict[str, Any], row_count: int) -> bool:
+    """
+    A numeric column whose values are all distinct and increasing, such as
+    an auto-increment id, carries no information worth charting.
+
+    """
+    return (
+        column["kind"] == "numeric"
+        and column["monotonic"] == "increasing"
+        and row_count > 2
+        and column["cardinality"] == row_count
+        and "int" in column["dtype"]
+    )
+
+def describe_profile(profile: Dict[str, Dict[str, Any]], max_columns: int = 20) -> str:
+    """
+    Summarize a profile as short text lines for LLM prompts.
+
+    """
+    lines = []
+    for col, column in list(profile.items())[:max_columns]:
+        description = f"- {col}: {column['kind']}, {column['cardinality']} distinct"
+        if column["min"] is not None:
+            description += f", range {column['min']} to {column['max']}"
+        if column["nulls"]:
+            description += f", {column['nulls']} nulls"
+        lines.append(description)
+    return "\n".join(lines)
@@ -0,0 +1,287 @@
+"""
+Query statistics for the Data Analytics Chatbot API Server
+
+Tracks which generated SQL statements are costing the most:
+- Each statement is normalized into a fingerprint, with literals, IN
+  lists, comments and whitespace folded, so the same query with
+  different values is counted together
+- Each fingerprint keeps its call count, total and max latency, rows
+  returned, errors and a streaming percentile sketch
+- Statements slower than SLOW_QUERY_SECONDS go to the slow-query log,
+  optionally written to its own file
+
+Statistics are kept per worker process and bounded to the most recently
+seen fingerprints.
+"""
+
+import hashlib
+import logging
+import math
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+
+from logger import JsonFormatter, get_logger
+
+# CONFIGURATION
+
+# Statements at least this slow are written to the slow-query log
+SLOW_QUERY_SECONDS = float(os.getenv("SLOW_QUERY_SECONDS", "1.0"))
+# Optional file the slow-query log is also written to, one JSON object per line
+SLOW_QUERY_LOG_PATH = os.getenv("SLOW_QUERY_LOG_PATH")
+# Fingerprints kept before the least recently seen are dropped
+QUERY_STATS_MAX_FINGERPRINTS = int(os.getenv("QUERY_STATS_MAX_FINGERPRINTS", "2000"))
+# Longest statement text kept as a fingerprint's example
+QUERY_SAMPLE_LENGTH = 2000
+
+# Slow queries are logged whatever LOG_LEVEL is
+slow_log = get_logger("slow_query")
+slow_log.logger.setLevel(logging.WARNING)
+if SLOW_QUERY_LOG_PATH:
+    _handler = logging.FileHandler(SLOW_QUERY_LOG_PATH)
+    _handler.setFormatter(JsonFormatter())
+    slow_log.logger.addHandler(_handler)
+
+# FINGERPRINTS
+
+# Comments, string literals, quoted identifiers and numbers, matched in one
+# pass so that quotes and digits inside one of them are left to it
+_TOKENS = re.compile(
+    r"(?P<comment>--[^\n]*|/\*.*?\*/)"
+    r"|(?P<string>'(?:[^']|'')*')"
+    r"|(?P<identifier>\"(?:[^\"]|\"\")*\"|`[^`]*`)"
+    r"|(?P<number>(?<![\w.])[-+]?\d+(?:\.\d+)?(?:[eE][-+]?\d+)?\b)",
+    re.DOTALL,
+)
+_IDENTIFIER_PLACEHOLDERS = re.compile(r"\x00(\d+)\x00")
+_WHITESPACE = re.compile(r"\s+")
+_OPERATORS = re.compile(r" ?([,=<>!]) ?")
+_PARENTHESES = re.compile(r"\( | \)")
+_IN_LISTS = re.compile(r"\bin ?\(\?(?:,\?)*\)")
+
+def normalize_sql(sql_query: str) -> str:
+    """
+    Fold a statement to its shape: literals become ?, IN lists become
+    (?+), comments are dropped and case and whitespace are normalized,
+    so "id=1" and "ID = 42" share a fingerprint. Quoted identifiers are
+    kept exactly as written, since their case and digits are part of the
+    name.
+    """
+    identifiers: List[str] = []
+
+    def replace(match):
+        if match.group("comment") is not None:
+            return " "
+        if match.group("identifier") is not None:
+            identifiers.append(match.group())
+            return f"\x00{len(identifiers) - 1}\x00"
+        return "?"
+
+    text = _TOKENS.sub(replace, sql_query)
+    text = _WHITESPACE.sub(" ", text).strip().rstrip(";").strip().lower()
+    text = _OPERATORS.sub(r"\1", text)
+    text = _PARENTHESES.sub(lambda match: match.group().strip(), text)
+    text = _IN_LISTS.sub("in (?+)", text)
+    return _IDENTIFIER_PLACEHOLDERS.sub(lambda match: identifiers[int(match.group(1))], text)
+
+def fingerprint(sql_query: str) -> str:
+    """Short stable id of a statement's normalized shape"""
+    return hashlib.sha1(normalize_sql(sql_query).encode()).hexdigest()[:16]
+
+def schema_fingerprint(schema_prompt: Optional[str]) -> Optional[str]:
+    """Short stable id of a workspace's schema prompt"""
+    if not schema_prompt:
+        return None
+    return hashlib.sha1(schema_prompt.encode()).hexdigest()[:16]
+
+# PERCENTILE SKETCH
+
+class QuantileSketch:
+    """
+    Streaming quantile estimate with bounded relative error.
+
+    Values are counted in logarithmic buckets, so any quantile is within
+    relative_accuracy of the true value while memory grows only with the
+    range of values seen, not their number. Past max_buckets the lowest
+    buckets are merged, trading accuracy on the fastest calls.
+    """
+
+    def __init__(self, relative_accuracy: float = 0.01, max_buckets: int = 2048, min_value: float = 1e-6):
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.max_buckets = max_buckets
+        self.min_value = min_value
+        self.buckets: Dict[int, int] = {}
+        self.zero_count = 0
+        self.count = 0
+
+    def add(self, value: float):
+        self.count += 1
+        if value <= self.min_value:
+            self.zero_count += 1
+            return
+        index = math.ceil(math.log(value) / self.log_gamma)
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+        if len(self.buckets) > self.max_buckets:
+            self._collapse()
+
+    def quantile(self, q: float) -> Optional[float]:
+        if self.count == 0:
+            return None
+        rank = q * (self.count - 1)
+        seen = self.zero_count
+        if rank < seen:
+            return 0.0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if rank < seen:
+                # Midpoint of the bucket (gamma^(i-1), gamma^i]
+                return 2 * self.gamma ** index / (self.gamma + 1)
+        return 2 * self.gamma ** max(self.buckets) / (self.gamma + 1)
+
+    def _collapse(self):
+        lowest = sorted(self.buckets)[:2]
+        self.buckets[lowest[1]] += self.buckets.pop(lowest[0])
+
+# STATISTICS
+
+class FingerprintStats:
+    """Running totals for one statement shape"""
+
+    def __init__(self, fingerprint_id: str, kind: str, sql_query: str):
+        self.fingerprint = fingerprint_id
+        self.kind = kind
+        self.example = sql_query[:QUERY_SAMPLE_LENGTH]
+        self.calls = 0
+        self.errors = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        self.rows = 0
+        self.modes: Dict[str, int] = {}
+        self.first_seen = time.time()
+        self.last_seen = self.first_seen
+        self.sketch = QuantileSketch()
+
+    def add(self, seconds: float, rows: Optional[int], mode: str, failed: bool):
+        self.calls += 1
+        self.errors += int(failed)
+        self.total_seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+        self.rows += rows or 0
+        self.modes[mode] = self.modes.get(mode, 0) + 1
+        self.last_seen = time.time()
+        self.sketch.add(seconds)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "fingerprint": self.fingerprint,
+            "kind": self.kind,
+            "example": self.example,
+            "normalized": normalize_sql(self.example),
+            "calls": self.calls,
+            "errors": self.errors,
+            "total_seconds": round(self.total_seconds, 3),
+            "mean_seconds": round(self.total_seconds / self.calls, 4) if self.calls else None,
+            "p50_seconds": _round(self.sketch.quantile(0.5)),
+            "p95_seconds": _round(self.sketch.quantile(0.95)),
+            "p99_seconds": _round(self.sketch.quantile(0.99)),
+            "max_seconds": round(self.max_seconds, 4),
+            "rows": self.rows,
+            "modes": dict(self.modes),
+            "first_seen": self.first_seen,
+            "last_seen": self.last_seen,
+        }
+
+def _round(value: Optional[float]) -> Optional[float]:
+    return round(value, 4) if value is not None else None
+
+class QueryStats:
+    """Per-fingerprint statistics, bounded to the most recently seen shapes"""
+
+    SORT_KEYS = {
+        "total": lambda stats: stats.total_seconds,
+        "p95": lambda stats: stats.sketch.quantile(0.95) or 0.0,
+        "calls": lambda stats: stats.calls,
+        "max": lambda stats: stats.max_seconds,
+    }
+
+    def __init__(self, max_fingerprints: int = QUERY_STATS_MAX_FINGERPRINTS,
+                 slow_seconds: float = SLOW_QUERY_SECONDS):
+        self.max_fingerprints = max_fingerprints
+        self.slow_seconds = slow_seconds
+        self.fingerprints: "OrderedDict[str, FingerprintStats]" = OrderedDict()
+        self.lock = threading.Lock()
+        self.started = time.time()
+
+    def record(self, sql_query: str, seconds: float, rows: Optional[int], mode: str,
+               kind: str, error: Optional[BaseException] = None):
+        """Count one execution of a statement"""
+        fingerprint_id = fingerprint(sql_query)
+        with self.lock:
+            stats = self.fingerprints.get(fingerprint_id)
+            if stats is None:
+                stats = self.fingerprints[fingerprint_id] = FingerprintStats(fingerprint_id, kind, sql_query)
+                if len(self.fingerprints) > self.max_fingerprints:
+                    self.fingerprints.popitem(last=False)
+            else:
+                self.fingerprints.move_to_end(fingerprint_id)
+            stats.add(seconds, rows, mode, error is not None)
+
+        if seconds >= self.slow_seconds:
+            slow_log.warning("slow_query", fingerprint=fingerprint_id, kind=kind, mode=mode,
+                             seconds=round(seconds, 3), rows=rows,
+                             error=str(error) if error else None,
+                             sql=sql_query[:QUERY_SAMPLE_LENGTH])
+
+    @contextmanager
+    def track(self, sql_query: str, mode: str, kind: str):
+        """
+        Time the statement run inside the block. Set "rows" on the yielded
+        dict to record how many rows it returned.
+        """
+        result: Dict[str, Any] = {"rows": None}
+        started = time.perf_counter()
+        try:
+            yield result
+        except BaseException as e:
+            self.record(sql_query, time.perf_counter() - started, result["rows"], mode, kind, error=e)
+            raise
+        self.record(sql_query, time.perf_counter() - started, result["rows"], mode, kind)
+
+    def top(self, sort: str = "total", limit: int = 20) -> List[Dict[str, Any]]:
+        """The fingerprints with the highest total time, p95, calls or max"""
+        if sort not in self.SORT_KEYS:
+            raise ValueError(f"Unknown sort '{sort}'. Use one of: {', '.join(self.SORT_KEYS)}")
+        with self.lock:
+            ranked = sorted(self.fingerprints.values(), key=self.SORT_KEYS[sort], reverse=True)[:limit]
+            return [stats.to_dict() for stats in ranked]
+
+    def get(self, fingerprint_id: str) -> Optional[Dict[str, Any]]:
+        with self.lock:
+            stats = self.fingerprints.get(fingerprint_id)
+            return stats.to_dict() if stats else None
+
+    def reset(self):
+        with self.lock:
+            self.fingerprints.clear()
+            self.started = time.time()
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            return {
+                "fingerprints": len(self.fingerprints),
+                "max_fingerprints": self.max_fingerprints,
+                "statements": sum(stats.calls for stats in self.fingerprints.values()),
+                "slow_query_seconds": self.slow_seconds,
+                "since": self.started,
+            }
+
+# Global statistics for this worker
+query_stats = QueryStats()
+
+def query_mode(is_csv: bool) -> str:
+    return "csv" if is_csv else "database"
@@ -0,0 +1,314 @@
+"""
+Rate limiting for the Data Analytics Chatbot API Server
+
+This module keeps one client from exhausting shared capacity:
+- Sliding-window counters with O(1) memory per key (the current and the
+  previous fixed window, weighted by how far the current one has run)
+- An in-process counter store, or the shared state backend when workers
+  need to agree on counts
+- Request limits for login, /ask, exports and uploads
+- Per-user budgets on LLM calls and database time
+- A FastAPI dependency that answers 429 with Retry-After
+
+Limits are configured as "<count>/<seconds>", e.g. RATE_LIMIT_ASK=30/60.
+"""
+
+import ipaddress
+import math
+import os
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+from fastapi import Depends, HTTPException, Request
+
+from metrics import rate_limited_requests
+from state_backend import StateBackend, state_backend
+
+# CONFIGURATION
+
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() == "true"
+# Reverse proxies whose X-Forwarded-For / X-Real-IP headers are believed,
+# as comma-separated addresses or networks, e.g. TRUSTED_PROXIES=10.0.0.0/8
+TRUSTED_PROXIES = [
+    ipaddress.ip_network(network.strip(), strict=False)
+    for network in os.getenv("TRUSTED_PROXIES", "").split(",") if network.strip()
+]
+
+def parse_rate(value: str) -> Tuple[int, int]:
+    """
+    Parse "<count>/<seconds>" into (count, seconds).
+
+    """
+    count, _, seconds = value.partition("/")
+    return int(count), int(seconds or 60)
+
+# IN-PROCESS AND SHARED COUNTERS
+
+class InProcessCounterStore:
+    """
+    Window counters for one worker process.
+
+    Each key holds only the current window's index and count and the
+    previous window's count.
+    """
+
+    # Sweep idle keys once the table grows past this many entries
+    SWEEP_THRESHOLD = 10000
+
+    def __init__(self):
+        self.counters: Dict[str, Tuple[int, int, int]] = {}
+        self.lock = threading.Lock()
+
+    def _roll(self, key: str, window: int) -> Tuple[int, int]:
+        index, current, previous = self.counters.get(key, (window, 0, 0))
+        if index == window:
+            return current, previous
+        if index == window - 1:
+            return 0, current
+        return 0, 0
+
+    def read(self, key: str, window: int, window_seconds: int) -> Tuple[int, int]:
+        with self.lock:
+            return self._roll(key, window)
+
+    def add(self, key: str, window: int, window_seconds: int, cost: int) -> Tuple[int, int]:
+        with self.lock:
+            current, previous = self._roll(key, window)
+            current += cost
+            self.counters[key] = (window, current, previous)
+            if len(self.counters) > self.SWEEP_THRESHOLD:
+                self._sweep(window)
+            return current, previous
+
+    def _sweep(self, window: int):
+        """Drop keys that have been idle for two windows and so count nothing"""
+        idle = [key for key, (index, _, _) in self.counters.items() if index < window - 1]
+        for key in idle:
+            del self.counters[key]
+
+class SharedCounterStore:
+    """
+    Window counters in the shared state backend, one key per window that
+    expires once it can no longer be the previous window.
+    """
+
+    def __init__(self, backend: StateBackend):
+        self.backend = backend
+
+    def read(self, key: str, window: int, window_seconds: int) -> Tuple[int, int]:
+        current = self.backend.get(f"ratelimit:{key}:{window}") or 0
+        previous = self.backend.get(f"ratelimit:{key}:{window - 1}") or 0
+        return current, previous
+
+    def add(self, key: str, window: int, window_seconds: int, cost: int) -> Tuple[int, int]:
+        current = self.backend.incr(f"ratelimit:{key}:{window}", cost, ttl_seconds=2 * window_seconds)
+        previous = self.backend.get(f"ratelimit:{key}:{window - 1}") or 0
+        return current, previous
+
+# Counters follow the state backend, so limits hold across workers when it is shared
+counter_store = SharedCounterStore(state_backend) if state_backend.shared else InProcessCounterStore()
+
+# SLIDING WINDOW LIMITER
+
+class RateLimitExceeded(Exception):
+    """Raised when a key has used up its limit"""
+
+    def __init__(self, limiter: "SlidingWindowLimiter", retry_after: float):
+        super().__init__(f"{limiter.description} exceeded, retry in {math.ceil(retry_after)}s")
+        self.limiter = limiter
+        self.retry_after = retry_after
+
+class SlidingWindowLimiter:
+    """
+    Allows limit units per window_seconds for each key.
+
+    Usage is estimated as the current window's count plus the previous
+    window's count weighted by the share of it still inside the sliding
+    window.
+    """
+
+    def __init__(self, name: str, limit: int, window_seconds: int, description: str = "",
+                 store=None):
+        self.name = name
+        self.limit = limit
+        self.window_seconds = window_seconds
+        self.description = description or f"Rate limit of {limit} per {window_seconds}s"
+        self.store = store if store is not None else counter_store
+
+    @classmethod
+    def from_env(cls, name: str, env_var: str, default: str, description: str = "") -> "SlidingWindowLimiter":
+        limit, window_seconds = parse_rate(os.getenv(env_var, default))
+        return cls(name, limit, window_seconds, description)
+
+    def _window(self, now: float) -> Tuple[int, float]:
+        window, offset = divmod(now, self.window_seconds)
+        return int(window), offset / self.window_seconds
+
+    def _retry_after(self, current: int, previous: int, elapsed: float, cost: int) -> float:
+        """
+        Seconds until cost more units fit, or 0 if they fit now.
+
+        """
+        if previous * (1 - elapsed) + current + cost <= self.limit:
+            return 0.0
+        if current + cost <= self.limit:
+            # The previous window's weight has to decay further
+            needed = 1 - (self.limit - current - cost) / previous
+            return (needed - elapsed) * self.window_seconds
+        if cost > self.limit:
+            return float(self.window_seconds)
+        # Wait for the current window to become the previous one and decay
+        needed = 1 - (self.limit - cost) / current
+        return (1 - elapsed + needed) * self.window_seconds
+
+    def check(self, key: str, cost: int = 1) -> float:
+        """
+        Seconds until cost units would be allowed, without using any.
+
+        """
+        if not RATE_LIMIT_ENABLED:
+            return 0.0
+        window, elapsed = self._window(time.time())
+        current, previous = self.store.read(f"{self.name}:{key}", window, self.window_seconds)
+        return self._retry_after(current, previous, elapsed, cost)
+
+    def record(self, key: str, cost: int = 1):
+        """
+        Use cost units unconditionally, e.g. for work that already happened.
+
+        """
+        if RATE_LIMIT_ENABLED and cost > 0:
+            window, _ = self._window(time.time())
+            self.store.add(f"{self.name}:{key}", window, self.window_seconds, cost)
+
+    def consume(self, key: str, cost: int = 1):
+        """
+        Use cost units, raising RateLimitExceeded if they don't fit.
+
+        The units are counted even when rejected, so clients that keep
+        retrying stay limited.
+
+        """
+        if not RATE_LIMIT_ENABLED:
+            return
+        window, elapsed = self._window(time.time())
+        current, previous = self.store.add(f"{self.name}:{key}", window, self.window_seconds, cost)
+        retry_after = self._retry_after(current - cost, previous, elapsed, cost)
+        if retry_after > 0:
+            raise RateLimitExceeded(self, retry_after)
+
+# LIMITS AND BUDGETS
+
+ask_limiter = SlidingWindowLimiter.from_env("ask", "RATE_LIMIT_ASK", "30/60", "Query rate limit")
+export_limiter = SlidingWindowLimiter.from_env("export", "RATE_LIMIT_EXPORT", "10/60", "Export rate limit")
+upload_limiter = SlidingWindowLimiter.from_env("upload", "RATE_LIMIT_UPLOAD", "10/300", "Upload rate limit")
+
+# Failed logins per account, and all login attempts per client address
+login_failure_limiter = SlidingWindowLimiter.from_env("login", "RATE_LIMIT_LOGIN", "5/300", "Failed login limit")
+login_ip_limiter = SlidingWindowLimiter.from_env("login-ip", "RATE_LIMIT_LOGIN_IP", "30/300", "Login rate limit")
+
+# Per-user budgets: LLM calls, and database time in milliseconds
+llm_call_budget = SlidingWindowLimiter.from_env("llm", "LLM_CALL_BUDGET", "300/3600", "LLM call budget")
+_db_seconds, _db_window = parse_rate(os.getenv("DB_SECONDS_BUDGET", "600/3600"))
+db_time_budget = SlidingWindowLimiter("db-ms", _db_seconds * 1000, _db_window, "Database time budget")
+
+# REQUEST HELPERS
+
+def _is_trusted_proxy(address: str) -> bool:
+    try:
+        ip = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    return any(ip in network for network in TRUSTED_PROXIES)
+
+def client_address(request: Request) -> str:
+    """
+    Client IP. Proxy headers are only believed when they come from a
+    trusted proxy: the address is the right-most hop in X-Forwarded-For
+    that is not one, since any hop further left could be made up by the
+    client.
+
+    """
+    peer = request.client.host if request.client else "unknown"
+    if not _is_trusted_proxy(peer):
+        return peer
+    forwarded_for = request.headers.get("X-Forwarded-For")
+    if forwarded_for:
+        hops = [hop.strip() for hop in forwarded_for.split(",") if hop.strip()]
+        for hop in reversed(hops):
+            if not _is_trusted_proxy(hop):
+                return hop
+        # Every hop is a trusted proxy; the left-most is the closest to the client
+        return hops[0] if hops else peer
+    real_ip = request.headers.get("X-Real-IP")
+    if real_ip:
+        return real_ip.strip()
+    return peer
+
+def client_identity(request: Request, user: Optional[Dict[str, Any]]) -> str:
+    """Signed-in users are limited per account, everyone else per address"""
+    if user:
+        return f"user:{user['username']}"
+    return f"ip:{client_address(request)}"
+
+def too_many_requests(error: RateLimitExceeded) -> HTTPException:
+    rate_limited_requests.inc(limiter=error.limiter.name)
+    return HTTPException(
+        status_code=429,
+        detail=str(error),
+        headers={"Retry-After": str(max(math.ceil(error.retry_after), 1))}
+    )
+
+def enforce(limiter: SlidingWindowLimiter, key: str, cost: int = 1):
+    """
+    Consume from a limiter, turning a rejection into a 429.
+
+    """
+    try:
+        limiter.consume(key, cost)
+    except RateLimitExceeded as e:
+        raise too_many_requests(e)
+
+def enforce_available(limiter: SlidingWindowLimiter, key: str, cost: int = 1):
+    """
+    Reject with a 429 if cost units are not available, without using them.
+
+    """
+    retry_after = limiter.check(key, cost)
+    if retry_after > 0:
+        raise too_many_requests(RateLimitExceeded(limiter, retry_after))
+
+def charge_db_time(key: str, started: float):
+    """
+    Charge the database time since started (a perf_counter reading) to a
+    client's budget.
+
+    """
+    db_time_budget.record(key, int((time.perf_counter() - started) * 1000))
+
+def client_key():
+    """
+    FastAPI dependency returning the caller's identity for budget checks.
+
+    """
+    from auth_routes import get_optional_user
+
+    def dependency(request: Request, user: Optional[Dict[str, Any]] = Depends(get_optional_user)) -> str:
+        return client_identity(request, user)
+
+    return dependency
+
+def rate_limited(limiter: SlidingWindowLimiter):
+    """
+    FastAPI dependency that counts a request against a limiter and returns
+    the caller's identity for further budget checks.
+
+    """
+    identify = client_key()
+
+    def dependency(identity: str = Depends(identify)) -> str:
+        enforce(limiter, identity)
+        return identity
+
+    return dependency
@@ -0,0 +1,309 @@
+"""
+Request profiling for the Data Analytics Chatbot API Server
+
+Opt-in profiling of a single slow request:
+- An admin sends "X-Profile: cpu" (or ?profile=cpu) to /ask, /upload-csv,
+  /export-csv or /export; "memory" adds a tracemalloc allocation snapshot
+  and "all" takes both
+- The request runs under cProfile, including the worker threads its
+  queries run in and the threads that stream its export, and the result is saved as a pstats file, a text summary
+  and an allocation report under PROFILE_DIR
+- Artifacts are named after the request id returned in X-Request-Id and
+  served from /admin/profiles
+
+When no flag is sent nothing is enabled. Only one request is profiled at
+a time. On the event loop cProfile also sees any other requests running
+alongside, so profile on a quiet worker where possible.
+"""
+
+import cProfile
+import io
+import json
+import os
+import pstats
+import tempfile
+import threading
+import time
+import tracemalloc
+import uuid
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Set
+
+from fastapi import Depends, HTTPException, Request
+
+from logger import get_logger, request_id
+
+log = get_logger("request_profiler")
+
+# CONFIGURATION
+
+# Directory the profile artifacts are written to
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join(tempfile.gettempdir(), "queryous-profiles"))
+# Profiles kept before the oldest are deleted
+PROFILE_KEEP = int(os.getenv("PROFILE_KEEP", "20"))
+# Stack frames recorded per allocation in memory profiles
+PROFILE_TRACEMALLOC_FRAMES = int(os.getenv("PROFILE_TRACEMALLOC_FRAMES", "10"))
+# Lines in the text summaries
+PROFILE_SUMMARY_LINES = 60
+
+PROFILE_FLAGS = {
+    "1": {"cpu"},
+    "true": {"cpu"},
+    "cpu": {"cpu"},
+    "memory": {"memory"},
+    "all": {"cpu", "memory"},
+}
+
+# Artifact kinds: file suffix and media type
+PROFILE_ARTIFACTS = {
+    "prof": (".prof", "application/octet-stream"),
+    "txt": (".txt", "text/plain"),
+    "memory": (".memory.txt", "text/plain"),
+}
+
+class ProfileBusyError(Exception):
+    """Raised when another request is already being profiled"""
+    pass
+
+def parse_profile_flag(value: Optional[str]) -> Set[str]:
+    """
+    Profiling modes requested by an X-Profile header or ?profile= value.
+
+    """
+    if not value:
+        return set()
+    modes: Set[str] = set()
+    for part in value.lower().replace(" ", "").split(","):
+        if part not in PROFILE_FLAGS:
+            raise ValueError(f"Unknown profile mode '{part}'. Use one of: {', '.join(PROFILE_FLAGS)}")
+        modes |= PROFILE_FLAGS[part]
+    return modes
+
+# PROFILE OF ONE REQUEST
+
+class RequestProfile:
+    """
+    CPU and allocation profile of one request.
+
+    cProfile only follows the thread it is enabled on, so each thread doing
+    work for the request gets its own profiler and they are merged when
+    the profile is saved.
+    """
+
+    def __init__(self, profile_id: str, route: str, username: str, modes: Set[str]):
+        self.id = profile_id
+        self.route = route
+        self.username = username
+        self.modes = modes
+        self.profilers: List[cProfile.Profile] = []
+        self.lock = threading.Lock()
+        self.created_at = time.time()
+        self.started = time.perf_counter()
+        self.seconds: Optional[float] = None
+        self.memory_snapshot: Optional[tracemalloc.Snapshot] = None
+        self.memory_peak_bytes: Optional[int] = None
+
+    @contextmanager
+    def enabled(self):
+        """Profile the current thread for the duration of the block"""
+        if "cpu" not in self.modes:
+            yield
+            return
+        profiler = cProfile.Profile()
+        with self.lock:
+            self.profilers.append(profiler)
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+
+    def wrap(self, func: Callable) -> Callable:
+        """Profile calls of func on whichever thread runs them, e.g. in asyncio.to_thread"""
+        def profiled_func(*args, **kwargs):
+            with self.enabled():
+                return func(*args, **kwargs)
+        return profiled_func
+
+    def wrap_stream(self, stream: Iterator[bytes]) -> Iterator[bytes]:
+        """Profile each chunk of a stream on whichever thread pulls it"""
+        try:
+            while True:
+                with self.enabled():
+                    chunk = next(stream, None)
+                if chunk is None:
+                    return
+                yield chunk
+        finally:
+            close = getattr(stream, "close", None)
+            if close is not None:
+                close()
+
+    def start_memory(self):
+        if "memory" in self.modes:
+            tracemalloc.start(PROFILE_TRACEMALLOC_FRAMES)
+
+    def stop_memory(self):
+        if "memory" in self.modes and tracemalloc.is_tracing():
+            self.memory_snapshot = tracemalloc.take_snapshot().filter_traces((
+                tracemalloc.Filter(False, tracemalloc.__file__),
+            ))
+            self.memory_peak_bytes = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+    def cpu_stats(self) -> Optional[pstats.Stats]:
+        if not self.profilers:
+            return None
+        stats = pstats.Stats(self.profilers[0])
+        for profiler in self.profilers[1:]:
+            stats.add(profiler)
+        return stats
+
+    def metadata(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "route": self.route,
+            "username": self.username,
+            "modes": sorted(self.modes),
+            "created_at": self.created_at,
+            "seconds": round(self.seconds, 3) if self.seconds is not None else None,
+            "threads": len(self.profilers),
+            "memory_peak_bytes": self.memory_peak_bytes,
+        }
+
+# ARTIFACT STORE
+
+class ProfileStore:
+    """Profile artifacts on disk, one request profiled at a time"""
+
+    def __init__(self, directory: str = PROFILE_DIR, keep: int = PROFILE_KEEP):
+        self.directory = directory
+        self.keep = keep
+        self.active = threading.Lock()
+
+    def begin(self, route: str, username: str, modes: Set[str]) -> RequestProfile:
+        if not self.active.acquire(blocking=False):
+            raise ProfileBusyError("Another request is being profiled")
+        profile = RequestProfile(request_id.get() or uuid.uuid4().hex[:12], route, username, modes)
+        try:
+            profile.start_memory()
+        except Exception:
+            self.active.release()
+            raise
+        return profile
+
+    def finish(self, profile: RequestProfile):
+        """Stop the profile, release the profiling slot and write its artifacts"""
+        try:
+            profile.seconds = time.perf_counter() - profile.started
+            profile.stop_memory()
+        finally:
+            self.active.release()
+        self.save(profile)
+        log.info("request_profiled", profile_id=profile.id, route=profile.route, seconds=round(profile.seconds, 3))
+
+    def save(self, profile: RequestProfile):
+        os.makedirs(self.directory, exist_ok=True)
+        base = os.path.join(self.directory, profile.id)
+
+        stats = profile.cpu_stats()
+        if stats is not None:
+            stats.dump_stats(base + ".prof")
+            summary = io.StringIO()
+            stats.stream = summary
+            stats.sort_stats("cumulative").print_stats(PROFILE_SUMMARY_LINES)
+            stats.sort_stats("tottime").print_stats(PROFILE_SUMMARY_LINES)
+            with open(base + ".txt", "w") as f:
+                f.write(summary.getvalue())
+
+        if profile.memory_snapshot is not None:
+            with open(base + ".memory.txt", "w") as f:
+                f.write(f"Peak traced memory: {profile.memory_peak_bytes} bytes\n\n")
+                for stat in profile.memory_snapshot.statistics("lineno")[:PROFILE_SUMMARY_LINES]:
+                    f.write(f"{stat}\n")
+
+        with open(base + ".json", "w") as f:
+            json.dump(profile.metadata(), f)
+        self.prune()
+
+    def prune(self):
+        profiles = self.list()
+        for metadata in profiles[self.keep:]:
+            for suffix in [".json"] + [suffix for suffix, _ in PROFILE_ARTIFACTS.values()]:
+                try:
+                    os.remove(os.path.join(self.directory, metadata["id"] + suffix))
+                except FileNotFoundError:
+                    pass
+
+    def list(self) -> List[Dict[str, Any]]:
+        """Saved profiles, newest first"""
+        if not os.path.isdir(self.directory):
+            return []
+        profiles = []
+        for name in os.listdir(self.directory):
+            if name.endswith(".json"):
+                try:
+                    with open(os.path.join(self.directory, name)) as f:
+                        profiles.append(json.load(f))
+                except (OSError, ValueError):
+                    continue
+        return sorted(profiles, key=lambda metadata: metadata["created_at"], reverse=True)
+
+    def get(self, profile_id: str) -> Optional[Dict[str, Any]]:
+        for metadata in self.list():
+            if metadata["id"] == profile_id:
+                artifacts = [
+                    kind for kind, (suffix, _) in PROFILE_ARTIFACTS.items()
+                    if os.path.exists(os.path.join(self.directory, profile_id + suffix))
+                ]
+                return {**metadata, "artifacts": artifacts}
+        return None
+
+    def artifact_path(self, profile_id: str, kind: str) -> Optional[str]:
+        if kind not in PROFILE_ARTIFACTS or self.get(profile_id) is None:
+            return None
+        path = os.path.join(self.directory, profile_id + PROFILE_ARTIFACTS[kind][0])
+        return path if os.path.exists(path) else None
+
+# Global profile store
+profile_store = ProfileStore()
+
+# FASTAPI DEPENDENCY
+
+def profiled_call(profile: Optional[RequestProfile], func: Callable) -> Callable:
+    """func, profiled wherever it runs when the request is being profiled"""
+    return func if profile is None else profile.wrap(func)
+
+def profiled():
+    """
+    FastAPI dependency yielding a RequestProfile when an admin asked for
+    one with X-Profile or ?profile=, otherwise None.
+
+    """
+    from auth_routes import get_optional_user, is_admin
+
+    async def dependency(request: Request, user: Optional[Dict[str, Any]] = Depends(get_optional_user)):
+        flag = request.headers.get("x-profile") or request.query_params.get("profile")
+        if not flag:
+            yield None
+            return
+
+        if not is_admin(user):
+            raise HTTPException(status_code=403, detail="Profiling requires admin access")
+        try:
+            modes = parse_profile_flag(flag)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        try:
+            profile = profile_store.begin(request.url.path, user["username"], modes)
+        except ProfileBusyError as e:
+            raise HTTPException(status_code=409, detail=str(e))
+
+        # Runs on the event loop thread, like the async handlers it wraps
+        try:
+            with profile.enabled():
+                yield profile
+        finally:
+            profile_store.finish(profile)
+
+    return dependency
@@ -1,17 +1,72 @@
 # services.py
 # Contains llm communication logic split from main.py for modularity
 
-import requests
+from __future__ import annotations
+
+import asyncio
 import json
-import pandas as pd
-import altair as alt
+import os
 import time
-import traceback
+from typing import Optional
 from fastapi import HTTPException
 
+from deadlines import RequestCancelledError, check_deadline, current_deadline, database_connection
+from lazy_imports import lazy_module
+from logger import get_logger
+from metrics import stage, llm_requests, record_llm_usage, cancelled_work
+
+httpx = lazy_module("httpx")
+pd = lazy_module("pandas")
+
+log = get_logger("services")
+
+# Longest wait for an LLM response outside a request deadline
+LLM_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", "60"))
+
+_llm_client: Optional[httpx.AsyncClient] = None
+
+def llm_client() -> httpx.AsyncClient:
+    """The shared HTTP client for LLM calls, keeping connections to the API open"""
+    global _llm_client
+    if _llm_client is None:
+        _llm_client = httpx.AsyncClient(timeout=LLM_TIMEOUT_SECONDS)
+    return _llm_client
+
+async def close_llm_client():
+    global _llm_client
+    if _llm_client is not None:
+        await _llm_client.aclose()
+        _llm_client = None
+
+async def post_llm_request(task: str, llm_api_url: str, headers: dict, data: dict) -> dict:
+    """
+    POST a chat completion request, timing it as the llm_<task> stage and
+    counting the call and its tokens. Waits no longer than the request's
+    deadline; cancelling the request aborts the call.
+    """
+    deadline = current_deadline.get()
+    timeout = min(LLM_TIMEOUT_SECONDS, deadline.remaining()) if deadline is not None else LLM_TIMEOUT_SECONDS
+    try:
+        with stage(f"llm_{task}"):
+            response = await llm_client().post(llm_api_url, headers=headers, json=data, timeout=timeout)
+            response.raise_for_status()
+            result = response.json()
+    except asyncio.CancelledError:
+        llm_requests.inc(task=task, outcome="cancelled")
+        if deadline is not None and deadline.reason is not None:
+            cancelled_work.inc(reason=deadline.reason, kind="llm")
+        raise
+    except httpx.HTTPError:
+        llm_requests.inc(task=task, outcome="error")
+        check_deadline()
+        raise
+    llm_requests.inc(task=task, outcome="ok")
+    record_llm_usage(task, result.get("usage"))
+    return result
+
 # LLM Communication
 
-def query_llm(user_prompt: str, system_prompt: str, schema_prompt: str, llm_api_url: str, llm_api_key: str) -> str:
+async def query_llm(user_prompt: str, system_prompt: str, schema_prompt: str, llm_api_url: str, llm_api_key: str) -> str:
     full_prompt = f"{schema_prompt}\n\nUser question: {user_prompt}"
     
     # Groq API configuration for Llama model
@@ -40,23 +95,19 @@ def query_llm(user_prompt: str, system_prompt: str, schema_prompt: str, llm_api_
     }
     
     try:
-        response = requests.post(llm_api_url, headers=headers, json=data)
-        response.raise_for_status()
-        result = response.json()
+        result = await post_llm_request("sql", llm_api_url, headers, data)
         return result["choices"][0]["message"]["content"].strip()
-    except requests.exceptions.RequestException as e:
-        print(f"Error calling Groq API: {e}")
-        if 'response' in locals():
-            print(f"Response content: {response.text}")
+    except httpx.HTTPError as e:
+        response = getattr(e, "response", None)
+        log.error("llm_request_failed", task="sql", error=str(e),
+                  response=response.text if response is not None else None)
         raise HTTPException(status_code=500, detail=f"Failed to communicate with LLM: {e}")
     except KeyError as e:
-        print(f"Unexpected API response format: {e}")
-        if 'result' in locals():
-            print(f"Full response: {result}")
+        log.error("llm_response_invalid", task="sql", missing=str(e), response=result)
         raise HTTPException(status_code=500, detail="Invalid response from LLM service")
 
 
-def summarize_results(query, sql_query, result_data, llm_api_url, llm_api_key, task="summary"):
+async def summarize_results(query, sql_query, result_data, llm_api_url, llm_api_key, task="summary"):
     prompt = f"""
         Question: {query}
         SQL Query: {sql_query}
@@ -91,15 +142,13 @@ def summarize_results(query, sql_query, result_data, llm_api_url, llm_api_key, t
     }
     
     try:
-        response = requests.post(llm_api_url, headers=headers, json=data)
-        response.raise_for_status()
-        result = response.json()
+        result = await post_llm_request(task, llm_api_url, headers, data)
         return result["choices"][0]["message"]["content"].strip()
-    except requests.exceptions.RequestException as e:
-        print(f"Error calling Groq API: {e}")
+    except httpx.HTTPError as e:
+        log.error("llm_request_failed", task=task, error=str(e))
         raise HTTPException(status_code=500, detail=f"Failed to communicate with LLM: {e}")
     except KeyError as e:
-        print(f"Unexpected API response format: {e}")
+        log.error("llm_response_invalid", task=task, missing=str(e))
         raise HTTPException(status_code=500, detail="Invalid response from LLM service")
 
 
@@ -107,48 +156,11 @@ def execute_query(sql_query: str, db_engine) -> pd.DataFrame:
     try:
         if db_engine is None:
             raise Exception("Database engine not initialized.")
-        df = pd.read_sql_query(sql_query, db_engine)
+        with database_connection(db_engine) as conn:
+            df = pd.read_sql_query(sql_query, conn)
         return df
+    except RequestCancelledError:
+        raise
     except Exception as e:
-        print("Query execution failed:", str(e))
-        traceback.print_exc()
+        log.error("query_execution_failed", exc_info=True, error=str(e))
         return pd.DataFrame()
-
-
-def generate_auto_chart(df):
-    try:
-        if df.empty:
-            return None
-        
-        if df.shape[1] == 1:
-            counts = df[df.columns[0]].value_counts().reset_index()
-            counts.columns = [df.columns[0], 'count']
-            chart = alt.Chart(counts).mark_bar().encode(
-                x=alt.X(df.columns[0], type='nominal'),
-                y=alt.Y('count', type='quantitative')
-            )
-        elif 'date' in df.columns or 'time' in df.columns:
-            time_col = 'date' if 'date' in df.columns else 'time'
-            chart = alt.Chart(df).mark_line().encode(
-                x=alt.X(f'{time_col}:T'),
-                y=alt.Y(df.columns[1], type='quantitative')
-            )
-        elif df.select_dtypes(include=['object']).shape[1] > 0 and df.select_dtypes(include=['number']).shape[1] > 0:
-            cat_col = df.select_dtypes(include=['object']).columns[0]
-            num_col = df.select_dtypes(include=['number']).columns[0]
-            chart = alt.Chart(df).mark_bar().encode(
-                x=alt.X(cat_col, type='nominal'),
-                y=alt.Y(num_col, type='quantitative')
-            )
-        else:
-            chart = alt.Chart(df).mark_point().encode(
-                x=alt.X(df.columns[0], type='quantitative'),
-                y=alt.Y(df.columns[1], type='quantitative')
-            )
-        
-        return chart.to_json(format="vega")
-        
-    except Exception as e:
-        print(f"Error generating chart: {e}")
-        print("Returning None for visualization due to chart generation error")
-        return None
@@ -0,0 +1,104 @@
+"""
+Generated SQL cache for the Data Analytics Chatbot API Server
+
+Repeated questions skip the SQL generation call to the LLM:
+- Entries are keyed by mode, schema fingerprint and the question with
+  case, spacing and trailing punctuation normalized, so a schema change
+  misses naturally and any workspace with the same schema shares them
+- Only SQL that executed successfully is stored
+- Hits are counted per entry, so the hottest entries can be carried over
+  a restart by the warm-start manifest (see warm_start.py)
+
+SQL_CACHE_SIZE=0 disables the cache.
+"""
+
+import hashlib
+import os
+import re
+import time
+from typing import Any, Dict, List, Optional
+
+from cache import ExpiringLRUCache
+from metrics import sql_cache_lookups
+from query_stats import schema_fingerprint
+
+# CONFIGURATION
+
+SQL_CACHE_SIZE = int(os.getenv("SQL_CACHE_SIZE", "1000"))
+SQL_CACHE_TTL_SECONDS = int(os.getenv("SQL_CACHE_TTL_SECONDS", str(24 * 3600)))
+
+_WHITESPACE = re.compile(r"\s+")
+_TRAILING_PUNCTUATION = re.compile(r"[\s?.!]+$")
+
+def normalize_question(question: str) -> str:
+    return _TRAILING_PUNCTUATION.sub("", _WHITESPACE.sub(" ", question.strip().lower()))
+
+class SQLCache(ExpiringLRUCache):
+    """
+    LRU cache of generated SQL. Values are dicts holding the SQL, the
+    schema fingerprint, the mode and the hit count. Look questions up
+    with lookup() and store() rather than the raw get() and put().
+    """
+
+    def __init__(self, max_size: int = SQL_CACHE_SIZE, ttl_seconds: int = SQL_CACHE_TTL_SECONDS):
+        super().__init__(max_size, ttl_seconds)
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(schema_prompt: str, is_csv: bool, question: str) -> str:
+        mode = "csv" if is_csv else "database"
+        return hashlib.sha256(f"{mode}\0{schema_prompt}\0{normalize_question(question)}".encode()).hexdigest()
+
+    def lookup(self, schema_prompt: str, is_csv: bool, question: str) -> Optional[str]:
+        if self.max_size <= 0:
+            return None
+        entry = self.get(self._key(schema_prompt, is_csv, question))
+        with self.lock:
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                entry["hits"] += 1
+        sql_cache_lookups.inc(outcome="miss" if entry is None else "hit")
+        return entry["sql"] if entry is not None else None
+
+    def store(self, schema_prompt: str, is_csv: bool, question: str, sql_query: str):
+        self.put(self._key(schema_prompt, is_csv, question), {
+            "sql": sql_query,
+            "schema": schema_fingerprint(schema_prompt),
+            "mode": "csv" if is_csv else "database",
+            "hits": 0,
+        })
+
+    # Warm start
+
+    def hottest(self, limit: int) -> List[Dict[str, Any]]:
+        """Live entries with their keys and expiry, most hit first"""
+        now = time.time()
+        with self.lock:
+            entries = [
+                {"key": key, "expires_at": expires_at, **value}
+                for key, (value, expires_at) in self.entries.items()
+                if expires_at > now
+            ]
+        entries.sort(key=lambda entry: entry["hits"], reverse=True)
+        return entries[:limit]
+
+    def load(self, entries: List[Dict[str, Any]]):
+        """Insert entries saved by hottest(), keeping their hits and expiry"""
+        # Least hit first, so the hottest end up most recently used
+        for entry in reversed(entries):
+            value = {name: entry[name] for name in ("sql", "schema", "mode", "hits")}
+            self.put(entry["key"], value, entry["expires_at"])
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "entries": len(self.entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+# Global generated SQL cache
+sql_cache = SQLCache()
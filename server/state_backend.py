@@ -0,0 +1,416 @@
+"""
+Shared state storage for the Data Analytics Chatbot API Server
+
+This module lets several uvicorn workers, or several replicas, share the
+state that used to live in a single process:
+- A small key-value interface holding JSON values with per-key expiry
+- In-process, SQLite file and Redis-protocol backends
+- Encryption for secrets such as stored database passwords
+- Uploaded tables stored as Parquet files on a shared directory
+
+The backend is chosen with STATE_BACKEND_URL:
+- memory://                        one process only (default)
+- sqlite:////path/to/state.db      workers on one host sharing a file
+- redis://host:6379/0              workers and replicas sharing a Redis server
+"""
+
+from __future__ import annotations
+
+import abc
+import base64
+import hashlib
+import json
+import os
+import socket
+import sqlite3
+import tempfile
+import threading
+import time
+from typing import Any, Dict, List, Optional
+from urllib.parse import urlparse
+
+from cryptography.fernet import Fernet, InvalidToken
+
+from lazy_imports import lazy_module
+
+pd = lazy_module("pandas")
+
+# CONFIGURATION
+
+STATE_BACKEND_URL = os.getenv("STATE_BACKEND_URL", "memory://")
+SHARED_DATA_DIR = os.getenv("SHARED_DATA_DIR", os.path.join(tempfile.gettempdir(), "queryous_shared"))
+
+# Secrets are encrypted with this key, or one derived from JWT_SECRET so all workers agree
+STATE_ENCRYPTION_KEY = os.getenv("STATE_ENCRYPTION_KEY")
+
+# BACKENDS
+
+class StateBackend(abc.ABC):
+    """
+    Key-value store for JSON-serializable values.
+
+    shared is False when the state is only visible to the current process.
+    """
+
+    shared = True
+
+    @abc.abstractmethod
+    def get(self, key: str) -> Optional[Any]:
+        ...
+
+    @abc.abstractmethod
+    def set(self, key: str, value: Any, ttl_seconds: Optional[int] = None):
+        ...
+
+    @abc.abstractmethod
+    def add(self, key: str, value: Any, ttl_seconds: Optional[int] = None) -> bool:
+        """Set a key only if it doesn't exist yet, returning whether it was set"""
+
+    @abc.abstractmethod
+    def delete(self, key: str):
+        ...
+
+    @abc.abstractmethod
+    def incr(self, key: str, amount: int = 1, ttl_seconds: Optional[int] = None) -> int:
+        """Atomically add to an integer counter, returning the new value"""
+
+    @abc.abstractmethod
+    def keys(self, prefix: str) -> List[str]:
+        ...
+
+class InProcessStateBackend(StateBackend):
+    """State held in a dict, for a single worker process"""
+
+    shared = False
+
+    def __init__(self):
+        self.values: Dict[str, Any] = {}
+        self.expiry: Dict[str, float] = {}
+        self.lock = threading.Lock()
+
+    def _live(self, key: str) -> bool:
+        expires_at = self.expiry.get(key)
+        if expires_at is not None and expires_at <= time.time():
+            self.values.pop(key, None)
+            self.expiry.pop(key, None)
+        return key in self.values
+
+    def _store(self, key: str, value: Any, ttl_seconds: Optional[int]):
+        # Round-trip through JSON so callers can't share mutable state
+        self.values[key] = json.loads(json.dumps(value))
+        if ttl_seconds:
+            self.expiry[key] = time.time() + ttl_seconds
+        else:
+            self.expiry.pop(key, None)
+
+    def get(self, key: str) -> Optional[Any]:
+        with self.lock:
+            return json.loads(json.dumps(self.values[key])) if self._live(key) else None
+
+    def set(self, key: str, value: Any, ttl_seconds: Optional[int] = None):
+        with self.lock:
+            self._store(key, value, ttl_seconds)
+
+    def add(self, key: str, value: Any, ttl_seconds: Optional[int] = None) -> bool:
+        with self.lock:
+            if self._live(key):
+                return False
+            self._store(key, value, ttl_seconds)
+            return True
+
+    def delete(self, key: str):
+        with self.lock:
+            self.values.pop(key, None)
+            self.expiry.pop(key, None)
+
+    def incr(self, key: str, amount: int = 1, ttl_seconds: Optional[int] = None) -> int:
+        with self.lock:
+            value = (self.values[key] if self._live(key) else 0) + amount
+            self.values[key] = value
+            if ttl_seconds and key not in self.expiry:
+                self.expiry[key] = time.time() + ttl_seconds
+            return value
+
+    def keys(self, prefix: str) -> List[str]:
+        with self.lock:
+            return [key for key in list(self.values) if key.startswith(prefix) and self._live(key)]
+
+class SQLiteStateBackend(StateBackend):
+    """
+    State in a SQLite file, shared by every worker on the same host.
+
+    Each thread keeps its own connection. WAL mode lets readers proceed
+    while another process writes. Expired rows are swept every few
+    hundred writes.
+    """
+
+    SWEEP_EVERY = 500
+
+    def __init__(self, path: str):
+        self.path = path
+        self.local = threading.local()
+        self.writes = 0
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        with self._connection() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS state "
+                "(key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL)"
+            )
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self.local.conn = conn
+        return conn
+
+    @staticmethod
+    def _expires_at(ttl_seconds: Optional[int]) -> Optional[float]:
+        return time.time() + ttl_seconds if ttl_seconds else None
+
+    def _count_write(self):
+        self.writes += 1
+        if self.writes % self.SWEEP_EVERY == 0:
+            self._connection().execute("DELETE FROM state WHERE expires_at <= ?", (time.time(),))
+
+    def get(self, key: str) -> Optional[Any]:
+        row = self._connection().execute(
+            "SELECT value FROM state WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)",
+            (key, time.time())
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, key: str, value: Any, ttl_seconds: Optional[int] = None):
+        self._connection().execute(
+            "INSERT OR REPLACE INTO state (key, value, expires_at) VALUES (?, ?, ?)",
+            (key, json.dumps(value), self._expires_at(ttl_seconds))
+        )
+        self._count_write()
+
+    def add(self, key: str, value: Any, ttl_seconds: Optional[int] = None) -> bool:
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM state WHERE key = ? AND expires_at <= ?", (key, time.time()))
+            cursor = conn.execute(
+                "INSERT OR IGNORE INTO state (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, json.dumps(value), self._expires_at(ttl_seconds))
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return cursor.rowcount == 1
+
+    def delete(self, key: str):
+        self._connection().execute("DELETE FROM state WHERE key = ?", (key,))
+
+    def incr(self, key: str, amount: int = 1, ttl_seconds: Optional[int] = None) -> int:
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            now = time.time()
+            row = conn.execute(
+                "SELECT value, expires_at FROM state WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)",
+                (key, now)
+            ).fetchone()
+            value = (json.loads(row[0]) if row else 0) + amount
+            expires_at = row[1] if row else self._expires_at(ttl_seconds)
+            conn.execute(
+                "INSERT OR REPLACE INTO state (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, json.dumps(value), expires_at)
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        self._count_write()
+        return value
+
+    def keys(self, prefix: str) -> List[str]:
+        escaped = prefix.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        rows = self._connection().execute(
+            "SELECT key FROM state WHERE key LIKE ? ESCAPE '\\' AND (expires_at IS NULL OR expires_at > ?)",
+            (escaped + "%", time.time())
+        ).fetchall()
+        return [row[0] for row in rows]
+
+class RedisStateBackend(StateBackend):
+    """
+    State on a Redis server, or anything else that speaks its protocol.
+
+    Only plain GET/SET/DEL/INCRBY/SCAN commands are used, sent over one
+    connection per thread.
+    """
+
+    def __init__(self, url: str):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or "localhost"
+        self.port = parsed.port or 6379
+        self.password = parsed.password
+        self.db = int(parsed.path.lstrip("/") or 0)
+        self.local = threading.local()
+
+    def _connect(self):
+        sock = socket.create_connection((self.host, self.port), timeout=10)
+        self.local.sock = sock
+        self.local.reader = sock.makefile("rb")
+        if self.password:
+            self._send("AUTH", self.password)
+        if self.db:
+            self._send("SELECT", str(self.db))
+
+    def _send(self, *args: str) -> Any:
+        parts = [f"*{len(args)}\r\n".encode()]
+        for arg in args:
+            data = arg.encode() if isinstance(arg, str) else arg
+            parts.append(b"$%d\r\n%s\r\n" % (len(data), data))
+        self.local.sock.sendall(b"".join(parts))
+        return self._read_reply()
+
+    def _read_reply(self) -> Any:
+        line = self.local.reader.readline()
+        if not line:
+            raise ConnectionError("Redis connection closed")
+        kind, payload = line[:1], line[1:-2]
+        if kind == b"+":
+            return payload.decode()
+        if kind == b"-":
+            raise RuntimeError(f"Redis error: {payload.decode()}")
+        if kind == b":":
+            return int(payload)
+        if kind == b"$":
+            length = int(payload)
+            if length < 0:
+                return None
+            data = self.local.reader.read(length + 2)
+            return data[:-2].decode()
+        if kind == b"*":
+            length = int(payload)
+            return None if length < 0 else [self._read_reply() for _ in range(length)]
+        raise RuntimeError(f"Unexpected Redis reply: {line!r}")
+
+    def _command(self, *args: str) -> Any:
+        """Run a command, reconnecting once if the connection dropped"""
+        for attempt in range(2):
+            try:
+                if getattr(self.local, "sock", None) is None:
+                    self._connect()
+                return self._send(*args)
+            except (ConnectionError, OSError):
+                sock = getattr(self.local, "sock", None)
+                if sock is not None:
+                    sock.close()
+                self.local.sock = None
+                if attempt:
+                    raise
+
+    def get(self, key: str) -> Optional[Any]:
+        value = self._command("GET", key)
+        return json.loads(value) if value is not None else None
+
+    def set(self, key: str, value: Any, ttl_seconds: Optional[int] = None):
+        args = ["SET", key, json.dumps(value)]
+        if ttl_seconds:
+            args += ["EX", str(int(ttl_seconds))]
+        self._command(*args)
+
+    def add(self, key: str, value: Any, ttl_seconds: Optional[int] = None) -> bool:
+        args = ["SET", key, json.dumps(value), "NX"]
+        if ttl_seconds:
+            args += ["EX", str(int(ttl_seconds))]
+        return self._command(*args) is not None
+
+    def delete(self, key: str):
+        self._command("DEL", key)
+
+    def incr(self, key: str, amount: int = 1, ttl_seconds: Optional[int] = None) -> int:
+        value = self._command("INCRBY", key, str(amount))
+        if ttl_seconds and value == amount:
+            self._command("EXPIRE", key, str(int(ttl_seconds)))
+        return value
+
+    def keys(self, prefix: str) -> List[str]:
+        pattern = "".join(f"\\{char}" if char in "*?[]\\" else char for char in prefix) + "*"
+        keys, cursor = [], "0"
+        while True:
+            cursor, batch = self._command("SCAN", cursor, "MATCH", pattern, "COUNT", "500")
+            keys.extend(batch)
+            if cursor == "0":
+                return keys
+
+def create_state_backend(url: str = STATE_BACKEND_URL) -> StateBackend:
+    """
+    Build the backend described by a STATE_BACKEND_URL.
+
+    """
+    scheme = urlparse(url).scheme
+    if scheme in ("", "memory"):
+        return InProcessStateBackend()
+    if scheme == "sqlite":
+        # sqlite:////abs/path.db or sqlite:///relative/path.db
+        return SQLiteStateBackend(url.split("://", 1)[1][1:] or "state.db")
+    if scheme in ("redis", "rediss"):
+        if scheme == "rediss":
+            raise ValueError("TLS Redis connections are not supported, use a local TLS proxy")
+        return RedisStateBackend(url)
+    raise ValueError(f"Unsupported state backend: {url}")
+
+# Global state backend instance
+state_backend = create_state_backend()
+
+# SECRETS
+
+def _fernet() -> Fernet:
+    key = STATE_ENCRYPTION_KEY
+    if not key:
+        secret = os.getenv("JWT_SECRET", "your-secret-key-change-in-production")
+        key = base64.urlsafe_b64encode(hashlib.sha256(secret.encode()).digest()).decode()
+    return Fernet(key.encode())
+
+def encrypt_secret(value: str) -> str:
+    return _fernet().encrypt(value.encode()).decode()
+
+def decrypt_secret(token: str) -> str:
+    try:
+        return _fernet().decrypt(token.encode()).decode()
+    except InvalidToken:
+        raise ValueError("Stored secret can't be decrypted, was the encryption key changed?")
+
+# SHARED TABLE STORAGE
+
+def _workspace_dir(workspace_key: str) -> str:
+    digest = hashlib.sha256(workspace_key.encode()).hexdigest()[:32]
+    return os.path.join(SHARED_DATA_DIR, "tables", digest)
+
+def save_table(workspace_key: str, table_name: str, df: pd.DataFrame) -> str:
+    """
+    Write an uploaded table to the shared directory and return its path.
+
+    The file is written under a temporary name and renamed, so readers in
+    other workers never see a partial file.
+
+    """
+    directory = _workspace_dir(workspace_key)
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{table_name}.parquet")
+    partial_path = f"{path}.{os.getpid()}.part"
+    df.to_parquet(partial_path, index=False)
+    os.replace(partial_path, path)
+    return path
+
+def load_table(path: str) -> pd.DataFrame:
+    return pd.read_parquet(path)
+
+def remove_tables(workspace_key: str):
+    directory = _workspace_dir(workspace_key)
+    if not os.path.isdir(directory):
+        return
+    for entry in os.scandir(directory):
+        try:
+            os.remove(entry.path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,5 @@
+"""
+Tests for the Data Analytics Chatbot API Server
+
+Run from the server directory with `python -m pytest tests`.
+"""
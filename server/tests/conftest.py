@@ -0,0 +1,25 @@
+"""
+Shared fixtures: a fresh in-memory application database per test
+"""
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from models import Base, User
+
+@pytest.fixture
+def session_factory():
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(engine)
+    yield sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    engine.dispose()
+
+@pytest.fixture
+def user_id(session_factory) -> str:
+    with session_factory() as db:
+        user = User(username="alice", email="alice@example.com")
+        db.add(user)
+        db.commit()
+        return user.id
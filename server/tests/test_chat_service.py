@@ -0,0 +1,82 @@
+"""
+Chat history tests: legacy message blobs migrated into the append-only
+messages table, paging, and out-of-row payloads
+"""
+
+import gzip
+import json
+from datetime import datetime
+
+import pytest
+
+from chat_schemas import ChatMessageCreate, ChatSessionCreate
+from chat_service import ChatService
+from models import ChatMessage, ChatSession
+
+LEGACY_MESSAGES = [
+    {"type": "user", "text": "top customers?"},
+    {"role": "assistant", "content": "Here they are", "sql_query": "SELECT 1", "title": "Top customers",
+     "data": [{"customer": "Acme", "total": 10}]},
+]
+
+@pytest.fixture
+def service(session_factory) -> ChatService:
+    return ChatService(session_factory)
+
+def legacy_session(session_factory, user_id: str, messages=LEGACY_MESSAGES, updated_at=datetime(2024, 1, 1)) -> str:
+    with session_factory() as db:
+        chat = ChatSession(user_id=user_id, title="Legacy", messages=messages, updated_at=updated_at)
+        db.add(chat)
+        db.commit()
+        return chat.id
+
+def test_legacy_messages_migrate_on_first_read(service, session_factory, user_id):
+    session_id = legacy_session(session_factory, user_id)
+    page = service.get_messages(user_id, session_id, before_seq=None, limit=10)
+    user, assistant = page["messages"]
+    assert (user["seq"], user["role"], user["content"]) == (1, "user", "top customers?")
+    assert (assistant["seq"], assistant["role"], assistant["sql_query"]) == (2, "assistant", "SELECT 1")
+    assert assistant["details"] == {"title": "Top customers"}
+    assert assistant["has_payload"] and not user["has_payload"]
+    payload = json.loads(gzip.decompress(service.get_payload(user_id, session_id, 2)))
+    assert payload == {"data": [{"customer": "Acme", "total": 10}]}
+
+    with session_factory() as db:
+        chat = db.get(ChatSession, session_id)
+        assert chat.messages is None
+        # Migrating doesn't move the session up the listing
+        assert chat.updated_at == datetime(2024, 1, 1)
+
+def test_migrate_legacy_sessions_skips_conflicting_sessions(service, session_factory, user_id):
+    migrated = legacy_session(session_factory, user_id)
+    conflicting = legacy_session(session_factory, user_id)
+    with session_factory() as db:
+        db.add(ChatMessage(session_id=conflicting, seq=1, role="user", content="already here"))
+        db.commit()
+
+    assert service.migrate_legacy_sessions(batch_size=1) == 1
+    sessions, has_more = service.list_sessions(user_id, limit=10, offset=0)
+    counts = {session["id"]: session["message_count"] for session in sessions}
+    assert counts == {migrated: 2, conflicting: 1} and not has_more
+
+def test_appends_page_backwards_from_the_newest(service, user_id):
+    session_id = service.create_session(user_id, ChatSessionCreate(title="New"))["id"]
+    for index in range(5):
+        service.append_message(user_id, session_id, ChatMessageCreate(role="user", content=f"message {index}"))
+
+    page = service.get_messages(user_id, session_id, before_seq=None, limit=2)
+    assert [message["seq"] for message in page["messages"]] == [4, 5]
+    assert page["has_more"] and page["next_before_seq"] == 4
+    page = service.get_messages(user_id, session_id, before_seq=2, limit=2)
+    assert [message["seq"] for message in page["messages"]] == [1] and not page["has_more"]
+    assert service.get_messages("someone-else", session_id, before_seq=None, limit=2) is None
+
+def test_listing_is_most_recent_first_without_messages(service, session_factory, user_id):
+    older = legacy_session(session_factory, user_id)
+    newer = service.create_session(user_id, ChatSessionCreate(title="New"))["id"]
+    service.append_message(user_id, newer, ChatMessageCreate(role="user", content="hi"))
+    sessions, has_more = service.list_sessions(user_id, limit=1, offset=0)
+    assert [session["id"] for session in sessions] == [newer] and has_more
+    assert "messages" not in sessions[0] and sessions[0]["message_count"] == 1
+    sessions, _ = service.list_sessions(user_id, limit=1, offset=1)
+    assert [session["id"] for session in sessions] == [older]
@@ -0,0 +1,84 @@
+"""
+Cost guard tests: planner estimates from DuckDB, PostgreSQL and MySQL
+plans, and the action taken for expensive queries
+"""
+
+import duckdb
+import pytest
+
+from cost_guard import CostGuard, QueryTooExpensiveError, limit_query, mysql_estimate, postgres_estimate
+
+@pytest.fixture(scope="module")
+def connection():
+    # Three 10,000-row tables: a cross product of two is over the default
+    # 50 million row threshold, and of all three prohibitive
+    connection = duckdb.connect()
+    for table in ("a", "b", "c"):
+        connection.execute(f"CREATE TABLE {table} AS SELECT range AS {table}_id FROM range(10000)")
+    yield connection
+    connection.close()
+
+@pytest.fixture
+def cursor(connection):
+    cursor = connection.cursor()
+    yield cursor
+    cursor.close()
+
+def test_cheap_queries_run_unchanged(cursor):
+    guard = CostGuard(enabled=True, action="limit")
+    action, sql, estimate = guard.check("SELECT * FROM a WHERE a_id < 5", cursor, True, "schema")
+    assert (action, sql) == ("ok", "SELECT * FROM a WHERE a_id < 5")
+    assert estimate.backend == "duckdb"
+
+def test_streaming_cross_product_is_limited(cursor):
+    guard = CostGuard(enabled=True, action="limit", limit_rows=1000)
+    action, sql, estimate = guard.check("SELECT * FROM a, b", cursor, True, "schema")
+    assert action == "limit" and sql == limit_query("SELECT * FROM a, b", 1000)
+    assert estimate.rows == 100_000_000 and estimate.limitable()
+    # Later pages of the capped query keep the cap rather than nesting it
+    assert guard.check(sql, cursor, True, "schema")[:2] == ("limit", sql)
+
+def test_aggregate_over_cross_product_is_refused(cursor):
+    guard = CostGuard(enabled=True, action="limit")
+    with pytest.raises(QueryTooExpensiveError, match="capping the result would not help"):
+        guard.check("SELECT count(*) FROM a, b", cursor, True, "schema")
+
+def test_prohibitive_queries_are_always_refused(cursor):
+    guard = CostGuard(enabled=True, action="allow")
+    with pytest.raises(QueryTooExpensiveError):
+        guard.check("SELECT * FROM a, b, c", cursor, True, "schema")
+
+def test_background_action_needs_a_caller_that_can_hand_off(cursor):
+    guard = CostGuard(enabled=True, action="background")
+    assert guard.check("SELECT * FROM a, b", cursor, True, "schema", background=True)[0] == "background"
+    with pytest.raises(QueryTooExpensiveError):
+        guard.check("SELECT * FROM a, b", cursor, True, "schema")
+
+def test_estimates_are_cached_and_failures_are_not_guarded(cursor):
+    guard = CostGuard(enabled=True, action="limit")
+    guard.check("SELECT * FROM a, b", cursor, True, "schema")
+    assert len(guard.estimates.entries) == 1
+    assert guard.check("SELECT * FROM missing", cursor, True, "schema")[0] == "ok"
+    assert CostGuard(enabled=False).check("SELECT * FROM a, b, c", cursor, True, "schema")[0] == "ok"
+
+def test_invalid_action_is_rejected():
+    with pytest.raises(ValueError):
+        CostGuard(action="sometimes")
+
+def test_postgres_sorted_aggregates_stream():
+    scan = {"Node Type": "Seq Scan", "Plan Rows": 80_000_000, "Total Cost": 2_000_000}
+    sorted_plan = [{"Plan": {"Node Type": "Aggregate", "Strategy": "Sorted", "Plan Rows": 10,
+                             "Total Cost": 3_000_000, "Plans": [scan]}}]
+    hashed_plan = [{"Plan": {**sorted_plan[0]["Plan"], "Strategy": "Hashed"}}]
+    estimate = postgres_estimate(sorted_plan)
+    assert (estimate.rows, estimate.cost, estimate.blocked_rows) == (80_000_000, 3_000_000, 0)
+    assert estimate.level() == "expensive" and estimate.limitable()
+    assert not postgres_estimate(hashed_plan).limitable()
+
+def test_mysql_grouping_blocks_the_whole_join():
+    table = {"table": {"rows_examined_per_scan": 60_000_000, "rows_produced_per_join": 60_000_000}}
+    plan = {"query_block": {"cost_info": {"query_cost": "1234.5"}, "nested_loop": [table]}}
+    estimate = mysql_estimate(plan)
+    assert (estimate.rows, estimate.cost) == (60_000_000, 1234.5) and estimate.limitable()
+    grouped = {"query_block": {"cost_info": {"query_cost": "1234.5"}, "grouping_operation": {"nested_loop": [table]}}}
+    assert not mysql_estimate(grouped).limitable()
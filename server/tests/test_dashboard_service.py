@@ -0,0 +1,78 @@
+"""
+Dashboard tests: Parquet snapshots read a page at a time, legacy data
+migration, and cached shared views
+"""
+
+import json
+
+import pytest
+
+import dashboard_service
+from dashboard_schemas import DashboardCreate, DashboardUpdate
+from dashboard_service import DashboardService, ViewCounter, encode_snapshot, read_snapshot
+from models import Dashboard
+from state_backend import InProcessStateBackend
+
+ROWS = [{"id": index, "name": f"row {index}", "score": index / 2} for index in range(25)]
+
+@pytest.fixture
+def small_row_groups(monkeypatch):
+    monkeypatch.setattr(dashboard_service, "DASHBOARD_ROW_GROUP_SIZE", 10)
+
+def test_snapshot_pages_span_row_groups(small_row_groups):
+    snapshot = encode_snapshot(ROWS)
+    assert snapshot["row_count"] == 25
+    assert [column["name"] for column in snapshot["columns"]] == ["id", "name", "score"]
+    page = read_snapshot(snapshot["body"], None, offset=8, limit=5)
+    assert page["data"] == ROWS[8:13]
+    assert page["has_more"] is True and page["total_rows"] == 25
+
+def test_snapshot_reads_only_requested_columns(small_row_groups):
+    body = encode_snapshot(ROWS)["body"]
+    page = read_snapshot(body, ["name"], offset=20, limit=10)
+    assert page["data"] == [{"name": row["name"]} for row in ROWS[20:]]
+    assert page["returned_rows"] == 5 and page["has_more"] is False
+    with pytest.raises(ValueError, match="Unknown dashboard columns"):
+        read_snapshot(body, ["missing"], offset=0, limit=10)
+
+def test_snapshot_past_the_end_is_empty():
+    page = read_snapshot(encode_snapshot(ROWS)["body"], None, offset=100, limit=10)
+    assert page["data"] == [] and page["has_more"] is False
+
+def test_snapshot_keeps_mixed_columns_readable():
+    rows = [{"value": 1, "extra": {"a": 1}}, {"value": 2.5, "extra": "text"}, {"value": None}]
+    page = read_snapshot(encode_snapshot(rows)["body"], None, offset=0, limit=10)
+    assert [row["value"] for row in page["data"]] == [1.0, 2.5, None]
+    assert [row["extra"] for row in page["data"]] == ['{"a":1}', "text", None]
+
+@pytest.fixture
+def service(session_factory) -> DashboardService:
+    return DashboardService(session_factory, InProcessStateBackend(), ViewCounter(session_factory))
+
+def test_legacy_data_moves_to_a_snapshot(service, session_factory, user_id):
+    with session_factory() as db:
+        dashboard = Dashboard(user_id=user_id, title="Legacy", data={"rows": ROWS})
+        db.add(dashboard)
+        db.commit()
+        dashboard_id = dashboard.id
+
+    page = service.read_data(user_id, dashboard_id, ["id"], offset=0, limit=3)
+    assert page["data"] == [{"id": 0}, {"id": 1}, {"id": 2}] and page["total_rows"] == 25
+    with session_factory() as db:
+        assert db.get(Dashboard, dashboard_id).data == []
+    assert service.read_data("someone-else", dashboard_id, None, offset=0, limit=3) is None
+
+def test_shared_data_is_cached_until_the_dashboard_changes(service, user_id):
+    created = service.create_dashboard(user_id, DashboardCreate(title="Sales", data=ROWS[:3], is_public=True))
+    token = created["share_token"]
+    body, etag = service.shared_data(token, None, 0, 10)
+    assert json.loads(body)["total_rows"] == 3
+    assert service.shared_data(token, None, 0, 10) == (body, etag)
+    assert service.counter.pending(created["id"]) == 2
+
+    service.update_dashboard(user_id, created["id"], DashboardUpdate(data=ROWS[:5]))
+    body, new_etag = service.shared_data(token, None, 0, 10)
+    assert json.loads(body)["total_rows"] == 5 and new_etag != etag
+
+    service.set_sharing(user_id, created["id"], False)
+    assert service.shared_data(token, None, 0, 10) is None
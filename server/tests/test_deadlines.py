@@ -0,0 +1,114 @@
+"""
+Deadline tests: timeouts, cancelling work in flight, DuckDB interrupts
+and requests cancelled by a disconnect or their deadline
+"""
+
+import asyncio
+import threading
+import time
+
+import duckdb
+import pytest
+from sqlalchemy import create_engine
+
+import deadlines
+from deadlines import (
+    Deadline,
+    RequestCancelledError,
+    current_deadline,
+    database_connection,
+    interruptible,
+    request_deadline,
+)
+
+@pytest.fixture
+def deadline():
+    """Starts a deadline as the current one, for work run outside a request"""
+    tokens = []
+
+    def start(timeout_seconds: float) -> Deadline:
+        started = Deadline(timeout_seconds)
+        tokens.append(current_deadline.set(started))
+        return started
+
+    yield start
+    for token in reversed(tokens):
+        current_deadline.reset(token)
+
+def test_deadline_expires(deadline):
+    short = deadline(0.05)
+    short.check()
+    time.sleep(0.06)
+    with pytest.raises(RequestCancelledError) as raised:
+        short.check()
+    assert raised.value.reason == "deadline"
+
+def test_zero_timeout_never_expires():
+    unbounded = Deadline(0)
+    assert unbounded.remaining() == float("inf") and not unbounded.expired
+
+def test_cancel_stops_registered_work_once():
+    cancelled = []
+    disconnected = Deadline(60)
+    with pytest.raises(RequestCancelledError) as raised:
+        with disconnected.cancels("query", lambda: cancelled.append("query")):
+            assert disconnected.cancel("disconnect") == 1
+            # The backend's own error for the cancelled query
+            raise RuntimeError("canceling statement due to user request")
+    assert raised.value.reason == "disconnect" and cancelled == ["query"]
+    assert disconnected.cancel("deadline") == 0
+    with pytest.raises(RequestCancelledError):
+        with disconnected.cancels("llm", lambda: None):
+            pass
+
+def test_errors_of_live_requests_pass_through():
+    with pytest.raises(ValueError):
+        with Deadline(60).cancels("query", lambda: None):
+            raise ValueError("syntax error")
+
+def test_duckdb_query_is_interrupted(deadline):
+    running = deadline(60)
+    connection = duckdb.connect()
+    cursor = connection.cursor()
+    timer = threading.Timer(0.2, running.cancel, args=("disconnect",))
+    timer.start()
+    started = time.monotonic()
+    with pytest.raises(RequestCancelledError):
+        with interruptible(cursor):
+            cursor.execute("SELECT sum(a.range * b.range) FROM range(100000) a, range(100000) b").fetchall()
+    assert time.monotonic() - started < 10
+    timer.join()
+    connection.close()
+
+def test_database_connection_checks_the_deadline(deadline):
+    engine = create_engine("sqlite://")
+    with database_connection(engine) as conn:
+        assert conn.exec_driver_sql("SELECT 1").scalar() == 1
+    deadline(60).cancel("disconnect")
+    with pytest.raises(RequestCancelledError):
+        with database_connection(engine):
+            pass
+
+class FakeRequest:
+    def __init__(self, disconnect_after: float):
+        self.disconnect_at = time.monotonic() + disconnect_after
+
+    async def is_disconnected(self) -> bool:
+        return time.monotonic() >= self.disconnect_at
+
+async def wait_under_deadline(request: FakeRequest, timeout_seconds: float):
+    async with request_deadline(request, timeout_seconds):
+        await asyncio.sleep(10)
+
+@pytest.mark.parametrize("disconnect_after, timeout_seconds, reason", [
+    (0.05, 60, "disconnect"),
+    (60, 0.05, "deadline"),
+])
+def test_request_is_cancelled(monkeypatch, disconnect_after, timeout_seconds, reason):
+    monkeypatch.setattr(deadlines, "DISCONNECT_POLL_SECONDS", 0.01)
+    started = time.monotonic()
+    with pytest.raises(RequestCancelledError) as raised:
+        asyncio.run(wait_under_deadline(FakeRequest(disconnect_after), timeout_seconds))
+    assert raised.value.reason == reason
+    assert time.monotonic() - started < 5
+    assert current_deadline.get() is None
@@ -0,0 +1,119 @@
+"""
+Export job tests: running, scoping and cancelling jobs, and Range header
+parsing for resumable downloads
+"""
+
+import os
+import time
+
+import pytest
+
+import export_jobs
+from export_jobs import ExportJobManager, ExportQueueFullError, iter_file_range, parse_range_header
+
+@pytest.fixture
+def manager(tmp_path, monkeypatch):
+    monkeypatch.setattr(export_jobs, "EXPORT_JOB_DIR", str(tmp_path))
+    jobs = ExportJobManager(workers=1, max_pending=2, quota_bytes=1000)
+    yield jobs
+    jobs.executor.shutdown(wait=True)
+
+class Stream:
+    """An export stream that counts rows and remembers being closed"""
+
+    def __init__(self, progress, blocks, fail=False):
+        self.progress = progress
+        self.blocks = iter(blocks)
+        self.fail = fail
+        self.closed = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> bytes:
+        block = next(self.blocks, None)
+        if block is None:
+            if self.fail:
+                raise RuntimeError("database went away")
+            raise StopIteration
+        self.progress.rows_written += 1
+        return block
+
+    def close(self):
+        self.closed = True
+
+def opener(blocks, fail=False, opened=None):
+    """An open_stream callable, appending each stream it opens to opened"""
+    def open_stream(progress):
+        stream = Stream(progress, blocks, fail)
+        if opened is not None:
+            opened.append(stream)
+        return stream
+    return open_stream
+
+def wait_for(job, timeout: float = 5.0):
+    deadline = time.monotonic() + timeout
+    while not job.is_finished:
+        assert time.monotonic() < deadline, f"job still {job.status}"
+        time.sleep(0.01)
+    return job
+
+def test_job_writes_artifact_and_reports_progress(manager):
+    streams = []
+    job = wait_for(manager.submit(opener([b"a,b\n", b"1,2\n"], opened=streams), "csv", "out.csv", owner="alice"))
+    assert job.status == "completed"
+    assert job.to_dict()["rows_written"] == 2 and job.bytes_written == 8
+    assert b"".join(iter_file_range(job.path, 4, 7)) == b"1,2\n"
+    assert streams[0].closed
+
+def test_jobs_are_scoped_to_their_owner(manager):
+    job = wait_for(manager.submit(opener([b"x"]), "csv", "out.csv", owner="alice"))
+    assert manager.get(job.id, "alice") is job
+    assert manager.get(job.id, "bob") is None
+    assert manager.list_jobs("bob") == []
+    assert manager.cancel(job.id, "bob") is False
+
+def test_failed_job_removes_partial_file_and_closes_stream(manager):
+    streams = []
+    job = wait_for(manager.submit(opener([b"x"], fail=True, opened=streams), "csv", "out.csv", owner="alice"))
+    assert job.status == "failed" and "database went away" in job.error
+    assert streams[0].closed
+    assert os.listdir(export_jobs.EXPORT_JOB_DIR) == []
+
+def test_cancelling_a_finished_job_deletes_its_artifact(manager):
+    job = wait_for(manager.submit(opener([b"x"]), "csv", "out.csv", owner="alice"))
+    assert os.path.exists(job.path)
+    assert manager.cancel(job.id, "alice") is True
+    assert not os.path.exists(job.path)
+    assert manager.get(job.id, "alice") is None
+
+def test_quota_fails_jobs_that_outgrow_it(manager):
+    job = wait_for(manager.submit(opener([b"x" * 600, b"x" * 600]), "csv", "out.csv", owner="alice"))
+    assert job.status == "failed" and "quota" in job.error
+
+def test_expired_jobs_are_cleaned_up(manager, monkeypatch):
+    job = wait_for(manager.submit(opener([b"x"]), "csv", "out.csv", owner="alice"))
+    monkeypatch.setattr(export_jobs, "EXPORT_JOB_TTL_SECONDS", 0)
+    assert manager.cleanup_expired() == 1
+    assert not os.path.exists(job.path)
+
+def test_queue_is_bounded(manager):
+    manager.max_pending = 0
+    with pytest.raises(ExportQueueFullError):
+        manager.submit(opener([]), "csv", "out.csv", owner="alice")
+
+@pytest.mark.parametrize("header, expected", [
+    (None, None),
+    ("bytes=0-99", (0, 99)),
+    ("bytes=900-", (900, 999)),
+    ("bytes=900-5000", (900, 999)),
+    ("bytes=-100", (900, 999)),
+    ("bytes=-5000", (0, 999)),
+])
+def test_parse_range_header(header, expected):
+    assert parse_range_header(header, 1000) == expected
+
+@pytest.mark.parametrize("header", ["bytes=-", "items=0-1", "bytes=1000-", "bytes=5-2", "bytes=-0", "bytes=0-1,5-6"])
+def test_parse_range_header_rejects(header):
+    with pytest.raises(ValueError):
+        parse_range_header(header, 1000)
@@ -0,0 +1,24 @@
+"""
+Export encoder tests: chunked Parquet and Arrow output
+"""
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from exports import _encode_arrow_chunks, _encode_parquet_chunks
+
+def chunks():
+    first = pd.DataFrame({"id": [1, 2], "note": [None, None]})
+    later = [pd.DataFrame({"id": [3, 4], "note": ["x", "y"]}), pd.DataFrame({"id": [5], "note": [None]})]
+    return first, iter(later)
+
+def test_parquet_column_null_in_first_chunk_takes_later_values():
+    table = pq.read_table(pa.BufferReader(b"".join(_encode_parquet_chunks(*chunks()))))
+    assert table.column("id").to_pylist() == [1, 2, 3, 4, 5]
+    assert table.column("note").to_pylist() == [None, None, "x", "y", None]
+
+def test_arrow_column_null_in_first_chunk_takes_later_values():
+    table = pa.ipc.open_stream(b"".join(_encode_arrow_chunks(*chunks()))).read_all()
+    assert table.column("id").to_pylist() == [1, 2, 3, 4, 5]
+    assert table.column("note").to_pylist() == [None, None, "x", "y", None]
@@ -0,0 +1,19 @@
+"""
+Query statistics tests: statement fingerprints
+"""
+
+from query_stats import fingerprint, normalize_sql
+
+def test_literals_case_and_whitespace_share_a_fingerprint():
+    assert fingerprint("SELECT * FROM sales WHERE id = 1") == fingerprint("select *  from SALES where ID=42;")
+    assert normalize_sql("SELECT a FROM t WHERE s = 'x' AND n > -1.5e3") == "select a from t where s=? and n>?"
+
+def test_in_lists_and_comments_are_folded():
+    assert normalize_sql("SELECT a FROM t WHERE b IN (1, 2, 3) -- note") == "select a from t where b in (?+)"
+    assert normalize_sql("SELECT /* hint */ a FROM t WHERE s = '--not a comment'") == "select a from t where s=?"
+
+def test_quoted_identifiers_are_kept_as_written():
+    sql = 'SELECT "Revenue 2024", "ID" FROM `Sales_2023` WHERE year = 2024'
+    assert normalize_sql(sql) == 'select "Revenue 2024","ID" from `Sales_2023` where year=?'
+    assert fingerprint('SELECT "Revenue 2024" FROM t') != fingerprint('SELECT "Revenue 2023" FROM t')
+    assert fingerprint('SELECT "Name" FROM t') != fingerprint('SELECT "name" FROM t')
@@ -0,0 +1,116 @@
+"""
+Rate limiter tests: sliding-window accounting in process and in the
+shared state backend, 429 responses, and client addresses behind proxies
+"""
+
+import ipaddress
+from types import SimpleNamespace
+
+import pytest
+from fastapi import HTTPException
+
+import rate_limit
+from rate_limit import (
+    InProcessCounterStore,
+    RateLimitExceeded,
+    SharedCounterStore,
+    SlidingWindowLimiter,
+    client_address,
+    client_identity,
+    enforce,
+    enforce_available,
+)
+from state_backend import InProcessStateBackend
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = SimpleNamespace(value=1000.0)
+    monkeypatch.setattr(rate_limit, "RATE_LIMIT_ENABLED", True)
+    monkeypatch.setattr(rate_limit.time, "time", lambda: now.value)
+    return now
+
+def limiter(limit: int = 3, window_seconds: int = 10) -> SlidingWindowLimiter:
+    return SlidingWindowLimiter("test", limit, window_seconds, store=InProcessCounterStore())
+
+def test_consume_rejects_past_the_limit(clock):
+    ask = limiter()
+    for _ in range(3):
+        ask.consume("alice")
+    with pytest.raises(RateLimitExceeded) as raised:
+        ask.consume("alice")
+    assert 0 < raised.value.retry_after <= 20
+    ask.consume("bob")
+
+def test_previous_window_decays(clock):
+    ask = limiter()
+    for _ in range(3):
+        ask.consume("alice")
+    # Half way through the next window half the previous count still applies
+    clock.value += 15
+    assert ask.check("alice") == 0
+    ask.consume("alice")
+    with pytest.raises(RateLimitExceeded):
+        ask.consume("alice")
+    clock.value += 20
+    assert ask.check("alice", 3) == 0
+
+def test_check_does_not_consume(clock):
+    ask = limiter(limit=1)
+    assert ask.check("alice") == 0
+    assert ask.check("alice") == 0
+    ask.consume("alice")
+    assert ask.check("alice") > 0
+
+def test_record_charges_without_raising(clock):
+    budget = limiter(limit=100)
+    budget.record("alice", 250)
+    assert budget.check("alice") > 0
+
+def test_shared_store_counts_across_limiters(clock):
+    # Two workers' limiters sharing one backend see each other's requests
+    backend = InProcessStateBackend()
+    first = SlidingWindowLimiter("test", 3, 10, store=SharedCounterStore(backend))
+    second = SlidingWindowLimiter("test", 3, 10, store=SharedCounterStore(backend))
+    first.consume("alice", 2)
+    second.consume("alice")
+    with pytest.raises(RateLimitExceeded):
+        first.consume("alice")
+    clock.value += 20
+    assert second.check("alice", 3) == 0
+
+def test_enforce_answers_429_with_retry_after(clock):
+    ask = limiter(limit=1)
+    enforce(ask, "alice")
+    with pytest.raises(HTTPException) as raised:
+        enforce(ask, "alice")
+    assert raised.value.status_code == 429
+    assert int(raised.value.headers["Retry-After"]) >= 1
+    with pytest.raises(HTTPException):
+        enforce_available(ask, "alice")
+
+def test_disabled_limits_allow_everything(clock, monkeypatch):
+    monkeypatch.setattr(rate_limit, "RATE_LIMIT_ENABLED", False)
+    ask = limiter(limit=1)
+    for _ in range(5):
+        ask.consume("alice")
+    assert ask.check("alice") == 0
+
+def request(peer: str, **headers) -> SimpleNamespace:
+    return SimpleNamespace(client=SimpleNamespace(host=peer), headers={key.replace("_", "-"): value for key, value in headers.items()})
+
+def test_client_address_ignores_headers_from_untrusted_peers(monkeypatch):
+    monkeypatch.setattr(rate_limit, "TRUSTED_PROXIES", [])
+    assert client_address(request("203.0.113.9", X_Forwarded_For="1.2.3.4")) == "203.0.113.9"
+    assert client_address(request("203.0.113.9", X_Real_IP="1.2.3.4")) == "203.0.113.9"
+
+def test_client_address_takes_the_right_most_untrusted_hop(monkeypatch):
+    monkeypatch.setattr(rate_limit, "TRUSTED_PROXIES", [ipaddress.ip_network("10.0.0.0/8")])
+    forwarded = request("10.0.0.1", X_Forwarded_For="6.6.6.6, 198.51.100.7, 10.0.0.2")
+    assert client_address(forwarded) == "198.51.100.7"
+    assert client_address(request("10.0.0.1", X_Real_IP="198.51.100.7")) == "198.51.100.7"
+    assert client_address(request("10.0.0.1")) == "10.0.0.1"
+
+def test_client_identity_prefers_the_account(monkeypatch):
+    monkeypatch.setattr(rate_limit, "TRUSTED_PROXIES", [])
+    assert client_identity(request("203.0.113.9"), {"username": "alice"}) == "user:alice"
+    assert client_identity(request("203.0.113.9"), None) == "ip:203.0.113.9"
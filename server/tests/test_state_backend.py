@@ -0,0 +1,102 @@
+"""
+State backend tests: every backend against the same key-value contract,
+with the Redis backend talking to the local RESP stand-in
+"""
+
+import time
+
+import pytest
+
+from benchmarks.redis_stub import RedisStub
+from state_backend import (
+    InProcessStateBackend,
+    RedisStateBackend,
+    SQLiteStateBackend,
+    StateBackend,
+    create_state_backend,
+)
+
+@pytest.fixture(scope="module")
+def redis_stub():
+    with RedisStub(password="secret") as stub:
+        yield stub
+
+@pytest.fixture(params=["memory", "sqlite", "redis"])
+def backend(request, tmp_path) -> StateBackend:
+    if request.param == "memory":
+        return InProcessStateBackend()
+    if request.param == "sqlite":
+        return SQLiteStateBackend(str(tmp_path / "state.db"))
+    stub = request.getfixturevalue("redis_stub")
+    with stub.lock:
+        stub.values.clear()
+        stub.expiry.clear()
+    return RedisStateBackend(stub.url)
+
+def test_state_backend_is_abstract():
+    with pytest.raises(TypeError):
+        StateBackend()
+
+def test_get_set_round_trips_json(backend):
+    value = {"name": "sales", "rows": [1, 2.5, None], "ok": True}
+    assert backend.get("workspace:a") is None
+    backend.set("workspace:a", value)
+    assert backend.get("workspace:a") == value
+    backend.set("workspace:a", "replaced")
+    assert backend.get("workspace:a") == "replaced"
+
+def test_add_only_sets_missing_keys(backend):
+    assert backend.add("lock:a", "first") is True
+    assert backend.add("lock:a", "second") is False
+    assert backend.get("lock:a") == "first"
+
+def test_delete(backend):
+    backend.set("workspace:a", 1)
+    backend.delete("workspace:a")
+    backend.delete("workspace:missing")
+    assert backend.get("workspace:a") is None
+
+def test_incr_counts_and_keeps_first_expiry(backend):
+    assert backend.incr("ratelimit:ask:1", ttl_seconds=60) == 1
+    assert backend.incr("ratelimit:ask:1", 4, ttl_seconds=60) == 5
+    assert backend.get("ratelimit:ask:1") == 5
+
+def test_keys_by_prefix_escapes_patterns(backend):
+    for key in ("job:1", "job:2", "job_x", "jobs*:3", "other"):
+        backend.set(key, 0)
+    assert sorted(backend.keys("job:")) == ["job:1", "job:2"]
+    assert backend.keys("jobs*") == ["jobs*:3"]
+
+def test_keys_scan_past_one_batch(backend):
+    for index in range(1200):
+        backend.set(f"many:{index}", index)
+    assert len(backend.keys("many:")) == 1200
+
+def test_expiry(backend):
+    backend.set("short", 1, ttl_seconds=1)
+    backend.add("short-add", 1, ttl_seconds=1)
+    backend.incr("short-incr", ttl_seconds=1)
+    assert backend.get("short") == 1
+    time.sleep(1.1)
+    assert backend.get("short") is None
+    assert backend.get("short-incr") is None
+    assert backend.add("short-add", 2) is True
+    assert backend.keys("short") == ["short-add"]
+
+def test_redis_reconnects_after_connection_drops(redis_stub):
+    backend = RedisStateBackend(redis_stub.url)
+    backend.set("workspace:a", 1)
+    backend.local.sock.close()
+    assert backend.get("workspace:a") == 1
+
+def test_redis_errors_are_raised(redis_stub):
+    backend = RedisStateBackend(redis_stub.url.replace(":secret@", ":wrong@"))
+    with pytest.raises(RuntimeError, match="WRONGPASS"):
+        backend.get("workspace:a")
+
+def test_create_state_backend(tmp_path):
+    assert isinstance(create_state_backend("memory://"), InProcessStateBackend)
+    assert isinstance(create_state_backend(f"sqlite:///{tmp_path}/state.db"), SQLiteStateBackend)
+    assert isinstance(create_state_backend("redis://localhost:6379/1"), RedisStateBackend)
+    with pytest.raises(ValueError):
+        create_state_backend("rediss://localhost:6379/0")
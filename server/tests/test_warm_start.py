@@ -0,0 +1,90 @@
+"""
+Warm start tests: the generated SQL cache, and a manifest of workspaces
+and hot SQL saved and restored across a simulated restart
+"""
+
+import pandas as pd
+import pytest
+
+import state_backend as state_backend_module
+import warm_start as warm_start_module
+from sql_cache import SQLCache
+from utils import WorkspaceRegistry, setup_csv_engine
+from warm_start import WarmStart
+
+SCHEMA = "Table sales: region (VARCHAR), amount (BIGINT)"
+SQL = "SELECT region, SUM(amount) AS total FROM sales GROUP BY region"
+
+def test_lookups_normalize_the_question_and_count_hits():
+    cache = SQLCache(max_size=10, ttl_seconds=60)
+    assert cache.lookup(SCHEMA, True, "Total by region?") is None
+    cache.store(SCHEMA, True, "Total by region?", SQL)
+    assert cache.lookup(SCHEMA, True, "  total   BY region ") == SQL
+    # Another mode or schema is another question
+    assert cache.lookup(SCHEMA, False, "total by region") is None
+    assert cache.lookup(SCHEMA + ", year (INT)", True, "total by region") is None
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 3
+    assert cache.hottest(1)[0]["hits"] == 1
+
+def test_disabled_cache_stores_nothing():
+    cache = SQLCache(max_size=0, ttl_seconds=60)
+    cache.store(SCHEMA, True, "total by region", SQL)
+    assert cache.lookup(SCHEMA, True, "total by region") is None
+
+def test_hottest_entries_load_with_their_hits_and_expiry():
+    cache = SQLCache(max_size=10, ttl_seconds=60)
+    cache.store(SCHEMA, True, "cold", "SELECT 1")
+    cache.store(SCHEMA, True, "hot", "SELECT 2")
+    for _ in range(3):
+        cache.lookup(SCHEMA, True, "hot")
+    saved = cache.hottest(10)
+    assert [entry["sql"] for entry in saved] == ["SELECT 2", "SELECT 1"]
+
+    restored = SQLCache(max_size=1, ttl_seconds=60)
+    restored.load(saved)
+    # The hottest entry is loaded last, so it survives a smaller cache
+    assert restored.lookup(SCHEMA, True, "hot") == "SELECT 2"
+    assert restored.lookup(SCHEMA, True, "cold") is None
+    assert restored.hottest(1)[0]["hits"] == 4
+    assert restored.hottest(1)[0]["expires_at"] == saved[0]["expires_at"]
+
+@pytest.fixture
+def restart(monkeypatch, tmp_path):
+    """Gives the warm start a fresh workspace registry and SQL cache, as after a restart"""
+    monkeypatch.setattr(state_backend_module, "SHARED_DATA_DIR", str(tmp_path))
+    monkeypatch.setattr(warm_start_module, "SHARED_DATA_DIR", str(tmp_path))
+
+    def start():
+        registry, cache = WorkspaceRegistry(max_live=10), SQLCache(max_size=10, ttl_seconds=60)
+        monkeypatch.setattr(warm_start_module, "workspaces", registry)
+        monkeypatch.setattr(warm_start_module, "sql_cache", cache)
+        return registry, cache, WarmStart(str(tmp_path / "warm_start.manifest"), enabled=True)
+
+    return start
+
+def test_manifest_restores_workspaces_and_cache(restart):
+    registry, cache, warm = restart()
+    workspace = registry.get("alice:sales", "alice")
+    workspace.set_csv_mode({"sales": pd.DataFrame({"region": ["north", "south"], "amount": [10, 20]})}, SCHEMA)
+    workspace.csv_engine = setup_csv_engine(workspace.uploaded_csvs)
+    cache.store(SCHEMA, True, "total by region", SQL)
+    cache.lookup(SCHEMA, True, "total by region")
+    # Nothing is saved over a manifest that hasn't been restored yet
+    assert warm.save() is False
+    warm.restore()
+    assert warm.save() is True
+
+    registry, cache, warm = restart()
+    summary = warm.restore()
+    assert (summary["workspaces"], summary["sql_entries"], summary["primed"], summary["failed"]) == (1, 1, 1, 0)
+    assert cache.lookup(SCHEMA, True, "Total by region?") == SQL
+    restored = registry.workspaces["alice:sales"]
+    assert restored.owner == "alice" and restored.is_csv_mode and restored.schema_prompt == SCHEMA
+    result = restored.csv_engine.execute(SQL + " ORDER BY region").fetchall()
+    assert result == [("north", 10), ("south", 20)]
+
+def test_unreadable_manifest_is_ignored(restart, tmp_path):
+    (tmp_path / "warm_start.manifest").write_text("not a manifest")
+    _, _, warm = restart()
+    assert warm.restore()["workspaces"] == 0
+    assert warm.restored
@@ -0,0 +1,80 @@
+"""
+Workload capture tests: redaction of captured SQL and questions, and
+records written by the capture log and read back for replay
+"""
+
+import json
+import time
+
+import workload_capture as capture_module
+from benchmarks.replay import load_workload
+from utils import ApplicationState
+from workload_capture import WorkloadCapture, numeric_token, redact_sql, redact_text, redaction_token
+
+def test_redact_sql_replaces_literals_and_keeps_shape():
+    sql = "SELECT \"col_12345\" FROM orders WHERE email = 'a@b.c' AND account = 9876543210 AND qty > 5"
+    redacted = redact_sql(sql)
+    assert "'a@b.c'" not in redacted and "9876543210" not in redacted
+    assert "\"col_12345\"" in redacted
+    assert "qty > 5" in redacted
+    assert "'" + redaction_token("'a@b.c'") + "'" in redacted
+    assert redact_sql(sql) == redacted
+
+def test_numeric_token_is_stable_and_keeps_length():
+    token = numeric_token("9876543210")
+    assert token == numeric_token("9876543210")
+    assert len(token) == 10 and token.isdigit() and token[0] != "0"
+    assert token != "9876543210"
+
+def test_redact_text_removes_pii():
+    question = 'Orders for jane@example.com or +1 (555) 123-4567 named "Acme" over 123456'
+    redacted = redact_text(question)
+    for value in ("jane@example.com", "555", "Acme", "123456"):
+        assert value not in redacted
+    assert redacted.startswith("Orders for r_")
+
+def written(capture: WorkloadCapture, count: int, timeout: float = 5.0):
+    deadline = time.monotonic() + timeout
+    while capture.written < count:
+        assert time.monotonic() < deadline, "capture writer fell behind"
+        time.sleep(0.01)
+    with open(capture.path) as f:
+        return [json.loads(line) for line in f]
+
+def test_capture_writes_redacted_records(tmp_path):
+    capture = WorkloadCapture(str(tmp_path / "capture.jsonl"), enabled=True)
+    workspace = ApplicationState("alice")
+    capture.record("ask", workspace, "SELECT * FROM t WHERE id = 1234567", question="orders for jane@example.com",
+                   returned_rows=3)
+    capture.record("export", workspace, "SELECT 1", error=RuntimeError("boom"), format="csv")
+    ask, export = written(capture, 2)
+    assert ask["kind"] == "ask" and ask["returned_rows"] == 3 and ask["status"] == "ok"
+    assert "1234567" not in ask["sql"] and "jane@example.com" not in ask["question"]
+    assert ask["user"] == redaction_token("alice") and ask["redacted"] is True
+    assert export["status"] == "error" and export["error"] == "RuntimeError"
+
+def test_disabled_capture_samples_nothing(tmp_path):
+    assert not WorkloadCapture(str(tmp_path / "capture.jsonl"), enabled=False).sampled()
+    assert not WorkloadCapture(str(tmp_path / "capture.jsonl"), enabled=True, sample_rate=0.0).sampled()
+
+def test_capture_rotates_full_files(tmp_path, monkeypatch):
+    monkeypatch.setattr(capture_module, "CAPTURE_MAX_BYTES", 1)
+    capture = WorkloadCapture(str(tmp_path / "capture.jsonl"), enabled=True)
+    workspace = ApplicationState("alice")
+    capture.record("ask", workspace, "SELECT 1")
+    written(capture, 1)
+    capture.record("ask", workspace, "SELECT 2")
+    written(capture, 2)
+    assert (tmp_path / "capture.jsonl.1").exists()
+
+def test_replay_loads_successful_records_in_order(tmp_path):
+    capture = WorkloadCapture(str(tmp_path / "capture.jsonl"), enabled=True, redact=False)
+    workspace = ApplicationState("alice")
+    capture.record("ask", workspace, "SELECT 1")
+    capture.record("ask", workspace, "SELECT 2", error=RuntimeError("boom"))
+    capture.record("export", workspace, "SELECT 3")
+    capture.record("ask", workspace, None)
+    written(capture, 4)
+    records = load_workload([capture.path], ["ask", "export"], limit=None)
+    assert [record["sql"] for record in records] == ["SELECT 1", "SELECT 3"]
+    assert [record["sql"] for record in load_workload([capture.path], ["ask"], limit=1)] == ["SELECT 1"]
@@ -0,0 +1,31 @@
+"""
+Workspace registry tests: who can open workspaces and how many
+"""
+
+import pytest
+
+from utils import WorkspaceLimitError, WorkspaceRegistry, workspace_key, workspace_owner
+
+def test_only_signed_in_users_pick_a_workspace_id():
+    assert workspace_key(None, "mine") == workspace_key(None) == "anonymous"
+    assert workspace_key({"username": "alice"}, "mine") == "alice:mine"
+    assert workspace_key({"username": "alice"}) == "alice"
+
+def test_owner_cap_evicts_only_the_owners_workspaces():
+    registry = WorkspaceRegistry(max_live=50, max_per_owner=2)
+    bob = registry.get("bob", "bob")
+    registry.get("alice:1", "alice")
+    registry.get("alice:2", "alice")
+    registry.get("alice:3", "alice")
+    assert set(registry.workspaces) == {"bob", "alice:2", "alice:3"}
+    assert registry.workspaces["bob"] is bob
+
+def test_owner_cap_refuses_when_every_workspace_is_busy():
+    registry = WorkspaceRegistry(max_live=50, max_per_owner=1)
+    busy = registry.get("alice:1", "alice")
+    with busy.hold():
+        with pytest.raises(WorkspaceLimitError):
+            registry.get("alice:2", "alice")
+        assert set(registry.workspaces) == {"alice:1"}
+    registry.get("alice:2", workspace_owner({"username": "alice"}))
+    assert set(registry.workspaces) == {"alice:2"}
@@ -8,24 +8,60 @@ This module contains helper functions for:
 - State management helpers
 """
 
+from __future__ import annotations
+
 import os
 import re
 import io
 import time
-import pandas as pd
-import duckdb
-from typing import Dict, Optional, Tuple, Any, List
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Dict, Optional, Tuple, Any, List, Iterator
 from dotenv import load_dotenv
 
+from deadlines import RequestCancelledError, interruptible
+from lazy_imports import lazy_module
+from logger import get_logger
+from query_stats import query_stats, query_mode
+
+from state_backend import (
+    state_backend,
+    encrypt_secret,
+    decrypt_secret,
+    save_table,
+    load_table,
+    remove_tables
+)
+
+pd = lazy_module("pandas")
+duckdb = lazy_module("duckdb")
+
 # Load environment variables
 load_dotenv()
 
+log = get_logger("utils")
+
 # CONFIGURATION CONSTANTS
 
 # API Configuration
 LLM_API_URL = os.getenv("LLM_API_URL")
 LLM_API_KEY = os.getenv("LLM_API_KEY")
 
+# Workspace limits: live workspaces, memory held by uploaded data, idle eviction
+WORKSPACE_MAX_LIVE = int(os.getenv("WORKSPACE_MAX_LIVE", "50"))
+# Live workspaces one user may hold through X-Workspace-Id
+WORKSPACE_MAX_PER_USER = int(os.getenv("WORKSPACE_MAX_PER_USER", "5"))
+WORKSPACE_MEMORY_LIMIT_BYTES = int(os.getenv("WORKSPACE_MEMORY_LIMIT_MB", "2048")) * 1024 * 1024
+WORKSPACE_MAX_BYTES = int(os.getenv("WORKSPACE_MAX_MB", "512")) * 1024 * 1024
+WORKSPACE_IDLE_SECONDS = int(os.getenv("WORKSPACE_IDLE_SECONDS", "1800"))
+
+# How long a workspace's shared record outlives its last change
+WORKSPACE_STATE_TTL_SECONDS = int(os.getenv("WORKSPACE_STATE_TTL_SECONDS", str(7 * 24 * 3600)))
+
+# Workspace used by requests without a signed-in user
+ANONYMOUS_WORKSPACE = "anonymous"
+
 # System prompts for different modes
 MYSQL_SYSTEM_PROMPT = """
 You are a precise SQL query generator for data analytics. Your ONLY task is to generate accurate SELECT queries based on the provided database schema.
@@ -141,37 +177,405 @@ REMEMBER: These examples are for reference only. Always use the actual CSV schem
 
 # APPLICATION STATE MANAGEMENT
 
+class WorkspaceMemoryError(Exception):
+    """Raised when uploaded data would exceed the workspace memory limit"""
+
+class WorkspaceLimitError(Exception):
+    """Raised when a user has too many workspaces in use to open another"""
+
 class ApplicationState:
-    """Manages the global application state"""
+    """
+    Manages the state of one workspace: its database or CSV data source.
     
-    def __init__(self):
+    With a shared state backend, every change is published as a versioned
+    record (connection settings, schema prompt, table files) and other
+    workers rebuild their local engines from it on their next request.
+    """
+    
+    def __init__(self, key: str = ANONYMOUS_WORKSPACE, owner: Optional[str] = None):
+        self.key = key
+        # The user the workspace belongs to, who may hold several
+        self.owner = owner if owner is not None else key
         self.db_engine = None
+        self.database_params: Optional[Dict[str, str]] = None
         self.schema_prompt = ""
         self.uploaded_csvs: Dict[str, pd.DataFrame] = {}
+        self.csv_table_bytes: Dict[str, int] = {}
+        self.csv_table_paths: Dict[str, str] = {}
         self.csv_engine = None
         self.is_csv_mode = False
+        self.last_used = time.time()
+        self.active_operations = 0
+        self.version = 0
+        self.sync_lock = threading.Lock()
+        # Saved record a warm start is about to restore (see warm_start.py)
+        self.pending_restore: Optional[Dict[str, Any]] = None
+    
+    @property
+    def query_engine(self):
+        """Engine queries run against in the current mode"""
+        return self.csv_engine if self.is_csv_mode else self.db_engine
+    
+    @property
+    def memory_bytes(self) -> int:
+        """Memory held by the uploaded DataFrames"""
+        return sum(self.csv_table_bytes.values())
+    
+    def touch(self):
+        self.last_used = time.time()
+    
+    @contextmanager
+    def hold(self):
+        """Keep the workspace from being evicted while a long operation runs"""
+        self.active_operations += 1
+        try:
+            yield self
+        finally:
+            self.active_operations -= 1
+            self.touch()
+    
+    def set_database_engine(self, engine, params: Optional[Dict[str, str]] = None):
+        """
+        Replace the database connection, disposing the previous one.
+        
+        params are the configure_db arguments, kept so other workers can
+        open the same connection.
+        
+        """
+        self.close_database()
+        self.db_engine = engine
+        self.database_params = params
+    
+    def close_database(self):
+        if self.db_engine is not None:
+            self.db_engine.dispose()
+        self.db_engine = None
+        self.database_params = None
+    
+    def close_csv_engine(self):
+        if self.csv_engine is not None:
+            self.csv_engine.close()
+        self.csv_engine = None
     
     def reset_database_connection(self):
         """Reset database connection state"""
-        self.db_engine = None
+        self.close_database()
         self.schema_prompt = ""
     
     def reset_csv_state(self):
         """Reset CSV state"""
+        self.close_csv_engine()
         self.uploaded_csvs = {}
-        self.csv_engine = None
+        self.csv_table_bytes = {}
+        self.csv_table_paths = {}
         self.is_csv_mode = False
         self.schema_prompt = ""
     
+    def add_csv_table(self, table_name: str, df: pd.DataFrame):
+        """
+        Store an uploaded table, enforcing the per-workspace memory limit.
+        
+        """
+        table_bytes = int(df.memory_usage(deep=True).sum())
+        replaced_bytes = self.csv_table_bytes.get(table_name, 0)
+        if self.memory_bytes - replaced_bytes + table_bytes > WORKSPACE_MAX_BYTES:
+            raise WorkspaceMemoryError(
+                f"Uploaded data would exceed the workspace limit of {WORKSPACE_MAX_BYTES // (1024 * 1024)} MB"
+            )
+        self.uploaded_csvs[table_name] = df
+        self.csv_table_bytes[table_name] = table_bytes
+        if state_backend.shared:
+            self.csv_table_paths[table_name] = save_table(self.key, table_name, df)
+        else:
+            # Any file saved for a warm start now holds the replaced data
+            self.csv_table_paths.pop(table_name, None)
+    
+    def csv_cursor(self) -> duckdb.DuckDBPyConnection:
+        """Open a separate DuckDB cursor with every uploaded CSV registered"""
+        cursor = self.csv_engine.cursor()
+        for table_name, df in self.uploaded_csvs.items():
+            cursor.register(table_name, df)
+        return cursor
+    
     def set_csv_mode(self, csv_data: Dict[str, pd.DataFrame], schema_prompt: str):
         """Set application to CSV mode"""
         self.uploaded_csvs = csv_data
         self.schema_prompt = schema_prompt
         self.is_csv_mode = True
-        self.db_engine = None  # Disconnect from database when switching to CSV
+        self.close_database()  # Disconnect from database when switching to CSV
+    
+    def close(self):
+        """Release the engines and uploaded data held by this workspace"""
+        self.reset_database_connection()
+        self.reset_csv_state()
+    
+    # Shared state
+    
+    def record(self) -> Dict[str, Any]:
+        """
+        The workspace's data source as a JSON record, with the database
+        password encrypted: connection settings, schema prompt and the
+        files holding its tables.
+        
+        """
+        database = None
+        if self.database_params:
+            database = {**self.database_params, "password": encrypt_secret(self.database_params["password"])}
+        return {
+            "version": self.version,
+            "is_csv_mode": self.is_csv_mode,
+            "schema_prompt": self.schema_prompt,
+            "database": database,
+            "tables": dict(self.csv_table_paths),
+        }
+    
+    def publish(self, removed_tables: bool = False):
+        """
+        Share the workspace's current data source with the other workers.
+        
+        """
+        if not state_backend.shared:
+            return
+        if removed_tables:
+            remove_tables(self.key)
+        
+        self.version = state_backend.incr(f"workspace-version:{self.key}")
+        state_backend.set(f"workspace:{self.key}", self.record(), WORKSPACE_STATE_TTL_SECONDS)
+    
+    def save_tables(self) -> Dict[str, str]:
+        """
+        Write uploaded tables that have no file yet to the shared
+        directory, returning the path of every table.
+        
+        """
+        for table_name, df in list(self.uploaded_csvs.items()):
+            if table_name not in self.csv_table_paths:
+                self.csv_table_paths[table_name] = save_table(self.key, table_name, df)
+        return dict(self.csv_table_paths)
+    
+    def restore_pending(self) -> bool:
+        """
+        Rebuild the data source from the record set aside by a warm start.
+        
+        Whichever of the warm start and the workspace's first request gets
+        here first restores it; the other waits for it to finish. Skipped
+        if the workspace got a data source meanwhile. Returns whether it
+        was restored by this call.
+        
+        """
+        with self.sync_lock:
+            record = self.pending_restore
+            if record is None:
+                return False
+            try:
+                if self.query_engine is not None or self.schema_prompt:
+                    return False
+                self._restore(record)
+                return True
+            except Exception:
+                self.close()
+                raise
+            finally:
+                self.pending_restore = None
+    
+    def sync(self):
+        """
+        Rebuild the local engines if another worker changed this workspace,
+        or if a warm start has yet to restore it.
+        
+        """
+        if self.pending_restore is not None:
+            try:
+                self.restore_pending()
+            except Exception as e:
+                log_error(e, f"Restoring workspace {self.key}", include_traceback=False)
+        if not state_backend.shared:
+            return
+        with self.sync_lock:
+            record = state_backend.get(f"workspace:{self.key}")
+            version = record["version"] if record else 0
+            if version == self.version:
+                return
+            if self.active_operations:
+                # Rebuilding would close engines a running query is reading;
+                # the next request after it finishes syncs instead
+                return
+            
+            self.close()
+            self.version = version
+            if record:
+                try:
+                    self._restore(record)
+                except Exception as e:
+                    log_error(e, f"Restoring workspace {self.key}", include_traceback=False)
+    
+    def _restore(self, record: Dict[str, Any]):
+        """Load shared table files and reconnect from a published record"""
+        for table_name, path in record["tables"].items():
+            df = load_table(path)
+            self.uploaded_csvs[table_name] = df
+            self.csv_table_bytes[table_name] = int(df.memory_usage(deep=True).sum())
+            self.csv_table_paths[table_name] = path
+        if self.uploaded_csvs:
+            self.csv_engine = setup_csv_engine(self.uploaded_csvs)
+        self.is_csv_mode = record["is_csv_mode"]
+        # The published schema prompt saves re-reading the database schema
+        self.schema_prompt = record["schema_prompt"]
+        
+        if record["database"]:
+            from db import configure_db
+            params = {**record["database"], "password": decrypt_secret(record["database"]["password"])}
+            self.set_database_engine(configure_db(**params), params)
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "workspace": self.key,
+            "csv_mode": self.is_csv_mode,
+            "database_connected": self.db_engine is not None,
+            "tables": len(self.uploaded_csvs),
+            "memory_bytes": self.memory_bytes,
+            "idle_seconds": round(time.time() - self.last_used, 1),
+        }
+
+class WorkspaceRegistry:
+    """
+    Live workspaces keyed by user, kept in least-recently-used order.
+    
+    The registry is bounded both by the number of workspaces and by the
+    memory their uploaded data holds. Workspaces beyond either bound, or
+    idle for longer than the idle timeout, are evicted and their engines
+    closed. Workspaces with a running export are never evicted. Each
+    owner may hold max_per_owner workspaces; opening another evicts their
+    own least recently used one, so no user can push out everyone else's.
+    """
+    
+    def __init__(self, max_live: int = WORKSPACE_MAX_LIVE,
+                 memory_limit_bytes: int = WORKSPACE_MEMORY_LIMIT_BYTES,
+                 idle_seconds: int = WORKSPACE_IDLE_SECONDS,
+                 max_per_owner: int = WORKSPACE_MAX_PER_USER):
+        self.max_live = max_live
+        self.max_per_owner = max_per_owner
+        self.memory_limit_bytes = memory_limit_bytes
+        self.idle_seconds = idle_seconds
+        self.workspaces: "OrderedDict[str, ApplicationState]" = OrderedDict()
+        self.lock = threading.Lock()
+    
+    def get(self, key: str, owner: Optional[str] = None) -> ApplicationState:
+        """
+        Return the workspace for a key, creating it if needed. Raises
+        WorkspaceLimitError when the owner's other workspaces are all busy.
+        
+        """
+        with self.lock:
+            workspace = self.workspaces.get(key)
+            evicted = []
+            if workspace is None:
+                workspace = ApplicationState(key, owner)
+                evicted = self._evict_owner_over_limit(workspace.owner)
+                self.workspaces[key] = workspace
+            else:
+                self.workspaces.move_to_end(key)
+            workspace.touch()
+            evicted += self._evict_over_limits(keep=key)
+        
+        self._close(evicted)
+        return workspace
+    
+    def enforce_limits(self, keep: Optional[str] = None) -> int:
+        """
+        Evict least recently used workspaces until the registry is within
+        its bounds. Call after a workspace's memory grows.
+        
+        """
+        with self.lock:
+            evicted = self._evict_over_limits(keep=keep)
+        self._close(evicted)
+        return len(evicted)
+    
+    def evict_idle(self) -> int:
+        """
+        Evict workspaces unused for longer than the idle timeout.
+        
+        """
+        cutoff = time.time() - self.idle_seconds
+        with self.lock:
+            evicted = [
+                self.workspaces.pop(key)
+                for key, workspace in list(self.workspaces.items())
+                if workspace.last_used < cutoff and not workspace.active_operations
+            ]
+        self._close(evicted)
+        return len(evicted)
+    
+    @property
+    def memory_bytes(self) -> int:
+        return sum(workspace.memory_bytes for workspace in self.workspaces.values())
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "live_workspaces": len(self.workspaces),
+            "max_workspaces": self.max_live,
+            "max_workspaces_per_user": self.max_per_owner,
+            "memory_bytes": self.memory_bytes,
+            "memory_limit_bytes": self.memory_limit_bytes,
+        }
+    
+    def _evict_over_limits(self, keep: Optional[str]) -> List[ApplicationState]:
+        """Pop workspaces in LRU order while over a bound (caller holds the lock)"""
+        evicted = []
+        candidates = [
+            key for key, workspace in self.workspaces.items()
+            if key != keep and not workspace.active_operations
+        ]
+        for key in candidates:
+            if len(self.workspaces) <= self.max_live and self.memory_bytes <= self.memory_limit_bytes:
+                break
+            evicted.append(self.workspaces.pop(key))
+        return evicted
+    
+    def _evict_owner_over_limit(self, owner: str) -> List[ApplicationState]:
+        """Pop an owner's workspaces in LRU order to make room for one more (caller holds the lock)"""
+        owned = [workspace for workspace in self.workspaces.values() if workspace.owner == owner]
+        excess = len(owned) - self.max_per_owner + 1
+        if excess <= 0:
+            return []
+        idle = [workspace for workspace in owned if not workspace.active_operations][:excess]
+        if len(idle) < excess:
+            raise WorkspaceLimitError(
+                f"Too many workspaces in use (limit {self.max_per_owner}), try again when one finishes"
+            )
+        for workspace in idle:
+            self.workspaces.pop(workspace.key)
+        return idle
+    
+    def _close(self, evicted: List[ApplicationState]):
+        for workspace in evicted:
+            try:
+                workspace.close()
+            except Exception as e:
+                log_error(e, f"Closing workspace {workspace.key}", include_traceback=False)
+            log.info("workspace_evicted", workspace=workspace.key)
+
+# Global registry of per-user workspaces
+workspaces = WorkspaceRegistry()
+
+def workspace_owner(user: Optional[Dict[str, Any]]) -> str:
+    """The owner of a request's workspaces: its user, or the anonymous workspace"""
+    return user["username"] if user else ANONYMOUS_WORKSPACE
 
-# Global application state instance
-app_state = ApplicationState()
+def workspace_key(user: Optional[Dict[str, Any]], workspace_id: Optional[str] = None) -> str:
+    """
+    Key the workspace for a request by its user and optional workspace id.
+    
+    Only signed-in users can pick a workspace id; unauthenticated requests
+    all share the anonymous workspace, so they can neither fill the
+    registry nor guess their way into another client's workspace.
+    
+    """
+    owner = workspace_owner(user)
+    if workspace_id and user:
+        return f"{owner}:{workspace_id}"
+    return owner
 
 # CSV PROCESSING UTILITIES
 
@@ -271,25 +675,34 @@ def get_total_row_count(sql_query: str, engine, is_csv: bool = False) -> int:
         clean_query = clean_sql_query(sql_query)        
         count_sql = f"SELECT COUNT(*) as total_count FROM ({clean_query}) as count_query"
         
-        if is_csv:
-            count_result = engine.execute(count_sql).fetchone()
-            return count_result[0] if count_result else 0
-        else:
-            from services import execute_query
-            count_result = execute_query(count_sql, engine)
-            return count_result.iloc[0]['total_count'] if not count_result.empty else 0
+        with query_stats.track(count_sql, query_mode(is_csv), "count") as tracked:
+            tracked["rows"] = 1
+            if is_csv:
+                with interruptible(engine):
+                    count_result = engine.execute(count_sql).fetchone()
+                return count_result[0] if count_result else 0
+            else:
+                from services import execute_query
+                count_result = execute_query(count_sql, engine)
+                return int(count_result.iloc[0]['total_count']) if not count_result.empty else 0
             
+    except RequestCancelledError:
+        raise
     except Exception as e:
-        print(f"Count query failed: {str(e)}")
+        log.warning("count_query_failed", error=str(e))
         # Fallback: execute original query and count results
         if is_csv:
             try:
                 # For fallback, also remove LIMIT/OFFSET from original query
                 clean_fallback_query = clean_sql_query(sql_query)
-                temp_result = engine.execute(clean_fallback_query).fetchdf()
+                with query_stats.track(clean_fallback_query, "csv", "count_fallback") as tracked, interruptible(engine):
+                    temp_result = engine.execute(clean_fallback_query).fetchdf()
+                    tracked["rows"] = len(temp_result)
                 return len(temp_result)
+            except RequestCancelledError:
+                raise
             except Exception as e2:
-                print(f"Fallback count also failed: {str(e2)}")
+                log.warning("fallback_count_failed", error=str(e2))
                 raise ValueError(f"Query execution failed: {str(e2)}")
         else:
             raise ValueError(f"Count query failed: {str(e)}")
@@ -306,18 +719,42 @@ def execute_paginated_query(sql_query: str, limit: int, offset: int, engine, is_
     # Add our pagination
     paginated_sql = f"{clean_query} LIMIT {limit} OFFSET {offset}"
     
-    if is_csv:
-        return engine.execute(paginated_sql).fetchdf()
-    else:
-        from services import execute_query
-        return execute_query(paginated_sql, engine)
+    with query_stats.track(paginated_sql, query_mode(is_csv), "page") as tracked:
+        if is_csv:
+            with interruptible(engine):
+                result = engine.execute(paginated_sql).fetchdf()
+        else:
+            from services import execute_query
+            result = execute_query(paginated_sql, engine)
+        tracked["rows"] = len(result)
+    return result
 
-def prepare_visualization_data(dataframe: pd.DataFrame, max_rows: int = 1000) -> pd.DataFrame:
+def iter_query_chunks(sql_query: str, engine, is_csv: bool = False, chunk_size: int = 50000) -> Iterator[pd.DataFrame]:
     """
-    Prepare data for visualization by limiting rows if necessary.
+    Execute a query and yield its results as a sequence of DataFrame chunks.
+
+    DuckDB results are pulled vector by vector from the open result set and
+    database results through a server-side cursor, so only one chunk is held
+    in memory at a time.
 
     """
-    return dataframe.head(max_rows) if len(dataframe) > max_rows else dataframe
+    sql_query = sql_query.strip().rstrip(';')
+
+    if is_csv:
+        result = engine.execute(sql_query)
+        # DuckDB hands out results in vectors of 2048 rows
+        vectors_per_chunk = max(chunk_size // 2048, 1)
+        while True:
+            chunk = result.fetch_df_chunk(vectors_per_chunk)
+            if chunk.empty:
+                break
+            yield chunk
+    else:
+        with engine.connect().execution_options(stream_results=True, max_row_buffer=chunk_size) as conn:
+            result = conn.exec_driver_sql(sql_query)
+            columns = list(result.keys())
+            for rows in result.partitions(chunk_size):
+                yield pd.DataFrame.from_records(rows, columns=columns)
 
 def prepare_summary_data(query_results: List[Dict], max_rows: int = 100) -> List[Dict]:
     """
@@ -338,28 +775,6 @@ def create_response_message(total_rows: int, returned_rows: int, page: int, limi
     else:
         return f"Query executed successfully on {data_source_msg}. Returned {returned_rows} rows."
 
-# EXPORT UTILITIES
-
-def export_to_csv(dataframe: pd.DataFrame, filename: str = "query_results.csv") -> Tuple[str, Dict[str, str]]:
-    """
-    Export DataFrame to CSV format.
-
-    """
-    if dataframe.empty:
-        raise ValueError("Query returned no results to export")
-    
-    # Convert DataFrame to CSV
-    csv_buffer = io.StringIO()
-    dataframe.to_csv(csv_buffer, index=False)
-    csv_content = csv_buffer.getvalue()
-    
-    # Create headers
-    headers = {
-        'Content-Disposition': f'attachment; filename="{filename}"',
-    }
-    
-    return csv_content, headers
-
 # TIMING AND PERFORMANCE UTILITIES
 
 class Timer:
@@ -370,18 +785,19 @@ class Timer:
         self.end_time = None
     
     def __enter__(self):
-        self.start_time = time.time()
+        self.start_time = time.perf_counter()
         return self
     
     def __exit__(self, exc_type, exc_val, exc_tb):
-        self.end_time = time.time()
+        self.end_time = time.perf_counter()
     
     @property
     def elapsed_time(self) -> float:
-        """Get elapsed time in seconds, rounded to 2 decimal places"""
-        if self.start_time and self.end_time:
-            return round(self.end_time - self.start_time, 2)
-        return 0.0
+        """Get elapsed time in seconds to the millisecond, so far if still running"""
+        if self.start_time is None:
+            return 0.0
+        end_time = self.end_time if self.end_time is not None else time.perf_counter()
+        return round(end_time - self.start_time, 3)
 
 # VALIDATION UTILITIES
 
@@ -421,34 +837,26 @@ def log_error(error: Exception, context: str = "", include_traceback: bool = Tru
     Log error with optional traceback.
 
     """
-    import traceback
-    
-    error_msg = format_error_message(error, context)
-    print(f"❌ Error: {error_msg}")
-    
-    if include_traceback:
-        traceback.print_exc()
+    log.error("error", exc_info=error if include_traceback else None,
+              context=context, error=format_error_message(error, context))
 
 ## Bug Fix: SQL Query must not have LIMIT or OFFSET clauses
 def clean_sql_query(sql_query: str) -> str:
     """
     Clean SQL query by removing:
-    1. LIMIT and OFFSET clauses
+    1. A trailing LIMIT and/or OFFSET clause
     2. Trailing semicolons
     3. Any extra whitespace
     
     This is useful when we need to count total rows or apply our own pagination
     to a query that might already have LIMIT/OFFSET clauses from the LLM.
+    Limits inside subqueries are part of the query's meaning and are kept.
     
     """
     import re
-    clean_query = sql_query.strip()
-    
-    # Remove LIMIT and OFFSET clauses (case-insensitive)
-    clean_query = re.sub(r'\s+LIMIT\s+\d+', '', clean_query, flags=re.IGNORECASE)
-    clean_query = re.sub(r'\s+OFFSET\s+\d+', '', clean_query, flags=re.IGNORECASE)
+    clean_query = sql_query.strip().rstrip(';').rstrip()
     
-    # Remove trailing semicolons that cause issues in subqueries
-    clean_query = clean_query.rstrip(';')
+    # Remove the outer LIMIT and OFFSET clauses (case-insensitive)
+    clean_query = re.sub(r'(\s+(LIMIT|OFFSET)\s+\d+)+\s*$', '', clean_query, flags=re.IGNORECASE)
     
     return clean_query
@@ -0,0 +1,275 @@
+"""
+Warm start for the Data Analytics Chatbot API Server
+
+Carries the state a deploy or crash throws away over a restart, so the
+first query afterwards is as fast as in steady state:
+- A manifest of the live workspaces (database connection settings, schema
+  prompts, uploaded tables) and the hottest generated SQL, saved every
+  WARM_START_INTERVAL_SECONDS and at shutdown
+- The manifest is encrypted as a whole with the state encryption key,
+  written atomically and readable only by the server's user
+- On startup it is restored in the background in priority order: the SQL
+  cache first, then workspaces most recently used first, then the hottest
+  queries of each restored workspace are run once to open pool
+  connections and warm the database's caches
+
+A request for a workspace still waiting its turn restores it right away,
+and one arriving mid-restore waits for it rather than seeing it half
+built. Uploaded tables are written as Parquet to SHARED_DATA_DIR when the
+manifest is saved.
+
+Enable with WARM_START_ENABLED=true.
+"""
+
+import asyncio
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from cost_guard import QueryTooExpensiveError, cost_guard
+from logger import get_logger
+from query_stats import schema_fingerprint
+from sql_cache import sql_cache
+from state_backend import SHARED_DATA_DIR, decrypt_secret, encrypt_secret, state_backend
+from utils import (
+    WORKSPACE_MAX_LIVE,
+    ApplicationState,
+    execute_paginated_query,
+    get_total_row_count,
+    log_error,
+    workspaces,
+)
+
+log = get_logger("warm_start")
+
+# CONFIGURATION
+
+WARM_START_ENABLED = os.getenv("WARM_START_ENABLED", "false").lower() == "true"
+WARM_START_PATH = os.getenv("WARM_START_PATH", os.path.join(SHARED_DATA_DIR, "warm_start.manifest"))
+WARM_START_INTERVAL_SECONDS = int(os.getenv("WARM_START_INTERVAL_SECONDS", "60"))
+# Manifests older than this are ignored rather than restored
+WARM_START_MAX_AGE_SECONDS = int(os.getenv("WARM_START_MAX_AGE_SECONDS", str(24 * 3600)))
+WARM_START_MAX_WORKSPACES = int(os.getenv("WARM_START_MAX_WORKSPACES", str(WORKSPACE_MAX_LIVE)))
+WARM_START_SQL_ENTRIES = int(os.getenv("WARM_START_SQL_ENTRIES", "200"))
+# Hottest cached queries run against each restored workspace
+WARM_START_PRIME_QUERIES = int(os.getenv("WARM_START_PRIME_QUERIES", "3"))
+WARM_START_PRIME_LIMIT = 1000
+
+MANIFEST_FORMAT = 1
+
+class WarmStart:
+    """Saves the warm-start manifest and restores from it"""
+
+    def __init__(self, path: str = WARM_START_PATH, enabled: bool = WARM_START_ENABLED):
+        self.path = path
+        self.enabled = enabled
+        # A manifest is only written once the previous one has been restored
+        self.restored = False
+        self.saved_at: Optional[float] = None
+        self.last_restore: Dict[str, Any] = {}
+        self.lock = threading.Lock()
+
+    # Saving
+
+    def build_manifest(self) -> Dict[str, Any]:
+        live = sorted(list(workspaces.workspaces.values()), key=lambda workspace: workspace.last_used, reverse=True)
+        entries = []
+        for workspace in live:
+            if len(entries) >= WARM_START_MAX_WORKSPACES:
+                break
+            if not workspace.schema_prompt:
+                continue
+            if workspace.uploaded_csvs:
+                workspace.save_tables()
+            entries.append({
+                "key": workspace.key,
+                "owner": workspace.owner,
+                "last_used": workspace.last_used,
+                "schema": schema_fingerprint(workspace.schema_prompt),
+                **workspace.record(),
+            })
+        return {
+            "format": MANIFEST_FORMAT,
+            "saved_at": time.time(),
+            "workspaces": entries,
+            "sql_cache": sql_cache.hottest(WARM_START_SQL_ENTRIES),
+        }
+
+    def save(self) -> bool:
+        """Write the manifest. Skipped until the previous one has been restored."""
+        if not self.enabled or not self.restored:
+            return False
+        with self.lock:
+            manifest = self.build_manifest()
+            token = encrypt_secret(json.dumps(manifest))
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            partial_path = f"{self.path}.{os.getpid()}.part"
+            fd = os.open(partial_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, "w") as f:
+                f.write(token)
+            os.replace(partial_path, self.path)
+            self.saved_at = manifest["saved_at"]
+            if not state_backend.shared:
+                self._remove_unlisted_tables(manifest)
+        log.debug("warm_start_saved", workspaces=len(manifest["workspaces"]), sql_entries=len(manifest["sql_cache"]))
+        return True
+
+    @staticmethod
+    def _remove_unlisted_tables(manifest: Dict[str, Any]):
+        """
+        Delete table files of workspaces that are gone. Only for a local
+        state backend, where no other worker reads them.
+
+        """
+        keep = {os.path.abspath(path) for entry in manifest["workspaces"] for path in entry["tables"].values()}
+        for workspace in list(workspaces.workspaces.values()):
+            keep.update(os.path.abspath(path) for path in workspace.csv_table_paths.values())
+        tables_dir = os.path.join(SHARED_DATA_DIR, "tables")
+        if not os.path.isdir(tables_dir):
+            return
+        for directory in os.scandir(tables_dir):
+            if not directory.is_dir():
+                continue
+            for entry in os.scandir(directory.path):
+                if entry.name.endswith(".parquet") and os.path.abspath(entry.path) not in keep:
+                    try:
+                        os.remove(entry.path)
+                    except FileNotFoundError:
+                        pass
+
+    # Restoring
+
+    def load(self) -> Optional[Dict[str, Any]]:
+        if not os.path.exists(self.path):
+            return None
+        try:
+            with open(self.path) as f:
+                manifest = json.loads(decrypt_secret(f.read()))
+        except (ValueError, OSError) as e:
+            log.warning("warm_start_unreadable", path=self.path, error=str(e))
+            return None
+        if manifest.get("format") != MANIFEST_FORMAT:
+            return None
+        age = time.time() - manifest["saved_at"]
+        if age > WARM_START_MAX_AGE_SECONDS:
+            log.info("warm_start_expired", age_seconds=round(age))
+            return None
+        return manifest
+
+    def restore(self) -> Dict[str, Any]:
+        """Restore the SQL cache, then workspaces, then prime their hottest queries"""
+        started = time.perf_counter()
+        summary = {"workspaces": 0, "failed": 0, "sql_entries": 0, "primed": 0}
+        try:
+            manifest = self.load()
+            if manifest is None:
+                return summary
+
+            sql_cache.load(manifest["sql_cache"])
+            summary["sql_entries"] = len(manifest["sql_cache"])
+
+            # Register every workspace first, so their requests find them
+            # pending; least recently used first, to keep the registry's order
+            pending = []
+            for entry in reversed(manifest["workspaces"]):
+                workspace = workspaces.get(entry["key"], entry.get("owner"))
+                if not state_backend.shared:
+                    workspace.pending_restore = entry
+                pending.insert(0, (workspace, entry))
+
+            restored: List[ApplicationState] = []
+            for workspace, entry in pending:
+                try:
+                    self._restore_workspace(workspace, entry)
+                except Exception as e:
+                    summary["failed"] += 1
+                    log_error(e, f"Warm start of workspace {entry['key']}", include_traceback=False)
+                if workspace.schema_prompt:
+                    restored.append(workspace)
+                workspaces.enforce_limits()
+            summary["workspaces"] = len(restored)
+
+            for workspace in restored:
+                summary["primed"] += self._prime(workspace, manifest["sql_cache"])
+            return summary
+        finally:
+            self.restored = True
+            summary["seconds"] = round(time.perf_counter() - started, 3)
+            self.last_restore = summary
+            log.info("warm_start_restored", **summary)
+
+    @staticmethod
+    def _restore_workspace(workspace: ApplicationState, entry: Dict[str, Any]):
+        if state_backend.shared:
+            # A record other workers published is newer than the manifest
+            workspace.sync()
+            if workspace.schema_prompt:
+                return
+            workspace.pending_restore = entry
+        workspace.restore_pending()
+
+    @staticmethod
+    def _prime(workspace: ApplicationState, entries: List[Dict[str, Any]]) -> int:
+        """
+        Run the hottest cached queries for the workspace's schema once. The
+        cache holds SQL as generated, so each goes through the cost guard
+        like a request would, and refused ones are skipped.
+
+        """
+        schema = schema_fingerprint(workspace.schema_prompt)
+        mode = "csv" if workspace.is_csv_mode else "database"
+        queries = [entry["sql"] for entry in entries if entry["schema"] == schema and entry["mode"] == mode]
+        primed = 0
+        for sql_query in queries[:WARM_START_PRIME_QUERIES]:
+            try:
+                with workspace.hold():
+                    if workspace.is_csv_mode:
+                        if not workspace.csv_engine:
+                            break
+                        engine = workspace.csv_cursor()
+                    else:
+                        if not workspace.db_engine:
+                            break
+                        engine = workspace.db_engine
+                    try:
+                        _, sql_query, _ = cost_guard.check(sql_query, engine, workspace.is_csv_mode,
+                                                           workspace.schema_prompt)
+                        get_total_row_count(sql_query, engine, workspace.is_csv_mode)
+                        execute_paginated_query(sql_query, WARM_START_PRIME_LIMIT, 0, engine, workspace.is_csv_mode)
+                    finally:
+                        if workspace.is_csv_mode:
+                            engine.close()
+                primed += 1
+            except QueryTooExpensiveError:
+                log.info("warm_start_prime_skipped", workspace=workspace.key, reason="too_expensive")
+            except Exception as e:
+                log.warning("warm_start_prime_failed", workspace=workspace.key, error=str(e))
+        return primed
+
+    # Background loop
+
+    async def run(self, interval_seconds: int = WARM_START_INTERVAL_SECONDS):
+        """Restore in a worker thread, then save the manifest periodically"""
+        if not self.enabled:
+            return
+        await asyncio.to_thread(self.restore)
+        while True:
+            await asyncio.sleep(interval_seconds)
+            try:
+                await asyncio.to_thread(self.save)
+            except Exception as e:
+                log_error(e, "Warm start manifest save")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "restored": self.restored,
+            "saved_at": self.saved_at,
+            "last_restore": self.last_restore,
+            "sql_cache": sql_cache.stats(),
+        }
+
+# Global warm start manager
+warm_start = WarmStart()
@@ -0,0 +1,213 @@
+"""
+Workload capture for the Data Analytics Chatbot API Server
+
+Opt-in recording of real traffic so performance changes can be tested
+against it (see benchmarks/replay.py):
+- One JSON line per /ask, /get-more-data and /export-csv request: the
+  question, mode, schema fingerprint, generated SQL, per-stage timings
+  and result sizes
+- PII-safe by default: string literals and long numbers in the SQL and
+  emails, phone numbers, long digit runs and quoted text in the question
+  become stable keyed-hash tokens, and users are recorded only as hashes
+- Written by a background thread through a bounded queue, so requests
+  never wait on the disk; records are dropped (and counted) if it falls
+  behind
+- Files rotate at CAPTURE_MAX_MB
+
+Enable with CAPTURE_ENABLED=true. Set CAPTURE_SALT to keep tokens stable
+across restarts and workers.
+"""
+
+import hashlib
+import hmac
+import json
+import os
+import queue
+import random
+import re
+import secrets
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from logger import get_logger, request_id
+from metrics import current_timings
+from query_stats import fingerprint, schema_fingerprint
+
+log = get_logger("workload_capture")
+
+# CONFIGURATION
+
+CAPTURE_ENABLED = os.getenv("CAPTURE_ENABLED", "false").lower() == "true"
+# Capture file; rotated files get .1, .2, ... suffixes
+CAPTURE_PATH = os.getenv("CAPTURE_PATH", "workload_capture.jsonl")
+# Fraction of requests captured
+CAPTURE_SAMPLE_RATE = float(os.getenv("CAPTURE_SAMPLE_RATE", "1.0"))
+# Replace literals and PII in the question and SQL with tokens
+CAPTURE_REDACT = os.getenv("CAPTURE_REDACT", "true").lower() == "true"
+# Size at which the capture file is rotated, and rotated files kept
+CAPTURE_MAX_BYTES = int(os.getenv("CAPTURE_MAX_MB", "100")) * 1024 * 1024
+CAPTURE_KEEP = int(os.getenv("CAPTURE_KEEP", "5"))
+# Key for the redaction tokens; random per process when unset
+CAPTURE_SALT = os.getenv("CAPTURE_SALT") or secrets.token_hex(16)
+# Records buffered for the writer thread before new ones are dropped
+CAPTURE_QUEUE_SIZE = 10000
+
+# REDACTION
+
+# String literals and long numbers in SQL; quoted identifiers are matched
+# so that digits inside them are left alone
+_SQL_LITERALS = re.compile(r"(?P<string>'(?:[^']|'')*')|(?P<identifier>\"(?:[^\"]|\"\")*\"|`[^`]*`)|(?P<number>\b\d{5,}\b)")
+_EMAILS = re.compile(r"[\w.+-]+@[\w-]+\.[\w.-]+")
+_PHONES = re.compile(r"\+?\d[\d\s().-]{7,}\d")
+_DIGIT_RUNS = re.compile(r"\b\d{5,}\b")
+_QUOTED = re.compile(r"\"[^\"]*\"|'[^']*'")
+
+def redaction_token(value: str) -> str:
+    """A stable token for a value that cannot be reversed without the salt"""
+    return "r_" + hmac.new(CAPTURE_SALT.encode(), value.encode(), hashlib.sha256).hexdigest()[:10]
+
+def numeric_token(digits: str) -> str:
+    """A stable number with as many digits as the one it replaces"""
+    value = int(hmac.new(CAPTURE_SALT.encode(), digits.encode(), hashlib.sha256).hexdigest(), 16)
+    magnitude = 10 ** (len(digits) - 1)
+    return str(magnitude + value % (9 * magnitude))
+
+def redact_sql(sql_query: str) -> str:
+    """
+    Replace string literals and numbers of five or more digits (phone,
+    account and ID numbers) with tokens. Equal literals get equal tokens
+    of the same type, so the statement keeps its shape and stays
+    executable.
+    """
+    def replace(match):
+        if match.group("string") is not None:
+            return f"'{redaction_token(match.group())}'"
+        if match.group("number") is not None:
+            return numeric_token(match.group())
+        return match.group()
+    return _SQL_LITERALS.sub(replace, sql_query)
+
+def redact_text(text: str) -> str:
+    """Replace emails, phone numbers, long digit runs and quoted text in a question"""
+    for pattern in (_EMAILS, _QUOTED, _PHONES, _DIGIT_RUNS):
+        text = pattern.sub(lambda match: redaction_token(match.group()), text)
+    return text
+
+# CAPTURE
+
+class WorkloadCapture:
+    """Appends request records to a rotating JSON lines file from a writer thread"""
+
+    def __init__(self, path: str = CAPTURE_PATH, enabled: bool = CAPTURE_ENABLED,
+                 sample_rate: float = CAPTURE_SAMPLE_RATE, redact: bool = CAPTURE_REDACT):
+        self.path = path
+        self.enabled = enabled
+        self.sample_rate = sample_rate
+        self.redact = redact
+        self.queue: "queue.Queue[Dict[str, Any]]" = queue.Queue(maxsize=CAPTURE_QUEUE_SIZE)
+        self.written = 0
+        self.dropped = 0
+        self.thread: Optional[threading.Thread] = None
+        self.lock = threading.Lock()
+
+    def sampled(self) -> bool:
+        """Whether to capture the current request. Check before building a record."""
+        return self.enabled and (self.sample_rate >= 1.0 or random.random() < self.sample_rate)
+
+    def record(self, kind: str, workspace, sql_query: Optional[str], question: Optional[str] = None,
+               error: Optional[BaseException] = None, **fields):
+        """
+        Queue one request record. fields carry the result sizes and
+        pagination of the request.
+        """
+        timings = current_timings.get()
+        stages: Dict[str, float] = {}
+        seconds = None
+        if timings is not None:
+            for name, stage_seconds in timings.stages:
+                stages[name] = round(stages.get(name, 0.0) + stage_seconds, 4)
+            seconds = round(time.perf_counter() - timings.started, 4)
+
+        redact = self.redact
+        entry = {
+            "ts": round(time.time(), 3),
+            "kind": kind,
+            "request_id": request_id.get(),
+            "user": redaction_token(workspace.key),
+            "mode": "csv" if workspace.is_csv_mode else "database",
+            "db_type": (workspace.database_params or {}).get("db_type") if not workspace.is_csv_mode else "duckdb",
+            "schema": schema_fingerprint(workspace.schema_prompt),
+            "tables": sorted(workspace.uploaded_csvs) if workspace.is_csv_mode else None,
+            "question": (redact_text(question) if redact else question) if question else None,
+            "sql": (redact_sql(sql_query) if redact else sql_query) if sql_query else None,
+            "fingerprint": fingerprint(sql_query) if sql_query else None,
+            "seconds": seconds,
+            "stages": stages,
+            "status": "error" if error is not None else "ok",
+            "error": type(error).__name__ if error is not None else None,
+            "redacted": redact,
+            **fields,
+        }
+        try:
+            self.queue.put_nowait(entry)
+        except queue.Full:
+            self.dropped += 1
+            return
+        self._ensure_writer()
+
+    def _ensure_writer(self):
+        if self.thread is None:
+            with self.lock:
+                if self.thread is None:
+                    self.thread = threading.Thread(target=self._write_loop, name="workload-capture", daemon=True)
+                    self.thread.start()
+
+    def _write_loop(self):
+        while True:
+            entry = self.queue.get()
+            try:
+                self._rotate_if_full()
+                lines = [json.dumps(entry, default=str)]
+                # Drain whatever else is waiting in the same write
+                while len(lines) < 1000:
+                    try:
+                        lines.append(json.dumps(self.queue.get_nowait(), default=str))
+                    except queue.Empty:
+                        break
+                with open(self.path, "a") as f:
+                    f.write("\n".join(lines) + "\n")
+                self.written += len(lines)
+            except Exception as e:
+                log.error("capture_write_failed", error=str(e), path=self.path)
+
+    def _rotate_if_full(self):
+        try:
+            if os.path.getsize(self.path) < CAPTURE_MAX_BYTES:
+                return
+        except OSError:
+            return
+        for index in range(CAPTURE_KEEP - 1, 0, -1):
+            if os.path.exists(f"{self.path}.{index}"):
+                os.replace(f"{self.path}.{index}", f"{self.path}.{index + 1}")
+        os.replace(self.path, f"{self.path}.1")
+
+    def flush(self, timeout: float = 5.0):
+        """Wait briefly for queued records to be written, e.g. at shutdown"""
+        deadline = time.time() + timeout
+        while not self.queue.empty() and time.time() < deadline:
+            time.sleep(0.05)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "path": self.path,
+            "sample_rate": self.sample_rate,
+            "redact": self.redact,
+            "written": self.written,
+            "dropped": self.dropped,
+            "queued": self.queue.qsize(),
+        }
+
+# Global capture log
+workload_capture = WorkloadCapture()